@@ -0,0 +1,113 @@
+"""
+Compare the single-pass page analysis with the former per-check parsing.
+
+The former code built one BeautifulSoup tree in check_title, another one in
+check_js_files and lowercased the body again in check_word_in_body. This
+script times that against inspector.analysis.analyze() with every parser
+installed, and checks that all of them extract the same data. The former code
+needs beautifulsoup4, which inspector no longer depends on.
+
+Usage:
+    pip install beautifulsoup4
+    PYTHONPATH=src python benchmarks/bench_analysis.py [CORPUS_DIR] [--repeat N] [--json FILE]
+
+CORPUS_DIR holds saved pages (*.html). Without it, synthetic SPA-like pages
+are generated.
+"""
+import argparse
+import json
+import re
+import time
+from pathlib import Path
+
+from bs4 import BeautifulSoup
+
+from inspector.analysis import analyze
+from inspector.analysis import available_parsers
+
+
+def synthetic_corpus(pages=20, scripts=200, paragraphs=2000):
+    """Return SPA-like pages with many chunks and a large body."""
+    corpus = []
+    for page in range(pages):
+        head = ''.join(
+            f'<link rel="modulepreload" href="/assets/chunk-{page}-{i}.js">'
+            for i in range(scripts // 2)
+        )
+        body = ''.join(
+            f'<div class="row"><p>Paragraph {i} of page {page} with <a href="/l/{i}">a link</a></p></div>'
+            for i in range(paragraphs)
+        )
+        tags = ''.join(f'<script src="/static/js/{page}.{i}.js"></script>' for i in range(scripts // 2))
+        corpus.append(
+            f'<!doctype html><html><head><title>Page {page}</title>{head}</head>'
+            f'<body>{body}{tags}</body></html>',
+        )
+    return corpus
+
+
+def load_corpus(directory):
+    return [path.read_text(errors='replace') for path in sorted(Path(directory).glob('*.html'))]
+
+
+def legacy(html):
+    soup = BeautifulSoup(html, 'html.parser')
+    title = soup.title.text.strip() if soup.title else None
+    soup = BeautifulSoup(html, 'html.parser')
+    scripts = [script['src'] for script in soup.find_all('script', src=True)]
+    links = [
+        link['href'] for link in soup.find_all(
+            'link', rel='modulepreload', href=re.compile(r'\.js$'),
+        )
+    ]
+    hit = 'inspector' in html.lower()
+    return title, links + scripts, hit
+
+
+def single_pass(parser):
+    def run(html):
+        analysis = analyze(html, keywords=['inspector'], parser=parser)
+        return (
+            analysis.title,
+            analysis.modulepreloads + analysis.scripts,
+            analysis.keyword_hits['inspector'],
+        )
+    return run
+
+
+def measure(function, corpus, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        results = [function(html) for html in corpus]
+        best = min(best, time.perf_counter() - start)
+    return best, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('corpus', nargs='?', help='Directory of saved *.html pages')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per variant, the best is kept')
+    parser.add_argument('--json', help='Write the results to this JSON file')
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus) if args.corpus else synthetic_corpus()
+    size = sum(len(html) for html in corpus)
+    print(f'{len(corpus)} pages, {size / 1e6:.1f} MB')
+
+    baseline, expected = measure(legacy, corpus, args.repeat)
+    report = {'pages': len(corpus), 'bytes': size, 'legacy_seconds': baseline, 'parsers': {}}
+    print(f'{"legacy (2x BeautifulSoup)":<28}{baseline:8.3f}s')
+
+    for name in available_parsers():
+        elapsed, results = measure(single_pass(name), corpus, args.repeat)
+        same = results == expected
+        report['parsers'][name] = {'seconds': elapsed, 'speedup': baseline / elapsed, 'same_results': same}
+        print(f'{name:<28}{elapsed:8.3f}s  {baseline / elapsed:5.1f}x  same results: {same}')
+
+    if args.json:
+        Path(args.json).write_text(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
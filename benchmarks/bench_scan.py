@@ -0,0 +1,266 @@
+"""
+Benchmark the scan pipeline against synthetic sites served locally.
+
+Each scale runs in a fresh process with its own ~/.inspector. The URLs of
+that many sites are imported first, with URLInspector and the bulk importer
+of 'inspector add -l'. They are then scanned twice with main.scan(), the
+pipeline of the scheduled run: once after a deployment changed every site,
+and once unchanged, when pages and JS files are only revalidated.
+
+Each stage reports:
+- URLs per second.
+- The p50/p99 latency of a URL.
+- The peak RSS of the process.
+- The time spent in SQL statements.
+- The bytes written to disk.
+
+Usage:
+    PYTHONPATH=src python benchmarks/bench_scan.py [--scales 10 1000 10000] [--json FILE] [--compare FILE]
+
+The sites are served by benchmarks/sites.py in another process, see --help
+for their page size, scripts, JS bundle size, latency and error rate. All
+of them share the host 127.0.0.1, so the per host limits of the scanner are
+raised to the concurrency.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+import urllib.request
+from functools import partial
+from pathlib import Path
+
+from sites import SiteOptions
+from sites import SiteServer
+
+CHECKS = ['status_code', 'title', 'js_files', 'content_length', 'fingerprint']
+DEFAULTS = SiteOptions()
+
+
+def serve(options, conn):
+    server = SiteServer(options)
+    conn.send(server.server_port)
+    server.serve_forever()
+
+
+def set_version(port, version):
+    request = urllib.request.Request(f'http://127.0.0.1:{port}/version/{version}', method='PUT')
+    urllib.request.urlopen(request).close()
+
+
+def disk_write_bytes():
+    """Return the bytes this process caused to be written to storage, None where unknown."""
+    try:
+        with open('/proc/self/io') as file:
+            counters = dict(line.split(': ') for line in file.read().splitlines())
+    except OSError:
+        return None
+    return int(counters['write_bytes'])
+
+
+def directory_size(path):
+    return sum(file.stat().st_size for file in Path(path).rglob('*') if file.is_file())
+
+
+class Probe:
+    """
+    Probe measures a stage: the latency of each URL, the time spent in SQL
+    statements and the bytes written to disk.
+    """
+
+    def __init__(self, engine, data_dir):
+
+        from sqlalchemy import event
+
+        self.data_dir = data_dir
+        self.latencies = []
+        self.db_seconds = 0.0
+        event.listen(engine, 'before_cursor_execute', self._before_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_execute)
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('started', []).append(time.perf_counter())
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.db_seconds += time.perf_counter() - conn.info['started'].pop()
+
+    def timed(self, function):
+        """Wrap the fetch of a URL to record its latency."""
+        def run(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.latencies.append(time.perf_counter() - start)
+        return run
+
+    def measure(self, urls, stage):
+        """Run a stage over ``urls`` URLs and return its measures."""
+        self.latencies.clear()
+        self.db_seconds = 0.0
+        written = disk_write_bytes()
+        start = time.perf_counter()
+        extra = stage() or {}
+        elapsed = time.perf_counter() - start
+
+        percentiles = statistics.quantiles(self.latencies, n=100) if len(self.latencies) > 1 else [0.0] * 99
+        return {
+            'urls': urls,
+            'seconds': elapsed,
+            'urls_per_second': urls / elapsed,
+            'p50_ms': percentiles[49] * 1000,
+            'p99_ms': percentiles[98] * 1000,
+            'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            'db_seconds': self.db_seconds,
+            'disk_write_bytes': None if written is None else disk_write_bytes() - written,
+            'data_dir_bytes': directory_size(self.data_dir),
+            **extra,
+        }
+
+
+def run_scale(scale, port, concurrency, conn):
+    """Import and scan ``scale`` sites in this process, and send the measures of each stage."""
+    home = tempfile.mkdtemp(prefix='inspector-bench-')
+    os.environ.update({
+        'HOME': home,
+        'INSPECTOR_SCAN_CONCURRENCY': str(concurrency),
+        'INSPECTOR_IMPORT_CONCURRENCY': str(concurrency),
+        'INSPECTOR_SCAN_PER_HOST': str(concurrency),
+        'INSPECTOR_HTTP_POOL_MAXSIZE': str(concurrency),
+        'INSPECTOR_SCAN_DELAY': '0',
+        'INSPECTOR_RUN_TIMEOUT': '0',
+    })
+    # The configuration is read from the environment when inspector is imported.
+    from inspector import main as pipeline
+    from inspector.blobstore import BlobStore
+    from inspector.cache import ValidatorCache
+    from inspector.cli import run_checks
+    from inspector.httpclient import HTTPClient
+    from inspector.importer import BulkImporter
+    from inspector.urlinspector import JsDownloads
+
+    try:
+        pipeline.open_db()
+        probe = Probe(pipeline.session.get_bind(), os.path.join(home, '.inspector'))
+        urls = [f'http://127.0.0.1:{port}/{site}' for site in range(scale)]
+
+        def import_urls():
+            blob_store = BlobStore()
+            with HTTPClient(cache=ValidatorCache()) as client:
+                inspect = probe.timed(partial(
+                    run_checks, checks=CHECKS, client=client, blob_store=blob_store, downloads=JsDownloads(),
+                ))
+                added, updated, failed = BulkImporter(pipeline.queries, inspect).run(urls)
+            blob_store.close()
+            return {'failed': len(failed)}
+
+        def scan():
+            pipeline.scan(list(pipeline.queries.iter_monitored()))
+            notifications = len(pipeline.messages)
+            pipeline.messages.clear()
+            return {'notifications': notifications}
+
+        pipeline.fetch_record = probe.timed(pipeline.fetch_record)
+        set_version(port, 0)
+        stages = {'import': probe.measure(scale, import_urls)}
+        set_version(port, 1)
+        stages['scan_changed'] = probe.measure(scale, scan)
+        stages['scan_unchanged'] = probe.measure(scale, scan)
+        conn.send(stages)
+    finally:
+        shutil.rmtree(home)
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=Path(__file__).parent,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_stages(scale, stages):
+    for name, stage in stages.items():
+        written = stage['disk_write_bytes']
+        print(
+            f"{scale:>6} {name:<15}{stage['urls_per_second']:9.1f}{stage['p50_ms']:9.1f}{stage['p99_ms']:9.1f}"
+            f"{stage['peak_rss_mb']:9.1f}{stage['db_seconds']:8.2f}"
+            f"{'-' if written is None else f'{written / 1e6:.1f}':>9}",
+        )
+
+
+def compare(baseline, report):
+    """Print the change of throughput and p99 latency of each stage since a former report."""
+    print(f"\nCompared with {baseline.get('commit') or 'baseline'}:")
+    if (baseline['options'], baseline['concurrency']) != (report['options'], report['concurrency']):
+        print('Warning: the sites or the concurrency differ')
+    for scale, stages in report['scales'].items():
+        for name, stage in stages.items():
+            former = baseline['scales'].get(scale, {}).get(name)
+            if former is None:
+                continue
+            throughput = stage['urls_per_second'] / former['urls_per_second'] - 1
+            p99 = stage['p99_ms'] / former['p99_ms'] - 1 if former['p99_ms'] else 0.0
+            print(f'{scale:>6} {name:<15} URLs/s {throughput:+7.1%}   p99 {p99:+7.1%}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--scales', type=int, nargs='+', default=[10, 1000, 10000], help='Numbers of sites')
+    parser.add_argument('--page-size', type=int, default=DEFAULTS.page_size, help='Bytes per page')
+    parser.add_argument('--scripts', type=int, default=DEFAULTS.script_count, help='Scripts per page')
+    parser.add_argument('--js-size', type=int, default=DEFAULTS.js_size, help='Bytes per JS bundle')
+    parser.add_argument('--latency', type=float, default=DEFAULTS.latency, help='Seconds before each response')
+    parser.add_argument('--error-rate', type=float, default=DEFAULTS.error_rate, help='Share of pages answering 500')
+    parser.add_argument('--concurrency', type=int, default=20, help='URLs fetched at once')
+    parser.add_argument('--json', help='Write the results to this JSON file')
+    parser.add_argument('--compare', help='Compare the results with this JSON file of a former run')
+    args = parser.parse_args()
+
+    options = SiteOptions(args.page_size, args.scripts, args.js_size, args.latency, args.error_rate)
+    # Every scale starts from a fresh interpreter, with nothing cached or imported.
+    context = multiprocessing.get_context('spawn')
+    server_conn, conn = context.Pipe()
+    server = context.Process(target=serve, args=(options, conn), daemon=True)
+    server.start()
+    port = server_conn.recv()
+
+    report = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'options': options._asdict(),
+        'concurrency': args.concurrency,
+        'scales': {},
+    }
+    print(f"{'sites':>6} {'stage':<15}{'URLs/s':>9}{'p50 ms':>9}{'p99 ms':>9}{'RSS MB':>9}{'DB s':>8}{'disk MB':>9}")
+    try:
+        for scale in args.scales:
+            stages_conn, conn = context.Pipe()
+            process = context.Process(target=run_scale, args=(scale, port, args.concurrency, conn))
+            process.start()
+            # Closed here, so a crash of the process ends recv() with EOFError.
+            conn.close()
+            stages = stages_conn.recv()
+            process.join()
+            report['scales'][str(scale)] = stages
+            print_stages(scale, stages)
+    finally:
+        server.terminate()
+
+    if args.compare:
+        compare(json.loads(Path(args.compare).read_text()), report)
+    if args.json:
+        Path(args.json).write_text(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
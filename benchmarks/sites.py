@@ -0,0 +1,119 @@
+"""
+Synthetic sites: a local HTTP server for reproducible scan benchmarks.
+
+Every site is a page with scripts:
+
+    /<site>                the page, <title>Site <site> v<version></title>,
+                           padded to page_size bytes, with script_count
+                           <script> tags.
+    /<site>/js/<i>.js      a JS bundle of js_size bytes.
+    PUT /version/<n>       sets the version of the sites.
+
+Bumping the version changes the title of every page and its first JS
+bundle, as a deployment would. Responses carry an ETag and answer 304 Not
+Modified when it matches. Each response waits ``latency`` seconds, and the
+pages of ``error_rate`` of the sites, always the same ones, answer 500. The
+server listens on 127.0.0.1.
+"""
+from __future__ import annotations
+
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from typing import NamedTuple
+
+
+class SiteOptions(NamedTuple):
+    page_size: int = 20_000
+    script_count: int = 5
+    js_size: int = 50_000
+    latency: float = 0.0
+    error_rate: float = 0.0
+
+
+class SiteHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are sent separately: with Nagle's algorithm, the body
+    # would wait for the delayed ACK of the headers.
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        options = self.server.options
+        if options.latency:
+            time.sleep(options.latency)
+
+        parts = self.path.split('?')[0].strip('/').split('/')
+        if len(parts) == 1 and parts[0].isdigit():
+            site = int(parts[0])
+            if zlib.crc32(parts[0].encode()) % 10_000 < options.error_rate * 10_000:
+                return self.answer(500, b'error', None)
+            return self.answer(200, self.server.page(site), f'"p{site}-{self.server.version}"')
+        if len(parts) == 3 and parts[1] == 'js' and parts[2].endswith('.js'):
+            site, index = int(parts[0]), int(parts[2][:-3])
+            version = self.server.version if index == 0 else 0
+            body = self.server.bundle(site, index, version)
+            return self.answer(200, body, f'"j{site}-{index}-{version}"', 'text/javascript')
+        self.answer(404, b'not found', None)
+
+    def do_PUT(self):
+        _, _, version = self.path.strip('/').partition('/')
+        self.server.version = int(version)
+        self.answer(204, b'', None)
+
+    def answer(self, status, body, etag, content_type='text/html'):
+        if etag is not None and self.headers.get('If-None-Match') == etag:
+            status, body = 304, b''
+        self.send_response(status)
+        if etag is not None:
+            self.send_header('ETag', etag)
+        if status != 304:
+            self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class SiteServer(ThreadingHTTPServer):
+    """
+    SiteServer serves synthetic sites until closed.
+
+    Usage Example:
+        with SiteServer(SiteOptions(latency=0.05)) as server:
+            URLInspector(server.url(0)).inspect(['title', 'js_files'])
+    """
+
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, options: SiteOptions = SiteOptions(), port: int = 0) -> None:
+
+        super().__init__(('127.0.0.1', port), SiteHandler)
+        self.options = options
+        self.version = 0
+
+    def url(self, site: int) -> str:
+        return f'http://127.0.0.1:{self.server_port}/{site}'
+
+    def page(self, site: int) -> bytes:
+        head = f'<html><head><title>Site {site} v{self.version}</title></head><body>'
+        scripts = ''.join(f'<script src="/{site}/js/{index}.js"></script>' for index in range(self.options.script_count))
+        filler = max(0, self.options.page_size - len(head) - len(scripts) - len('</body></html>'))
+        paragraphs = (f'<p>Paragraph of site {site}.</p>' * (filler // 24 + 1))[:filler]
+        return f'{head}{paragraphs}{scripts}</body></html>'.encode()
+
+    def bundle(self, site: int, index: int, version: int) -> bytes:
+        line = f'console.log("site {site} bundle {index} v{version}");\n'.encode()
+        return (line * (self.options.js_size // len(line) + 1))[:self.options.js_size]
+
+    def __enter__(self) -> 'SiteServer':
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.shutdown()
+        self.server_close()
@@ -30,14 +30,14 @@ class CustomInstallCommand(install):
 setup(
     name='inspector',
     version='0.1',
-    packages=['src.inspector'],
+    packages=['src.inspector', 'src.inspector.migrations', 'src.inspector.migrations.versions'],
+    package_data={'src.inspector': ['alembic.ini', 'migrations/script.py.mako']},
     install_requires=[
         'rich>=13.5.3',
         'requests>=2.31.0',
+        'urllib3>=2.0.0',
         'python-crontab>=3.0.0',
         'tldextract>=3.6.0',
-        'beautifulsoup4>=4.12.2',
-        'validators>=0.22.0',
         'alembic>=1.12.0',
     ],
     entry_points={
@@ -0,0 +1,217 @@
+import importlib.util
+import re
+from functools import lru_cache
+from html.parser import HTMLParser
+from typing import Callable
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import NamedTuple
+from typing import Optional
+from typing import Tuple
+
+from .config import HTML_PARSER
+
+
+JS_HREF = re.compile(r'\.js$')
+
+
+class PageAnalysis(NamedTuple):
+    title: Optional[str]
+    scripts: List[str]
+    modulepreloads: List[str]
+    keyword_hits: Dict[str, bool]
+    # The fingerprint of the page as stored in UrlData, when it was asked for.
+    fingerprint: Optional[str] = None
+
+
+ParseResult = Tuple[Optional[str], List[str], List[str]]
+
+
+class PageTokenizer(HTMLParser):
+    """
+    PageTokenizer extracts the title and JS references of a page in one pass.
+
+    It is an incremental tokenizer: the document can be fed in chunks, and
+    ``title_done``/``head_done`` tell when the title or the head has been seen,
+    so streaming callers can stop reading early.
+
+    Attributes:
+        title (str): The text of the first <title>, or None.
+        scripts (list): The src of every <script src>, in document order.
+        modulepreloads (list): The href of <link rel="modulepreload"> ending in .js.
+        title_done (bool): True once the first </title> has been seen.
+        head_done (bool): True once </head> or <body> has been seen.
+    """
+
+    def __init__(self) -> None:
+        super().__init__(convert_charrefs=True)
+        self.title = None
+        self.scripts = []
+        self.modulepreloads = []
+        self.title_done = False
+        self.head_done = False
+        self._title_parts = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'title':
+            if self._title_parts is None and not self.title_done:
+                self._title_parts = []
+        elif tag == 'script':
+            attributes = dict(attrs)
+            if 'src' in attributes:
+                self.scripts.append(attributes['src'] or '')
+        elif tag == 'link':
+            attributes = dict(attrs)
+            rel = (attributes.get('rel') or '').split()
+            href = attributes.get('href') or ''
+            if 'modulepreload' in rel and JS_HREF.search(href):
+                self.modulepreloads.append(href)
+        elif tag == 'body':
+            self.head_done = True
+
+    def handle_endtag(self, tag):
+        if tag == 'title' and self._title_parts is not None:
+            self._finish_title()
+        elif tag == 'head':
+            self.head_done = True
+
+    def handle_data(self, data):
+        if self._title_parts is not None:
+            self._title_parts.append(data)
+
+    def close(self):
+        super().close()
+        if self._title_parts is not None:
+            self._finish_title()
+
+    def _finish_title(self):
+        self.title = ''.join(self._title_parts).strip()
+        self._title_parts = None
+        self.title_done = True
+
+
+def _parse_html_parser(html: str) -> ParseResult:
+    tokenizer = PageTokenizer()
+    tokenizer.feed(html)
+    tokenizer.close()
+    return tokenizer.title, tokenizer.scripts, tokenizer.modulepreloads
+
+
+def _parse_lxml(html: str) -> ParseResult:
+    from lxml import etree
+    from lxml import html as lxml_html
+
+    try:
+        tree = lxml_html.document_fromstring(html)
+    except (etree.ParserError, ValueError):
+        return None, [], []
+
+    title = tree.find('.//title')
+    scripts = [
+        script.get('src') for script in tree.iter('script')
+        if script.get('src') is not None
+    ]
+    modulepreloads = [
+        link.get('href') for link in tree.iter('link')
+        if 'modulepreload' in (link.get('rel') or '').split()
+        and JS_HREF.search(link.get('href') or '')
+    ]
+    return (
+        title.text_content().strip() if title is not None else None,
+        scripts,
+        modulepreloads,
+    )
+
+
+def _parse_selectolax(html: str) -> ParseResult:
+    from selectolax.parser import HTMLParser as SelectolaxParser
+
+    tree = SelectolaxParser(html)
+    title = tree.css_first('title')
+    scripts = [
+        script.attributes.get('src') or ''
+        for script in tree.css('script[src]')
+    ]
+    modulepreloads = [
+        link.attributes.get('href') for link in tree.css('link[rel~="modulepreload"]')
+        if JS_HREF.search(link.attributes.get('href') or '')
+    ]
+    return (
+        title.text(deep=True).strip() if title is not None else None,
+        scripts,
+        modulepreloads,
+    )
+
+
+PARSERS: Dict[str, Tuple[Optional[str], Callable[[str], ParseResult]]] = {
+    'selectolax': ('selectolax', _parse_selectolax),
+    'lxml': ('lxml', _parse_lxml),
+    'html.parser': (None, _parse_html_parser),
+}
+
+
+@lru_cache(maxsize=None)
+def available_parsers() -> Tuple[str, ...]:
+    """
+    Return the names of the parsers usable in this environment, fastest first.
+    """
+    return tuple(
+        name for name, (module, _) in PARSERS.items()
+        if module is None or importlib.util.find_spec(module) is not None
+    )
+
+
+def get_parser(name: str = HTML_PARSER) -> Callable[[str], ParseResult]:
+    """
+    Return the parse function of a parser, or of the fastest one for 'auto'.
+
+    Raises:
+        ValueError: If the parser is unknown or not installed.
+    """
+    available = available_parsers()
+    if name == 'auto':
+        name = available[0]
+    if name not in available:
+        raise ValueError(f"HTML parser '{name}' is not available")
+    return PARSERS[name][1]
+
+
+def analyze(
+    html: str, keywords: Iterable[str] = (), parser: str = HTML_PARSER, fingerprint: bool = False,
+) -> PageAnalysis:
+    """
+    Analyze a page with a single parse of the document.
+
+    Args:
+        html (str): The page content.
+        keywords: Words to look for (case-insensitively) in the page content.
+        parser (str): The parser to use, see PARSERS.
+        fingerprint (bool): Also fingerprint the page. The fingerprint comes from the
+            tokens of html.parser, so the page is then parsed by a PageFingerprinter,
+            whatever the parser, rather than parsed a second time.
+
+    Returns:
+        PageAnalysis: The title, script srcs, modulepreload links, keyword hits
+            and, with ``fingerprint``, the fingerprint.
+    """
+    page_fingerprint = None
+    if fingerprint:
+        # Imported here, as fingerprint builds on PageTokenizer.
+        from .fingerprint import PageFingerprinter
+
+        fingerprinter = PageFingerprinter()
+        fingerprinter.feed(html)
+        fingerprinter.close()
+        title, scripts, modulepreloads = fingerprinter.title, fingerprinter.scripts, fingerprinter.modulepreloads
+        page_fingerprint = str(fingerprinter.fingerprint())
+    else:
+        title, scripts, modulepreloads = get_parser(parser)(html)
+
+    keyword_hits = {}
+    keywords = list(keywords)
+    if keywords:
+        lowered = html.lower()
+        keyword_hits = {keyword: keyword.lower() in lowered for keyword in keywords}
+
+    return PageAnalysis(title, scripts, modulepreloads, keyword_hits, page_fingerprint)
@@ -0,0 +1,300 @@
+import atexit
+import hashlib
+import importlib.util
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import zlib
+from pathlib import Path
+from typing import Iterable
+from typing import NamedTuple
+from typing import Optional
+from typing import Tuple
+
+from .config import BLOB_DIR
+from .config import BLOB_INDEX_PATH
+from .config import BLOB_RETENTION_DAYS
+from .config import get_logger
+from .metrics import METRICS
+
+
+logger = get_logger()
+
+
+class BlobInfo(NamedTuple):
+    key: str
+    md5: str
+    size: int
+
+
+def _fast_hash():
+    """Return the name and constructor of the fastest content hash installed."""
+    if importlib.util.find_spec('blake3'):
+        import blake3
+        return 'blake3', blake3.blake3
+    if importlib.util.find_spec('xxhash'):
+        import xxhash
+        return 'xxh128', xxhash.xxh3_128
+    return 'blake2b', lambda: hashlib.blake2b(digest_size=16)
+
+
+def _compressor():
+    """Return the codec name and a compressobj factory, zstd when installed."""
+    if importlib.util.find_spec('zstandard'):
+        import zstandard
+        return 'zstd', lambda: zstandard.ZstdCompressor(level=10).compressobj()
+    return 'zlib', lambda: zlib.compressobj(6)
+
+
+def _decompress(codec: str, data: bytes) -> bytes:
+    if codec == 'zstd':
+        import zstandard
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    return zlib.decompress(data)
+
+
+class BlobStore:
+    """
+    BlobStore is a content-addressed, compressed store for downloaded JS files.
+
+    Every blob is keyed by a fast hash of its content (BLAKE3 or xxHash when
+    installed, BLAKE2b otherwise) and written once, whatever the number of pages
+    or hosts that load it, under sharded directories (``ab/cd/abcd...``). Blobs
+    are compressed with zstd when installed, zlib otherwise, and written to a
+    temporary file renamed into place, so a crashed run never leaves a
+    truncated blob. The MD5 of the content is kept for compatibility with the
+    hashes stored in the database.
+
+    An SQLite index counts the references of each blob: a reference is a
+    (page URL, JS URL) pair. A blob whose last reference is dropped is
+    deleted by gc() once it has been unreferenced for the retention period.
+    Index changes are committed every ``commit_every`` writes; processes
+    sharing the store should commit often so they do not hold the write lock.
+
+    Usage Example:
+        store = BlobStore()
+        info = store.put(js_response.content)
+        store.link("https://example.com", "https://example.com/app.js", info.key)
+        store.retain("https://example.com", ["https://example.com/app.js"])
+        store.gc()
+    """
+
+    COMMIT_EVERY = 200
+
+    def __init__(
+        self,
+        root=BLOB_DIR,
+        index_path=BLOB_INDEX_PATH,
+        retention_days: float = BLOB_RETENTION_DAYS,
+        commit_every: int = COMMIT_EVERY,
+    ) -> None:
+
+        self.root = Path(root)
+        self.commit_every = commit_every
+        self.retention_days = retention_days
+        self.algorithm, self._hasher = _fast_hash()
+        self.codec, self._compressobj = _compressor()
+        self._lock = threading.Lock()
+        self._pending = 0
+
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(str(index_path), check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(
+            'CREATE TABLE IF NOT EXISTS blobs ('
+            'key TEXT PRIMARY KEY, md5 TEXT NOT NULL, size INTEGER NOT NULL, '
+            'stored_size INTEGER NOT NULL, codec TEXT NOT NULL, '
+            'refcount INTEGER NOT NULL DEFAULT 0, created_at REAL NOT NULL, released_at REAL);'
+            'CREATE TABLE IF NOT EXISTS refs ('
+            'owner TEXT NOT NULL, name TEXT NOT NULL, key TEXT NOT NULL, '
+            'PRIMARY KEY (owner, name));'
+            'CREATE INDEX IF NOT EXISTS ix_refs_key ON refs (key);'
+            'CREATE INDEX IF NOT EXISTS ix_blobs_released ON blobs (released_at) WHERE refcount = 0;',
+        )
+        self.connection.commit()
+
+    def path(self, key: str, codec: Optional[str] = None) -> Path:
+        """
+        Return the sharded path of a blob.
+        """
+        return self.root / key[:2] / key[2:4] / f'{key}.{codec or self.codec}'
+
+    def put(self, data: bytes) -> BlobInfo:
+        """
+        Store a blob, unless a blob with the same content is already stored.
+        """
+        return self.put_stream([data])
+
+    def put_stream(self, chunks: Iterable[bytes]) -> BlobInfo:
+        """
+        Store a blob from an iterable of chunks without holding it in memory.
+
+        The chunks are hashed and compressed into a temporary file, which is
+        renamed to its content address, or discarded if the blob already exists.
+        The hashing and writing times are recorded in the metrics.
+        """
+        fast_hash = self._hasher()
+        md5 = hashlib.md5()
+        compressor = self._compressobj()
+        size = 0
+        hash_seconds = 0.0
+        start = time.perf_counter()
+
+        fd, temp_path = tempfile.mkstemp(dir=self.root, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                for chunk in chunks:
+                    hash_start = time.perf_counter()
+                    fast_hash.update(chunk)
+                    md5.update(chunk)
+                    hash_seconds += time.perf_counter() - hash_start
+                    size += len(chunk)
+                    file.write(compressor.compress(chunk))
+                file.write(compressor.flush())
+                stored_size = file.tell()
+
+            info = BlobInfo(fast_hash.hexdigest(), md5.hexdigest(), size)
+            path = self.path(info.key)
+            if path.exists():
+                os.remove(temp_path)
+            else:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                os.replace(temp_path, path)
+                METRICS.inc('blob_bytes_written', stored_size)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        METRICS.observe('hash', hash_seconds)
+        METRICS.observe('write', time.perf_counter() - start - hash_seconds)
+        with self._lock:
+            self.connection.execute(
+                'INSERT OR IGNORE INTO blobs (key, md5, size, stored_size, codec, created_at, released_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (info.key, info.md5, info.size, stored_size, self.codec, time.time(), time.time()),
+            )
+            self._committed()
+        return info
+
+    def get(self, key: str) -> bytes:
+        """
+        Return the content of a blob.
+
+        Raises:
+            KeyError: If the blob is not stored.
+        """
+        with self._lock:
+            row = self.connection.execute('SELECT codec FROM blobs WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return _decompress(row[0], self.path(key, row[0]).read_bytes())
+
+    def link(self, owner: str, name: str, key: str) -> None:
+        """
+        Reference a blob as the content of ``name`` loaded by ``owner``.
+
+        The blob previously referenced by the same pair loses a reference.
+        """
+        with self._lock:
+            row = self.connection.execute(
+                'SELECT key FROM refs WHERE owner = ? AND name = ?', (owner, name),
+            ).fetchone()
+            if row and row[0] == key:
+                return
+            if row:
+                self._release(row[0])
+            self.connection.execute(
+                'INSERT OR REPLACE INTO refs (owner, name, key) VALUES (?, ?, ?)', (owner, name, key),
+            )
+            self.connection.execute(
+                'UPDATE blobs SET refcount = refcount + 1, released_at = NULL WHERE key = ?', (key,),
+            )
+            self._committed()
+
+    def retain(self, owner: str, names: Iterable[str]) -> None:
+        """
+        Drop the references of ``owner`` to every name not in ``names``.
+        """
+        names = set(names)
+        with self._lock:
+            rows = self.connection.execute(
+                'SELECT name, key FROM refs WHERE owner = ?', (owner,),
+            ).fetchall()
+            for name, key in rows:
+                if name not in names:
+                    self.connection.execute('DELETE FROM refs WHERE owner = ? AND name = ?', (owner, name))
+                    self._release(key)
+            self._committed()
+
+    def gc(self, retention_days: Optional[float] = None) -> Tuple[int, int]:
+        """
+        Delete the blobs that have been unreferenced for the retention period.
+        It must not run while JS files are being stored, e.g. at the end of a run.
+
+        Returns:
+            tuple: The number of blobs deleted and the number of bytes freed.
+        """
+        days = self.retention_days if retention_days is None else retention_days
+        cutoff = time.time() - days * 86400
+
+        with self._lock:
+            rows = self.connection.execute(
+                'SELECT key, codec, stored_size FROM blobs WHERE refcount = 0 AND released_at <= ?',
+                (cutoff,),
+            ).fetchall()
+            for key, codec, _ in rows:
+                try:
+                    os.remove(self.path(key, codec))
+                except FileNotFoundError:
+                    pass
+                self.connection.execute('DELETE FROM blobs WHERE key = ?', (key,))
+            self.connection.commit()
+            self._pending = 0
+
+        freed = sum(stored_size for _, _, stored_size in rows)
+        logger.info(f'Deleted {len(rows)} unreferenced JS blobs ({freed} bytes)')
+        return len(rows), freed
+
+    def close(self) -> None:
+        """
+        Commit pending changes and close the index. Closing twice is a no-op.
+        """
+        with self._lock:
+            if self.connection is None:
+                return
+            self.connection.commit()
+            self.connection.close()
+            self.connection = None
+
+    def _release(self, key: str) -> None:
+        self.connection.execute(
+            'UPDATE blobs SET refcount = MAX(refcount - 1, 0), '
+            'released_at = CASE WHEN refcount <= 1 THEN ? ELSE released_at END WHERE key = ?',
+            (time.time(), key),
+        )
+
+    def _committed(self) -> None:
+        self._pending += 1
+        if self._pending >= self.commit_every:
+            self.connection.commit()
+            self._pending = 0
+
+
+_default_store: Optional[BlobStore] = None
+_default_lock = threading.Lock()
+
+
+def get_blob_store() -> BlobStore:
+    """
+    Return the process-wide default BlobStore, creating it on first use.
+    """
+    global _default_store
+    with _default_lock:
+        if _default_store is None:
+            _default_store = BlobStore()
+            atexit.register(_default_store.close)
+        return _default_store
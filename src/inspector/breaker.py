@@ -0,0 +1,150 @@
+import sqlite3
+import threading
+import time
+from typing import Dict
+from typing import List
+from typing import NamedTuple
+
+from .config import BREAKER_COOLDOWN
+from .config import BREAKER_MAX_COOLDOWN
+from .config import BREAKER_PATH
+from .config import BREAKER_THRESHOLD
+from .config import get_logger
+
+
+logger = get_logger()
+
+
+class HostState(NamedTuple):
+    failures: int
+    trips: int
+    open_until: float
+
+
+CLOSED = HostState(0, 0, 0.0)
+
+
+class CircuitBreaker:
+    """
+    CircuitBreaker skips the hosts which keep failing until a cooldown has passed.
+
+    After ``threshold`` consecutive failed requests, the circuit of a host opens
+    and its requests are refused without being sent for ``cooldown`` seconds,
+    doubled each time it opens again, up to ``max_cooldown``. Once the cooldown
+    has passed the circuit is half-open: one request is let through as a trial,
+    and it closes the circuit when it succeeds or opens it again when it fails.
+
+    The state of the hosts is loaded from SQLite when the breaker is created and
+    written back on every change, so an unreachable host is not retried at full
+    cost by every run.
+
+    Usage Example:
+        breaker = CircuitBreaker()
+        if breaker.allow('example.com'):
+            ok = send()
+            breaker.record('example.com', ok)
+    """
+
+    def __init__(
+        self,
+        path=BREAKER_PATH,
+        threshold: int = BREAKER_THRESHOLD,
+        cooldown: float = BREAKER_COOLDOWN,
+        max_cooldown: float = BREAKER_MAX_COOLDOWN,
+        clock=time.time,
+    ) -> None:
+
+        self.threshold = max(1, threshold)
+        self.cooldown = cooldown
+        self.max_cooldown = max(cooldown, max_cooldown)
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._trials = set()
+        self.connection = sqlite3.connect(str(path), timeout=30, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS hosts ('
+            'host TEXT PRIMARY KEY, failures INTEGER NOT NULL, trips INTEGER NOT NULL, '
+            'open_until REAL NOT NULL)',
+        )
+        self.connection.commit()
+        self._hosts: Dict[str, HostState] = {
+            host: HostState(*state)
+            for host, *state in self.connection.execute('SELECT host, failures, trips, open_until FROM hosts')
+        }
+
+    def allow(self, host: str) -> bool:
+        """
+        Return whether a request to the host may be sent.
+        """
+        with self._lock:
+            state = self._hosts.get(host, CLOSED)
+            if state.failures < self.threshold:
+                return True
+            if self.clock() < state.open_until or host in self._trials:
+                return False
+            self._trials.add(host)
+            return True
+
+    def record(self, host: str, success: bool) -> None:
+        """
+        Record the outcome of a request to the host.
+        """
+        with self._lock:
+            self._trials.discard(host)
+            state = self._hosts.get(host, CLOSED)
+            if success:
+                if state != CLOSED:
+                    if state.failures >= self.threshold:
+                        logger.info(f'Circuit closed for {host}')
+                    self._save(host, CLOSED)
+                return
+
+            failures = state.failures + 1
+            if failures < self.threshold:
+                self._save(host, HostState(failures, state.trips, state.open_until))
+                return
+
+            cooldown = min(self.max_cooldown, self.cooldown * 2 ** state.trips)
+            self._save(host, HostState(failures, state.trips + 1, self.clock() + cooldown))
+            logger.warning(f'Circuit opened for {host} after {failures} failures, for {cooldown:.0f}s')
+
+    def release(self, host: str) -> None:
+        """
+        Let another request to the host through as a trial, when the outcome of
+        the last one says nothing of the host.
+        """
+        with self._lock:
+            self._trials.discard(host)
+
+    def open_hosts(self) -> List[str]:
+        """
+        Return the hosts whose circuit is open.
+        """
+        now = self.clock()
+        with self._lock:
+            return sorted(
+                host for host, state in self._hosts.items()
+                if state.failures >= self.threshold and now < state.open_until
+            )
+
+    def _save(self, host: str, state: HostState) -> None:
+        if state == CLOSED:
+            self._hosts.pop(host, None)
+            self.connection.execute('DELETE FROM hosts WHERE host = ?', (host,))
+        else:
+            self._hosts[host] = state
+            self.connection.execute(
+                'INSERT OR REPLACE INTO hosts (host, failures, trips, open_until) VALUES (?, ?, ?, ?)',
+                (host, *state),
+            )
+        self.connection.commit()
+
+    def close(self) -> None:
+        """
+        Close the database. Closing twice is a no-op.
+        """
+        with self._lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
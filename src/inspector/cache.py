@@ -0,0 +1,155 @@
+import sqlite3
+import threading
+import time
+from typing import Dict
+from typing import Iterable
+from typing import NamedTuple
+from typing import Optional
+
+from .config import CACHE_DB_PATH
+
+
+class CacheEntry(NamedTuple):
+    url: str
+    etag: Optional[str]
+    last_modified: Optional[str]
+    content_hash: str
+
+
+class ValidatorCache:
+    """
+    ValidatorCache stores HTTP validators and content hashes of fetched URLs.
+
+    For every URL fetched with a 200 response that carries an ``ETag`` or a
+    ``Last-Modified`` header, the validators are stored together with the MD5
+    hash of the body. The next request for the URL sends them back as
+    ``If-None-Match``/``If-Modified-Since``, and a 304 answer lets the caller
+    reuse the stored hash without downloading the body again.
+
+    The cache is a small SQLite database shared by all scanner threads. Writes
+    are committed every ``commit_every`` stores; processes sharing the cache
+    should commit often so they do not hold the write lock.
+
+    Usage Example:
+        cache = ValidatorCache()
+        client = HTTPClient(cache=cache)
+        ...
+        cache.close()
+    """
+
+    COMMIT_EVERY = 500
+
+    def __init__(self, path=CACHE_DB_PATH, commit_every: int = COMMIT_EVERY) -> None:
+
+        self.commit_every = commit_every
+        self._lock = threading.Lock()
+        self._pending = 0
+        self.connection = sqlite3.connect(str(path), check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS validators ('
+            'url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, '
+            'content_hash TEXT NOT NULL, updated_at REAL NOT NULL)',
+        )
+        self.connection.execute('CREATE TABLE IF NOT EXISTS sources (url TEXT PRIMARY KEY, source TEXT NOT NULL)')
+        self.connection.commit()
+
+    def get(self, url: str) -> Optional[CacheEntry]:
+        """
+        Return the cache entry of a URL, or None if it is not cached.
+        """
+        with self._lock:
+            row = self.connection.execute(
+                'SELECT url, etag, last_modified, content_hash FROM validators WHERE url = ?',
+                (url,),
+            ).fetchone()
+        return CacheEntry(*row) if row else None
+
+    def conditional_headers(self, url: str) -> Dict[str, str]:
+        """
+        Return the If-None-Match/If-Modified-Since headers for a URL.
+        """
+        entry = self.get(url)
+        headers = {}
+        if entry:
+            if entry.etag:
+                headers['If-None-Match'] = entry.etag
+            if entry.last_modified:
+                headers['If-Modified-Since'] = entry.last_modified
+        return headers
+
+    @staticmethod
+    def entry(url: str, response, content_hash: str) -> Optional[CacheEntry]:
+        """
+        Return the cache entry of a 200 response and the hash of its body, or
+        None when it has no validators.
+
+        Responses without validators are not cached, since they could never
+        be answered with a 304.
+        """
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if response.status_code != 200 or not (etag or last_modified):
+            return None
+        return CacheEntry(url, etag, last_modified, content_hash)
+
+    def store(self, url: str, response, content_hash: str) -> None:
+        """
+        Store the validators of a 200 response and the hash of its body.
+        """
+        entry = self.entry(url, response, content_hash)
+        if entry is None:
+            return
+
+        with self._lock:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO validators VALUES (?, ?, ?, ?, ?)', (*entry, time.time()),
+            )
+            self._committed()
+
+    def store_entries(self, entries: Iterable[CacheEntry]) -> None:
+        """
+        Store cache entries made by entry() and commit them at once, e.g. those
+        of the pages whose changes were just written to the database.
+        """
+        now = time.time()
+        with self._lock:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO validators VALUES (?, ?, ?, ?, ?)',
+                [(*entry, now) for entry in entries],
+            )
+            self.connection.commit()
+            self._pending = 0
+
+    def source(self, url: str) -> Optional[str]:
+        """
+        Return the URL a JS file known by ``url``, its URL without cache
+        busters, was last downloaded from, or None if it is not known.
+        """
+        with self._lock:
+            row = self.connection.execute('SELECT source FROM sources WHERE url = ?', (url,)).fetchone()
+        return row[0] if row else None
+
+    def store_source(self, url: str, source: str) -> None:
+        """
+        Store the URL a JS file known by ``url`` was downloaded from, so it is
+        downloaded from there again while the page loading it is not modified.
+        """
+        with self._lock:
+            self.connection.execute('INSERT OR REPLACE INTO sources VALUES (?, ?)', (url, source))
+            self._committed()
+
+    def _committed(self) -> None:
+        self._pending += 1
+        if self._pending >= self.commit_every:
+            self.connection.commit()
+            self._pending = 0
+
+    def close(self) -> None:
+        """
+        Commit pending entries and close the database.
+        """
+        with self._lock:
+            self.connection.commit()
+            self.connection.close()
@@ -1,27 +1,44 @@
+from __future__ import annotations
+
 import argparse
 import os
+from contextlib import closing
+from datetime import datetime
+from datetime import timezone
+from functools import partial
+from typing import Any
+from typing import Dict
 from typing import List
-from urllib.parse import urlparse
-
-from rich import print
-from tqdm import tqdm
+from typing import Optional
+from typing import TYPE_CHECKING
 
 from .config import DB_URL
 from .config import get_logger
 from .config import LOG_FILE
-from .db import get_session
-from .models import UrlData
-from .queries import UrlDataQueries
-from .urlinspector import URLInspector
+from .urls import get_host
+from .urls import normalize_url
+
+# The dependencies of the commands are imported by the commands which need
+# them, so e.g. -logs or -subs start without loading the HTTP stack.
+if TYPE_CHECKING:
+    from .blobstore import BlobStore
+    from .httpclient import HTTPClient
+    from .models import UrlData
+    from .queries import UrlDataQueries
+    from .urlinspector import JsDownloads
+    from .urlinspector import URLInspector
+    from .versions import VersionStore
 
 
 logger = get_logger()
 
+# Failed URLs listed at the end of a bulk import, the others are in the log.
+MAX_FAILURES_SHOWN = 20
+
 
 def validate_url(url: str) -> bool:
     """Validate URL input"""
-    parsed = urlparse(url)
-    return bool(parsed.scheme and parsed.netloc)
+    return normalize_url(url) is not None
 
 
 def validate_file(fil_path: str) -> bool:
@@ -30,14 +47,265 @@ def validate_file(fil_path: str) -> bool:
 
 
 def get_urls_from_file(file_path: str) -> List[str]:
-    """Extract URLs from file"""
+    """Extract the normalized URLs from file, without duplicates"""
+    from .importer import read_urls
+
     with open(file_path) as f:
-        urls = [line.strip() for line in f]
-        return [url for url in urls if validate_url(url)]
+        urls, invalid, duplicates = read_urls(f)
+    if invalid or duplicates:
+        print(f'Skipped {invalid} invalid and {duplicates} duplicate URLs')
+    return urls
+
+
+def get_inspector(
+    url: str,
+    client: Optional[HTTPClient] = None,
+    blob_store: Optional[BlobStore] = None,
+    downloads: Optional[JsDownloads] = None,
+    versions: Optional[VersionStore] = None,
+) -> URLInspector:
+    from .urlinspector import URLInspector
+
+    return URLInspector(url, client=client, blob_store=blob_store, downloads=downloads, versions=versions)
+
+
+def get_checks(args: argparse.Namespace) -> List[str]:
+    """Return the checks enabled by the command line flags"""
+    flags = {
+        'status_code': args.status_code,
+        'title': args.title,
+        'js_files': args.js,
+        'content_length': args.content_length,
+        # Content changes are detected by the fingerprint of the page.
+        'fingerprint': args.content_length,
+    }
+    return [check for check, enabled in flags.items() if enabled]
+
+
+def run_checks(
+    url: str,
+    checks: List[str],
+    client: Optional[HTTPClient] = None,
+    blob_store: Optional[BlobStore] = None,
+    downloads: Optional[JsDownloads] = None,
+    versions: Optional[VersionStore] = None,
+) -> Dict[str, Any]:
+    """Run the checks of a URL with a single fetch"""
+    if not checks:
+        return {}
+    return get_inspector(url, client, blob_store, downloads, versions).inspect(checks)
+
+
+def import_urls(
+    urls: List[str],
+    args: argparse.Namespace,
+    queries: UrlDataQueries,
+    client: Optional[HTTPClient] = None,
+    blob_store: Optional[BlobStore] = None,
+    versions: Optional[VersionStore] = None,
+) -> None:
+    """Add or update the records of a list of URLs concurrently, and print a summary"""
+    from tqdm import tqdm
+
+    from .importer import BulkImporter
+    from .urlinspector import JsDownloads
+
+    # The hosts which do not exist are found before the URLs are fetched, and
+    # the JS files shared by several of the URLs are downloaded once.
+    if client is not None and client.resolver is not None:
+        client.resolver.prefetch(get_host(url) for url in urls)
+    downloads = JsDownloads()
+    importer = BulkImporter(
+        queries,
+        partial(
+            run_checks, checks=get_checks(args), client=client, blob_store=blob_store, downloads=downloads,
+            versions=versions,
+        ),
+        min_interval=args.min_interval,
+        max_interval=args.max_interval,
+    )
+    with tqdm(total=len(urls)) as progress:
+        added, updated, failed = importer.run(urls, progress=progress.update)
+
+    print(f'Added {added} and updated {updated} URLs, {len(failed)} failed')
+    for url in failed[:MAX_FAILURES_SHOWN]:
+        print(f'Failed: {url}')
+    if len(failed) > MAX_FAILURES_SHOWN:
+        print(f'... and {len(failed) - MAX_FAILURES_SHOWN} more, see {LOG_FILE}')
+
+
+def inspect_url(
+    url_data: UrlData,
+    args: argparse.Namespace,
+    queries: UrlDataQueries,
+    client: Optional[HTTPClient] = None,
+    blob_store: Optional[BlobStore] = None,
+    versions: Optional[VersionStore] = None,
+) -> UrlData:
+    """Fill the enabled fields of a record with a single fetch of its URL"""
+    if args.min_interval is not None:
+        url_data.min_interval = args.min_interval
+    if args.max_interval is not None:
+        url_data.max_interval = args.max_interval
+
+    checks = get_checks(args)
+    if checks:
+        results = get_inspector(url_data.url, client, blob_store, versions=versions).inspect(checks)
+        js_files = results.pop('js_files', None)
+        if js_files is not None:
+            url_data.track_js = True
+            queries.sync_js_assets(url_data, js_files)
+        for field, value in results.items():
+            setattr(url_data, field, value)
+    return url_data
+
 
+def open_queries() -> UrlDataQueries:
+    """Upgrade the database if needed, and return the queries of a new session"""
+    from .db import get_session
+    from .db import upgrade_db
+    from .queries import UrlDataQueries
 
-def get_inspector(url: str) -> URLInspector:
-    return URLInspector(url)
+    upgrade_db(DB_URL)
+    return UrlDataQueries(get_session(DB_URL))
+
+
+def add(args: argparse.Namespace) -> None:
+    """Add or update the records of the URLs given on the command line"""
+    from .blobstore import BlobStore
+    from .cache import ValidatorCache
+    from .httpclient import HTTPClient
+    from .models import UrlData
+    from .resolver import Resolver
+    from .versions import VersionStore
+
+    if args.list:
+        urls = get_urls_from_file(args.list)
+    elif args.url:
+        url = normalize_url(args.url)
+        if url is None:
+            print(f'Error: {args.url} is not a valid URL.')
+            return
+    else:
+        print("Error: Please specify either a single URL using '-u' or a file containing a list of URLs using '-l'.")
+        return
+
+    queries = open_queries()
+    with HTTPClient(cache=ValidatorCache(), resolver=Resolver()) as client, closing(BlobStore()) as blob_store, \
+            closing(VersionStore()) as versions:
+        if args.list:
+            import_urls(urls, args, queries, client, blob_store, versions)
+            return
+
+        url_data = queries.get(url)
+        if url_data:
+            queries.update(inspect_url(url_data, args, queries, client, blob_store, versions))
+            print(f'Data for URL {url} updated successfully!')
+        else:
+            queries.add(inspect_url(UrlData(url=url), args, queries, client, blob_store, versions))
+            print(f'Data for URL {url} added successfully!')
+
+
+def remove(args: argparse.Namespace) -> None:
+    """Remove the record of the URL given on the command line"""
+    if not args.url:
+        print("Error: Please specify a URL using '-u' to remove its data.")
+        return
+
+    queries = open_queries()
+    # Records added before URLs were normalized may not be in canonical form.
+    url_data = queries.delete(normalize_url(args.url) or args.url) or queries.delete(args.url)
+    if url_data:
+
+        print(f'Data for URL {args.url} removed successfully!')
+    else:
+        print(f'Data for URL {args.url} not found!')
+
+
+def parse_time(value: str) -> datetime:
+    """Parse a point in time given on the command line, see logs.parse_since, to naive UTC"""
+    from .logs import parse_since
+
+    return parse_since(value).astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def find_record(queries: UrlDataQueries, url: str) -> Optional[UrlData]:
+    """Return the record of a URL given on the command line, canonical or not"""
+    return queries.get(normalize_url(url) or url) or queries.get(url)
+
+
+def history(args: argparse.Namespace) -> None:
+    """Print the observed changes of the URL given on the command line, oldest first"""
+    from .queries import JS_FIELD
+
+    if not args.url:
+        print("Error: Please specify a URL using '-u' to show its history.")
+        return
+
+    queries = open_queries()
+    url_data = find_record(queries, args.url)
+    if url_data is None:
+        print(f'Data for URL {args.url} not found!')
+        return
+
+    for observation in queries.history(url_data.id):
+        when = f'{observation.observed_at:%Y-%m-%d %H:%M:%S}'
+        if observation.field == JS_FIELD:
+            print(f"{when}  js  {observation.asset_url}  {observation.value or 'removed'}")
+        else:
+            print(f'{when}  {observation.field}  `{observation.value}`')
+
+
+def diff(args: argparse.Namespace, start: datetime, end: datetime) -> None:
+    """Print the changes of the URL given on the command line between two points in time (UTC)"""
+    from .queries import diff_js_assets
+    from .queries import HISTORY_FIELDS
+    from .versions import diff_versions
+    from .versions import VersionStore
+
+    if not args.url:
+        print("Error: Please specify a URL using '-u' to show its changes.")
+        return
+
+    queries = open_queries()
+    url_data = find_record(queries, args.url)
+    if url_data is None:
+        print(f'Data for URL {args.url} not found!')
+        return
+
+    before = queries.state_at(url_data.id, start)
+    after = queries.state_at(url_data.id, end)
+    print(f'{url_data.url}: {start:%Y-%m-%d %H:%M:%S} to {end:%Y-%m-%d %H:%M:%S} UTC')
+
+    changed = False
+    for field in HISTORY_FIELDS:
+        old, new = before.fields.get(field), after.fields.get(field)
+        if old != new:
+            changed = True
+            print(f'{field}: `{old}` -> `{new}`')
+
+    changes = diff_js_assets(before.js_assets, {url: (md5, None) for url, md5 in after.js_assets.items()})
+    for url in changes.added:
+        print(f'JS added: {url}')
+    for url in changes.removed:
+        print(f'JS removed: {url}')
+    for url, old_url in changes.renamed.items():
+        print(f'JS renamed: {old_url} -> {url}')
+    with closing(VersionStore()) as versions:
+        for url in changes.changed:
+            old_url = changes.renamed.get(url, url)
+            print(f'JS changed: {url}')
+            try:
+                old = versions.get(old_url, before.js_assets[old_url])
+                new = versions.get(url, after.js_assets[url])
+            except KeyError:
+                print('  (content not in the history)')
+                continue
+            for line in diff_versions(old, new, old_url, url):
+                print(line)
+
+    if not changed and not any(changes):
+        print('No changes')
 
 
 def main():
@@ -46,10 +314,14 @@ def main():
     parser = argparse.ArgumentParser(description='URL Data Management')
     parser.add_argument(
         'action', nargs='?', choices=[
-            'add', 'remove',
-        ], help='Action to perform: add or remove',
+            'add', 'remove', 'gc', 'worker', 'daemon', 'history', 'diff',
+        ], help=(
+            'Action to perform: add, remove, gc (delete unreferenced JS files), '
+            'worker (join the running sharded scan), daemon (scan URLs as they come due), '
+            'history (show the changes of a URL) or diff (show the changes of a URL between -from and -to)'
+        ),
     )
-    parser.add_argument('-u', '--url', help='URL of the data')
+    parser.add_argument('-u', '--url', help='URL of the data, or shown by -logs')
     parser.add_argument(
         '-l', '--list', help='Path to a file containing a list of URLs',
     )
@@ -65,109 +337,112 @@ def main():
     )
     parser.add_argument(
         '-content-length', action='store_true',
-        help='Include content length',
+        help='Include content length, and notify content changes',
+    )
+
+    parser.add_argument(
+        '-min-interval', type=int,
+        help='Minimum number of seconds between two checks of the URL',
+    )
+    parser.add_argument(
+        '-max-interval', type=int,
+        help='Maximum number of seconds between two checks of the URL',
+    )
+    parser.add_argument(
+        '-shard', help='Shard owned by the worker, e.g. shard-0 (default: take over dead shards)',
+    )
+    parser.add_argument(
+        '-asset', help='Show the URLs loading a JS file, given its URL or MD5 hash',
+    )
+
+    parser.add_argument(
+        '-from', dest='start', help='Start of the changes shown by diff, e.g. 2d or 2026-10-18T08:00',
+    )
+    parser.add_argument(
+        '-to', dest='end', help='End of the changes shown by diff, e.g. 12h or 2026-10-18T20:00 (default: now)',
     )
 
     parser.add_argument('-logs', action='store_true', help='Show logs')
+    parser.add_argument(
+        '-lines', type=int, default=100, help='Number of log entries shown, the last ones (0 for all, default: 100)',
+    )
+    parser.add_argument(
+        '-since', help='Show the log entries since a time, e.g. 30m, 12h, 2d or 2026-10-18T08:00',
+    )
+    parser.add_argument(
+        '-level', type=str.upper, choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
+        help='Show the log entries of this level or higher',
+    )
+    parser.add_argument(
+        '-profile', '--profile', action='store_true',
+        help='Print the time spent per stage by add and by each round of the daemon',
+    )
 
     args = parser.parse_args()
 
-    # get the db session
-    session = get_session(DB_URL)
-    queries = UrlDataQueries(session)
+    if args.action == 'daemon':
+        from .main import run_daemon
 
-    if args.action == 'add':
-        if args.list:
-            urls = get_urls_from_file(args.list)
-
-            for url in tqdm(urls):
-                url_data = queries.get(url)
-                if url_data:
-                    if args.status_code:
-                        url_data.status_code = URLInspector(
-                            url,
-                        ).check_status_code()
-                    if args.title:
-                        url_data.title = URLInspector(url).check_title()
-                    if args.js:
-                        url_data.js_hash = URLInspector(url).check_js_files()
-                    if args.content_length:
-                        url_data.content_length = URLInspector(
-                            url,
-                        ).check_content_length()
-
-                    queries.add(url_data)
-                    print(f'Data for URL {url} updated successfully!')
-                else:
-                    url_data = queries.get(url)
-                    domain = get_inspector(url)
-                    if args.status_code:
-                        url_data.status_code = domain.check_status_code()
-                    if args.title:
-                        url_data.title = domain.check_title()
-                    if args.js:
-                        url_data.js_hash = domain.check_js_files()
-                    if args.content_length:
-                        url_data.content_length = domain.check_content_length()
-
-                    queries.add(url_data)
-                    print(f'Data for URL {url} added successfully!')
-
-        elif args.url:
-            url_data = queries.get(args.url)
-            if url_data:
-                if args.status_code:
-                    url_data.status_code = URLInspector(
-                        args.url,
-                    ).check_status_code()
-                if args.title:
-                    url_data.title = URLInspector(args.url).check_title()
-                if args.js:
-                    url_data.js_hash = URLInspector(args.url).check_js_files()
-                if args.content_length:
-                    url_data.content_length = URLInspector(
-                        args.url,
-                    ).check_content_length()
-
-                queries.update(url_data)
-                print(f'Data for URL {args.url} updated successfully!')
-            else:
-                url_data = UrlData(url=args.url)
-                domain = URLInspector(args.url)
-                if args.status_code:
-                    url_data.status_code = domain.check_status_code()
-                if args.title:
-                    url_data.title = domain.check_title()
-                if args.js:
-                    url_data.js_hash = domain.check_js_files()
-                if args.content_length:
-                    url_data.content_length = domain.check_content_length()
-
-                queries.add(url_data)
-                print(f'Data for URL {args.url} added successfully!')
-        else:
-            print("Error: Please specify either a single URL using '-u' or a file containing a list of URLs using '-l'.")
+        try:
+            run_daemon(profile=args.profile)
+        except KeyboardInterrupt:
+            print('Daemon stopped')
+
+    elif args.action == 'worker':
+        from .coordinator import run_worker
+
+        completed = run_worker(shard=args.shard)
+        print(f'Completed {completed} batches')
+
+    elif args.action == 'gc':
+        from .blobstore import BlobStore
+
+        with closing(BlobStore()) as blob_store:
+            deleted, freed = blob_store.gc()
+        print(f'Deleted {deleted} unreferenced JS files ({freed} bytes freed)')
+
+    elif args.action == 'add':
+        from .metrics import profiled
+
+        with profiled(args.profile):
+            add(args)
 
     elif args.action == 'remove':
-        if args.url:
-            url_data = queries.delete(args.url)
-            if url_data:
+        remove(args)
 
-                print(f'Data for URL {args.url} removed successfully!')
-            else:
-                print(f'Data for URL {args.url} not found!')
-        else:
-            print("Error: Please specify a URL using '-u' to remove its data.")
+    elif args.action == 'history':
+        history(args)
+
+    elif args.action == 'diff':
+        if not args.start:
+            parser.error('diff: -from is required')
+        try:
+            start = parse_time(args.start)
+            end = parse_time(args.end) if args.end else datetime.now(timezone.utc).replace(tzinfo=None)
+        except ValueError:
+            parser.error(f'diff: invalid time {args.start!r} or {args.end!r}')
+        diff(args, start, end)
+
+    elif args.asset:
+        for url_data in open_queries().get_by_js_asset(args.asset):
+            print(url_data.url)
 
     elif args.subs:
-        all_records_json = queries.get_all()
-        print(all_records_json)
+        from rich import print as rich_print
+
+        all_records_json = open_queries().get_all()
+        rich_print(all_records_json)
 
     elif args.logs:
-        with open(LOG_FILE) as file:
-            data = file.readlines()
-            for line in data:
-                print(line.strip())
+        from .logs import parse_since
+        from .logs import read_logs
+
+        try:
+            since = parse_since(args.since) if args.since else None
+        except ValueError:
+            parser.error(f'-since: invalid time {args.since!r}')
+        for entry in read_logs(limit=args.lines, since=since, level=args.level, url=args.url):
+            print(entry)
 
 
 if __name__ == '__main__':
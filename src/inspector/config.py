@@ -8,23 +8,185 @@ BASE_DIR = HOME / '.inspector'
 DB_PATH = BASE_DIR / 'data.db'
 DB_URL = f'sqlite:///{DB_PATH}'
 LOG_FILE = BASE_DIR / 'app.log'
+CACHE_DB_PATH = BASE_DIR / 'cache.db'
+BLOB_DIR = BASE_DIR / 'blobs'
+BLOB_INDEX_PATH = BASE_DIR / 'blobs.db'
+QUEUE_PATH = BASE_DIR / 'queue.db'
+OUTBOX_PATH = BASE_DIR / 'outbox.db'
+BREAKER_PATH = BASE_DIR / 'breaker.db'
+VERSIONS_PATH = BASE_DIR / 'versions.db'
 DISCORD_WEBHOOK_URL = os.getenv('DISCORD_WEBHOOK_URL') or 'put your webhook url here'
 
+# Scan engine: maximum number of URLs fetched at once, maximum number of
+# concurrent requests to a single host and the delay (in seconds) between
+# two requests to the same host.
+SCAN_CONCURRENCY = int(os.getenv('INSPECTOR_SCAN_CONCURRENCY', '20'))
+SCAN_PER_HOST = int(os.getenv('INSPECTOR_SCAN_PER_HOST', '2'))
+SCAN_DELAY = float(os.getenv('INSPECTOR_SCAN_DELAY', '0.5'))
+
+# Bulk import (inspector add -l): maximum number of URLs fetched at once.
+IMPORT_CONCURRENCY = int(os.getenv('INSPECTOR_IMPORT_CONCURRENCY', '100'))
+
+# HTTP client: number of per host connection pools kept alive, maximum number
+# of keep-alive connections per host and connect/read timeouts in seconds.
+HTTP_POOL_CONNECTIONS = int(os.getenv('INSPECTOR_HTTP_POOL_CONNECTIONS', '256'))
+HTTP_POOL_MAXSIZE = int(os.getenv('INSPECTOR_HTTP_POOL_MAXSIZE', '10'))
+HTTP_CONNECT_TIMEOUT = float(os.getenv('INSPECTOR_HTTP_CONNECT_TIMEOUT', '10'))
+HTTP_READ_TIMEOUT = float(os.getenv('INSPECTOR_HTTP_READ_TIMEOUT', '30'))
+
+# HTTP retries: total time in seconds a request may take, body and retries
+# included, number of retries of connection errors, timeouts and 429/502/503/504
+# responses, and base and maximum of their jittered exponential backoff.
+HTTP_TOTAL_TIMEOUT = float(os.getenv('INSPECTOR_HTTP_TOTAL_TIMEOUT', '60'))
+HTTP_RETRIES = int(os.getenv('INSPECTOR_HTTP_RETRIES', '2'))
+HTTP_BACKOFF = float(os.getenv('INSPECTOR_HTTP_BACKOFF', '0.5'))
+HTTP_MAX_BACKOFF = float(os.getenv('INSPECTOR_HTTP_MAX_BACKOFF', '10'))
+
+# DNS: comma-separated nameservers (host or host:port) of the in-process
+# resolver, those of /etc/resolv.conf by default, 'system' to use the system
+# resolver only. Resolved hosts are cached for the TTL of their records, kept
+# between DNS_MIN_TTL and DNS_MAX_TTL seconds, and hosts which do not exist
+# for up to DNS_NEGATIVE_TTL seconds. Queries time out after DNS_TIMEOUT
+# seconds and are sent DNS_ATTEMPTS times to each nameserver, and the hosts
+# of a scan are resolved before it starts, DNS_CONCURRENCY at a time.
+DNS_SERVERS = [item for item in os.getenv('INSPECTOR_DNS_SERVERS', '').split(',') if item]
+DNS_MIN_TTL = float(os.getenv('INSPECTOR_DNS_MIN_TTL', '60'))
+DNS_MAX_TTL = float(os.getenv('INSPECTOR_DNS_MAX_TTL', '3600'))
+DNS_NEGATIVE_TTL = float(os.getenv('INSPECTOR_DNS_NEGATIVE_TTL', '600'))
+DNS_TIMEOUT = float(os.getenv('INSPECTOR_DNS_TIMEOUT', '2'))
+DNS_ATTEMPTS = int(os.getenv('INSPECTOR_DNS_ATTEMPTS', '2'))
+DNS_CONCURRENCY = int(os.getenv('INSPECTOR_DNS_CONCURRENCY', '200'))
+
+# Circuit breaker: number of consecutive failed requests after which a host is
+# skipped, and cooldown in seconds before it is tried again, doubled each time
+# the host keeps failing up to BREAKER_MAX_COOLDOWN.
+BREAKER_THRESHOLD = int(os.getenv('INSPECTOR_BREAKER_THRESHOLD', '5'))
+BREAKER_COOLDOWN = float(os.getenv('INSPECTOR_BREAKER_COOLDOWN', '600'))
+BREAKER_MAX_COOLDOWN = float(os.getenv('INSPECTOR_BREAKER_MAX_COOLDOWN', '86400'))
+
+# Maximum wall time of a scan in seconds (0 for no limit): the URLs not
+# started when it is reached are left for the next run.
+RUN_TIMEOUT = float(os.getenv('INSPECTOR_RUN_TIMEOUT', '3300'))
+
+# HTML parser used to analyze pages: 'auto' picks the fastest one installed
+# among 'selectolax', 'lxml' and the standard library 'html.parser'.
+HTML_PARSER = os.getenv('INSPECTOR_HTML_PARSER', 'auto')
+
+# Page parsing: number of worker processes analyzing and fingerprinting the
+# pages of a scan, by default one per core but one left to the threads of the
+# scan (0 parses them in these threads), and size in bytes from which a page
+# is handed to them.
+PARSE_WORKERS = int(os.getenv('INSPECTOR_PARSE_WORKERS', str(max(0, (os.cpu_count() or 1) - 1))))
+PARSE_MIN_SIZE = int(os.getenv('INSPECTOR_PARSE_MIN_SIZE', '8192'))
+
+# URL filtering: comma-separated substrings of the JS URLs never downloaded,
+# and of the only ones downloaded when set. FIRST_PARTY_DOMAINS lists the
+# registered domains, e.g. CDNs, whose JS files belong to every site. Up to
+# URL_CACHE_SIZE parsed URLs and hostnames are kept in memory.
+JS_BLACKLIST = [item for item in os.getenv('INSPECTOR_JS_BLACKLIST', 'jquery').split(',') if item]
+JS_ALLOWLIST = [item for item in os.getenv('INSPECTOR_JS_ALLOWLIST', '').split(',') if item]
+FIRST_PARTY_DOMAINS = [item for item in os.getenv('INSPECTOR_FIRST_PARTY_DOMAINS', '').split(',') if item]
+URL_CACHE_SIZE = int(os.getenv('INSPECTOR_URL_CACHE_SIZE', '65536'))
+
+# Metrics: requests slower than METRICS_SLOW_REQUEST seconds are counted per
+# host, and the METRICS_TOP_HOSTS slowest hosts are exported. When set, the
+# scheduled run and the daemon write the metrics to METRICS_TEXTFILE for the
+# node_exporter textfile collector, and the daemon serves them on
+# http://127.0.0.1:METRICS_PORT/metrics.
+METRICS_SLOW_REQUEST = float(os.getenv('INSPECTOR_METRICS_SLOW_REQUEST', '5'))
+METRICS_TOP_HOSTS = int(os.getenv('INSPECTOR_METRICS_TOP_HOSTS', '10'))
+METRICS_TEXTFILE = os.getenv('INSPECTOR_METRICS_TEXTFILE', '')
+METRICS_PORT = int(os.getenv('INSPECTOR_METRICS_PORT', '0'))
+
+# Log: minimum level of the records written, and size in bytes at which
+# LOG_FILE is rotated, keeping LOG_BACKUPS former files (app.log.1, ...).
+LOG_LEVEL = os.getenv('INSPECTOR_LOG_LEVEL', 'INFO').upper()
+LOG_MAX_BYTES = int(os.getenv('INSPECTOR_LOG_MAX_BYTES', str(50 * 1024 * 1024)))
+LOG_BACKUPS = int(os.getenv('INSPECTOR_LOG_BACKUPS', '5'))
+
+# Size in bytes of the chunks read from streamed responses.
+STREAM_CHUNK_SIZE = int(os.getenv('INSPECTOR_STREAM_CHUNK_SIZE', '16384'))
+
+# JS files: number of JS files of a page downloaded at once, and maximum size
+# in bytes of a JS file (0 for no limit), larger ones are skipped.
+JS_CONCURRENCY = int(os.getenv('INSPECTOR_JS_CONCURRENCY', '4'))
+JS_MAX_SIZE = int(os.getenv('INSPECTOR_JS_MAX_SIZE', str(10 * 1024 * 1024)))
+
+# Content changes: maximum number of bits, out of 64, by which the text or the
+# tag structure fingerprint of a page may differ from the last one stored
+# before a change is notified.
+FINGERPRINT_THRESHOLD = int(os.getenv('INSPECTOR_FINGERPRINT_THRESHOLD', '3'))
+
+# Masking rules: comma-separated query parameters stripped from the JS URLs,
+# e.g. cache busters, JSON file of the global and per-site rules, and maximum
+# length in bytes of a masked string, held back between two chunks of a file.
+STRIP_PARAMS = [item for item in os.getenv('INSPECTOR_STRIP_PARAMS', 'v,ver,version,cb,_').split(',') if item]
+MASKS_FILE = Path(os.getenv('INSPECTOR_MASKS_FILE', str(BASE_DIR / 'masks.json')))
+MASK_MAX_LENGTH = int(os.getenv('INSPECTOR_MASK_MAX_LENGTH', '1024'))
+
+# Sharded scan: number of worker processes (1 scans in-process), number of
+# records per leased batch and lease duration in seconds. A worker that does
+# not renew its lease in time is considered dead and its shard taken over.
+SCAN_WORKERS = int(os.getenv('INSPECTOR_SCAN_WORKERS', '1'))
+SCAN_BATCH_SIZE = int(os.getenv('INSPECTOR_SCAN_BATCH_SIZE', '50'))
+LEASE_SECONDS = float(os.getenv('INSPECTOR_LEASE_SECONDS', '120'))
+
+# Database: number of rows read per chunk and of updates written per
+# transaction by the scheduled scan.
+DB_BATCH_SIZE = int(os.getenv('INSPECTOR_DB_BATCH_SIZE', '500'))
+
+# Scheduler daemon: default, minimum and maximum interval in seconds between
+# two checks of a URL. The interval is multiplied by SCHEDULE_BACKOFF when the
+# URL did not change, and by SCHEDULE_SPEEDUP when it did, then jittered by
+# +/- SCHEDULE_JITTER. At most SCHEDULE_BATCH_SIZE due URLs are scanned at
+# once, and a URL whose scan failed is retried after SCHEDULE_RETRY seconds.
+SCHEDULE_DEFAULT_INTERVAL = int(os.getenv('INSPECTOR_SCHEDULE_DEFAULT_INTERVAL', '3600'))
+SCHEDULE_MIN_INTERVAL = int(os.getenv('INSPECTOR_SCHEDULE_MIN_INTERVAL', '600'))
+SCHEDULE_MAX_INTERVAL = int(os.getenv('INSPECTOR_SCHEDULE_MAX_INTERVAL', '86400'))
+SCHEDULE_BACKOFF = float(os.getenv('INSPECTOR_SCHEDULE_BACKOFF', '1.5'))
+SCHEDULE_SPEEDUP = float(os.getenv('INSPECTOR_SCHEDULE_SPEEDUP', '0.5'))
+SCHEDULE_JITTER = float(os.getenv('INSPECTOR_SCHEDULE_JITTER', '0.1'))
+SCHEDULE_BATCH_SIZE = int(os.getenv('INSPECTOR_SCHEDULE_BATCH_SIZE', '200'))
+SCHEDULE_RETRY = int(os.getenv('INSPECTOR_SCHEDULE_RETRY', '900'))
+SCHEDULE_POLL_INTERVAL = float(os.getenv('INSPECTOR_SCHEDULE_POLL_INTERVAL', '30'))
+
+# Discord notifications: webhook messages sent per second and burst size (on
+# top of the limits announced by Discord), how long the end of a run waits
+# for the outbox to be sent, and the age in seconds after which a
+# notification Discord did not accept is dropped.
+DISCORD_RATE = float(os.getenv('INSPECTOR_DISCORD_RATE', '0.5'))
+DISCORD_BURST = float(os.getenv('INSPECTOR_DISCORD_BURST', '5'))
+DISCORD_FLUSH_TIMEOUT = float(os.getenv('INSPECTOR_DISCORD_FLUSH_TIMEOUT', '120'))
+DISCORD_MAX_AGE = float(os.getenv('INSPECTOR_DISCORD_MAX_AGE', '604800'))
+
+# JS blob store: number of days an unreferenced JS file is kept before the
+# garbage collector deletes it.
+BLOB_RETENTION_DAYS = float(os.getenv('INSPECTOR_BLOB_RETENTION_DAYS', '30'))
+
+# History: every version of a JS file is kept in VERSIONS_PATH as a delta
+# against the previous one, with a full copy every HISTORY_KEYFRAME_INTERVAL
+# versions, the most deltas applied to read a version back.
+HISTORY_KEYFRAME_INTERVAL = int(os.getenv('INSPECTOR_HISTORY_KEYFRAME_INTERVAL', '20'))
+
 
 if not BASE_DIR.exists():
     BASE_DIR.mkdir()
 
 
 def get_logger():
+    """
+    Return the logger of the package, writing JSON lines to LOG_FILE.
 
+    Logging is configured by the first call only: records are queued and
+    written by a background thread, see logs.configure_logging. The log file
+    is opened by the first message, so commands which log nothing never
+    touch it.
+    """
     logger = logging.getLogger('inspector')
-    logger.setLevel(logging.INFO)
-
-    file_handler = logging.FileHandler(LOG_FILE)
-    file_handler.setLevel(logging.INFO)
-    file_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-    file_handler.setFormatter(file_formatter)
+    if logger.handlers:
+        return logger
 
-    logger.addHandler(file_handler)
+    from .logs import configure_logging
 
+    configure_logging(logger)
     return logger
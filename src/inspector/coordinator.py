@@ -0,0 +1,236 @@
+import multiprocessing
+import os
+import socket
+import time
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Optional
+
+from .blobstore import BlobStore
+from .breaker import CircuitBreaker
+from .cache import ValidatorCache
+from .config import get_logger
+from .config import LEASE_SECONDS
+from .config import QUEUE_PATH
+from .config import SCAN_BATCH_SIZE
+from .config import SCAN_WORKERS
+from .httpclient import HTTPClient
+from .queries import diff_js_assets
+from .queries import JsAssetChanges
+from .queries import MonitoredUrl
+from .resolver import Resolver
+from .sharding import HashRing
+from .sharding import LeaseQueue
+from .urls import get_host
+from .versions import VersionStore
+
+
+logger = get_logger()
+
+
+def shard_names(count: int) -> List[str]:
+    return [f'shard-{index}' for index in range(max(1, count))]
+
+
+def plan_batches(
+    records: Iterable[MonitoredUrl],
+    shards: List[str],
+    batch_size: int = SCAN_BATCH_SIZE,
+) -> Dict[str, List[List[Any]]]:
+    """
+    Partition records into shards by a consistent hash of their hostname, and
+    split each shard into batches of serialized records.
+    """
+    ring = HashRing(shards)
+    per_shard: Dict[str, List[Any]] = {shard: [] for shard in shards}
+    for record in records:
+        per_shard[ring.node_for(get_host(record.url))].append(list(record))
+
+    batch_size = max(1, batch_size)
+    return {
+        shard: [items[start:start + batch_size] for start in range(0, len(items), batch_size)]
+        for shard, items in per_shard.items()
+    }
+
+
+class ResultCollector:
+    """
+    ResultCollector stands in for a BulkUpdater in worker processes.
+
+    Workers do not write to the database: the column changes, JS files, HTTP
+    validators and whether each record changed are kept and sent back to the
+    coordinator, which applies and reschedules them with its own BulkUpdater.
+    """
+
+    def __init__(self) -> None:
+        self.results: Dict[int, Dict[str, Any]] = {}
+
+    def update(self, url_data_id: int, values: Dict[str, Any]) -> None:
+        if values:
+            self.results.setdefault(url_data_id, {}).setdefault('changes', {}).update(values)
+
+    def sync_js_assets(self, record: MonitoredUrl, js_files: Dict[str, tuple], now=None) -> JsAssetChanges:
+        self.results.setdefault(record.id, {})['js_files'] = {
+            url: list(js_file) for url, js_file in js_files.items()
+        }
+        return diff_js_assets(record.js_assets, js_files)
+
+    def remember(self, url_data_id: int, cache, entries: List[tuple]) -> None:
+        if entries:
+            self.results.setdefault(url_data_id, {})['validators'] = [list(entry) for entry in entries]
+
+    def reschedule(self, record: MonitoredUrl, changed: bool, now=None) -> None:
+        self.results.setdefault(record.id, {})['changed'] = changed
+
+    def as_list(self) -> List[Dict[str, Any]]:
+        return [{'id': url_data_id, **result} for url_data_id, result in self.results.items()]
+
+
+def run_worker(
+    run_id: Optional[str] = None,
+    shard: Optional[str] = None,
+    queue_path=QUEUE_PATH,
+    lease_seconds: float = LEASE_SECONDS,
+    deadline: Optional[float] = None,
+) -> int:
+    """
+    Scan the batches of a run until the worker has nothing left to do.
+
+    The worker owns ``shard`` and takes over the shards of dead workers. It can
+    run on another node sharing the queue file, and without ``run_id`` it joins
+    the latest unfinished run. It leases no batch after ``deadline``, a
+    time.time() value.
+
+    Returns:
+        int: The number of batches completed.
+    """
+    # main imports this module to run the coordinator.
+    from . import main as scan
+
+    queue = LeaseQueue(queue_path, lease_seconds)
+    run_id = run_id or queue.latest_run()
+    if run_id is None:
+        logger.info('No scan to join')
+        queue.close()
+        return 0
+
+    worker_id = f'{socket.gethostname()}-{os.getpid()}'
+    queue.join(run_id, worker_id, shard)
+    logger.info(f'Worker {worker_id} joined run {run_id} for {shard or "any dead shard"}')
+
+    completed = 0
+    # Several processes share the blob index, the history and the validator
+    # cache, so they commit every write instead of holding the SQLite write lock.
+    blob_store = BlobStore(commit_every=1)
+    versions = VersionStore(commit_every=1)
+    try:
+        # A host belongs to a single shard, so workers never record the same host.
+        client = HTTPClient(cache=ValidatorCache(commit_every=1), breaker=CircuitBreaker(), resolver=Resolver())
+        with client, queue.heartbeat(run_id, worker_id):
+            while deadline is None or time.time() < deadline:
+                batch = queue.lease(run_id, worker_id)
+                if batch is None:
+                    break
+                records = [MonitoredUrl(*item) for item in batch.items]
+                result = scan.scan_batch(records, client, blob_store, deadline, versions)
+                if queue.complete(batch.id, worker_id, result):
+                    completed += 1
+                else:
+                    logger.warning(f'Worker {worker_id} lost the lease of batch {batch.id}')
+    finally:
+        versions.close()
+        blob_store.close()
+        queue.close()
+
+    logger.info(f'Worker {worker_id} completed {completed} batches')
+    return completed
+
+
+def run_coordinator(
+    records: Iterable[MonitoredUrl],
+    apply_result: Callable[[Dict[str, Any]], None],
+    workers: int = SCAN_WORKERS,
+    batch_size: int = SCAN_BATCH_SIZE,
+    queue_path=QUEUE_PATH,
+    lease_seconds: float = LEASE_SECONDS,
+    poll_interval: float = 1.0,
+    deadline: Optional[float] = None,
+) -> int:
+    """
+    Scan records with local worker processes, one per shard.
+
+    The coordinator queues the batches of every shard, starts the workers and
+    hands the result of each completed batch to ``apply_result`` as soon as it
+    is available, so only the coordinator writes to the database. If every
+    worker exits while batches are left, e.g. because they crashed, the
+    coordinator waits for their leases to expire and takes the remaining shards
+    over itself.
+    After ``deadline``, a time.time() value, no batch is started and the
+    batches left are dropped with the run.
+
+    Returns:
+        int: The number of batches that failed.
+    """
+    shards = shard_names(workers)
+    queue = LeaseQueue(queue_path, lease_seconds)
+    run_id = queue.create_run(plan_batches(records, shards, batch_size))
+
+    context = multiprocessing.get_context('spawn')
+    processes = [
+        context.Process(
+            target=run_worker,
+            kwargs={
+                'run_id': run_id,
+                'shard': shard,
+                'queue_path': str(queue_path),
+                'lease_seconds': lease_seconds,
+                'deadline': deadline,
+            },
+            name=f'inspector-{shard}',
+        )
+        for shard in shards
+    ]
+    for process in processes:
+        process.start()
+    logger.info(f'Started {len(processes)} workers for run {run_id}')
+
+    try:
+        while True:
+            for result in queue.take_results(run_id):
+                apply_result(result)
+
+            counts = queue.counts(run_id)
+            if not counts.get(LeaseQueue.PENDING) and not counts.get(LeaseQueue.LEASED):
+                break
+
+            if not any(process.is_alive() for process in processes):
+                if deadline is not None and time.time() >= deadline:
+                    break
+                # Nothing can be taken over before the leases of the dead workers
+                # expire: wait for them rather than starting a worker every tick.
+                wait = (queue.takeover_time(run_id) or 0) - time.time()
+                if deadline is not None:
+                    wait = min(wait, deadline - time.time())
+                if wait > 0:
+                    time.sleep(wait)
+                    continue
+                run_worker(run_id, queue_path=queue_path, lease_seconds=lease_seconds, deadline=deadline)
+            time.sleep(poll_interval)
+
+        for result in queue.take_results(run_id):
+            apply_result(result)
+    finally:
+        for process in processes:
+            process.join()
+        counts = queue.counts(run_id)
+        failed = counts.get(LeaseQueue.FAILED, 0)
+        left = counts.get(LeaseQueue.PENDING, 0) + counts.get(LeaseQueue.LEASED, 0)
+        if left:
+            logger.warning(f'{left} batches of run {run_id} left unscanned')
+        queue.finish_run(run_id)
+        queue.close()
+
+    return failed
@@ -1,41 +1,119 @@
-from alembic import command
-from alembic.config import Config
+import os
+from typing import Optional
+
 from sqlalchemy import create_engine
+from sqlalchemy import event
+from sqlalchemy import inspect
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import sessionmaker
 
 from .config import get_logger
-from .models import Base
 
 
 logger = get_logger()
 
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+# The revision matching the schema created by create_all() before migrations existed.
+BASELINE_REVISION = '0001'
+# Migrations are numbered: the revision of 'versions/0004_schedule.py' is '0004'.
+HEAD_REVISION = max(
+    name[:4] for name in os.listdir(os.path.join(MIGRATIONS_DIR, 'versions')) if name[:4].isdigit()
+)
+
 
 def create_db(db_url: str) -> None:
     """
-    Create the database schema.
+    Create the database schema, or upgrade it to the latest revision.
 
     Args:
       db_url: Database URL
     """
-    engine = create_engine(db_url)
-    connection = engine.connect()
+    upgrade_db(db_url)
+
+
+def get_alembic_config(db_url: str):
+    """Return an Alembic configuration for the packaged migrations."""
+    from alembic.config import Config
+
+    alembic_cfg = Config()
+    alembic_cfg.set_main_option('script_location', MIGRATIONS_DIR)
+    alembic_cfg.set_main_option('sqlalchemy.url', db_url.replace('%', '%%'))
+    return alembic_cfg
+
+
+def upgrade_db(db_url: str) -> None:
+    """
+    Upgrade the database schema to the latest revision.
 
-    if not engine.dialect.has_table(connection, 'url_data'):
-        logger.info('Creating tables')
-        Base.metadata.create_all(engine)
-    else:
-        logger.info('Tables already present')
+    Databases created before migrations existed have the url_data table but
+    no alembic_version table: they are stamped with the baseline revision
+    first, so their data is migrated instead of the table being recreated.
 
-    connection.close()
+    Alembic is only imported when the database is not at the latest revision,
+    which keeps it out of the start of the CLI commands.
+
+    Args:
+      db_url: Database URL
+    """
+    engine = get_engine(db_url)
+    with engine.connect() as connection:
+        tables = inspect(connection).get_table_names()
+        revision = get_revision(connection) if 'alembic_version' in tables else None
+    engine.dispose()
+    if revision == HEAD_REVISION:
+        return
+
+    from alembic import command
+
+    alembic_cfg = get_alembic_config(db_url)
+    if 'url_data' in tables and 'alembic_version' not in tables:
+        logger.info(f'Stamping existing database with revision {BASELINE_REVISION}')
+        command.stamp(alembic_cfg, BASELINE_REVISION)
+
+    command.upgrade(alembic_cfg, 'head')
+
+
+def get_revision(connection) -> Optional[str]:
+    """Return the revision of the database schema, None if it has none."""
+
+    return connection.execute(text('SELECT version_num FROM alembic_version')).scalar()
 
 
 def run_migrations(alembic_ini: str) -> None:
     """Run Alembic migrations."""
+    from alembic import command
+    from alembic.config import Config
 
     alembic_cfg = Config(alembic_ini)
     command.upgrade(alembic_cfg, 'head')
 
 
+def get_engine(db_url: str) -> Engine:
+    """
+    Create a SQLAlchemy engine for the database.
+
+    SQLite databases use write-ahead logging, so the CLI can read while a
+    scheduled run writes, and commits only sync the log.
+
+    Args:
+      db_url: Database URL
+    Return:
+      Engine instance
+    """
+    engine = create_engine(db_url)
+    if engine.dialect.name == 'sqlite':
+        event.listen(engine, 'connect', _set_sqlite_pragmas)
+    return engine
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.close()
+
+
 def get_session(db_url: str) -> sessionmaker:
     """
     Create a SQLAlchemy session for the database.
@@ -44,6 +122,6 @@ def get_session(db_url: str) -> sessionmaker:
     Return:
       Sessionmaker instance
     """
-    engine = create_engine(db_url)
+    engine = get_engine(db_url)
     Session = sessionmaker(bind=engine)
     return Session()
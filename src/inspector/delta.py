@@ -0,0 +1,131 @@
+import re
+from typing import List
+from typing import Tuple
+
+
+# JS and text files are split after each newline, semicolon and closing brace,
+# so an edit only changes the segments it touches, even in minified bundles.
+SEGMENT_END = re.compile(rb'(?<=[\n;}])')
+
+# Copies shorter than this are inserted instead, as they cost more to encode.
+MIN_COPY = 16
+
+COPY = 0
+INSERT = 1
+
+
+def _segments(data: bytes) -> List[bytes]:
+    return [segment for segment in SEGMENT_END.split(data) if segment]
+
+
+def _write_varint(out: bytearray, value: int) -> None:
+    while value >= 0x80:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data: bytes, position: int) -> Tuple[int, int]:
+    value = shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, position
+        shift += 7
+
+
+def make_delta(base: bytes, target: bytes) -> bytes:
+    """
+    Return a delta turning ``base`` into ``target``, see apply_delta().
+
+    The target is encoded as copies of runs of segments of the base and
+    insertions of new bytes. Runs are found greedily from an index of the
+    segments of the base, so a delta takes one pass over both files and is
+    about the size of the changes.
+    """
+    base_segments = _segments(base)
+    offsets = [0]
+    for segment in base_segments:
+        offsets.append(offsets[-1] + len(segment))
+    index = {}
+    for position, segment in enumerate(base_segments):
+        index.setdefault(segment, position)
+
+    out = bytearray()
+    _write_varint(out, len(target))
+    inserted = []
+
+    def flush_inserted():
+        if inserted:
+            data = b''.join(inserted)
+            out.append(INSERT)
+            _write_varint(out, len(data))
+            out.extend(data)
+            inserted.clear()
+
+    target_segments = _segments(target)
+    count = len(target_segments)
+    following = None
+    i = 0
+    while i < count:
+        segment = target_segments[i]
+        # The base segment following the last copy, or the one after it when a
+        # segment was replaced, is usually where the target goes on.
+        best_start = best_end = None
+        for start in (following, None if following is None else following + 1, index.get(segment)):
+            if start is None or start >= len(base_segments) or base_segments[start] != segment:
+                continue
+            end, k = start, i
+            while k < count and end < len(base_segments) and base_segments[end] == target_segments[k]:
+                end += 1
+                k += 1
+            if best_end is None or end - start > best_end - best_start:
+                best_start, best_end = start, end
+
+        if best_start is None or offsets[best_end] - offsets[best_start] < MIN_COPY:
+            inserted.append(segment)
+            i += 1
+            continue
+
+        flush_inserted()
+        out.append(COPY)
+        _write_varint(out, offsets[best_start])
+        _write_varint(out, offsets[best_end] - offsets[best_start])
+        i += best_end - best_start
+        following = best_end
+
+    flush_inserted()
+    return bytes(out)
+
+
+def apply_delta(base: bytes, delta: bytes) -> bytes:
+    """
+    Return the target of a delta made by make_delta() from ``base``.
+
+    Raises:
+        ValueError: The delta is corrupt or was not made from this base.
+    """
+    try:
+        size, position = _read_varint(delta, 0)
+        parts = []
+        while position < len(delta):
+            op = delta[position]
+            if op == COPY:
+                offset, position = _read_varint(delta, position + 1)
+                length, position = _read_varint(delta, position)
+                parts.append(base[offset:offset + length])
+            elif op == INSERT:
+                length, position = _read_varint(delta, position + 1)
+                parts.append(delta[position:position + length])
+                position += length
+            else:
+                raise ValueError(f'Unknown delta operation {op}')
+    except IndexError:
+        raise ValueError('Truncated delta') from None
+
+    target = b''.join(parts)
+    if len(target) != size:
+        raise ValueError(f'Delta produced {len(target)} bytes instead of {size}')
+    return target
@@ -1,11 +1,57 @@
+import sqlite3
+import threading
+import time
+from typing import List
+from typing import NamedTuple
+from typing import Optional
+from urllib.parse import urlsplit
+
+import requests
 from discord_webhook import DiscordEmbed
 from discord_webhook import DiscordWebhook
 
+from .config import DISCORD_BURST
+from .config import DISCORD_FLUSH_TIMEOUT
+from .config import DISCORD_MAX_AGE
+from .config import DISCORD_RATE
+from .config import get_logger
+from .config import HTTP_READ_TIMEOUT
+from .config import OUTBOX_PATH
+from .metrics import METRICS
+from .metrics import timed
+from .urls import get_host
+
+
+logger = get_logger()
+
+
+class Notification(NamedTuple):
+    id: int
+    site: str
+    title: str
+    url: str
+    status: str
+
+
+def parse_message(message: str) -> Notification:
+    """
+    Parse a 'title|url|status' message. The title may itself contain '|'.
+    """
+    title, url, status = message.rsplit('|', 2)
+    return Notification(None, get_host(url), title, url, status)
+
+
+def is_webhook_url(url: Optional[str]) -> bool:
+    """Return True if a webhook URL is set, as an http(s) URL."""
+    parts = urlsplit(url or '')
+    return parts.scheme in ('http', 'https') and bool(parts.netloc)
+
 
 class DiscordNotification:
 
-    def __init__(self, webhook_url: str) -> None:
-        self.webhook = DiscordWebhook(url=webhook_url, username='URL Inspector')
+    def __init__(self, webhook_url: str, timeout: float = HTTP_READ_TIMEOUT) -> None:
+        self.webhook_url = webhook_url
+        self.timeout = timeout
         self.embed = DiscordEmbed
         self.STATUS = {
             'red': ':red_circle:',
@@ -13,16 +59,331 @@ class DiscordNotification:
             'blue': ':blue_circle:',
         }
 
-    def send_message(self, title: str, url: str, status: str) -> None:
-        """Send a message to the webhook.
+    def make_embed(self, title: str, url: str, status: str) -> DiscordEmbed:
+        """Build the embed of a change.
 
         Args:
             title (str): The title for the Discord message.
             url (str): The url for the Discord message.
+            status (str): The color of the status emoji: red, green or blue.
         """
         embed = self.embed(title=f'{self.STATUS[status]}   {title}', description=f'{url}', color='03b2f8')
         embed.set_author(name='URL Inspector', url='https://github.com/H3lllfir3', icon_url='https://avatars.githubusercontent.com/u/55285134')
         embed.set_timestamp()
+        return embed
+
+    @timed('discord')
+    def send_embeds(self, embeds: List[DiscordEmbed]) -> requests.Response:
+        """Send one webhook message with the given embeds (at most 10).
+
+        A new webhook is built for every message, so earlier embeds are never sent again.
+        """
+        webhook = DiscordWebhook(url=self.webhook_url, username='URL Inspector', embeds=embeds, timeout=self.timeout)
+        METRICS.inc('discord_messages')
+        return webhook.execute()
+
+    def send_message(self, title: str, url: str, status: str) -> requests.Response:
+        """Send a message to the webhook.
+
+        Args:
+            title (str): The title for the Discord message.
+            url (str): The url for the Discord message.
+        """
+        return self.send_embeds([self.make_embed(title, url, status)])
+
+
+class TokenBucket:
+    """
+    TokenBucket spaces the requests sent to a rate-limited API.
+
+    Tokens are refilled at ``rate`` per second up to ``capacity``. The bucket
+    also follows the limits announced by the server: when the
+    ``X-RateLimit-Remaining`` header drops to 0, or when a 429 response carries
+    ``Retry-After``, no token is handed out until the given delay has passed.
+
+    Usage Example:
+        bucket = TokenBucket(rate=0.5, capacity=5)
+        time.sleep(bucket.reserve())
+        response = send()
+        bucket.update(response)
+    """
+
+    def __init__(self, rate: float = DISCORD_RATE, capacity: float = DISCORD_BURST, clock=time.monotonic) -> None:
+
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self.clock = clock
+        self._tokens = self.capacity
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """
+        Take a token and return the number of seconds to wait before using it.
+        """
+        with self._lock:
+            now = self.clock()
+            if now > self._updated:
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+
+            wait = self._updated - now
+            if self._tokens < 1:
+                wait += (1 - self._tokens) / self.rate
+            self._tokens -= 1
+            return wait
+
+    def pause(self, seconds: float) -> None:
+        """
+        Hand out no token for the given number of seconds.
+        """
+        with self._lock:
+            until = self.clock() + max(0.0, seconds)
+            if until > self._updated:
+                self._updated = until
+            self._tokens = min(self._tokens, 0.0)
+
+    def update(self, response: requests.Response) -> None:
+        """
+        Follow the rate limit headers of a response.
+        """
+        if response.status_code == 429:
+            self.pause(retry_after(response))
+            return
+
+        remaining = response.headers.get('X-RateLimit-Remaining')
+        reset_after = response.headers.get('X-RateLimit-Reset-After')
+        if remaining is not None and reset_after is not None and float(remaining) < 1:
+            self.pause(float(reset_after))
+
+
+def retry_after(response: requests.Response, default: float = 1.0) -> float:
+    """
+    Return the delay requested by a 429 response, from its headers or JSON body.
+    """
+    value = response.headers.get('Retry-After')
+    if value is None:
+        try:
+            value = response.json().get('retry_after')
+        except ValueError:
+            value = None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+class NotificationOutbox:
+    """
+    NotificationOutbox persists notifications until they are delivered.
+
+    Notifications are written to SQLite before being sent and deleted once
+    Discord accepted them, so the ones left unsent by a crash or a Discord
+    outage are sent by the next run.
+    """
+
+    def __init__(self, path=OUTBOX_PATH) -> None:
+
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(str(path), check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.executescript(
+            'CREATE TABLE IF NOT EXISTS outbox ('
+            'id INTEGER PRIMARY KEY, site TEXT NOT NULL, title TEXT NOT NULL, url TEXT NOT NULL, '
+            'status TEXT NOT NULL, created_at REAL NOT NULL);'
+            'CREATE INDEX IF NOT EXISTS ix_outbox_site ON outbox (site, id);',
+        )
+        self.connection.commit()
+
+    def add(self, notification: Notification) -> None:
+        with self._lock:
+            self.connection.execute(
+                'INSERT INTO outbox (site, title, url, status, created_at) VALUES (?, ?, ?, ?, ?)',
+                (notification.site, notification.title, notification.url, notification.status, time.time()),
+            )
+            self.connection.commit()
+
+    def next_batch(self, limit: int) -> List[Notification]:
+        """
+        Return the oldest pending notifications of the site with the oldest one.
+        """
+        with self._lock:
+            rows = self.connection.execute(
+                'SELECT id, site, title, url, status FROM outbox '
+                'WHERE site = (SELECT site FROM outbox ORDER BY id LIMIT 1) ORDER BY id LIMIT ?',
+                (limit,),
+            ).fetchall()
+        return [Notification(*row) for row in rows]
+
+    def remove(self, ids: List[int]) -> None:
+        with self._lock:
+            self.connection.executemany('DELETE FROM outbox WHERE id = ?', [(id,) for id in ids])
+            self.connection.commit()
+
+    def expire(self, max_age: float) -> int:
+        """
+        Drop the notifications older than ``max_age`` seconds, and return their number.
+        """
+        with self._lock:
+            cursor = self.connection.execute('DELETE FROM outbox WHERE created_at < ?', (time.time() - max_age,))
+            self.connection.commit()
+            return cursor.rowcount
+
+    def count(self) -> int:
+        with self._lock:
+            return self.connection.execute('SELECT COUNT(*) FROM outbox').fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+
+class DiscordDispatcher:
+    """
+    DiscordDispatcher sends change notifications to a Discord webhook in the background.
+
+    Notifications are persisted in an outbox, then a background thread sends
+    them grouped per site, up to 10 embeds per webhook message, spaced by a
+    token bucket that follows Discord's rate limit headers. Failed messages
+    stay in the outbox and are retried with an exponential backoff, until
+    they are older than ``max_age`` seconds; those Discord rejects with a 4xx
+    status other than 429 are dropped. The notifications left in the outbox
+    when the dispatcher starts, e.g. after a crash, are sent first.
+
+    Without a webhook URL, i.e. when it is not an http(s) URL, nothing is
+    sent nor kept: the changes are only logged.
+
+    Usage Example:
+        with DiscordDispatcher(webhook_url) as dispatcher:
+            dispatcher.send('Title changed|https://example.com|blue')
+    """
+
+    MAX_EMBEDS = 10
+    MAX_BACKOFF = 60.0
+
+    def __init__(
+        self,
+        webhook_url: str,
+        outbox: Optional[NotificationOutbox] = None,
+        bucket: Optional[TokenBucket] = None,
+        flush_timeout: float = DISCORD_FLUSH_TIMEOUT,
+        max_age: float = DISCORD_MAX_AGE,
+    ) -> None:
+
+        self.enabled = is_webhook_url(webhook_url)
+        self.discord = DiscordNotification(webhook_url)
+        self.outbox = outbox or NotificationOutbox()
+        self.bucket = bucket or TokenBucket()
+        self.flush_timeout = flush_timeout
+        self.max_age = max_age
+        self.sent = 0
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._abort = threading.Event()
+        self._thread = None
+
+    def __enter__(self) -> 'DiscordDispatcher':
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def start(self) -> None:
+        """
+        Start the sending thread, unless no webhook URL is set.
+        """
+        if not self.enabled:
+            logger.warning('DISCORD_WEBHOOK_URL is not set to an http(s) URL, notifications are not sent')
+            return
+        self._thread = threading.Thread(target=self._run, name='discord-dispatcher', daemon=True)
+        self._thread.start()
+
+    def send(self, message: str) -> None:
+        """
+        Queue a 'title|url|status' message; it is sent in the background.
+        """
+        if not self.enabled:
+            return
+        self.outbox.add(parse_message(message))
+        self._wake.set()
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        """
+        Wait until the outbox is empty, for at most ``timeout`` seconds, and stop.
+        Notifications still unsent are kept in the outbox for the next run.
+        """
+        timeout = self.flush_timeout if timeout is None else timeout
+        if self._thread is not None:
+            self._stopping.set()
+            self._wake.set()
+            self._thread.join(timeout)
+            if self._thread.is_alive():
+                self._abort.set()
+                self._thread.join()
+            self._thread = None
+
+        left = self.outbox.count()
+        if left:
+            logger.warning(f'{left} Discord notifications left in the outbox for the next run')
+        self.outbox.close()
+
+    def _run(self) -> None:
+        failures = 0
+        self._expire()
+        while not self._abort.is_set():
+            batch = self.outbox.next_batch(self.MAX_EMBEDS)
+            if not batch:
+                if self._stopping.is_set():
+                    return
+                self._wake.wait()
+                self._wake.clear()
+                continue
+
+            if self._deliver(batch):
+                failures = 0
+            else:
+                failures += 1
+                self._abort.wait(min(self.MAX_BACKOFF, 2.0 ** (failures - 1)))
+                self._expire()
+
+    def _expire(self) -> None:
+        expired = self.outbox.expire(self.max_age)
+        if expired:
+            logger.warning(f'Dropped {expired} Discord notifications older than {self.max_age:.0f}s')
+
+    def _deliver(self, batch: List[Notification]) -> bool:
+        """
+        Send a batch as one webhook message, retrying it while it is rate limited.
+        Returns False when it failed and should be retried later.
+        """
+        embeds = [self.discord.make_embed(n.title, n.url, n.status) for n in batch]
+        while True:
+            wait = self.bucket.reserve()
+            if wait > 0 and self._abort.wait(wait):
+                return False
+
+            try:
+                response = self.discord.send_embeds(embeds)
+            except (requests.exceptions.RequestException, ValueError) as e:
+                logger.error(f'Error sending Discord notifications for {batch[0].site}: {e}')
+                return False
 
-        self.webhook.add_embed(embed)
-        self.webhook.execute()
+            self.bucket.update(response)
+            if response.status_code == 429:
+                logger.warning(f'Discord rate limited, retrying in {retry_after(response)}s')
+                continue
+            if response.ok:
+                self.outbox.remove([n.id for n in batch])
+                self.sent += len(batch)
+                return True
+            if 400 <= response.status_code < 500:
+                # The payload or the webhook itself is rejected: sending it again cannot succeed.
+                logger.error(
+                    f'Discord rejected notifications for {batch[0].site} with HTTP {response.status_code}: {response.text}',
+                )
+                self.outbox.remove([n.id for n in batch])
+                return True
+            return False
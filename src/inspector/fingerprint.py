@@ -0,0 +1,161 @@
+import hashlib
+import re
+from collections import Counter
+from typing import NamedTuple
+from typing import Tuple
+
+from .analysis import PageTokenizer
+
+
+# Words of the visible text, and words holding a digit: counters, dates,
+# times, prices or tokens, all counted as the same word.
+WORD = re.compile(r'\w+')
+DIGIT = re.compile(r'\d')
+NUMBER_WORD = '#'
+
+# Elements whose content is not visible text.
+HIDDEN_TAGS = frozenset({'script', 'style', 'noscript', 'template'})
+VOID_TAGS = frozenset({
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input',
+    'link', 'meta', 'param', 'source', 'track', 'wbr',
+})
+# Number of tags of the path to an element taken as a structure feature, e.g. body>div>p.
+PATH_DEPTH = 3
+
+HASH_BITS = 64
+# The byte values with each bit set, to add up the weights of the features per bit.
+BYTES_WITH_BIT = [[byte for byte in range(256) if byte & (1 << bit)] for bit in range(8)]
+
+
+class Fingerprint(NamedTuple):
+    """
+    The simhashes of the text and of the tag structure of a page.
+
+    Similar pages have simhashes differing by few bits, so a page changed
+    when the number of bits differing from its last fingerprint exceeds a
+    threshold, rather than when a single byte of it changed.
+    It is stored as 32 hex digits, see str() and Fingerprint.parse().
+    """
+    text: int
+    structure: int
+
+    def __str__(self) -> str:
+        return f'{self.text:016x}{self.structure:016x}'
+
+    @classmethod
+    def parse(cls, value: str) -> 'Fingerprint':
+        return cls(int(value[:16], 16), int(value[16:], 16))
+
+    def distance(self, other: 'Fingerprint') -> Tuple[int, int]:
+        """Return the number of bits differing in the text and in the structure simhashes."""
+        return bin(self.text ^ other.text).count('1'), bin(self.structure ^ other.structure).count('1')
+
+
+def simhash(features: Counter) -> int:
+    """
+    Return the 64-bit simhash of weighted features.
+
+    Each bit is set when the features whose hash has it set outweigh the others.
+    The weights are added up per byte value of the hashes first, so hashing
+    a feature costs 8 additions instead of 64.
+    """
+    tables = [[0] * 256 for _ in range(HASH_BITS // 8)]
+    total = 0
+    for feature, weight in features.items():
+        digest = hashlib.blake2b(feature.encode(), digest_size=HASH_BITS // 8).digest()
+        for table, byte in zip(tables, digest):
+            table[byte] += weight
+        total += weight
+
+    value = 0
+    for position, table in enumerate(tables):
+        for bit, values in enumerate(BYTES_WITH_BIT):
+            if 2 * sum(table[byte] for byte in values) > total:
+                value |= 1 << (position * 8 + bit)
+    return value
+
+
+class PageFingerprinter(PageTokenizer):
+    """
+    PageFingerprinter fingerprints a page while extracting its title and JS references.
+
+    The text features are the words of the visible text, lowercased, words
+    holding a digit counting as one word, so timestamps, counters and tokens
+    do not change the fingerprint. The structure features are the paths of
+    the elements, up to PATH_DEPTH tags, so attribute values such as CSRF
+    tokens or ad slot ids do not either. Like PageTokenizer, the document can
+    be fed in chunks; the fingerprint is complete once it is closed.
+
+    Usage Example:
+        fingerprinter = PageFingerprinter()
+        fingerprinter.feed(html)
+        fingerprinter.close()
+        fingerprint = fingerprinter.fingerprint()
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.words = Counter()
+        self.paths = Counter()
+        self._stack = []
+        self._hidden = 0
+        # Text is tokenized at the next tag, as a word may span several chunks.
+        self._text = []
+
+    def handle_starttag(self, tag, attrs):
+        super().handle_starttag(tag, attrs)
+        self._flush_text()
+        self.paths['>'.join(self._stack[-(PATH_DEPTH - 1):] + [tag])] += 1
+        if tag in VOID_TAGS:
+            return
+        self._stack.append(tag)
+        if tag in HIDDEN_TAGS:
+            self._hidden += 1
+
+    def handle_startendtag(self, tag, attrs):
+        # An element closed by its start tag, e.g. <br/>: nothing is pushed.
+        super().handle_starttag(tag, attrs)
+        super().handle_endtag(tag)
+        self._flush_text()
+        self.paths['>'.join(self._stack[-(PATH_DEPTH - 1):] + [tag])] += 1
+
+    def handle_endtag(self, tag):
+        super().handle_endtag(tag)
+        self._flush_text()
+        if tag not in self._stack:
+            return
+        # Close the elements left open inside this one, e.g. <li> or <p>.
+        while self._stack:
+            closed = self._stack.pop()
+            if closed in HIDDEN_TAGS:
+                self._hidden -= 1
+            if closed == tag:
+                break
+
+    def handle_data(self, data):
+        super().handle_data(data)
+        if not self._hidden:
+            self._text.append(data)
+
+    def close(self):
+        super().close()
+        self._flush_text()
+
+    def fingerprint(self) -> Fingerprint:
+        return Fingerprint(simhash(self.words), simhash(self.paths))
+
+    def _flush_text(self):
+        if not self._text:
+            return
+        for word in WORD.findall(''.join(self._text).lower()):
+            self.words[NUMBER_WORD if DIGIT.search(word) else word] += 1
+        self._text = []
+
+
+def fingerprint_html(html: str) -> Fingerprint:
+    """Return the fingerprint of a page."""
+    fingerprinter = PageFingerprinter()
+    fingerprinter.feed(html)
+    fingerprinter.close()
+    return fingerprinter.fingerprint()
+
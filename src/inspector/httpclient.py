@@ -0,0 +1,557 @@
+import heapq
+import itertools
+import random
+import socket
+import threading
+import time
+from functools import partial
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+from urllib3.connection import HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool
+from urllib3.connectionpool import HTTPSConnectionPool
+from urllib3.exceptions import ConnectTimeoutError
+from urllib3.exceptions import NameResolutionError
+from urllib3.exceptions import NewConnectionError
+
+from .breaker import CircuitBreaker
+from .cache import CacheEntry
+from .cache import ValidatorCache
+from .config import get_logger
+from .config import HTTP_BACKOFF
+from .config import HTTP_CONNECT_TIMEOUT
+from .config import HTTP_MAX_BACKOFF
+from .config import HTTP_POOL_CONNECTIONS
+from .config import HTTP_POOL_MAXSIZE
+from .config import HTTP_READ_TIMEOUT
+from .config import HTTP_RETRIES
+from .config import HTTP_TOTAL_TIMEOUT
+from .metrics import METRICS
+from .resolver import Resolver
+from .urls import get_host
+
+
+logger = get_logger()
+
+# Responses worth another attempt: rate limited or a gateway failing to reach the site.
+RETRY_STATUSES = frozenset({429, 502, 503, 504})
+# Responses counted as failures of the host by the circuit breaker.
+FAILURE_STATUSES = frozenset({502, 503, 504})
+# Errors worth another attempt: refused or reset connections and timeouts.
+TRANSIENT_ERRORS = (
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+    requests.exceptions.ChunkedEncodingError,
+)
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """The request was not sent because the circuit of its host is open."""
+
+
+class HostNotFound(requests.exceptions.ConnectionError):
+    """The request was not sent: the resolver found that its host does not exist."""
+
+
+class TotalTimeout(requests.exceptions.Timeout):
+    """The response took longer than the total timeout of its request."""
+
+
+def _bound(iter_content, deadline: float, done):
+    """
+    Wrap the iter_content() of a response to raise TotalTimeout after the deadline,
+    and call ``done`` when the body has been read or given up. The time spent
+    reading the body and its size are recorded in the metrics.
+    """
+    def bounded(*args, **kwargs):
+        chunks = iter_content(*args, **kwargs)
+        downloaded = 0.0
+        size = 0
+        try:
+            while True:
+                start = time.perf_counter()
+                chunk = next(chunks, None)
+                downloaded += time.perf_counter() - start
+                if chunk is None:
+                    break
+                if time.monotonic() > deadline:
+                    raise TotalTimeout('Total timeout exceeded while reading the response')
+                size += len(chunk)
+                yield chunk
+        except requests.exceptions.RequestException as e:
+            # The watchdog shut the socket down under the read.
+            if time.monotonic() > deadline and not isinstance(e, TotalTimeout):
+                raise TotalTimeout('Total timeout exceeded while reading the response') from e
+            raise
+        finally:
+            done()
+            METRICS.observe('download', downloaded)
+            METRICS.inc('http_response_bytes', size)
+    return bounded
+
+
+def _abort(response: requests.Response) -> None:
+    """
+    Shut down the socket of a response. Unlike closing it, this wakes up a read
+    blocked on it in another thread.
+    """
+    sock = getattr(getattr(response.raw, 'connection', None), 'sock', None)
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+class Watchdog:
+    """
+    Watchdog aborts the responses whose body is still being read after their deadline.
+
+    A chunk of a body is read until it is full, so a host trickling its body in
+    neither triggers the read timeout nor lets the reader check the time. The
+    socket of such a response is shut down from the watchdog thread instead.
+    The thread starts with the first watched response.
+    """
+
+    def __init__(self) -> None:
+
+        self._condition = threading.Condition()
+        self._deadlines: List[Tuple[float, int]] = []
+        self._watched: Dict[int, requests.Response] = {}
+        self._keys = itertools.count()
+        self._thread = None
+        self._closed = False
+
+    def watch(self, response: requests.Response, deadline: float) -> int:
+        """
+        Abort the response at the monotonic ``deadline`` unless unwatched before.
+
+        Returns:
+            int: The key to unwatch the response with.
+        """
+        with self._condition:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='http-watchdog', daemon=True)
+                self._thread.start()
+            key = next(self._keys)
+            self._watched[key] = response
+            heapq.heappush(self._deadlines, (deadline, key))
+            self._condition.notify()
+        return key
+
+    def unwatch(self, key: int) -> None:
+        with self._condition:
+            self._watched.pop(key, None)
+
+    def close(self) -> None:
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self) -> None:
+        with self._condition:
+            while not self._closed:
+                now = time.monotonic()
+                while self._deadlines and self._deadlines[0][0] <= now:
+                    _, key = heapq.heappop(self._deadlines)
+                    response = self._watched.pop(key, None)
+                    if response is not None:
+                        _abort(response)
+                self._condition.wait(self._deadlines[0][0] - now if self._deadlines else None)
+
+
+def _resolved_conn(conn, new_conn):
+    """
+    Open the socket of a connection with the addresses given by its resolver,
+    trying them in turn until one connects, as urllib3 does with the addresses
+    of the system resolver, or with the system resolver when it has none.
+    The TLS server name and the Host header are still those of the URL.
+    """
+    addresses = conn.resolver.resolve(conn._dns_host) if conn.resolver is not None else None
+    if addresses is None:
+        return new_conn()
+    if not addresses:
+        raise NameResolutionError(conn.host, conn, socket.gaierror(socket.EAI_NONAME, 'Name or service not known'))
+
+    dns_host = conn._dns_host
+    try:
+        for address in addresses:
+            conn._dns_host = address
+            try:
+                return new_conn()
+            except (ConnectTimeoutError, NewConnectionError, OSError) as e:
+                # Timed out, refused or unreachable: the next address may answer.
+                error = e
+    finally:
+        conn._dns_host = dns_host
+    raise error
+
+
+class TimedHTTPConnection(HTTPConnection):
+    """An HTTP connection recording the time it takes to connect."""
+
+    # Set on the connection classes of the pools of an HTTPClient with a resolver.
+    resolver: Optional[Resolver] = None
+
+    def _new_conn(self):
+        with METRICS.time('connect'):
+            return _resolved_conn(self, super()._new_conn)
+
+
+class TimedHTTPSConnection(HTTPSConnection):
+    """An HTTPS connection recording the time it takes to connect, then to handshake."""
+
+    resolver: Optional[Resolver] = None
+
+    def _new_conn(self):
+        start = time.perf_counter()
+        try:
+            return _resolved_conn(self, super()._new_conn)
+        finally:
+            self.connect_seconds = time.perf_counter() - start
+            METRICS.observe('connect', self.connect_seconds)
+
+    def connect(self):
+        self.connect_seconds = 0.0
+        start = time.perf_counter()
+        super().connect()
+        METRICS.observe('tls', time.perf_counter() - start - self.connect_seconds)
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+def _resolving_pool(pool_cls, resolver: Resolver):
+    """Return a subclass of a pool class whose connections resolve their host with ``resolver``."""
+    connection_cls = type(pool_cls.ConnectionCls.__name__, (pool_cls.ConnectionCls,), {'resolver': resolver})
+    return type(pool_cls.__name__, (pool_cls,), {'ConnectionCls': connection_cls})
+
+
+class HTTPClient:
+    """
+    HTTPClient is a process-wide HTTP client shared by all URLInspector instances.
+
+    It wraps a single requests Session whose adapter keeps one connection pool
+    per host, so pages and JS files served from the same host or CDN reuse
+    their keep-alive TCP/TLS connections across URLs and threads. The client
+    speaks HTTP/1.1 only, as requests and urllib3 have no HTTP/2 support.
+
+    When a ValidatorCache is given, conditional requests send the validators
+    stored for the URL, and ``cached()`` returns the stored entry of a 304.
+
+    Every request is bounded by a total timeout on top of the connect and read
+    timeouts, which covers its retries and the body, streamed or not. Connection
+    errors, timeouts and 429/502/503/504 responses are retried with a jittered
+    exponential backoff while the total timeout allows it. When a CircuitBreaker
+    is given, the requests which still fail with an error or a 502/503/504 count
+    as failures of their host, and the requests to hosts whose circuit is open
+    raise CircuitOpenError without being sent.
+
+    When a Resolver is given, new connections resolve their host with it
+    instead of the system resolver, and the requests to hosts it found not to
+    exist raise HostNotFound without being sent, retried or counted by the
+    circuit breaker.
+
+    The stages of the requests (connection, TLS handshake, time to the headers
+    and body download) and their duration per host are recorded in METRICS.
+
+    Attributes:
+        session (requests.Session): The underlying session.
+        timeout (tuple): The default (connect, read) timeout in seconds.
+        total_timeout (float): The maximum time of a request in seconds.
+        retries (int): The maximum number of retries of a request.
+        cache (ValidatorCache): The optional ETag/Last-Modified cache.
+        breaker (CircuitBreaker): The optional per host circuit breaker.
+        resolver (Resolver): The optional in-process DNS resolver and cache.
+
+    Usage Example:
+        with HTTPClient(pool_maxsize=4) as client:
+            inspector = URLInspector("https://example.com", client=client)
+            print(client.stats())
+    """
+
+    def __init__(
+        self,
+        pool_connections: int = HTTP_POOL_CONNECTIONS,
+        pool_maxsize: int = HTTP_POOL_MAXSIZE,
+        connect_timeout: float = HTTP_CONNECT_TIMEOUT,
+        read_timeout: float = HTTP_READ_TIMEOUT,
+        cache: Optional[ValidatorCache] = None,
+        total_timeout: float = HTTP_TOTAL_TIMEOUT,
+        retries: int = HTTP_RETRIES,
+        backoff: float = HTTP_BACKOFF,
+        max_backoff: float = HTTP_MAX_BACKOFF,
+        breaker: Optional[CircuitBreaker] = None,
+        resolver: Optional[Resolver] = None,
+    ) -> None:
+
+        self.timeout = (connect_timeout, read_timeout)
+        self.total_timeout = total_timeout
+        self.retries = max(0, retries)
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.cache = cache
+        self.breaker = breaker
+        self.resolver = resolver
+        self._lock = threading.Lock()
+        self._retired = {'requests': 0, 'connections': 0}
+        self._counters = {'retries': 0, 'short_circuited': 0}
+        self._watchdog = Watchdog()
+
+        adapter = HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+        )
+        # Keep the counters of pools evicted from the LRU before closing them.
+        adapter.poolmanager.pools.dispose_func = self._retire_pool
+        pool_classes = {'http': TimedHTTPConnectionPool, 'https': TimedHTTPSConnectionPool}
+        if resolver is not None:
+            pool_classes = {scheme: _resolving_pool(pool_cls, resolver) for scheme, pool_cls in pool_classes.items()}
+        adapter.poolmanager.pool_classes_by_scheme = pool_classes
+        self._adapter = adapter
+
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def get(self, url: str, conditional: bool = False, **kwargs) -> requests.Response:
+        """
+        Send a GET request through the shared connection pools.
+
+        Args:
+            url (str): The URL to fetch.
+            conditional (bool): Send the cached validators of the URL, if any.
+        """
+        if conditional and self.cache is not None:
+            headers = dict(kwargs.pop('headers', None) or {})
+            headers.update(self.cache.conditional_headers(url))
+            kwargs['headers'] = headers
+        return self.request('GET', url, **kwargs)
+
+    def head(self, url: str, **kwargs) -> requests.Response:
+        """
+        Send a HEAD request through the shared connection pools.
+        """
+        kwargs.setdefault('allow_redirects', False)
+        return self.request('HEAD', url, **kwargs)
+
+    def request(self, method: str, url: str, stream: bool = False, **kwargs) -> requests.Response:
+        """
+        Send a request with retries, within the total timeout and the circuit breaker.
+
+        The response is always streamed from the socket: without ``stream`` its
+        body is read here, otherwise reading it with ``iter_content()`` raises
+        TotalTimeout once the total timeout has passed. A body which has not
+        been read to its end by then is aborted by the watchdog.
+
+        Raises:
+            CircuitOpenError: The circuit of the host is open.
+            HostNotFound: The host does not exist.
+            requests.exceptions.RequestException: The last attempt failed.
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        host = get_host(url)
+        if self.resolver is not None and self.resolver.is_dead(host):
+            METRICS.inc('http_dead_hosts')
+            raise HostNotFound(f'{host} does not exist, request to {url} skipped')
+        if self.breaker is not None and not self.breaker.allow(host):
+            with self._lock:
+                self._counters['short_circuited'] += 1
+            METRICS.inc('http_short_circuited')
+            raise CircuitOpenError(f'Circuit open for {host}, request to {url} skipped')
+
+        start = time.perf_counter()
+        success = False
+        try:
+            response = self._send(method, url, host, stream, kwargs)
+            success = response.status_code not in FAILURE_STATUSES
+            return response
+        except requests.exceptions.SSLError:
+            # Neither a success nor a failure of the host: the caller may retry without verification.
+            success = None
+            raise
+        finally:
+            # Whatever ends the request, e.g. a redirect loop, the breaker hears of
+            # it, so a half-open circuit does not wait for its trial forever.
+            self._record(host, success)
+            METRICS.observe_request(host, time.perf_counter() - start)
+
+    def _send(self, method: str, url: str, host: str, stream: bool, kwargs) -> requests.Response:
+        deadline = time.monotonic() + self.total_timeout
+        attempt = 0
+        while True:
+            try:
+                METRICS.inc('http_requests')
+                with METRICS.time('request'):
+                    response = self.session.request(method, url, stream=True, **kwargs)
+                key = self._watchdog.watch(response, deadline)
+                response.iter_content = _bound(response.iter_content, deadline, partial(self._watchdog.unwatch, key))
+                if not stream:
+                    response.content
+            except requests.exceptions.SSLError:
+                # Not a transient error: the caller may retry without verification.
+                raise
+            except TRANSIENT_ERRORS as e:
+                if self.resolver is not None and self.resolver.is_dead(host):
+                    # Found not to exist by this attempt: not worth another one.
+                    METRICS.inc('http_dead_hosts')
+                    raise HostNotFound(f'{host} does not exist, request to {url} failed') from e
+                delay = self._backoff(attempt, deadline)
+                if delay is None:
+                    raise
+                logger.info(f'Retrying {url} in {delay:.2f}s after {e.__class__.__name__}', extra={'url': url})
+            else:
+                delay = self._backoff(attempt, deadline, response) if response.status_code in RETRY_STATUSES else None
+                if delay is None:
+                    if response.status_code == 304:
+                        METRICS.inc('cache_hits')
+                    return response
+                response.close()
+                logger.info(f'Retrying {url} in {delay:.2f}s after HTTP {response.status_code}', extra={'url': url})
+
+            attempt += 1
+            with self._lock:
+                self._counters['retries'] += 1
+            METRICS.inc('http_retries')
+            time.sleep(delay)
+
+    def _backoff(self, attempt: int, deadline: float, response: Optional[requests.Response] = None) -> Optional[float]:
+        """
+        Return the delay before the next attempt, or None when there is none left.
+
+        The delay is drawn uniformly up to an exponential backoff (full jitter), so
+        the retries of requests failing together do not hit the host together. A
+        Retry-After header in seconds is followed when it is longer.
+        """
+        if attempt >= self.retries:
+            return None
+
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after is not None and retry_after.isdigit():
+            delay = max(delay, float(retry_after))
+
+        if time.monotonic() + delay >= deadline:
+            return None
+        return delay
+
+    def _record(self, host: str, success: Optional[bool]) -> None:
+        if self.breaker is None:
+            return
+        if success is None:
+            self.breaker.release(host)
+        else:
+            self.breaker.record(host, success)
+
+    def cached(self, url: str, response: requests.Response) -> Optional[CacheEntry]:
+        """
+        Return the cache entry of a URL if its response is a 304 Not Modified.
+        """
+        if self.cache is None or response.status_code != 304:
+            return None
+        return self.cache.get(url)
+
+    def remember(self, url: str, response: requests.Response, content_hash: str) -> None:
+        """
+        Store the validators of a response in the cache, if there is one.
+        """
+        if self.cache is not None:
+            self.cache.store(url, response, content_hash)
+
+    def source(self, url: str) -> Optional[str]:
+        """
+        Return the URL the JS file known by ``url`` was last downloaded from, if cached.
+        """
+        if self.cache is None:
+            return None
+        return self.cache.source(url)
+
+    def remember_source(self, url: str, source: str) -> None:
+        """
+        Store the URL the JS file known by ``url`` was downloaded from in the cache, if there is one.
+        """
+        if self.cache is not None:
+            self.cache.store_source(url, source)
+
+    def validators(self, url: str, response: requests.Response, content_hash: str) -> Optional[CacheEntry]:
+        """
+        Return the cache entry of a response, to be stored later, or None when
+        there is no cache or the response has no validators.
+        """
+        if self.cache is None:
+            return None
+        return self.cache.entry(url, response, content_hash)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Return the number of requests sent, connections opened and reused, requests
+        retried and requests skipped by the circuit breaker.
+        """
+        with self._lock:
+            totals = dict(self._retired)
+            counters = dict(self._counters)
+
+        pools = self._adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                totals['requests'] += pool.num_requests
+                totals['connections'] += pool.num_connections
+
+        totals['reused'] = max(0, totals['requests'] - totals['connections'])
+        totals.update(counters)
+        return totals
+
+    def close(self) -> None:
+        """
+        Close all pooled connections, the validator cache, the circuit breaker and the resolver.
+        """
+        self.session.close()
+        self._watchdog.close()
+        if self.resolver is not None:
+            self.resolver.close()
+        if self.cache is not None:
+            self.cache.close()
+        if self.breaker is not None:
+            self.breaker.close()
+
+    def _retire_pool(self, pool) -> None:
+        with self._lock:
+            self._retired['requests'] += pool.num_requests
+            self._retired['connections'] += pool.num_connections
+        pool.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+_default_client: Optional[HTTPClient] = None
+_default_lock = threading.Lock()
+
+
+def get_client() -> HTTPClient:
+    """
+    Return the process-wide default HTTPClient, creating it on first use.
+    """
+    global _default_client
+    with _default_lock:
+        if _default_client is None:
+            _default_client = HTTPClient()
+        return _default_client
@@ -0,0 +1,166 @@
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import NamedTuple
+from typing import Optional
+from typing import Tuple
+
+from .config import DB_BATCH_SIZE
+from .config import get_logger
+from .config import IMPORT_CONCURRENCY
+from .queries import MonitoredUrl
+from .queries import UrlDataQueries
+from .scanner import Scanner
+from .urls import normalize_url
+
+
+logger = get_logger()
+
+
+def read_urls(lines: Iterable[str]) -> Tuple[List[str], int, int]:
+    """
+    Normalize and deduplicate the URLs of a list, keeping their order. Bare
+    hostnames get the https scheme.
+
+    Returns:
+        tuple: The URLs, and the number of invalid and of duplicate lines.
+    """
+    urls: Dict[str, None] = {}
+    invalid = duplicates = 0
+    for line in lines:
+        if not line.strip():
+            continue
+        url = normalize_url(line)
+        if url is None:
+            invalid += 1
+        elif url in urls:
+            duplicates += 1
+        else:
+            urls[url] = None
+    return list(urls), invalid, duplicates
+
+
+class ImportResult(NamedTuple):
+    added: int
+    updated: int
+    failed: List[str]
+
+
+class BulkImporter:
+    """
+    BulkImporter adds or updates the records of many URLs at once.
+
+    The URLs are fetched concurrently by a Scanner, each with the single fetch
+    of ``inspect``, which returns the results of the checks of a URL. The
+    records that exist are looked up in chunks before the scan; their updates
+    and the new records are written in batched transactions of ``batch_size``
+    records as the results come in.
+
+    Usage Example:
+        importer = BulkImporter(queries, lambda url: URLInspector(url).inspect(['title']))
+        added, updated, failed = importer.run(urls)
+    """
+
+    def __init__(
+        self,
+        queries: UrlDataQueries,
+        inspect: Callable[[str], Dict[str, Any]],
+        min_interval: Optional[int] = None,
+        max_interval: Optional[int] = None,
+        batch_size: int = DB_BATCH_SIZE,
+        scanner: Optional[Scanner] = None,
+    ) -> None:
+
+        self.queries = queries
+        self.inspect = inspect
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.batch_size = max(1, batch_size)
+        self.scanner = scanner or Scanner(concurrency=IMPORT_CONCURRENCY)
+        self._new: List[Tuple[Dict[str, Any], Optional[Dict[str, tuple]]]] = []
+
+    def run(self, urls: List[str], progress: Optional[Callable[[], None]] = None) -> ImportResult:
+        """
+        Import URLs, normalized and deduplicated with read_urls().
+
+        Args:
+            urls: The URLs to add or update.
+            progress: Optional callable invoked after each URL, failed or not.
+
+        Returns:
+            ImportResult: The number of records added and updated, and the URLs
+                which could not be imported.
+        """
+        existing = self.queries.find_monitored(urls, self.batch_size)
+        imported = set()
+        failed = []
+        added = updated = 0
+
+        def on_result(url, results):
+            nonlocal updated
+            values, js_files = self._values(results)
+            record = existing.get(url)
+            if record is None:
+                self._new.append(({'url': url, **values}, js_files))
+                if len(self._new) >= self.batch_size:
+                    flush_new()
+            else:
+                updater.update(record.id, values)
+                if js_files is not None:
+                    updater.sync_js_assets(record, js_files)
+                updated += 1
+            imported.add(url)
+
+        def flush_new():
+            nonlocal added
+            added += self._insert_new(updater, failed)
+
+        def fetch(url):
+            try:
+                return self.inspect(url)
+            finally:
+                if progress is not None:
+                    progress()
+
+        with self.queries.bulk_updater(self.batch_size) as updater:
+            self.scanner.run(urls, fetch, on_result, url_of=str)
+            flush_new()
+
+        failed.extend(url for url in urls if url not in imported)
+        return ImportResult(added, updated, failed)
+
+    def _values(self, results: Dict[str, Any]) -> Tuple[Dict[str, Any], Optional[Dict[str, tuple]]]:
+        """
+        Return the column values of a URL from the results of its checks, and its JS files.
+        """
+        values = dict(results)
+        js_files = values.pop('js_files', None)
+        if js_files is not None:
+            values['track_js'] = True
+        if self.min_interval is not None:
+            values['min_interval'] = self.min_interval
+        if self.max_interval is not None:
+            values['max_interval'] = self.max_interval
+        return values, js_files
+
+    def _insert_new(self, updater, failed: List[str]) -> int:
+        """
+        Insert the new records queued so far, then queue the JS assets of their pages.
+        """
+        new, self._new = self._new, []
+        if not new:
+            return 0
+        try:
+            ids = self.queries.insert_many([values for values, _ in new])
+        except Exception as e:
+            logger.error(f'Error adding {len(new)} URLs: {e}')
+            failed.extend(values['url'] for values, _ in new)
+            return 0
+
+        for values, js_files in new:
+            if js_files is not None:
+                record = MonitoredUrl(ids[values['url']], values['url'], None, None, None, True, {})
+                updater.sync_js_assets(record, js_files)
+        return len(ids)
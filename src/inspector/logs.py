@@ -0,0 +1,249 @@
+import atexit
+import fcntl
+import json
+import logging
+import os
+import queue
+import re
+from datetime import datetime
+from datetime import timedelta
+from logging.handlers import QueueHandler
+from logging.handlers import QueueListener
+from logging.handlers import RotatingFileHandler
+from typing import Iterator
+from typing import List
+from typing import NamedTuple
+from typing import Optional
+
+from .config import LOG_BACKUPS
+from .config import LOG_FILE
+from .config import LOG_LEVEL
+from .config import LOG_MAX_BYTES
+
+
+# Lines written before logging switched to JSON, e.g.
+# 2026-10-18 00:00:00,000 - inspector - INFO - Scanned 1 due URLs
+LEGACY_LINE = re.compile(r'(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d,\d{3}) - (\S+) - ([A-Z]+) - (.*)')
+RELATIVE_TIME = re.compile(r'(\d+)([smhd])')
+UNITS = {'s': 'seconds', 'm': 'minutes', 'h': 'hours', 'd': 'days'}
+
+
+class LogEntry(NamedTuple):
+    time: Optional[datetime]
+    level: str
+    logger: str
+    message: str
+    url: Optional[str] = None
+
+    def __str__(self) -> str:
+        if self.time is None:
+            return self.message
+        return f'{self.time:%Y-%m-%d %H:%M:%S} {self.level:<8} {self.message}'
+
+
+class JSONFormatter(logging.Formatter):
+    """
+    JSONFormatter formats a record as a JSON object on a single line, with its
+    time, level, logger name, message and, when given with
+    ``extra={'url': ...}``, the URL it is about.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': datetime.fromtimestamp(record.created).astimezone().isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        url = getattr(record, 'url', None)
+        if url is not None:
+            entry['url'] = url
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class SharedRotatingFileHandler(RotatingFileHandler):
+    """
+    SharedRotatingFileHandler is a RotatingFileHandler for a log shared by
+    several processes: the workers of a sharded scan, workers on other nodes
+    and cron runs next to the daemon.
+
+    Each record is written under an exclusive lock of a ``.lock`` file next
+    to the log. A process whose log was rotated by another one reopens it
+    first, and the size deciding a rotation is that of the file on disk, so
+    no line is lost, clobbered or written to a rotated file.
+    """
+
+    def __init__(self, filename, maxBytes: int = 0, backupCount: int = 0) -> None:
+
+        super().__init__(filename, maxBytes=maxBytes, backupCount=backupCount, delay=True)
+        self.lock_path = f'{self.baseFilename}.lock'
+        self._lock_file = None
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            if self._lock_file is None:
+                self._lock_file = open(self.lock_path, 'a')
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+        except OSError:
+            self.handleError(record)
+            return
+        try:
+            self._reopen_if_rotated()
+            super().emit(record)
+        finally:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def _reopen_if_rotated(self) -> None:
+        if self.stream is None:
+            return
+        try:
+            rotated = os.stat(self.baseFilename).st_ino != os.fstat(self.stream.fileno()).st_ino
+        except FileNotFoundError:
+            rotated = True
+        if rotated:
+            self.stream.close()
+            self.stream = self._open()
+
+    def close(self) -> None:
+        self.acquire()
+        try:
+            if self._lock_file is not None:
+                self._lock_file.close()
+                self._lock_file = None
+        finally:
+            self.release()
+        super().close()
+
+
+def configure_logging(
+    logger: logging.Logger,
+    path=LOG_FILE,
+    level: str = LOG_LEVEL,
+    max_bytes: int = LOG_MAX_BYTES,
+    backups: int = LOG_BACKUPS,
+) -> QueueListener:
+    """
+    Send the records of ``logger`` to a rotating JSON-lines file, written by
+    a background thread. The file can be shared with other processes, see
+    SharedRotatingFileHandler.
+
+    The records are formatted by the thread logging them and queued, so a
+    scan never waits for the disk. The queue is flushed at exit.
+
+    Returns:
+        The listener writing the records, see stop_logging.
+    """
+    file_handler = SharedRotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups)
+    records = queue.SimpleQueue()
+    queue_handler = QueueHandler(records)
+    queue_handler.setFormatter(JSONFormatter())
+
+    logger.setLevel(level)
+    logger.addHandler(queue_handler)
+    listener = QueueListener(records, file_handler)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+def stop_logging(listener: QueueListener) -> None:
+    """Write the records left in the queue and stop the listener before exit."""
+    atexit.unregister(listener.stop)
+    listener.stop()
+
+
+def parse_line(line: str) -> LogEntry:
+    """Parse a line of the log, JSON or in the former text format."""
+    if line.startswith('{'):
+        try:
+            entry = json.loads(line)
+            return LogEntry(
+                datetime.fromisoformat(entry['time']), entry['level'], entry['logger'],
+                entry['message'], entry.get('url'),
+            )
+        except (ValueError, KeyError):
+            pass
+    match = LEGACY_LINE.fullmatch(line)
+    if match:
+        time = datetime.strptime(match[1], '%Y-%m-%d %H:%M:%S,%f').astimezone()
+        return LogEntry(time, match[3], match[2], match[4])
+    return LogEntry(None, '', '', line)
+
+
+def parse_since(value: str) -> datetime:
+    """
+    Parse the start of the logs shown: a relative time, e.g. 30m, 12h or 2d,
+    or an ISO 8601 date and time, local unless it has an offset.
+    """
+    match = RELATIVE_TIME.fullmatch(value)
+    if match:
+        return datetime.now().astimezone() - timedelta(**{UNITS[match[2]]: int(match[1])})
+    return datetime.fromisoformat(value).astimezone()
+
+
+def reverse_lines(path, block_size: int = 1 << 16) -> Iterator[str]:
+    """Yield the lines of a file from the last one, reading blocks from its end."""
+    with open(path, 'rb') as file:
+        position = file.seek(0, os.SEEK_END)
+        rest = b''
+        while position > 0:
+            size = min(block_size, position)
+            position -= size
+            file.seek(position)
+            lines = (file.read(size) + rest).split(b'\n')
+            # The first line may start in the previous block.
+            rest = lines.pop(0)
+            for line in reversed(lines):
+                if line:
+                    yield line.decode(errors='replace')
+        if rest:
+            yield rest.decode(errors='replace')
+
+
+def _level_number(name: str) -> int:
+    number = logging.getLevelName(name)
+    return number if isinstance(number, int) else logging.NOTSET
+
+
+def log_files(path=LOG_FILE) -> List[str]:
+    """Return the log file and its rotated backups, newest first."""
+    files = [str(path)] if os.path.exists(path) else []
+    index = 1
+    while os.path.exists(f'{path}.{index}'):
+        files.append(f'{path}.{index}')
+        index += 1
+    return files
+
+
+def read_logs(
+    path=LOG_FILE,
+    limit: int = 100,
+    since: Optional[datetime] = None,
+    level: Optional[str] = None,
+    url: Optional[str] = None,
+) -> List[LogEntry]:
+    """
+    Return the last ``limit`` entries of the log (all of them when 0), oldest
+    first, filtered by time, minimum level and URL.
+
+    The files are read backwards from their end, and reading stops at the
+    first entry older than ``since``, so the last entries of a log of any
+    size are shown at once.
+    """
+    minimum = _level_number(level.upper()) if level else None
+    entries = []
+    for file in log_files(path):
+        for line in reverse_lines(file):
+            entry = parse_line(line)
+            if since is not None and entry.time is not None and entry.time < since:
+                return entries[::-1]
+            if minimum is not None and _level_number(entry.level) < minimum:
+                continue
+            if url is not None and url not in (entry.url or '') and url not in entry.message:
+                continue
+            entries.append(entry)
+            if len(entries) == limit:
+                return entries[::-1]
+    return entries[::-1]
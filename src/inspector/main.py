@@ -1,94 +1,446 @@
+import argparse
+import signal
+import sys
+import time
+from contextlib import contextmanager
+from functools import partial
+from operator import attrgetter
+
+from inspector.blobstore import BlobStore
+from inspector.breaker import CircuitBreaker
+from inspector.cache import CacheEntry
+from inspector.cache import ValidatorCache
 from inspector.config import DB_URL
 from inspector.config import DISCORD_WEBHOOK_URL
+from inspector.config import FINGERPRINT_THRESHOLD
 from inspector.config import get_logger
+from inspector.config import METRICS_PORT
+from inspector.config import METRICS_TEXTFILE
+from inspector.config import RUN_TIMEOUT
+from inspector.config import SCAN_WORKERS
+from inspector.config import SCHEDULE_BATCH_SIZE
+from inspector.config import SCHEDULE_POLL_INTERVAL
+from inspector.config import SCHEDULE_RETRY
+from inspector.coordinator import ResultCollector
+from inspector.coordinator import run_coordinator
 from inspector.db import get_session
-from inspector.discord_client import DiscordNotification
+from inspector.db import upgrade_db
+from inspector.discord_client import DiscordDispatcher
+from inspector.fingerprint import Fingerprint
+from inspector.httpclient import HTTPClient
+from inspector.metrics import METRICS
+from inspector.metrics import profiled
+from inspector.metrics import serve_metrics
+from inspector.metrics import timed
 from inspector.queries import UrlDataQueries
+from inspector.queries import utcnow
+from inspector.resolver import Resolver
+from inspector.scanner import Scanner
+from inspector.streaming import STOP_TITLE
+from inspector.urlinspector import JsDownloads
 from inspector.urlinspector import URLInspector
+from inspector.urls import get_host
+from inspector.versions import VersionStore
 
 messages = []
+dispatcher = None
 logger = get_logger()
-session = get_session(DB_URL)
-queries = UrlDataQueries(session)
-
-
-def main():
-
-    all_records_json = queries.get_all()
-
-    for record in all_records_json:
-
-        process_record(record)
-
-    send_discord_messages()
-
-
-def process_record(record):
-    """Process a single URL record."""
-
-    data = {k: v for k, v in record.items() if v != 'None'}
-    url = record['url']
-    domain = URLInspector(data['url'])
-    url_data = queries.get(url)
-
-    if url_data:
-        check_status_code_change(data, domain, url_data)
-        check_title_change(data, domain, url_data)
-        check_content_length_change(data, domain, url_data)
-        check_js_hash_change(data, domain, url_data)
-
-        # Save the updated url_data
-        queries.update(url_data)
+# The database session of the scan, opened by open_db().
+session = None
+queries = None
+
+# Unreferenced JS files are collected once a day by the daemon.
+GC_INTERVAL = 86400
+
+
+def open_db():
+    """Upgrade the database schema, and open the session of the scan if not yet open."""
+    global session, queries
+
+    upgrade_db(DB_URL)
+    if queries is None:
+        session = get_session(DB_URL)
+        queries = UrlDataQueries(session)
+
+
+def main(profile=False):
+    """Scan every URL once, e.g. from cron. With ``profile``, print the time spent per stage."""
+
+    open_db()
+    with profiled(profile):
+        records = list(queries.iter_monitored())
+        with notifications():
+            scan(records)
+            collect_garbage()
+    export_metrics()
+
+
+def run_daemon(once=False, poll_interval=SCHEDULE_POLL_INTERVAL, profile=False):
+    """
+    Scan the URLs as they come due, until stopped.
+
+    Each URL is checked again after its own interval, shortened when it changed
+    and backed off when it did not, so changing sites are checked more often
+    than stable ones for the same number of requests. Unscheduled URLs are
+    spread over the default interval, and the jitter of the next checks keeps
+    the load spread over time.
+
+    The metrics are served on METRICS_PORT and written to METRICS_TEXTFILE
+    after each round, when set. With ``profile``, the time spent per stage
+    of each round is printed.
+    """
+
+    open_db()
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    spread = queries.spread_unscheduled()
+    if spread:
+        logger.info(f'Scheduled {spread} new URLs')
+
+    metrics_server = serve_metrics(METRICS_PORT) if METRICS_PORT else None
+    last_gc = time.monotonic()
+    try:
+        with notifications():
+            while True:
+                records = list(queries.iter_monitored(due_before=utcnow(), limit=SCHEDULE_BATCH_SIZE))
+                if records:
+                    # Until their results are written, the records are due for a retry only.
+                    queries.postpone([record.id for record in records], SCHEDULE_RETRY)
+                    with profiled(profile):
+                        scan(records)
+                    logger.info(f'Scanned {len(records)} due URLs')
+                    export_metrics()
+
+                if time.monotonic() - last_gc >= GC_INTERVAL:
+                    collect_garbage()
+                    last_gc = time.monotonic()
+
+                if once:
+                    break
+                if len(records) < SCHEDULE_BATCH_SIZE:
+                    wait = seconds_until(queries.next_due(), poll_interval)
+                    # End the read transaction, so the next round sees new URLs.
+                    session.commit()
+                    time.sleep(wait)
+    finally:
+        if metrics_server is not None:
+            metrics_server.shutdown()
+            metrics_server.server_close()
+
+
+def seconds_until(next_due, limit):
+    """Return the seconds to wait for the next check, at most ``limit``."""
+
+    if next_due is None:
+        return limit
+    return min(limit, max(0.0, (next_due - utcnow()).total_seconds()))
+
+
+@contextmanager
+def notifications():
+    """
+    Send notifications to Discord while the scan goes on, and wait for the
+    outbox to be delivered at the end.
+    """
+    global dispatcher
+
+    dispatcher = DiscordDispatcher(DISCORD_WEBHOOK_URL)
+    dispatcher.start()
+    try:
+        yield dispatcher
+    finally:
+        dispatcher.close()
+        dispatcher = None
+
+
+def scan(records):
+    """
+    Scan records and write their changes in batches.
+
+    The scan stops starting new fetches after RUN_TIMEOUT seconds, so a run
+    ends in time for the next one even when many hosts are slow.
+    """
+
+    deadline = time.time() + RUN_TIMEOUT if RUN_TIMEOUT > 0 else None
+    with queries.bulk_updater() as updater:
+        if SCAN_WORKERS > 1:
+            scan_sharded(records, updater, deadline=deadline)
+        else:
+            scan_local(records, updater, deadline=deadline)
+
+
+def export_metrics():
+    """Write the metrics to METRICS_TEXTFILE, when set."""
+
+    if not METRICS_TEXTFILE:
+        return
+    try:
+        METRICS.write_textfile(METRICS_TEXTFILE)
+    except OSError as e:
+        logger.error(f'Error writing the metrics to {METRICS_TEXTFILE}: {e}')
+
+
+def collect_garbage():
+    """Delete the JS files no longer referenced for the retention period."""
+
+    blob_store = BlobStore()
+    blob_store.gc()
+    blob_store.close()
+
+
+def scan_local(records, updater, deadline=None):
+    """Scan all records in this process."""
+
+    blob_store = BlobStore()
+    versions = VersionStore()
+    with HTTPClient(cache=ValidatorCache(), breaker=CircuitBreaker(), resolver=Resolver()) as client:
+        resolve_hosts(client, records)
+        scanner = Scanner(deadline=deadline)
+        fetch = partial(
+            fetch_record, client=client, blob_store=blob_store, downloads=JsDownloads(), versions=versions,
+            pace=scanner.wait_turn,
+        )
+        scanner.run(records, fetch, partial(process_record, updater=updater), url_of=attrgetter('url'))
+        # The validators are stored once the changes are written, while the cache is open.
+        updater.flush()
+        stats = client.stats()
+    versions.close()
+    blob_store.close()
+
+    METRICS.inc('urls_failed', scanner.failed)
+    if scanner.failed:
+        logger.error(f'{scanner.failed} URLs could not be scanned')
+    if scanner.skipped:
+        logger.warning(f'{scanner.skipped} URLs skipped, the run took longer than {RUN_TIMEOUT:.0f}s')
+    logger.info(
+        f"Sent {stats['requests']} HTTP requests over {stats['connections']} connections "
+        f"({stats['reused']} reused, {stats['retries']} retries, "
+        f"{stats['short_circuited']} skipped by the circuit breaker)",
+    )
 
 
-def check_status_code_change(data, domain, url_data):
-    """Check if the status code has changed and update messages."""
-    if not data.get('status_code'):
+def resolve_hosts(client, records):
+    """
+    Resolve the hosts of the records before they are scanned, so the requests
+    to the hosts which do not exist fail without a connection attempt.
+    """
+
+    if client.resolver is not None:
+        client.resolver.prefetch(get_host(record.url) for record in records)
+
+
+def scan_sharded(records, updater, workers=SCAN_WORKERS, deadline=None):
+    """
+    Scan the records with worker processes, each owning the hosts of a shard.
+    The results are applied here, so only this process writes to the database.
+    """
+
+    by_id = {record.id: record for record in records}
+    cache = ValidatorCache()
+    try:
+        failed_batches = run_coordinator(
+            records, partial(apply_batch, records=by_id, updater=updater, cache=cache), workers, deadline=deadline,
+        )
+        updater.flush()
+    finally:
+        cache.close()
+    if failed_batches:
+        logger.error(f'{failed_batches} batches of URLs could not be scanned')
+
+
+def scan_batch(records, client, blob_store, deadline=None, versions=None):
+    """
+    Scan a batch of records in a worker process.
+
+    Returns:
+        dict: The changes and JS files found for each record, the messages to
+            send, the number of URLs that failed and the metrics of the batch,
+            to be applied by apply_batch().
+    """
+
+    resolve_hosts(client, records)
+    collector = ResultCollector()
+    scanner = Scanner(deadline=deadline)
+    fetch = partial(
+        fetch_record, client=client, blob_store=blob_store, downloads=JsDownloads(), versions=versions,
+        pace=scanner.wait_turn,
+    )
+    scanner.run(records, fetch, partial(process_record, updater=collector), url_of=attrgetter('url'))
+    METRICS.inc('urls_failed', scanner.failed)
+
+    batch_messages = messages[:]
+    messages.clear()
+    return {
+        'records': collector.as_list(),
+        'messages': batch_messages,
+        'failed': scanner.failed,
+        'skipped': scanner.skipped,
+        'metrics': METRICS.drain(),
+    }
+
+
+def apply_batch(result, records, updater, cache=None):
+    """
+    Queue the results of a batch scanned by a worker process. The validators
+    the worker fetched the records with are stored in ``cache`` once written.
+    """
+
+    for item in result['records']:
+        record = records[item['id']]
+        updater.update(record.id, item.get('changes', {}))
+        if 'js_files' in item:
+            updater.sync_js_assets(record, item['js_files'])
+        if 'validators' in item:
+            updater.remember(record.id, cache, [CacheEntry(*entry) for entry in item['validators']])
+        updater.reschedule(record, item.get('changed', False))
+
+    for message in result['messages']:
+        notify(message)
+    if 'metrics' in result:
+        METRICS.merge(result['metrics'])
+    if result['failed']:
+        logger.error(f"{result['failed']} URLs could not be scanned")
+    if result.get('skipped'):
+        logger.warning(f"{result['skipped']} URLs skipped, the run took longer than {RUN_TIMEOUT:.0f}s")
+
+
+@timed('fetch')
+def fetch_record(record, client=None, blob_store=None, downloads=None, versions=None, pace=None):
+    """
+    Fetch the page of a record, and its JS files when they are monitored.
+
+    The page is revalidated with its cached ETag/Last-Modified. When it was not
+    modified, its known JS files are revalidated instead of re-parsing the page.
+    The JS files shared with the other pages of the run are downloaded once,
+    through ``downloads``, and their new versions kept in ``versions``. Each
+    download first waits for ``pace``, the politeness delay of its host. The
+    validators of the responses are only stored by process_record(), once the
+    changes found with them are written. When the content is monitored, the
+    page is also fingerprinted here. This runs on a scanner worker thread, so
+    it must not touch the database.
+    """
+
+    domain = URLInspector(
+        record.url, client=client, conditional=True, blob_store=blob_store, downloads=downloads,
+        versions=versions, defer_validators=True, pace=pace,
+    )
+    if not record.track_js:
+        # Without JS files, the page body is only read as far as the checks need.
+        domain.stream(
+            stop=STOP_TITLE if record.title is not None else None,
+            count_length=record.content_length is not None,
+            fingerprint=record.content_length is not None,
+        )
+        return domain
+
+    # Accessing not_modified fetches the page here; the checks reuse the memoized response.
+    if domain.not_modified:
+        logger.debug(f'{record.url} not modified')
+    elif record.content_length is not None:
+        # Parses the page for its fingerprint and its JS references at once.
+        domain.check_fingerprint()
+    domain.check_js_files(_known_js_urls(record.js_assets, domain))
+    return domain
+
+
+def process_record(record, domain=None, updater=None):
+    """
+    Process a single URL record.
+
+    The changes are queued on ``updater`` and written in batches; without an
+    updater they are written right away. The validators the page and JS files
+    were fetched with are stored after the changes, so a change not written,
+    e.g. because of a crash, is found again by the next scan.
+    """
+
+    if updater is None:
+        with queries.bulk_updater() as updater:
+            return process_record(record, domain, updater)
+
+    if domain is None:
+        domain = fetch_record(record)
+
+    with METRICS.time('process'):
+        changes = {}
+        # A page answered with 304 Not Modified has the same status, title and length.
+        if not domain.not_modified:
+            check_status_code_change(record, domain, changes)
+            check_title_change(record, domain, changes)
+            check_content_change(record, domain, changes, updater)
+        updater.update(record.id, changes)
+        js_changed = check_js_files_change(record, domain, updater)
+        updater.remember(record.id, domain.client.cache, domain.validators)
+        updater.reschedule(record, bool(changes) or js_changed)
+    METRICS.inc('urls_scanned')
+
+
+def check_status_code_change(record, domain, changes):
+    """Check if the status code has changed and send a notification."""
+    if record.status_code is None:
         return
 
     status_code = domain.check_status_code()
 
-    if status_code == url_data.status_code:
+    if status_code == record.status_code:
         return
 
-    messages.append(
-        f"Status code changed from `{url_data.status_code}` to `{status_code}`|{data['url']}|blue",
+    notify(
+        f'Status code changed from `{record.status_code}` to `{status_code}`|{record.url}|blue',
     )
-    logger.warning(f"Status code changed for {data['url']}")
-    url_data.status_code = status_code
+    logger.warning(f'Status code changed for {record.url}', extra={'url': record.url})
+    changes['status_code'] = status_code
 
 
-def check_title_change(data, domain, url_data):
-    """Check if the title has changed and update messages."""
-    if not data.get('title'):
+def check_title_change(record, domain, changes):
+    """Check if the title has changed and send a notification."""
+    if record.title is None:
         return
 
     title = domain.check_title()
 
-    if title == url_data.title:
+    if title == record.title:
         return
 
-    messages.append(f"Title changed from `{url_data.title}` to `{title}`|{data['url']}|blue")
-    logger.warning(f"Title changed for {data['url']}")
-    url_data.title = title
+    notify(f'Title changed from `{record.title}` to `{title}`|{record.url}|blue')
+    logger.warning(f'Title changed for {record.url}', extra={'url': record.url})
+    changes['title'] = title
 
 
-def check_content_length_change(data, domain, url_data):
-    """Check if the content length has changed and update messages."""
+def check_content_change(record, domain, changes, updater):
+    """
+    Check if the content has changed and send a notification.
 
-    if not data.get('content_length'):
-        return
-
-    content_length = domain.check_content_length()
+    The page changed when its text or tag structure fingerprint differs from
+    the stored one by more than FINGERPRINT_THRESHOLD bits, so tokens, dates
+    and counters changing on every fetch are not notified. The stored
+    fingerprint and length are only replaced by those of a change, so a page
+    drifting a little on each scan is still notified once it drifted enough.
+    Records without a fingerprint yet are compared by length one last time.
+    """
 
-    if content_length == url_data.content_length:
+    if record.content_length is None:
         return
 
-    messages.append(
-        f"Content length changed from `{url_data.content_length}` to `{content_length}`|{data['url']}|blue",
-    )
-    logger.warning(f"Content length changed for {data['url']}")
-    url_data.content_length = content_length
+    content_length = domain.check_content_length()
+    fingerprint = domain.check_fingerprint()
+
+    if record.fingerprint is None:
+        if content_length == record.content_length:
+            updater.update(record.id, {'fingerprint': fingerprint})
+            return
+        message = f'Content length changed from `{record.content_length}` to `{content_length}`'
+    else:
+        text_bits, structure_bits = Fingerprint.parse(record.fingerprint).distance(Fingerprint.parse(fingerprint))
+        if max(text_bits, structure_bits) <= FINGERPRINT_THRESHOLD:
+            return
+        message = (
+            f'Content changed ({text_bits} text and {structure_bits} structure bits of 64), '
+            f'length `{record.content_length}` to `{content_length}`'
+        )
+
+    notify(f'{message}|{record.url}|blue')
+    logger.warning(f'Content changed for {record.url}', extra={'url': record.url})
+    changes['content_length'] = content_length
+    changes['fingerprint'] = fingerprint
 
 
 JS_FILE_CHANGED = 'JS file changed'
@@ -96,73 +448,66 @@ JS_FILE_ADDED = 'JS file added'
 JS_FILE_REMOVED = 'JS file removed'
 
 
-def check_js_hash_change(data, domain, url_data):
-
-    if not data.get('js_hash'):
-        return
-
-    # Parse hashes
-    current_hashes = _parse_hashes(url_data.js_hash)
-    new_hashes = _parse_hashes(domain.check_js_files())
-
-    # Handle added files
-    changed_urls = _compare_hashes(current_hashes, new_hashes)
-
-    for url in changed_urls:
-        messages.append(f'{JS_FILE_CHANGED}|{url}|blue')
-
-    added_files = _get_added_files(current_hashes, new_hashes)
-    for url in added_files:
-        messages.append(f'{JS_FILE_ADDED}|{url}|green')
+def check_js_files_change(record, domain, updater):
+    """
+    Check if the JS files have changed, send notifications and update the JS assets.
+    Returns True if any JS file changed.
+    """
+    if not record.track_js:
+        return False
 
-    # Handle removed files
-    removed_files = _get_removed_files(current_hashes, new_hashes)
+    js_files = domain.check_js_files(_known_js_urls(record.js_assets, domain))
+    # A known JS file that failed, e.g. timed out, is kept as it was: removing it
+    # would stop monitoring it for as long as the page is not modified.
+    js_files = {**js_files, **_kept_js_files(record.js_assets, domain.js_failed)}
+    changes = updater.sync_js_assets(record, js_files)
 
-    for url in removed_files:
-        messages.append(f'{JS_FILE_REMOVED}|{url}|red')
+    for url in changes.changed:
+        notify(f'{JS_FILE_CHANGED}|{url}|blue')
 
-    # Update url data
-    url_data.js_hash = _create_hash_string(new_hashes)
+    for url in changes.added:
+        notify(f'{JS_FILE_ADDED}|{url}|green')
 
+    for url in changes.removed:
+        notify(f'{JS_FILE_REMOVED}|{url}|red')
 
-def _parse_hashes(hash_string):
-    hash_dict = {}
-    for pair in hash_string.split(','):
-        url, hash_url = pair.split('|')
-        hash_dict[url] = hash_url
-    return hash_dict
+    # A JS file renamed without changing, e.g. a new build of the same chunk, is no change.
+    return bool(changes.changed or changes.added or changes.removed)
 
 
-def _compare_hashes(current, new):
-    changed_urls = []
-    for url, current_hash in current.items():
-        if url in new and current_hash != new[url]:
-            changed_urls.append(url)
-    return changed_urls
+def _known_js_urls(js_assets, domain):
+    """Return the JS URLs to revalidate for a page that was not modified."""
+    if not domain.not_modified:
+        return None
+    return list(js_assets)
 
 
-def _get_added_files(current, new):
-    return list(set(new.keys()) - set(current.keys()))
+def _kept_js_files(js_assets, failed):
+    """Return the known hash, and unknown size, of the known JS files that failed."""
+    return {url: (js_assets[url], None) for url in failed if url in js_assets}
 
 
-def _get_removed_files(current, new):
-    return list(set(current.keys()) - set(new.keys()))
-
-
-def _create_hash_string(hash_dict):
-    return ','.join([f'{key}|{value}' for key, value in hash_dict.items()])
+def notify(message):
+    """
+    Send a 'title|url|status' change message to Discord in the background, or
+    collect it when no dispatcher runs, e.g. in worker processes.
+    """
+    if dispatcher is not None:
+        dispatcher.send(message)
+    else:
+        messages.append(message)
 
 
 def send_discord_messages():
-    """Send messages to Discord."""
-    webhook_url = DISCORD_WEBHOOK_URL
-    discord = DiscordNotification(webhook_url)
-
-    for message in messages:
-        title, url, status = message.split('|')
-        discord.send_message(title, url, status)
+    """Send the collected messages to Discord."""
+    with DiscordDispatcher(DISCORD_WEBHOOK_URL) as discord:
+        for message in messages:
+            discord.send(message)
+    messages.clear()
 
 
 if __name__ == '__main__':
 
-    main()
+    parser = argparse.ArgumentParser(description='Scan every URL once.')
+    parser.add_argument('--profile', action='store_true', help='Print the time spent per stage of the run')
+    main(profile=parser.parse_args().profile)
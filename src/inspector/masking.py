@@ -0,0 +1,208 @@
+import json
+import re
+import threading
+from pathlib import Path
+from typing import Any
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import Optional
+from typing import Tuple
+
+from .config import MASK_MAX_LENGTH
+from .config import MASKS_FILE
+from .config import STRIP_PARAMS
+from .urls import get_host
+
+
+# What a masked string is replaced with, in the JS files hashed and stored.
+MASK = b'MASKED'
+
+# The content hash in the file name of a webpack, Rollup or Vite chunk, e.g.
+# main.3f9a8c1b.js, 123.3f9a8c1b.chunk.js or index-BJk3x9aF.js. It holds a digit,
+# so words such as 'feedback' are not taken for hashes.
+CHUNK_HASH = re.compile(
+    r'(?<=[.~-])(?=[A-Za-z_]*\d)(?:[0-9a-f]{8,32}|[A-Za-z0-9_]{8})(?=(?:\.(?:chunk|bundle|min))*\.m?js$)',
+)
+
+
+def asset_name(url: str) -> str:
+    """
+    Return the canonical name of a JS URL: without its query and fragment, and
+    with the content hash of its file name replaced by [hash]. A page loading
+    a JS URL of the same name as a former one loads a new build of that file.
+    """
+    path = url.split('#', 1)[0].split('?', 1)[0]
+    return CHUNK_HASH.sub('[hash]', path)
+
+
+class Masks:
+    """
+    Masks are the compiled masking rules of a site.
+
+    The regexes are compiled into a single one, so masking a JS file takes one
+    scan of it whatever the number of rules. Each match is replaced by MASK;
+    lookbehinds and lookaheads mask a value but not its name, e.g.
+    ``(?<=buildTime:")[^"]+``. Matches are expected to be at most
+    ``max_length`` bytes long.
+
+    Usage Example:
+        masks = Masks([r'(?<=nonce=")[^"]+'], strip_params=['v'])
+        masks.strip_url('https://example.com/app.js?v=123')  # 'https://example.com/app.js'
+        masked_chunks = masks.mask_chunks(response.iter_content(16384))
+    """
+
+    def __init__(
+        self,
+        patterns: Iterable[str] = (),
+        strip_params: Iterable[str] = (),
+        max_length: int = MASK_MAX_LENGTH,
+    ) -> None:
+
+        patterns = list(dict.fromkeys(patterns))
+        try:
+            self.pattern = re.compile(b'|'.join(b'(?:%s)' % pattern.encode() for pattern in patterns)) if patterns else None
+        except re.error as e:
+            raise ValueError(f'Invalid mask: {e}') from e
+        self.strip_params = frozenset(strip_params)
+        self.max_length = max(1, max_length)
+
+    def strip_url(self, url: str) -> str:
+        """Return a URL without the query parameters to strip, e.g. cache busters."""
+        if not self.strip_params or '?' not in url:
+            return url
+        url, fragment = url.split('#', 1) if '#' in url else (url, None)
+        base, query = url.split('?', 1)
+        params = [param for param in query.split('&') if param and param.split('=', 1)[0] not in self.strip_params]
+        url = f"{base}?{'&'.join(params)}" if params else base
+        return url if fragment is None else f'{url}#{fragment}'
+
+    def mask_chunks(self, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        """
+        Mask a stream of chunks, yielding masked chunks.
+
+        The last ``max_length`` bytes of a chunk are held back until the next
+        one, so a match spanning two chunks is masked, and as many bytes
+        already yielded are kept for the lookbehinds.
+        """
+        if self.pattern is None:
+            yield from chunks
+            return
+
+        data = b''
+        # Bytes of data before position were yielded, and are only kept for the lookbehinds.
+        position = 0
+        for chunk in chunks:
+            start = max(0, position - self.max_length)
+            data = data[start:] + chunk
+            masked, position = self._mask(data, position - start, final=False)
+            if masked:
+                yield masked
+        masked, _ = self._mask(data, position, final=True)
+        if masked:
+            yield masked
+
+    def _mask(self, data: bytes, position: int, final: bool) -> Tuple[bytes, int]:
+        """Mask data from position to the bytes which no further chunk can match, and return them."""
+        end = len(data) if final else len(data) - self.max_length
+        parts = []
+        for match in self.pattern.finditer(data, position):
+            if match.end() > end:
+                # The match may go on in the next chunk.
+                end = min(end, match.start())
+                break
+            if match.end() == match.start():
+                continue
+            parts.append(data[position:match.start()])
+            parts.append(MASK)
+            position = match.end()
+        if end > position:
+            parts.append(data[position:end])
+            position = end
+        return b''.join(parts), position
+
+
+class MaskingRules:
+    """
+    MaskingRules are the global and per-site masking rules, applied to the JS
+    files before they are hashed, and to their URLs before they are downloaded
+    and compared.
+
+    The rules of a site apply to the JS files served from its host or
+    subdomains, on top of the global rules. They are compiled once per site.
+
+    Usage Example:
+        rules = MaskingRules(
+            {'masks': [r'(?<=buildTime:")[^"]+'], 'strip_params': ['v']},
+            {'example.com': {'masks': [r'(?<=nonce:")\\w+']}},
+        )
+        masks = rules.for_url('https://cdn.example.com/app.js')
+    """
+
+    def __init__(
+        self,
+        global_rules: Optional[Dict[str, Any]] = None,
+        sites: Optional[Dict[str, Dict[str, Any]]] = None,
+        max_length: int = MASK_MAX_LENGTH,
+    ) -> None:
+
+        global_rules = global_rules or {}
+        self.global_masks = Masks(global_rules.get('masks', ()), global_rules.get('strip_params', ()), max_length)
+        self.sites = {
+            site.lower(): Masks(
+                [*global_rules.get('masks', ()), *rules.get('masks', ())],
+                [*global_rules.get('strip_params', ()), *rules.get('strip_params', ())],
+                max_length,
+            )
+            for site, rules in (sites or {}).items()
+        }
+
+    @classmethod
+    def load(cls, path=MASKS_FILE, strip_params: Iterable[str] = STRIP_PARAMS) -> 'MaskingRules':
+        """
+        Load the rules of a JSON file, if it exists, adding ``strip_params`` to
+        its global rules. The file holds the global ``masks`` and ``strip_params``,
+        and the rules of each site under ``sites``.
+
+        Raises:
+            ValueError: The file or one of its masks is invalid.
+        """
+        rules = {}
+        if Path(path).exists():
+            try:
+                with open(path) as file:
+                    rules = json.load(file)
+            except json.JSONDecodeError as e:
+                raise ValueError(f'Invalid masking rules in {path}: {e}') from e
+        sites = rules.pop('sites', {})
+        rules['strip_params'] = [*strip_params, *rules.get('strip_params', ())]
+        return cls(rules, sites)
+
+    def for_url(self, url: str) -> Masks:
+        """Return the masks of the JS files served from the host of a URL."""
+        if not self.sites:
+            return self.global_masks
+        labels = get_host(url).split('.')
+        for index in range(len(labels)):
+            masks = self.sites.get('.'.join(labels[index:]))
+            if masks is not None:
+                return masks
+        return self.global_masks
+
+    def strip_url(self, url: str) -> str:
+        return self.for_url(url).strip_url(url)
+
+
+_default_rules: Optional[MaskingRules] = None
+_default_lock = threading.Lock()
+
+
+def get_masking_rules() -> MaskingRules:
+    """
+    Return the process-wide default MaskingRules, loaded from MASKS_FILE on first use.
+    """
+    global _default_rules
+    with _default_lock:
+        if _default_rules is None:
+            _default_rules = MaskingRules.load()
+        return _default_rules
@@ -0,0 +1,388 @@
+import bisect
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from .config import METRICS_SLOW_REQUEST
+from .config import METRICS_TOP_HOSTS
+
+
+# Upper bounds in seconds of the buckets of the stage histograms.
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# The stages timed on the hot path. They overlap: 'fetch' covers the requests
+# of a URL, 'request' covers 'connect' and 'tls' when a connection is opened.
+STAGES = {
+    'resolve': 'DNS resolution of a host by the in-process resolver',
+    'connect': 'System DNS resolution and TCP connection of a new connection',
+    'tls': 'TLS handshake of a new connection',
+    'request': 'Request sent until the response headers, retries included',
+    'download': 'Reading of a response body',
+    'parse': 'HTML parsing of a page',
+    'hash': 'Hashing of a page or a JS file',
+    'write': 'Compression and writing of a JS file to the blob store',
+    'history': 'Delta compression and writing of a new JS file version to the history',
+    'fetch': 'Fetch of a URL with its JS files',
+    'process': 'Comparison of a URL with its record and queueing of its changes',
+    'db_read': 'Reading of records from the database',
+    'db_write': 'Writing of records to the database, commit included',
+    'discord': 'Sending of a Discord webhook message',
+}
+
+COUNTERS = {
+    'http_requests': 'HTTP requests sent, retries included',
+    'http_retries': 'HTTP requests retried',
+    'http_short_circuited': 'HTTP requests skipped by the circuit breaker',
+    'http_response_bytes': 'Bytes of response bodies read',
+    'cache_hits': 'Responses not modified since their last fetch (304)',
+    'dns_queries': 'DNS queries sent by the in-process resolver',
+    'dns_cache_hits': 'Hosts resolved from the DNS cache',
+    'dns_nxdomain': 'Hosts found not to exist (NXDOMAIN)',
+    'http_dead_hosts': 'HTTP requests skipped as their host does not exist',
+    'blob_bytes_written': 'Compressed bytes of new JS files written to the blob store',
+    'history_bytes_written': 'Compressed bytes of new JS file versions written to the history',
+    'urls_scanned': 'URLs scanned',
+    'urls_failed': 'URLs which could not be scanned',
+    'db_rows_written': 'Records written to the database',
+    'discord_messages': 'Discord webhook messages sent',
+}
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Histogram:
+    """Counts of observations per bucket, with their sum and maximum."""
+
+    __slots__ = ('buckets', 'sum', 'max')
+
+    def __init__(self) -> None:
+
+        # The last bucket counts the observations above the last bound.
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.max = 0.0
+
+    @property
+    def count(self) -> int:
+        return sum(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self.buckets[bisect.bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        """Return the upper bound of the bucket of the ``q`` quantile, the maximum in the last one."""
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.buckets):
+            seen += count
+            if count and seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+class HostStats:
+    """The requests to a host: their number, total and maximum time, and how many were slow."""
+
+    __slots__ = ('requests', 'seconds', 'max', 'slow')
+
+    def __init__(self) -> None:
+
+        self.requests = 0
+        self.seconds = 0.0
+        self.max = 0.0
+        self.slow = 0
+
+
+class Metrics:
+    """
+    Metrics collects the timings and counters of the hot path of a scan.
+
+    Each stage of a scan (see STAGES) has a histogram of its durations, and
+    the requests are tracked per host: those slower than ``slow_request``
+    seconds are counted, so the hosts slowing a run down stand out. The
+    metrics are cumulative for the life of the process, exported in the
+    Prometheus text format by render(), write_textfile() or serve_metrics().
+
+    Worker processes send their metrics with their results: drain() returns
+    a snapshot and resets them, and merge() adds a snapshot.
+
+    Usage Example:
+        with METRICS.time('parse'):
+            analysis = analyze(html)
+        METRICS.inc('http_response_bytes', len(body))
+        print(METRICS.render())
+    """
+
+    def __init__(self, slow_request: float = METRICS_SLOW_REQUEST, top_hosts: int = METRICS_TOP_HOSTS) -> None:
+
+        self.slow_request = slow_request
+        self.top_hosts = top_hosts
+        self._lock = threading.Lock()
+        self._counters: Dict[str, float] = {}
+        self._stages: Dict[str, Histogram] = {}
+        self._hosts: Dict[str, HostStats] = {}
+
+    def inc(self, name: str, value: float = 1) -> None:
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def observe(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            histogram = self._stages.get(stage)
+            if histogram is None:
+                histogram = self._stages[stage] = Histogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def time(self, stage: str):
+        """Observe the duration of the block as one ``stage``."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def observe_request(self, host: str, seconds: float) -> None:
+        """Record the duration of a request to ``host``."""
+        with self._lock:
+            stats = self._hosts.get(host)
+            if stats is None:
+                stats = self._hosts[host] = HostStats()
+            stats.requests += 1
+            stats.seconds += seconds
+            stats.max = max(stats.max, seconds)
+            if seconds >= self.slow_request:
+                stats.slow += 1
+
+    def counter(self, name: str) -> float:
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def stage(self, name: str) -> Histogram:
+        with self._lock:
+            return self._stages.get(name) or Histogram()
+
+    def slowest_hosts(self, limit: Optional[int] = None) -> List[Tuple[str, HostStats]]:
+        """Return the hosts with the most slow requests, then the longest one."""
+        with self._lock:
+            hosts = sorted(self._hosts.items(), key=lambda item: (item[1].slow, item[1].max), reverse=True)
+        return hosts[:self.top_hosts if limit is None else limit]
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Return the metrics as a dict of lists, which can be serialized to JSON."""
+        with self._lock:
+            return self._snapshot()
+
+    def drain(self) -> Dict[str, Any]:
+        """Return a snapshot of the metrics and reset them."""
+        with self._lock:
+            snapshot = self._snapshot()
+            self._clear()
+        return snapshot
+
+    def _snapshot(self) -> Dict[str, Any]:
+        return {
+            'counters': dict(self._counters),
+            'stages': {
+                name: [list(histogram.buckets), histogram.sum, histogram.max]
+                for name, histogram in self._stages.items()
+            },
+            'hosts': {
+                host: [stats.requests, stats.seconds, stats.max, stats.slow]
+                for host, stats in self._hosts.items()
+            },
+        }
+
+    def merge(self, snapshot: Dict[str, Any], sign: int = 1) -> None:
+        """
+        Add a snapshot to the metrics, or subtract it with ``sign=-1``. The
+        maximums of a subtraction are the ones of the metrics.
+        """
+        with self._lock:
+            for name, value in snapshot['counters'].items():
+                self._counters[name] = self._counters.get(name, 0) + sign * value
+            for name, (buckets, total, maximum) in snapshot['stages'].items():
+                histogram = self._stages.get(name)
+                if histogram is None:
+                    histogram = self._stages[name] = Histogram()
+                histogram.buckets = [mine + sign * theirs for mine, theirs in zip(histogram.buckets, buckets)]
+                histogram.sum += sign * total
+                if sign > 0:
+                    histogram.max = max(histogram.max, maximum)
+            for host, (requests, seconds, maximum, slow) in snapshot['hosts'].items():
+                stats = self._hosts.get(host)
+                if stats is None:
+                    stats = self._hosts[host] = HostStats()
+                stats.requests += sign * requests
+                stats.seconds += sign * seconds
+                stats.slow += sign * slow
+                if sign > 0:
+                    stats.max = max(stats.max, maximum)
+                if stats.requests <= 0:
+                    del self._hosts[host]
+
+    def reset(self) -> None:
+        with self._lock:
+            self._clear()
+
+    def _clear(self) -> None:
+        self._counters.clear()
+        self._stages.clear()
+        self._hosts.clear()
+
+    def render(self) -> str:
+        """Return the metrics in the Prometheus text exposition format."""
+        lines = []
+        snapshot = self.snapshot()
+        for name, help_text in COUNTERS.items():
+            lines += [
+                f'# HELP inspector_{name}_total {help_text}',
+                f'# TYPE inspector_{name}_total counter',
+                f"inspector_{name}_total {snapshot['counters'].get(name, 0):g}",
+            ]
+
+        lines += [
+            '# HELP inspector_stage_seconds Time spent per stage of a scan',
+            '# TYPE inspector_stage_seconds histogram',
+        ]
+        for stage, (buckets, total, _) in sorted(snapshot['stages'].items()):
+            cumulative = 0
+            for bound, count in zip(BUCKETS + (float('inf'),), buckets):
+                cumulative += count
+                lines.append(f'inspector_stage_seconds_bucket{{stage="{stage}",le="{bound:g}"}} {cumulative}')
+            lines.append(f'inspector_stage_seconds_sum{{stage="{stage}"}} {total:.6f}')
+            lines.append(f'inspector_stage_seconds_count{{stage="{stage}"}} {cumulative}')
+
+        hosts = self.slowest_hosts()
+        lines += [
+            f'# HELP inspector_host_slow_requests_total Requests slower than {self.slow_request:g}s, per host',
+            '# TYPE inspector_host_slow_requests_total counter',
+        ]
+        lines += [f'inspector_host_slow_requests_total{{host="{_escape(host)}"}} {stats.slow}' for host, stats in hosts]
+        lines += [
+            '# HELP inspector_host_request_seconds_max Longest request, per host',
+            '# TYPE inspector_host_request_seconds_max gauge',
+        ]
+        lines += [f'inspector_host_request_seconds_max{{host="{_escape(host)}"}} {stats.max:.6f}' for host, stats in hosts]
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self, path) -> None:
+        """
+        Write the metrics to a file for the node_exporter textfile collector. The
+        file is replaced atomically, so the collector never reads it half written.
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.metrics-')
+        try:
+            with os.fdopen(fd, 'w') as file:
+                file.write(self.render())
+            os.chmod(temp_path, 0o644)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    def report(self, elapsed: Optional[float] = None) -> str:
+        """Return a readable breakdown of the metrics, e.g. of a run."""
+        lines = [f'Run took {elapsed:.2f}s' if elapsed is not None else 'Metrics']
+        lines.append(f"{'stage':<10}{'count':>9}{'total s':>10}{'mean ms':>10}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+        for stage in STAGES:
+            histogram = self.stage(stage)
+            count = histogram.count
+            if count:
+                lines.append(
+                    f'{stage:<10}{count:>9}{histogram.sum:>10.2f}{histogram.sum / count * 1000:>10.1f}'
+                    f'{histogram.quantile(0.5) * 1000:>10.1f}{histogram.quantile(0.99) * 1000:>10.1f}'
+                    f'{histogram.max * 1000:>10.1f}',
+                )
+
+        for name in COUNTERS:
+            value = self.counter(name)
+            if value:
+                lines.append(f'{name:<24}{value:>12g}')
+
+        hosts = self.slowest_hosts()
+        if hosts:
+            lines.append(f"{'slowest hosts':<40}{'requests':>9}{'total s':>10}{'max s':>9}{'slow':>6}")
+            lines += [
+                f'{host:<40}{stats.requests:>9}{stats.seconds:>10.2f}{stats.max:>9.2f}{stats.slow:>6}'
+                for host, stats in hosts
+            ]
+        return '\n'.join(lines)
+
+
+METRICS = Metrics()
+
+
+def timed(stage: str):
+    """Decorate a function to observe its duration as one ``stage``."""
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with METRICS.time(stage):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def profiled(enabled: bool = True, metrics: Metrics = METRICS):
+    """Print the breakdown of the metrics recorded during the block, when enabled."""
+    if not enabled:
+        yield
+        return
+
+    before = metrics.snapshot()
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        run = Metrics(metrics.slow_request, metrics.top_hosts)
+        run.merge(metrics.snapshot())
+        run.merge(before, sign=-1)
+        print(run.report(time.monotonic() - start))
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.server.metrics.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve_metrics(port: int, metrics: Metrics = METRICS, host: str = '127.0.0.1') -> ThreadingHTTPServer:
+    """
+    Serve the metrics on http://host:port/metrics from a background thread.
+
+    Returns:
+        ThreadingHTTPServer: The server, to shutdown() when done.
+    """
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    server.metrics = metrics
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    return server
@@ -0,0 +1,55 @@
+from alembic import context
+from sqlalchemy import engine_from_config
+from sqlalchemy import pool
+
+from inspector.config import DB_URL
+from inspector.models import Base
+
+
+config = context.config
+target_metadata = Base.metadata
+
+
+def get_url() -> str:
+    return config.get_main_option('sqlalchemy.url') or DB_URL
+
+
+def run_migrations_offline() -> None:
+    """Run migrations in 'offline' mode, emitting SQL to the output."""
+
+    context.configure(
+        url=get_url(),
+        target_metadata=target_metadata,
+        literal_binds=True,
+        render_as_batch=True,
+    )
+
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online() -> None:
+    """Run migrations against the database."""
+
+    connectable = engine_from_config(
+        {'sqlalchemy.url': get_url()},
+        prefix='sqlalchemy.',
+        poolclass=pool.NullPool,
+    )
+
+    with connectable.connect() as connection:
+        # SQLite cannot alter columns in place, batch mode recreates the table.
+        context.configure(
+            connection=connection,
+            target_metadata=target_metadata,
+            render_as_batch=True,
+        )
+
+        with context.begin_transaction():
+            context.run_migrations()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
@@ -0,0 +1,31 @@
+"""Initial url_data table
+
+Revision ID: 0001
+Revises:
+Create Date: 2023-12-08 00:00:00
+"""
+import sqlalchemy as sa
+from alembic import op
+
+
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'url_data',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('url', sa.String(), nullable=False),
+        sa.Column('title', sa.String(), nullable=True),
+        sa.Column('status_code', sa.Integer(), nullable=True),
+        sa.Column('js_hash', sa.String(), nullable=True),
+        sa.Column('content_length', sa.Integer(), nullable=True),
+        sa.Column('added_time', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('url_data')
@@ -0,0 +1,118 @@
+"""Move js_hash strings to a js_assets table
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 00:00:00
+"""
+import re
+from datetime import datetime
+from datetime import timezone
+
+import sqlalchemy as sa
+from alembic import op
+
+
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+# A legacy js_hash value is 'url|md5,url|md5'. Anchoring on the MD5 keeps URLs
+# containing ',' or '|' in one piece.
+LEGACY_PAIR = re.compile(r'(.+?)\|([0-9a-f]{32})(?:,|$)')
+
+url_data = sa.table(
+    'url_data',
+    sa.column('id', sa.Integer),
+    sa.column('js_hash', sa.String),
+    sa.column('track_js', sa.Boolean),
+)
+js_assets = sa.table(
+    'js_assets',
+    sa.column('id', sa.Integer),
+    sa.column('url_data_id', sa.Integer),
+    sa.column('url', sa.String),
+    sa.column('hash', sa.String),
+    sa.column('size', sa.Integer),
+    sa.column('first_seen', sa.DateTime),
+    sa.column('last_seen', sa.DateTime),
+    sa.column('last_changed', sa.DateTime),
+)
+
+
+def upgrade() -> None:
+    op.create_table(
+        'js_assets',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column(
+            'url_data_id', sa.Integer(),
+            sa.ForeignKey('url_data.id', ondelete='CASCADE'), nullable=False,
+        ),
+        sa.Column('url', sa.String(), nullable=False),
+        sa.Column('hash', sa.String(), nullable=False),
+        sa.Column('size', sa.Integer(), nullable=True),
+        sa.Column('first_seen', sa.DateTime(), nullable=False),
+        sa.Column('last_seen', sa.DateTime(), nullable=False),
+        sa.Column('last_changed', sa.DateTime(), nullable=False),
+        sa.UniqueConstraint('url_data_id', 'url', name='uq_js_assets_url_data_id_url'),
+    )
+    op.create_index('ix_js_assets_url', 'js_assets', ['url'])
+    op.create_index('ix_js_assets_hash', 'js_assets', ['hash'])
+
+    with op.batch_alter_table('url_data') as batch_op:
+        batch_op.add_column(
+            sa.Column('track_js', sa.Boolean(), nullable=False, server_default='0'),
+        )
+
+    connection = op.get_bind()
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    rows = connection.execute(
+        sa.select(url_data.c.id, url_data.c.js_hash).where(url_data.c.js_hash.isnot(None)),
+    ).fetchall()
+
+    assets = []
+    for url_data_id, js_hash in rows:
+        seen = set()
+        for url, md5 in LEGACY_PAIR.findall(js_hash):
+            if url not in seen:
+                seen.add(url)
+                assets.append({
+                    'url_data_id': url_data_id, 'url': url, 'hash': md5, 'size': None,
+                    'first_seen': now, 'last_seen': now, 'last_changed': now,
+                })
+
+    connection.execute(
+        url_data.update().where(url_data.c.js_hash.isnot(None)).values(track_js=True),
+    )
+    if assets:
+        op.bulk_insert(js_assets, assets)
+
+    with op.batch_alter_table('url_data') as batch_op:
+        batch_op.drop_column('js_hash')
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('url_data') as batch_op:
+        batch_op.add_column(sa.Column('js_hash', sa.String(), nullable=True))
+
+    connection = op.get_bind()
+    tracked = connection.execute(
+        sa.select(url_data.c.id).where(url_data.c.track_js.is_(True)),
+    ).scalars().all()
+    for url_data_id in tracked:
+        pairs = connection.execute(
+            sa.select(js_assets.c.url, js_assets.c.hash)
+            .where(js_assets.c.url_data_id == url_data_id)
+            .order_by(js_assets.c.id),
+        ).fetchall()
+        connection.execute(
+            url_data.update().where(url_data.c.id == url_data_id)
+            .values(js_hash=','.join(f'{url}|{md5}' for url, md5 in pairs)),
+        )
+
+    with op.batch_alter_table('url_data') as batch_op:
+        batch_op.drop_column('track_js')
+
+    op.drop_index('ix_js_assets_hash', table_name='js_assets')
+    op.drop_index('ix_js_assets_url', table_name='js_assets')
+    op.drop_table('js_assets')
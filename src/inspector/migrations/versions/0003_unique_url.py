@@ -0,0 +1,33 @@
+"""Add a unique index on url_data.url
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 00:00:01
+"""
+import sqlalchemy as sa
+from alembic import op
+
+
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+url_data = sa.table('url_data', sa.column('id', sa.Integer), sa.column('url', sa.String))
+js_assets = sa.table('js_assets', sa.column('url_data_id', sa.Integer))
+
+
+def upgrade() -> None:
+    # Keep the first record of each URL, the one queries.get() returned so far.
+    kept = sa.select(sa.func.min(url_data.c.id)).group_by(url_data.c.url)
+    duplicates = sa.select(url_data.c.id).where(url_data.c.id.not_in(kept))
+
+    connection = op.get_bind()
+    connection.execute(js_assets.delete().where(js_assets.c.url_data_id.in_(duplicates)))
+    connection.execute(url_data.delete().where(url_data.c.id.in_(duplicates)))
+
+    op.create_index('ix_url_data_url', 'url_data', ['url'], unique=True)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_url_data_url', table_name='url_data')
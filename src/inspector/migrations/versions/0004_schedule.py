@@ -0,0 +1,34 @@
+"""Add the scheduling columns of url_data
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 00:00:02
+"""
+import sqlalchemy as sa
+from alembic import op
+
+
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table('url_data') as batch_op:
+        batch_op.add_column(sa.Column('check_interval', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('min_interval', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('max_interval', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('next_due', sa.DateTime(), nullable=True))
+        batch_op.add_column(sa.Column('last_checked', sa.DateTime(), nullable=True))
+    op.create_index('ix_url_data_next_due', 'url_data', ['next_due'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_url_data_next_due', table_name='url_data')
+    with op.batch_alter_table('url_data') as batch_op:
+        batch_op.drop_column('last_checked')
+        batch_op.drop_column('next_due')
+        batch_op.drop_column('max_interval')
+        batch_op.drop_column('min_interval')
+        batch_op.drop_column('check_interval')
@@ -0,0 +1,24 @@
+"""Add the content fingerprint column of url_data
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18 00:00:03
+"""
+import sqlalchemy as sa
+from alembic import op
+
+
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table('url_data') as batch_op:
+        batch_op.add_column(sa.Column('fingerprint', sa.String(), nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('url_data') as batch_op:
+        batch_op.drop_column('fingerprint')
@@ -0,0 +1,87 @@
+"""Add the observations table, the history of the monitored fields
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18 00:00:04
+"""
+from datetime import datetime
+from datetime import timezone
+
+import sqlalchemy as sa
+from alembic import op
+
+
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+# The monitored fields of url_data, whose current values start the history.
+HISTORY_FIELDS = ('status_code', 'title', 'content_length', 'fingerprint')
+
+url_data = sa.table(
+    'url_data',
+    sa.column('id', sa.Integer),
+    sa.column('status_code', sa.Integer),
+    sa.column('title', sa.String),
+    sa.column('content_length', sa.Integer),
+    sa.column('fingerprint', sa.String),
+    sa.column('added_time', sa.DateTime),
+)
+js_assets = sa.table(
+    'js_assets',
+    sa.column('url_data_id', sa.Integer),
+    sa.column('url', sa.String),
+    sa.column('hash', sa.String),
+    sa.column('last_changed', sa.DateTime),
+)
+observations = sa.table(
+    'observations',
+    sa.column('url_data_id', sa.Integer),
+    sa.column('observed_at', sa.DateTime),
+    sa.column('field', sa.String),
+    sa.column('asset_url', sa.String),
+    sa.column('value', sa.String),
+)
+
+
+def upgrade() -> None:
+    op.create_table(
+        'observations',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column(
+            'url_data_id', sa.Integer(),
+            sa.ForeignKey('url_data.id', ondelete='CASCADE'), nullable=False,
+        ),
+        sa.Column('observed_at', sa.DateTime(), nullable=False),
+        sa.Column('field', sa.String(), nullable=False),
+        sa.Column('asset_url', sa.String(), nullable=True),
+        sa.Column('value', sa.String(), nullable=True),
+    )
+    op.create_index(
+        'ix_observations_url_data_id_observed_at', 'observations', ['url_data_id', 'observed_at'],
+    )
+
+    # The history starts with the values known today, when they were last set.
+    connection = op.get_bind()
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    rows = []
+    for record in connection.execute(sa.select(url_data)).mappings():
+        for field in HISTORY_FIELDS:
+            if record[field] is not None:
+                rows.append({
+                    'url_data_id': record['id'], 'observed_at': record['added_time'] or now,
+                    'field': field, 'asset_url': None, 'value': str(record[field]),
+                })
+    for url_data_id, url, md5, last_changed in connection.execute(sa.select(js_assets)):
+        rows.append({
+            'url_data_id': url_data_id, 'observed_at': last_changed,
+            'field': 'js', 'asset_url': url, 'value': md5,
+        })
+    if rows:
+        op.bulk_insert(observations, rows)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_observations_url_data_id_observed_at', table_name='observations')
+    op.drop_table('observations')
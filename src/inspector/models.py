@@ -1,8 +1,13 @@
+from sqlalchemy import Boolean
 from sqlalchemy import Column
 from sqlalchemy import DateTime
+from sqlalchemy import ForeignKey
+from sqlalchemy import Index
 from sqlalchemy import Integer
 from sqlalchemy import String
+from sqlalchemy import UniqueConstraint
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 
 
@@ -14,17 +19,91 @@ class UrlData(Base):
     __tablename__ = 'url_data'
 
     id = Column(Integer, primary_key=True)
-    url = Column(String, nullable=False)
+    url = Column(String, nullable=False, unique=True, index=True)
 
     title = Column(String, default=None)
     status_code = Column(Integer, default=None)
-    js_hash = Column(String, default=None)
+    track_js = Column(Boolean, nullable=False, default=False, server_default='0')
     content_length = Column(Integer, default=None)
+    fingerprint = Column(String, default=None)
+    check_interval = Column(Integer, default=None)
+    min_interval = Column(Integer, default=None)
+    max_interval = Column(Integer, default=None)
+    next_due = Column(DateTime, default=None, index=True)
+    last_checked = Column(DateTime, default=None)
     added_time = Column(
         DateTime,
         server_default=func.now(),
         server_onupdate=func.now(),
     )
 
+    js_assets = relationship(
+        'JsAsset',
+        back_populates='url_data',
+        cascade='all, delete-orphan',
+        order_by='JsAsset.id',
+    )
+    observations = relationship(
+        'Observation',
+        back_populates='url_data',
+        cascade='all, delete-orphan',
+        order_by='Observation.id',
+    )
+
     def __repr__(self):
         return f"<UrlData(url='{self.url}')>"
+
+
+class JsAsset(Base):
+
+    __tablename__ = 'js_assets'
+    __table_args__ = (
+        UniqueConstraint('url_data_id', 'url', name='uq_js_assets_url_data_id_url'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    url_data_id = Column(
+        Integer,
+        ForeignKey('url_data.id', ondelete='CASCADE'),
+        nullable=False,
+    )
+    url = Column(String, nullable=False, index=True)
+    hash = Column(String, nullable=False, index=True)
+    size = Column(Integer, default=None)
+    first_seen = Column(DateTime, nullable=False)
+    last_seen = Column(DateTime, nullable=False)
+    last_changed = Column(DateTime, nullable=False)
+
+    url_data = relationship('UrlData', back_populates='js_assets')
+
+    def __repr__(self):
+        return f"<JsAsset(url='{self.url}', hash='{self.hash}')>"
+
+
+class Observation(Base):
+    """
+    An observed value of a monitored field of a UrlData record, appended each
+    time it changes. The JS files are observed as the 'js' field: the value is
+    the MD5 hash of the file at ``asset_url``, None once it is no longer loaded.
+    """
+
+    __tablename__ = 'observations'
+    __table_args__ = (
+        Index('ix_observations_url_data_id_observed_at', 'url_data_id', 'observed_at'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    url_data_id = Column(
+        Integer,
+        ForeignKey('url_data.id', ondelete='CASCADE'),
+        nullable=False,
+    )
+    observed_at = Column(DateTime, nullable=False)
+    field = Column(String, nullable=False)
+    asset_url = Column(String, default=None)
+    value = Column(String, default=None)
+
+    url_data = relationship('UrlData', back_populates='observations')
+
+    def __repr__(self):
+        return f"<Observation(field='{self.field}', value='{self.value}')>"
@@ -0,0 +1,136 @@
+import multiprocessing
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing.util import Finalize
+from typing import Optional
+
+from .analysis import analyze
+from .analysis import PageAnalysis
+from .config import get_logger
+from .config import HTML_PARSER
+from .config import PARSE_MIN_SIZE
+from .config import PARSE_WORKERS
+
+
+logger = get_logger()
+
+# Memory-backed file system where the pages are handed to the workers, when there is one.
+SHARED_MEMORY_DIR = '/dev/shm'
+
+
+def _analyze_file(path: str, encoding: Optional[str], parser: str, fingerprint: bool = False) -> PageAnalysis:
+    """Analyze a page written to a file, in a worker process."""
+    with open(path, 'rb') as file:
+        content = file.read()
+    # Decoded as requests' Response.text does.
+    try:
+        text = str(content, encoding, errors='replace')
+    except (LookupError, TypeError):
+        text = str(content, errors='replace')
+    return analyze(text, parser=parser, fingerprint=fingerprint)
+
+
+class ParserPool:
+    """
+    ParserPool analyzes pages in worker processes, so parsing runs on several
+    cores while the threads of the scan keep fetching.
+
+    A page is handed to a worker as a file in a memory-backed directory
+    (/dev/shm when available), rather than pickled through the pipe of the
+    pool, and only its analysis comes back. Pages smaller than ``min_size``
+    bytes cost less to parse than to hand over, and are parsed in the
+    calling thread, as are all pages with no workers. The workers are
+    started with the first page handed over. If a worker dies, the page is
+    parsed in the calling thread and the next page starts a new pool.
+
+    Usage Example:
+        with ParserPool(workers=4) as pool:
+            analysis = pool.analyze(response)
+    """
+
+    def __init__(
+        self,
+        workers: int = PARSE_WORKERS,
+        min_size: int = PARSE_MIN_SIZE,
+        parser: str = HTML_PARSER,
+        spool_dir: Optional[str] = None,
+    ) -> None:
+
+        self.workers = max(0, workers)
+        self.min_size = min_size
+        self.parser = parser
+        if spool_dir is None and os.access(SHARED_MEMORY_DIR, os.W_OK):
+            spool_dir = SHARED_MEMORY_DIR
+        self.spool_dir = spool_dir
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def analyze(self, response, fingerprint: bool = False) -> PageAnalysis:
+        """
+        Return the analysis of the page of a response, read to its end, with
+        its fingerprint when ``fingerprint`` is set.
+        """
+        content = response.content
+        if not self.workers or len(content) < self.min_size:
+            return analyze(response.text, parser=self.parser, fingerprint=fingerprint)
+
+        encoding = response.encoding or response.apparent_encoding
+        fd, path = tempfile.mkstemp(dir=self.spool_dir, prefix='inspector-page-')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                file.write(content)
+            executor = self._get_executor()
+            try:
+                return executor.submit(_analyze_file, path, encoding, self.parser, fingerprint).result()
+            except BrokenProcessPool:
+                logger.warning('A page parser process died, restarting the pool')
+                with self._lock:
+                    if self._executor is executor:
+                        self._executor = None
+                return _analyze_file(path, encoding, self.parser, fingerprint)
+        finally:
+            os.remove(path)
+
+    def close(self) -> None:
+        """
+        Stop the worker processes. The pool can still be used, it starts new ones.
+        """
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # Forking would copy the locks held by the threads of the scan.
+                self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+            return self._executor
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+_default_pool: Optional[ParserPool] = None
+_default_lock = threading.Lock()
+
+
+def get_parser_pool() -> ParserPool:
+    """
+    Return the process-wide default ParserPool, creating it on first use.
+    """
+    global _default_pool
+    with _default_lock:
+        if _default_pool is None:
+            _default_pool = ParserPool()
+            # At exit, a process started by multiprocessing, e.g. a scan worker,
+            # waits for its children before running the atexit callbacks. The
+            # pool is closed before, and before the queues of the pool (priority 10).
+            Finalize(_default_pool, _default_pool.close, exitpriority=100)
+        return _default_pool
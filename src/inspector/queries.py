@@ -1,14 +1,151 @@
+import random
+import time
+from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
+from typing import Any
+from typing import Dict
+from typing import Iterator
 from typing import List
+from typing import NamedTuple
 from typing import Optional
+from typing import Tuple
 
+from sqlalchemy import bindparam
+from sqlalchemy import delete
+from sqlalchemy import func
+from sqlalchemy import insert
+from sqlalchemy import inspect
+from sqlalchemy import or_
+from sqlalchemy import select
+from sqlalchemy import update
 from sqlalchemy.ext.declarative import DeclarativeMeta
+from sqlalchemy.orm import selectinload
 
+from .config import DB_BATCH_SIZE
 from .config import get_logger
+from .config import SCHEDULE_DEFAULT_INTERVAL
+from .masking import asset_name
+from .metrics import METRICS
+from .metrics import timed
+from .models import JsAsset
+from .models import Observation
 from .models import UrlData
+from .schedule import next_check
 
 
 logger = get_logger()
 
+# The fields of a record whose changes are appended to its history, see
+# Observation. The JS files are observed as the JS_FIELD field.
+HISTORY_FIELDS = ('status_code', 'title', 'content_length', 'fingerprint')
+JS_FIELD = 'js'
+
+
+class JsAssetChanges(NamedTuple):
+    changed: List[str]
+    added: List[str]
+    removed: List[str]
+    # The former URL of the JS files loaded under a new name, keyed by their new URL.
+    renamed: Dict[str, str]
+
+
+class MonitoredUrl(NamedTuple):
+    """
+    A UrlData row as read by the scheduled scan. A field is monitored when it
+    is not None, and ``js_assets`` maps each known JS URL to its hash. The
+    content is monitored with ``content_length``, and compared by ``fingerprint``.
+    """
+    id: int
+    url: str
+    title: Optional[str]
+    status_code: Optional[int]
+    content_length: Optional[int]
+    track_js: bool
+    js_assets: Dict[str, str]
+    check_interval: Optional[int] = None
+    min_interval: Optional[int] = None
+    max_interval: Optional[int] = None
+    fingerprint: Optional[str] = None
+
+
+class Snapshot(NamedTuple):
+    """
+    The state of a record at a point in time, rebuilt from its history:
+    the value of each observed field, as text, and the hash of each JS file.
+    """
+    fields: Dict[str, Optional[str]]
+    js_assets: Dict[str, str]
+
+
+MONITORED_COLUMNS = (
+    UrlData.id, UrlData.url, UrlData.title, UrlData.status_code,
+    UrlData.content_length, UrlData.track_js, UrlData.check_interval,
+    UrlData.min_interval, UrlData.max_interval, UrlData.fingerprint,
+)
+
+
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _text(value: Any) -> Optional[str]:
+    return None if value is None else str(value)
+
+
+def field_observations(url_data_id: int, values: Dict[str, Any], now: datetime) -> List[Dict[str, Any]]:
+    """Return the observations rows of the monitored fields set by column values."""
+    return [
+        {'url_data_id': url_data_id, 'observed_at': now, 'field': field, 'asset_url': None, 'value': _text(values[field])}
+        for field in HISTORY_FIELDS if field in values
+    ]
+
+
+def js_observations(changes: JsAssetChanges, js_files: Dict[str, tuple]) -> List[Tuple[str, Optional[str]]]:
+    """
+    Return the (URL, hash) observations of JS asset changes, the hash being
+    None for the JS files no longer loaded, including the former URL of the
+    renamed ones.
+    """
+    observed = [(url, js_files[url][0]) for url in changes.added]
+    observed.extend((url, js_files[url][0]) for url in changes.renamed)
+    observed.extend((url, js_files[url][0]) for url in changes.changed if url not in changes.renamed)
+    observed.extend((url, None) for url in changes.removed)
+    observed.extend((old_url, None) for old_url in changes.renamed.values())
+    return observed
+
+
+def diff_js_assets(current: Dict[str, str], js_files: Dict[str, tuple]) -> JsAssetChanges:
+    """
+    Diff the known JS assets of a page, URL to hash, with the JS files found on it.
+
+    A JS file added with the same asset_name() as a removed one, e.g. a webpack
+    chunk whose content hash changed, is a new build of the removed file: it is
+    renamed, and changed only if its content changed.
+
+    Returns:
+        JsAssetChanges: The URLs of the changed and removed JS files, sorted,
+            of the added ones, in page order, and of the renamed ones.
+    """
+    added = [url for url in js_files if url not in current]
+    removed = sorted(current.keys() - js_files.keys())
+    renamed = {}
+    if added and removed:
+        former = {}
+        for url in removed:
+            former.setdefault(asset_name(url), []).append(url)
+        for url in added:
+            urls = former.get(asset_name(url))
+            if urls:
+                renamed[url] = urls.pop(0)
+        if renamed:
+            added = [url for url in added if url not in renamed]
+            removed = sorted(set(removed).difference(renamed.values()))
+
+    changed = [url for url in current.keys() & js_files.keys() if current[url] != js_files[url][0]]
+    changed.extend(url for url, old_url in renamed.items() if current[old_url] != js_files[url][0])
+    return JsAssetChanges(changed=sorted(changed), added=added, removed=removed, renamed=renamed)
+
 
 class UrlDataQueries:
     """Class for querying UrlData database model."""
@@ -30,6 +167,7 @@ class UrlDataQueries:
         """
 
         self.session.add(url_data)
+        self._observe_fields(url_data)
         self.session.commit()
         logger.info(f'Added new UrlData {url_data.id}')
         return url_data
@@ -59,6 +197,7 @@ class UrlDataQueries:
         """
 
         self.session.add(url_data)
+        self._observe_fields(url_data)
         self.session.commit()
 
         logger.info(f'Updated UrlData {url_data.id}')
@@ -91,7 +230,7 @@ class UrlDataQueries:
             list[UrlData]: A list of all UrlData objects in the database.
         """
 
-        url_data = self.session.query(UrlData).all()
+        url_data = self.session.query(UrlData).options(selectinload(UrlData.js_assets)).all()
 
         data = []
         for u in url_data:
@@ -100,9 +239,483 @@ class UrlDataQueries:
                 'url': u.url,
                 'title': str(u.title),
                 'status_code': str(u.status_code),
-                'js_hash': str(u.js_hash),
+                'track_js': u.track_js,
+                'js_assets': [asset.url for asset in u.js_assets],
                 'content_length': str(u.content_length),
                 'added_time': str(u.added_time),
             })
 
         return data
+
+    def get_by_js_asset(self, url_or_hash: str) -> List[DeclarativeMeta]:
+        """
+        Retrieve the UrlData records loading a JS file.
+
+        Args:
+            url_or_hash (str): The URL of the JS file, or the MD5 hash of its content.
+
+        Returns:
+            list[UrlData]: The UrlData objects whose page loads the JS file.
+        """
+
+        return (
+            self.session.query(UrlData)
+            .join(UrlData.js_assets)
+            .filter(or_(JsAsset.url == url_or_hash, JsAsset.hash == url_or_hash))
+            .distinct()
+            .order_by(UrlData.url)
+            .all()
+        )
+
+    def sync_js_assets(
+        self,
+        url_data: DeclarativeMeta,
+        js_files: Dict[str, tuple],
+        now: Optional[datetime] = None,
+    ) -> JsAssetChanges:
+        """
+        Replace the JS assets of a UrlData record with the JS files found on its page.
+
+        Assets are diffed by URL with set operations: new URLs are added, missing
+        ones are deleted, renamed ones take their new URL, and the hash, size and
+        timestamps of the others are updated. The changes are appended to the
+        history of the record, and not committed.
+
+        Args:
+            url_data (DeclarativeMeta): The UrlData object whose assets are synced.
+            js_files (dict): The (hash, size) of each JS file, keyed by URL.
+            now (datetime): The time the JS files were seen, defaults to now (UTC).
+
+        Returns:
+            JsAssetChanges: The URLs of the changed, added and removed JS files.
+        """
+
+        now = now or utcnow()
+        current = {asset.url: asset for asset in url_data.js_assets}
+        changes = diff_js_assets({url: asset.hash for url, asset in current.items()}, js_files)
+
+        for url in changes.removed:
+            url_data.js_assets.remove(current[url])
+
+        for url, old_url in changes.renamed.items():
+            current[url] = current.pop(old_url)
+            current[url].url = url
+
+        for url in current.keys() & js_files.keys():
+            asset = current[url]
+            js_hash, size = js_files[url]
+            if asset.hash != js_hash:
+                asset.hash = js_hash
+                asset.last_changed = now
+            if size is not None:
+                asset.size = size
+            asset.last_seen = now
+
+        for url in changes.added:
+            js_hash, size = js_files[url]
+            url_data.js_assets.append(
+                JsAsset(url=url, hash=js_hash, size=size, first_seen=now, last_seen=now, last_changed=now),
+            )
+
+        for url, js_hash in js_observations(changes, js_files):
+            self.session.add(
+                Observation(url_data=url_data, observed_at=now, field=JS_FIELD, asset_url=url, value=js_hash),
+            )
+        return changes
+
+    def history(self, url_data_id: int, end: Optional[datetime] = None) -> List[DeclarativeMeta]:
+        """
+        Return the history of a record, oldest first.
+
+        Args:
+            url_data_id (int): The id of the record.
+            end (datetime): Only return the observations made until this time (UTC).
+
+        Returns:
+            list[Observation]: The observed values of its fields and JS files.
+        """
+
+        query = self.session.query(Observation).filter(Observation.url_data_id == url_data_id)
+        if end is not None:
+            query = query.filter(Observation.observed_at <= end)
+        return query.order_by(Observation.observed_at, Observation.id).all()
+
+    def state_at(self, url_data_id: int, when: datetime) -> Snapshot:
+        """
+        Rebuild the state of a record at a point in time (UTC) from its history.
+        """
+
+        fields: Dict[str, Optional[str]] = {}
+        js_assets: Dict[str, str] = {}
+        for observation in self.history(url_data_id, end=when):
+            if observation.field != JS_FIELD:
+                fields[observation.field] = observation.value
+            elif observation.value is None:
+                js_assets.pop(observation.asset_url, None)
+            else:
+                js_assets[observation.asset_url] = observation.value
+        return Snapshot(fields, js_assets)
+
+    def iter_monitored(
+        self,
+        chunk_size: int = DB_BATCH_SIZE,
+        due_before: Optional[datetime] = None,
+        limit: Optional[int] = None,
+    ) -> Iterator[MonitoredUrl]:
+        """
+        Stream the UrlData records to scan, reading them in chunks.
+
+        Only the monitored columns are selected, without building ORM objects,
+        and the JS assets of each chunk are loaded with one query.
+
+        Args:
+            chunk_size (int): The number of rows fetched at once.
+            due_before (datetime): Only stream the records due for a check at this
+                time, the most overdue first. Unscheduled records are due.
+            limit (int): The maximum number of records to stream.
+
+        Yields:
+            MonitoredUrl: The record to scan, with its known JS assets.
+        """
+
+        query = select(*MONITORED_COLUMNS)
+        if due_before is None:
+            query = query.order_by(UrlData.id)
+        else:
+            query = (
+                query.where(or_(UrlData.next_due.is_(None), UrlData.next_due <= due_before))
+                .order_by(UrlData.next_due.is_not(None), UrlData.next_due, UrlData.id)
+            )
+        if limit is not None:
+            query = query.limit(limit)
+
+        # The time spent by the caller between two chunks is not read time.
+        start = time.perf_counter()
+        result = self.session.execute(query.execution_options(yield_per=chunk_size))
+        for rows in result.partitions():
+            records = list(self._monitored(rows))
+            METRICS.observe('db_read', time.perf_counter() - start)
+            yield from records
+            start = time.perf_counter()
+
+    @timed('db_read')
+    def find_monitored(self, urls: List[str], chunk_size: int = DB_BATCH_SIZE) -> Dict[str, MonitoredUrl]:
+        """
+        Return the records of the given URLs that exist, keyed by URL.
+
+        The URLs are looked up ``chunk_size`` at a time, with their JS assets.
+        """
+
+        found = {}
+        for start in range(0, len(urls), chunk_size):
+            rows = self.session.execute(
+                select(*MONITORED_COLUMNS).where(UrlData.url.in_(urls[start:start + chunk_size])),
+            ).all()
+            found.update((record.url, record) for record in self._monitored(rows))
+        return found
+
+    @timed('db_write')
+    def insert_many(self, rows: List[Dict[str, Any]]) -> Dict[str, int]:
+        """
+        Insert UrlData records in one transaction, with one executemany.
+
+        All rows must have the same keys.
+
+        Returns:
+            dict: The id of each inserted record, keyed by URL.
+        """
+
+        if not rows:
+            return {}
+        try:
+            result = self.session.execute(insert(UrlData).returning(UrlData.id, UrlData.url), rows)
+            ids = {url: url_data_id for url_data_id, url in result}
+            now = utcnow()
+            observed = [
+                observation
+                for row in rows
+                for observation in field_observations(ids[row['url']], row, now)
+                if observation['value'] is not None
+            ]
+            if observed:
+                self.session.execute(insert(_observations), observed)
+            self.session.commit()
+        except Exception:
+            self.session.rollback()
+            raise
+        METRICS.inc('db_rows_written', len(ids))
+        logger.info(f'Added {len(ids)} new UrlData records')
+        return ids
+
+    def _observe_fields(self, url_data: DeclarativeMeta) -> None:
+        """Append the monitored fields of a record changed since it was loaded to its history."""
+        now = utcnow()
+        state = inspect(url_data)
+        for field in HISTORY_FIELDS:
+            history = state.attrs[field].history
+            if not history.added:
+                continue
+            value = history.added[0]
+            if value != (history.deleted[0] if history.deleted else None):
+                self.session.add(Observation(url_data=url_data, observed_at=now, field=field, value=_text(value)))
+
+    def _monitored(self, rows) -> Iterator[MonitoredUrl]:
+        assets = self._js_assets_of([row.id for row in rows if row.track_js])
+        for row in rows:
+            yield MonitoredUrl(
+                id=row.id,
+                url=row.url,
+                title=row.title,
+                status_code=row.status_code,
+                content_length=row.content_length,
+                track_js=bool(row.track_js),
+                js_assets=assets.get(row.id, {}),
+                check_interval=row.check_interval,
+                min_interval=row.min_interval,
+                max_interval=row.max_interval,
+                fingerprint=row.fingerprint,
+            )
+
+    def _js_assets_of(self, url_data_ids: List[int]) -> Dict[int, Dict[str, str]]:
+        assets: Dict[int, Dict[str, str]] = {url_data_id: {} for url_data_id in url_data_ids}
+        if url_data_ids:
+            rows = self.session.execute(
+                select(JsAsset.url_data_id, JsAsset.url, JsAsset.hash)
+                .where(JsAsset.url_data_id.in_(url_data_ids))
+                .order_by(JsAsset.id),
+            )
+            for url_data_id, url, js_hash in rows:
+                assets[url_data_id][url] = js_hash
+        return assets
+
+    def spread_unscheduled(self, interval: int = SCHEDULE_DEFAULT_INTERVAL, now: Optional[datetime] = None) -> int:
+        """
+        Schedule the records that have no next check at a random time within
+        ``interval`` seconds, so new records do not come due all at once.
+
+        Returns:
+            int: The number of records scheduled.
+        """
+
+        now = now or utcnow()
+        ids = self.session.execute(select(UrlData.id).where(UrlData.next_due.is_(None))).scalars().all()
+        if ids:
+            self.session.execute(
+                update(UrlData.__table__).where(UrlData.__table__.c.id == bindparam('b_id'))
+                .values(next_due=bindparam('b_next_due')),
+                [
+                    {'b_id': url_data_id, 'b_next_due': now + timedelta(seconds=random.uniform(0, interval))}
+                    for url_data_id in ids
+                ],
+            )
+            self.session.commit()
+        return len(ids)
+
+    def postpone(self, url_data_ids: List[int], seconds: float, now: Optional[datetime] = None) -> None:
+        """
+        Push back the next check of records, e.g. while they are being scanned,
+        so a record whose scan fails is only retried after ``seconds``.
+        """
+
+        now = now or utcnow()
+        if url_data_ids:
+            self.session.execute(
+                update(UrlData).where(UrlData.id.in_(url_data_ids))
+                .values(next_due=now + timedelta(seconds=seconds)),
+            )
+            self.session.commit()
+
+    def next_due(self) -> Optional[datetime]:
+        """
+        Return the time of the next scheduled check, or None if no record is scheduled.
+        """
+
+        return self.session.execute(select(func.min(UrlData.next_due))).scalar()
+
+    def bulk_updater(self, batch_size: int = DB_BATCH_SIZE) -> 'BulkUpdater':
+        """
+        Return a BulkUpdater writing to this session.
+        """
+
+        return BulkUpdater(self.session, batch_size)
+
+
+_js_assets = JsAsset.__table__
+_observations = Observation.__table__
+
+UPDATE_CHANGED_ASSET = (
+    update(_js_assets)
+    .where(_js_assets.c.url_data_id == bindparam('b_url_data_id'), _js_assets.c.url == bindparam('b_url'))
+    .values(
+        hash=bindparam('b_hash'),
+        size=func.coalesce(bindparam('b_size'), _js_assets.c.size),
+        last_seen=bindparam('b_now'),
+        last_changed=bindparam('b_now'),
+    )
+)
+UPDATE_SEEN_ASSET = (
+    update(_js_assets)
+    .where(_js_assets.c.url_data_id == bindparam('b_url_data_id'), _js_assets.c.url == bindparam('b_url'))
+    .values(
+        size=func.coalesce(bindparam('b_size'), _js_assets.c.size),
+        last_seen=bindparam('b_now'),
+    )
+)
+RENAME_ASSET = (
+    update(_js_assets)
+    .where(_js_assets.c.url_data_id == bindparam('b_url_data_id'), _js_assets.c.url == bindparam('b_old_url'))
+    .values(url=bindparam('b_url'))
+)
+DELETE_ASSET = (
+    delete(_js_assets)
+    .where(_js_assets.c.url_data_id == bindparam('b_url_data_id'), _js_assets.c.url == bindparam('b_url'))
+)
+
+
+class BulkUpdater:
+    """
+    BulkUpdater applies the updates of a scan in batched transactions.
+
+    Column updates and JS asset changes are queued, then written every
+    ``batch_size`` records with one executemany per statement and a single
+    commit, instead of loading, updating and committing each record. The
+    changes of the monitored fields and JS files are appended to the history.
+
+    Usage Example:
+        with queries.bulk_updater() as updater:
+            updater.update(record.id, {'title': 'New title'})
+            updater.sync_js_assets(record, js_files)
+    """
+
+    def __init__(self, session, batch_size: int = DB_BATCH_SIZE) -> None:
+
+        self.session = session
+        self.batch_size = max(1, batch_size)
+        self.written = 0
+        self._records = set()
+        self._updates: Dict[int, Dict[str, Any]] = {}
+        self._inserted: List[Dict[str, Any]] = []
+        self._renamed: List[Dict[str, Any]] = []
+        self._changed: List[Dict[str, Any]] = []
+        self._seen: List[Dict[str, Any]] = []
+        self._deleted: List[Dict[str, Any]] = []
+        self._observed: List[Dict[str, Any]] = []
+        self._validators: List[Tuple[Any, List[tuple]]] = []
+
+    def __enter__(self) -> 'BulkUpdater':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.flush()
+
+    def update(self, url_data_id: int, values: Dict[str, Any]) -> None:
+        """
+        Queue an update of the columns of a UrlData record.
+        """
+        if values:
+            self._updates.setdefault(url_data_id, {'id': url_data_id}).update(values)
+            self._observed.extend(field_observations(url_data_id, values, utcnow()))
+            self._queued(url_data_id)
+
+    def reschedule(self, record: MonitoredUrl, changed: bool, now: Optional[datetime] = None) -> None:
+        """
+        Queue the next check of a record, sooner if it changed, later otherwise.
+        """
+        now = now or utcnow()
+        interval, next_due = next_check(record, changed, now)
+        self.update(record.id, {'check_interval': interval, 'next_due': next_due, 'last_checked': now})
+
+    def sync_js_assets(
+        self,
+        record: MonitoredUrl,
+        js_files: Dict[str, tuple],
+        now: Optional[datetime] = None,
+    ) -> JsAssetChanges:
+        """
+        Queue the changes turning the known JS assets of a record into the JS files
+        found on its page. Same as UrlDataQueries.sync_js_assets, without ORM objects.
+
+        Returns:
+            JsAssetChanges: The URLs of the changed, added and removed JS files.
+        """
+        now = now or utcnow()
+        changes = diff_js_assets(record.js_assets, js_files)
+        changed = set(changes.changed)
+
+        for url in changes.added:
+            js_hash, size = js_files[url]
+            self._inserted.append({
+                'url_data_id': record.id, 'url': url, 'hash': js_hash, 'size': size,
+                'first_seen': now, 'last_seen': now, 'last_changed': now,
+            })
+        for url, old_url in changes.renamed.items():
+            self._renamed.append({'b_url_data_id': record.id, 'b_old_url': old_url, 'b_url': url})
+        for url in (record.js_assets.keys() & js_files.keys()) | changes.renamed.keys():
+            js_hash, size = js_files[url]
+            params = {'b_url_data_id': record.id, 'b_url': url, 'b_size': size, 'b_now': now}
+            if url in changed:
+                self._changed.append({**params, 'b_hash': js_hash})
+            else:
+                self._seen.append(params)
+        for url in changes.removed:
+            self._deleted.append({'b_url_data_id': record.id, 'b_url': url})
+        for url, js_hash in js_observations(changes, js_files):
+            self._observed.append({
+                'url_data_id': record.id, 'observed_at': now, 'field': JS_FIELD, 'asset_url': url, 'value': js_hash,
+            })
+
+        self._queued(record.id)
+        return changes
+
+    def remember(self, url_data_id: int, cache, entries: List[tuple]) -> None:
+        """
+        Queue the HTTP validators a record was fetched with, stored in ``cache``,
+        a ValidatorCache, only once the changes of the record are committed.
+        """
+        if entries and cache is not None:
+            self._validators.append((cache, entries))
+            self._queued(url_data_id)
+
+    def flush(self) -> None:
+        """
+        Write the queued changes in one transaction, then store the validators
+        of the records written.
+        """
+        if not self._records:
+            return
+        start = time.perf_counter()
+        try:
+            if self._updates:
+                self.session.bulk_update_mappings(UrlData, list(self._updates.values()))
+            for statement, params in (
+                (DELETE_ASSET, self._deleted),
+                (insert(_js_assets), self._inserted),
+                (RENAME_ASSET, self._renamed),
+                (UPDATE_CHANGED_ASSET, self._changed),
+                (UPDATE_SEEN_ASSET, self._seen),
+                (insert(_observations), self._observed),
+            ):
+                if params:
+                    self.session.execute(statement, params)
+            self.session.commit()
+            for cache, entries in self._validators:
+                cache.store_entries(entries)
+            self.written += len(self._records)
+            METRICS.observe('db_write', time.perf_counter() - start)
+            METRICS.inc('db_rows_written', len(self._records))
+            logger.debug(f'Wrote the updates of {len(self._records)} records')
+        except Exception:
+            self.session.rollback()
+            raise
+        finally:
+            self._records.clear()
+            for queue in (
+                self._updates, self._inserted, self._renamed, self._changed, self._seen, self._deleted, self._observed,
+                self._validators,
+            ):
+                queue.clear()
+
+    def _queued(self, url_data_id: int) -> None:
+        self._records.add(url_data_id)
+        if len(self._records) >= self.batch_size:
+            self.flush()
@@ -0,0 +1,373 @@
+import asyncio
+import ipaddress
+import random
+import socket
+import struct
+import threading
+import time
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import NamedTuple
+from typing import Optional
+from typing import Tuple
+
+from .config import DNS_ATTEMPTS
+from .config import DNS_CONCURRENCY
+from .config import DNS_MAX_TTL
+from .config import DNS_MIN_TTL
+from .config import DNS_NEGATIVE_TTL
+from .config import DNS_SERVERS
+from .config import DNS_TIMEOUT
+from .config import get_logger
+from .metrics import METRICS
+
+
+logger = get_logger()
+
+RESOLV_CONF = '/etc/resolv.conf'
+HOSTS_FILE = '/etc/hosts'
+DNS_PORT = 53
+
+TYPE_A = 1
+TYPE_SOA = 6
+TYPE_AAAA = 28
+CLASS_IN = 1
+NOERROR = 0
+NXDOMAIN = 3
+# Header flags of a query: recursion desired.
+FLAG_RD = 0x0100
+
+
+class DnsError(Exception):
+    """A DNS reply could not be parsed."""
+
+
+class DnsReply(NamedTuple):
+    """
+    The addresses of a DNS reply, and how long they may be cached: the lowest
+    TTL of the answers, or for a negative reply the TTL given by the SOA record
+    of its authority section, None without one.
+    """
+    rcode: int
+    addresses: List[str]
+    ttl: Optional[int]
+
+
+def build_query(query_id: int, name: str, qtype: int) -> bytes:
+    """Return a recursive DNS query for the records of a type of a name."""
+    question = b''.join(
+        bytes([len(label)]) + label for label in name.rstrip('.').encode('idna').split(b'.')
+    )
+    return struct.pack('!HHHHHH', query_id, FLAG_RD, 1, 0, 0, 0) + question + b'\x00' + struct.pack('!HH', qtype, CLASS_IN)
+
+
+def _skip_name(data: bytes, position: int) -> int:
+    while True:
+        length = data[position]
+        if length == 0:
+            return position + 1
+        if length >= 0xc0:
+            # A compression pointer ends the name.
+            return position + 2
+        position += length + 1
+
+
+def parse_reply(data: bytes, query_id: Optional[int] = None) -> DnsReply:
+    """
+    Parse a DNS reply, keeping the A and AAAA records of its answers whatever
+    their name, so the addresses of a CNAME chain are found.
+
+    Raises:
+        DnsError: The reply is truncated, or not a reply to ``query_id``.
+    """
+    try:
+        reply_id, flags, questions, answers, authorities, _ = struct.unpack_from('!HHHHHH', data)
+        if query_id is not None and reply_id != query_id:
+            raise DnsError(f'Reply {reply_id} to another query than {query_id}')
+        position = 12
+        for _ in range(questions):
+            position = _skip_name(data, position) + 4
+
+        addresses = []
+        ttl = None
+        for index in range(answers + authorities):
+            position = _skip_name(data, position)
+            rtype, _, record_ttl, length = struct.unpack_from('!HHIH', data, position)
+            position += 10
+            rdata = data[position:position + length]
+            if len(rdata) != length:
+                raise DnsError('Truncated record')
+            position += length
+            if index < answers:
+                if rtype == TYPE_A:
+                    addresses.append(socket.inet_ntop(socket.AF_INET, rdata))
+                elif rtype == TYPE_AAAA:
+                    addresses.append(socket.inet_ntop(socket.AF_INET6, rdata))
+                ttl = record_ttl if ttl is None else min(ttl, record_ttl)
+            elif rtype == TYPE_SOA and not answers:
+                # The negative TTL is the lowest of the SOA TTL and its minimum field (RFC 2308).
+                ttl = min(record_ttl, struct.unpack('!I', rdata[-4:])[0])
+    except (struct.error, IndexError, ValueError) as e:
+        raise DnsError(f'Invalid reply: {e}') from e
+    return DnsReply(flags & 0xf, addresses, ttl)
+
+
+def parse_server(value: str) -> Tuple[str, int]:
+    """Parse a nameserver given as host, host:port or [IPv6]:port."""
+    if value.startswith('['):
+        host, _, port = value[1:].partition(']:')
+        return host.rstrip(']'), int(port or DNS_PORT)
+    if value.count(':') == 1:
+        host, port = value.split(':')
+        return host, int(port)
+    return value, DNS_PORT
+
+
+def read_resolv_conf(path: str = RESOLV_CONF) -> List[str]:
+    """Return the nameservers of resolv.conf, none if it cannot be read."""
+    try:
+        with open(path) as file:
+            return [
+                line.split()[1] for line in file
+                if line.startswith('nameserver') and len(line.split()) > 1
+            ]
+    except OSError:
+        return []
+
+
+def read_hosts(path: str = HOSTS_FILE) -> Dict[str, Tuple[str, ...]]:
+    """Return the addresses of the names of a hosts file, none if it cannot be read."""
+    hosts: Dict[str, Tuple[str, ...]] = {}
+    try:
+        with open(path) as file:
+            for line in file:
+                fields = line.split('#', 1)[0].split()
+                for name in fields[1:]:
+                    hosts[name.lower()] = hosts.get(name.lower(), ()) + (fields[0],)
+    except OSError:
+        pass
+    return hosts
+
+
+class _ReplyProtocol(asyncio.DatagramProtocol):
+
+    def __init__(self, query: bytes, reply: asyncio.Future) -> None:
+        self.query = query
+        self.reply = reply
+
+    def connection_made(self, transport):
+        transport.sendto(self.query)
+
+    def datagram_received(self, data, addr):
+        # A reply to another query, e.g. a late or spoofed one, is ignored.
+        if not self.reply.done() and data[:2] == self.query[:2]:
+            self.reply.set_result(data)
+
+    def error_received(self, exc):
+        if not self.reply.done():
+            self.reply.set_exception(exc)
+
+
+class Resolver:
+    """
+    Resolver is an in-process asynchronous DNS resolver with a TTL cache.
+
+    Hosts are resolved by sending A and AAAA queries over UDP to the
+    nameservers, concurrently, on an event loop running in a background
+    thread. The addresses are cached for the TTL of the reply, kept within
+    ``min_ttl`` and ``max_ttl``. Hosts which do not exist (NXDOMAIN) or have
+    no address are cached as dead for the negative TTL of the reply, up to
+    ``negative_ttl``, so they are skipped without a connection attempt.
+
+    The names of the hosts file, IP addresses and single-label names are
+    left to the system resolver, as are the hosts whose resolution fails
+    (timeouts or server failures), which are not cached.
+
+    ``prefetch()`` resolves the hosts of a scan before it starts, ``concurrency``
+    at a time. HTTPClient looks the hosts up with ``resolve()`` when it opens a
+    connection, see TimedHTTPConnection.
+
+    Usage Example:
+        resolver = Resolver()
+        dead = resolver.prefetch(['www.example.com', 'old.example.com'])
+        addresses = resolver.resolve('www.example.com')
+        resolver.close()
+    """
+
+    def __init__(
+        self,
+        servers: Iterable[str] = DNS_SERVERS,
+        min_ttl: float = DNS_MIN_TTL,
+        max_ttl: float = DNS_MAX_TTL,
+        negative_ttl: float = DNS_NEGATIVE_TTL,
+        timeout: float = DNS_TIMEOUT,
+        attempts: int = DNS_ATTEMPTS,
+        concurrency: int = DNS_CONCURRENCY,
+        hosts_path: str = HOSTS_FILE,
+        clock=time.monotonic,
+    ) -> None:
+
+        servers = list(servers) or read_resolv_conf()
+        # 'system' leaves every host to the system resolver.
+        self.servers = [parse_server(server) for server in servers if server != 'system']
+        self.min_ttl = min_ttl
+        self.max_ttl = max(min_ttl, max_ttl)
+        self.negative_ttl = negative_ttl
+        self.timeout = timeout
+        self.attempts = max(1, attempts)
+        self.concurrency = max(1, concurrency)
+        self.clock = clock
+        self.hosts = read_hosts(hosts_path)
+        self._lock = threading.Lock()
+        # The addresses of each host and when they expire, none for a dead host.
+        self._cache: Dict[str, Tuple[Tuple[str, ...], float]] = {}
+        # The resolutions in flight, only touched on the loop thread.
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._loop = None
+        self._thread = None
+
+    def resolve(self, host: str) -> Optional[Tuple[str, ...]]:
+        """
+        Return the addresses of a host, IPv4 first, from the cache or the nameservers.
+
+        Returns:
+            tuple: The addresses, empty if the host does not exist, or None if
+                it is left to the system resolver.
+        """
+        cached = self.cached(host)
+        if cached is not None:
+            METRICS.inc('dns_cache_hits')
+            return cached
+        if not self._handled(host):
+            return None
+        return asyncio.run_coroutine_threadsafe(self._resolve(host), self._get_loop()).result()
+
+    def cached(self, host: str) -> Optional[Tuple[str, ...]]:
+        """Return the cached addresses of a host, empty if it is dead, None if not cached."""
+        with self._lock:
+            entry = self._cache.get(host)
+            if entry is None or entry[1] <= self.clock():
+                return None
+            return entry[0]
+
+    def is_dead(self, host: str) -> bool:
+        """Return True if the host is cached as not existing."""
+        return self.cached(host) == ()
+
+    def prefetch(self, hosts: Iterable[str]) -> List[str]:
+        """
+        Resolve hosts ahead of their requests, ``concurrency`` at a time.
+
+        Returns:
+            list: The hosts which do not exist, sorted.
+        """
+        hosts = [host for host in dict.fromkeys(hosts) if self._handled(host) and self.cached(host) is None]
+        if hosts:
+            start = time.perf_counter()
+            asyncio.run_coroutine_threadsafe(self._resolve_many(hosts), self._get_loop()).result()
+            logger.info(f'Resolved {len(hosts)} hosts in {time.perf_counter() - start:.1f}s')
+        dead = sorted(host for host in hosts if self.is_dead(host))
+        if dead:
+            logger.info(f'{len(dead)} hosts do not exist and are skipped')
+        return dead
+
+    def close(self) -> None:
+        """Stop the event loop of the resolver. Closing twice is a no-op."""
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            self._loop = self._thread = None
+        if loop is not None:
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+            loop.close()
+
+    def _handled(self, host: str) -> bool:
+        if not self.servers or '.' not in host.strip('.') or host in self.hosts:
+            return False
+        try:
+            ipaddress.ip_address(host)
+        except ValueError:
+            return True
+        return False
+
+    def _get_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._loop.run_forever, name='resolver', daemon=True)
+                self._thread.start()
+            return self._loop
+
+    async def _resolve_many(self, hosts: List[str]) -> None:
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def resolve(host):
+            async with semaphore:
+                await self._resolve(host)
+
+        await asyncio.gather(*(resolve(host) for host in hosts))
+
+    async def _resolve(self, host: str) -> Optional[Tuple[str, ...]]:
+        # Concurrent resolutions of a host share the same queries.
+        pending = self._pending.get(host)
+        if pending is None:
+            pending = self._pending[host] = asyncio.ensure_future(self._lookup(host))
+            pending.add_done_callback(lambda _: self._pending.pop(host, None))
+        return await asyncio.shield(pending)
+
+    async def _lookup(self, host: str) -> Optional[Tuple[str, ...]]:
+        with METRICS.time('resolve'):
+            replies = await asyncio.gather(self._query(host, TYPE_A), self._query(host, TYPE_AAAA))
+        if any(reply is not None and reply.rcode == NXDOMAIN for reply in replies):
+            METRICS.inc('dns_nxdomain')
+            return self._store(host, (), self._negative_ttl(replies))
+
+        addresses = tuple(address for reply in replies if reply is not None for address in reply.addresses)
+        if addresses:
+            ttls = [reply.ttl for reply in replies if reply is not None and reply.addresses]
+            return self._store(host, addresses, min(self.max_ttl, max(self.min_ttl, min(ttls))))
+        if all(reply is not None and reply.rcode == NOERROR for reply in replies):
+            # The host exists but has no address.
+            return self._store(host, (), self._negative_ttl(replies))
+        return None
+
+    def _negative_ttl(self, replies: List[Optional[DnsReply]]) -> float:
+        ttls = [reply.ttl for reply in replies if reply is not None and reply.ttl is not None]
+        return min(self.negative_ttl, max(self.min_ttl, min(ttls))) if ttls else self.negative_ttl
+
+    def _store(self, host: str, addresses: Tuple[str, ...], ttl: float) -> Tuple[str, ...]:
+        with self._lock:
+            self._cache[host] = (addresses, self.clock() + ttl)
+        return addresses
+
+    async def _query(self, host: str, qtype: int) -> Optional[DnsReply]:
+        """Query the nameservers in turn, returning None when none of them answered."""
+        loop = asyncio.get_running_loop()
+        for attempt in range(self.attempts * len(self.servers)):
+            query_id = random.getrandbits(16)
+            try:
+                query = build_query(query_id, host, qtype)
+            except UnicodeError:
+                # Not a valid domain name, e.g. a label longer than 63 characters.
+                return None
+            server = self.servers[attempt % len(self.servers)]
+            reply = loop.create_future()
+            transport = None
+            try:
+                METRICS.inc('dns_queries')
+                transport, _ = await loop.create_datagram_endpoint(
+                    lambda: _ReplyProtocol(query, reply), remote_addr=server,
+                )
+                parsed = parse_reply(await asyncio.wait_for(reply, self.timeout), query_id)
+            except (asyncio.TimeoutError, OSError, DnsError) as e:
+                logger.debug(f'DNS query for {host} to {server[0]} failed: {e!r}')
+                continue
+            finally:
+                if transport is not None:
+                    transport.close()
+            if parsed.rcode in (NOERROR, NXDOMAIN):
+                return parsed
+            logger.debug(f'DNS query for {host} to {server[0]} failed with rcode {parsed.rcode}')
+        return None
+
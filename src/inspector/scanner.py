@@ -0,0 +1,155 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import Iterable
+from typing import Optional
+
+from .config import get_logger
+from .config import SCAN_CONCURRENCY
+from .config import SCAN_DELAY
+from .config import SCAN_PER_HOST
+from .urls import get_host
+
+
+logger = get_logger()
+
+
+class Scanner:
+    """
+    Scanner runs blocking fetches for many URLs concurrently on an asyncio loop.
+
+    Each item is fetched by a blocking ``fetch`` callable executed on a thread
+    pool, so the existing requests based code is reused as is. The number of
+    fetches in flight is bounded globally and per host, and two requests to
+    the same host are spaced by a politeness delay, which the requests a fetch
+    sends besides its own, e.g. for JS files, also wait for through wait_turn().
+    Results are passed to
+    ``on_result`` on the event loop thread as soon as they are ready, which
+    keeps database access on a single thread.
+
+    With a ``deadline``, the items whose fetch has not started when it is reached
+    are skipped, so the wall time of a scan is bounded by the deadline plus the
+    total timeout of the fetches in flight.
+
+    Attributes:
+        concurrency (int): Maximum number of fetches running at once.
+        per_host (int): Maximum number of fetches running at once per host.
+        delay (float): Minimum delay in seconds between requests to a host.
+        deadline (float): Optional time.time() after which no fetch is started.
+        failed (int): Number of items whose fetch or processing raised.
+        skipped (int): Number of items skipped because the deadline was reached.
+
+    Usage Example:
+        scanner = Scanner(concurrency=50, per_host=2, delay=0.5)
+        scanner.run(records, partial(fetch_record, pace=scanner.wait_turn), process_record)
+    """
+
+    def __init__(
+        self,
+        concurrency: int = SCAN_CONCURRENCY,
+        per_host: int = SCAN_PER_HOST,
+        delay: float = SCAN_DELAY,
+        deadline: Optional[float] = None,
+    ) -> None:
+
+        self.concurrency = max(1, concurrency)
+        self.per_host = max(1, per_host)
+        self.delay = max(0.0, delay)
+        self.deadline = deadline
+        self.failed = 0
+        self.skipped = 0
+        self._loop = None
+
+    def run(
+        self,
+        items: Iterable[Any],
+        fetch: Callable[[Any], Any],
+        on_result: Callable[[Any, Any], None],
+        url_of: Callable[[Any], str] = lambda item: item['url'],
+    ) -> None:
+        """
+        Fetch all items and hand each result to ``on_result(item, result)``.
+
+        Args:
+            items: The records to scan.
+            fetch: Blocking callable returning the fetched result of an item.
+            on_result: Callable invoked on the loop thread with each result.
+            url_of: Callable returning the URL of an item, used to find its host.
+        """
+        asyncio.run(self._run(list(items), fetch, on_result, url_of))
+
+    def wait_turn(self, url: str) -> None:
+        """
+        Block until a request to the host of a URL is polite, from a fetch thread.
+
+        Outside of run(), the request does not wait.
+        """
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        asyncio.run_coroutine_threadsafe(self._wait_turn(get_host(url)), loop).result()
+
+    async def _run(self, items, fetch, on_result, url_of) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._global = asyncio.Semaphore(self.concurrency)
+        self._host_slots: Dict[str, asyncio.Semaphore] = {}
+        self._host_locks: Dict[str, asyncio.Lock] = {}
+        self._next_request: Dict[str, float] = {}
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                await asyncio.gather(*[
+                    self._scan(item, fetch, on_result, url_of, executor)
+                    for item in items
+                ])
+        finally:
+            self._loop = None
+
+    async def _scan(self, item, fetch, on_result, url_of, executor) -> None:
+        url = url_of(item)
+        host = get_host(url)
+        loop = asyncio.get_running_loop()
+
+        if host not in self._host_slots:
+            self._host_slots[host] = asyncio.Semaphore(self.per_host)
+            self._host_locks[host] = asyncio.Lock()
+
+        # Waiting for a busy host must not hold one of the global slots.
+        async with self._host_slots[host]:
+            if not self._expired():
+                await self._wait_turn(host)
+            async with self._global:
+                if self._expired():
+                    self.skipped += 1
+                    return
+                try:
+                    result = await loop.run_in_executor(executor, fetch, item)
+                except Exception as e:
+                    self.failed += 1
+                    logger.error(f"Error scanning URL '{url}': {e}", extra={'url': url})
+                    return
+
+        try:
+            on_result(item, result)
+        except Exception as e:
+            self.failed += 1
+            logger.error(f"Error processing URL '{url}': {e}", extra={'url': url})
+
+    def _expired(self) -> bool:
+        return self.deadline is not None and time.time() >= self.deadline
+
+    async def _wait_turn(self, host: str) -> None:
+        """
+        Sleep until the politeness delay for the host has elapsed.
+        """
+        loop = asyncio.get_running_loop()
+        if host not in self._host_locks:
+            self._host_locks[host] = asyncio.Lock()
+        async with self._host_locks[host]:
+            wait = self._next_request.get(host, 0.0) - loop.time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            self._next_request[host] = loop.time() + self.delay
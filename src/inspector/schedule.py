@@ -0,0 +1,61 @@
+import random
+from datetime import datetime
+from datetime import timedelta
+from typing import Optional
+from typing import Tuple
+
+from .config import SCHEDULE_BACKOFF
+from .config import SCHEDULE_DEFAULT_INTERVAL
+from .config import SCHEDULE_JITTER
+from .config import SCHEDULE_MAX_INTERVAL
+from .config import SCHEDULE_MIN_INTERVAL
+from .config import SCHEDULE_SPEEDUP
+
+
+def interval_bounds(min_interval: Optional[int], max_interval: Optional[int]) -> Tuple[int, int]:
+    """
+    Return the minimum and maximum check intervals of a URL, falling back to
+    the configured defaults.
+    """
+    low = min_interval or SCHEDULE_MIN_INTERVAL
+    high = max_interval or SCHEDULE_MAX_INTERVAL
+    return low, max(low, high)
+
+
+def next_interval(
+    interval: Optional[int],
+    changed: bool,
+    min_interval: Optional[int] = None,
+    max_interval: Optional[int] = None,
+) -> int:
+    """
+    Adapt the check interval of a URL to how often it changes.
+
+    A change shortens the interval (SCHEDULE_SPEEDUP), a check without change
+    backs it off (SCHEDULE_BACKOFF), within the bounds of the URL.
+    """
+    low, high = interval_bounds(min_interval, max_interval)
+    interval = interval or SCHEDULE_DEFAULT_INTERVAL
+    interval *= SCHEDULE_SPEEDUP if changed else SCHEDULE_BACKOFF
+    return int(min(high, max(low, interval)))
+
+
+def jittered(interval: float, jitter: float = SCHEDULE_JITTER, rng=random) -> float:
+    """
+    Return the interval randomly stretched by +/- ``jitter``, so URLs checked
+    together drift apart instead of staying in bursts.
+    """
+    return interval * rng.uniform(1 - jitter, 1 + jitter)
+
+
+def next_check(
+    record,
+    changed: bool,
+    now: datetime,
+    rng=random,
+) -> Tuple[int, datetime]:
+    """
+    Return the new check interval of a record and the time of its next check.
+    """
+    interval = next_interval(record.check_interval, changed, record.min_interval, record.max_interval)
+    return interval, now + timedelta(seconds=jittered(interval, rng=rng))
@@ -0,0 +1,354 @@
+import bisect
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import NamedTuple
+from typing import Optional
+from typing import Tuple
+
+from .config import get_logger
+from .config import LEASE_SECONDS
+from .config import QUEUE_PATH
+
+
+logger = get_logger()
+
+
+def _point(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], 'big')
+
+
+class HashRing:
+    """
+    HashRing maps keys to nodes with consistent hashing.
+
+    Each node is placed ``replicas`` times on a ring of 64-bit hashes, and a key
+    belongs to the first node found after its own hash. Adding or removing a
+    node only moves the keys of that node, so most hosts keep their shard when
+    the number of workers changes between runs.
+
+    Usage Example:
+        ring = HashRing(['shard-0', 'shard-1'])
+        shard = ring.node_for('example.com')
+    """
+
+    def __init__(self, nodes: Iterable[str], replicas: int = 100) -> None:
+
+        self.nodes = list(nodes)
+        if not self.nodes:
+            raise ValueError('A hash ring needs at least one node')
+
+        ring = sorted(
+            (_point(f'{node}#{replica}'), node)
+            for node in self.nodes for replica in range(replicas)
+        )
+        self._points = [point for point, _ in ring]
+        self._owners = [node for _, node in ring]
+
+    def node_for(self, key: str) -> str:
+        """
+        Return the node owning a key.
+        """
+        index = bisect.bisect(self._points, _point(key)) % len(self._points)
+        return self._owners[index]
+
+
+class Batch(NamedTuple):
+    id: int
+    shard: str
+    items: List[Any]
+
+
+class LeaseQueue:
+    """
+    LeaseQueue is an SQLite-backed queue of batches shared by worker processes.
+
+    A run is a set of batches grouped in shards. Each shard is owned by one
+    worker, which leases the batches of its shards one at a time and stores
+    their result. Owners renew their shards and leases with heartbeat(): when a
+    worker stops renewing for ``lease_seconds``, another worker takes over its
+    whole shard, including the batch it was processing, so the hosts of a shard
+    stay on a single worker. The result of a batch whose lease was lost is
+    discarded.
+
+    The queue is a local file, so no broker is needed: every process opens
+    its own LeaseQueue on the same path.
+
+    Usage Example:
+        queue = LeaseQueue()
+        run_id = queue.create_run({'shard-0': [[1, 2], [3]]})
+        queue.join(run_id, 'worker-1', 'shard-0')
+        batch = queue.lease(run_id, 'worker-1')
+        queue.complete(batch.id, 'worker-1', {'done': batch.items})
+    """
+
+    PENDING = 'pending'
+    LEASED = 'leased'
+    DONE = 'done'
+    APPLIED = 'applied'
+    FAILED = 'failed'
+    MAX_ATTEMPTS = 3
+
+    def __init__(self, path=QUEUE_PATH, lease_seconds: float = LEASE_SECONDS) -> None:
+
+        self.lease_seconds = lease_seconds
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(
+            str(path), timeout=30, isolation_level=None, check_same_thread=False,
+        )
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(
+            'CREATE TABLE IF NOT EXISTS runs ('
+            'id TEXT PRIMARY KEY, created_at REAL NOT NULL, finished_at REAL);'
+            'CREATE TABLE IF NOT EXISTS shards ('
+            'run_id TEXT NOT NULL, shard TEXT NOT NULL, owner TEXT, heartbeat REAL NOT NULL, '
+            'PRIMARY KEY (run_id, shard));'
+            'CREATE TABLE IF NOT EXISTS batches ('
+            'id INTEGER PRIMARY KEY, run_id TEXT NOT NULL, shard TEXT NOT NULL, items TEXT NOT NULL, '
+            'state TEXT NOT NULL, owner TEXT, lease_until REAL, attempts INTEGER NOT NULL DEFAULT 0, '
+            'result TEXT);'
+            'CREATE INDEX IF NOT EXISTS ix_batches_run_state ON batches (run_id, state, shard);',
+        )
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        with self._lock:
+            self.connection.execute('BEGIN IMMEDIATE')
+            try:
+                yield self.connection
+            except BaseException:
+                self.connection.execute('ROLLBACK')
+                raise
+            self.connection.execute('COMMIT')
+
+    def create_run(self, shards: Dict[str, List[List[Any]]]) -> str:
+        """
+        Create a run from the batches of each shard.
+
+        The shards start with a fresh heartbeat, so their workers have one lease
+        period to join before their shard can be taken over.
+
+        Returns:
+            str: The id of the run.
+        """
+        run_id = uuid.uuid4().hex
+        now = time.time()
+        with self._transaction() as connection:
+            connection.execute('INSERT INTO runs (id, created_at) VALUES (?, ?)', (run_id, now))
+            connection.executemany(
+                'INSERT INTO shards (run_id, shard, heartbeat) VALUES (?, ?, ?)',
+                [(run_id, shard, now) for shard in shards],
+            )
+            connection.executemany(
+                'INSERT INTO batches (run_id, shard, items, state) VALUES (?, ?, ?, ?)',
+                [
+                    (run_id, shard, json.dumps(items), self.PENDING)
+                    for shard, batches in shards.items() for items in batches
+                ],
+            )
+        return run_id
+
+    def latest_run(self) -> Optional[str]:
+        """
+        Return the id of the latest unfinished run, or None.
+        """
+        with self._lock:
+            row = self.connection.execute(
+                'SELECT id FROM runs WHERE finished_at IS NULL ORDER BY created_at DESC LIMIT 1',
+            ).fetchone()
+        return row[0] if row else None
+
+    def join(self, run_id: str, worker_id: str, shard: Optional[str] = None) -> None:
+        """
+        Make a worker the owner of its shard, unless a live worker already owns it.
+        """
+        if shard is None:
+            return
+        now = time.time()
+        with self._transaction() as connection:
+            connection.execute(
+                'UPDATE shards SET owner = ?, heartbeat = ? WHERE run_id = ? AND shard = ? '
+                'AND (owner IS NULL OR owner = ? OR heartbeat < ?)',
+                (worker_id, now, run_id, shard, worker_id, now - self.lease_seconds),
+            )
+
+    def lease(self, run_id: str, worker_id: str) -> Optional[Batch]:
+        """
+        Lease the next batch of the shards owned by a worker.
+
+        When its shards have no batch left, the worker takes over the shard of a
+        dead worker, i.e. whose heartbeat is older than the lease period. A batch
+        leased ``MAX_ATTEMPTS`` times without completing is marked as failed.
+
+        Returns:
+            Batch: The leased batch, or None if the worker has nothing left to do.
+        """
+        while True:
+            now = time.time()
+            with self._transaction() as connection:
+                row = self._next_batch(connection, run_id, worker_id, now)
+                if row is None and self._take_over(connection, run_id, worker_id, now):
+                    row = self._next_batch(connection, run_id, worker_id, now)
+                if row is None:
+                    return None
+
+                batch_id, shard, items, attempts = row
+                if attempts >= self.MAX_ATTEMPTS:
+                    connection.execute(
+                        'UPDATE batches SET state = ?, owner = NULL WHERE id = ?', (self.FAILED, batch_id),
+                    )
+                    logger.error(f'Batch {batch_id} of shard {shard} failed {attempts} times, giving up')
+                    continue
+
+                connection.execute(
+                    'UPDATE batches SET state = ?, owner = ?, lease_until = ?, attempts = attempts + 1 '
+                    'WHERE id = ?',
+                    (self.LEASED, worker_id, now + self.lease_seconds, batch_id),
+                )
+                return Batch(batch_id, shard, json.loads(items))
+
+    def _next_batch(self, connection, run_id, worker_id, now) -> Optional[Tuple[int, str, str, int]]:
+        return connection.execute(
+            'SELECT id, shard, items, attempts FROM batches WHERE run_id = ? '
+            'AND shard IN (SELECT shard FROM shards WHERE run_id = ? AND owner = ?) '
+            'AND (state = ? OR (state = ? AND lease_until < ?)) ORDER BY id LIMIT 1',
+            (run_id, run_id, worker_id, self.PENDING, self.LEASED, now),
+        ).fetchone()
+
+    def _take_over(self, connection, run_id, worker_id, now) -> bool:
+        row = connection.execute(
+            'SELECT shards.shard, shards.owner FROM shards WHERE run_id = ? AND heartbeat < ? '
+            'AND EXISTS (SELECT 1 FROM batches WHERE batches.run_id = shards.run_id '
+            'AND batches.shard = shards.shard AND state IN (?, ?)) ORDER BY shard LIMIT 1',
+            (run_id, now - self.lease_seconds, self.PENDING, self.LEASED),
+        ).fetchone()
+        if row is None:
+            return False
+        shard, owner = row
+        connection.execute(
+            'UPDATE shards SET owner = ?, heartbeat = ? WHERE run_id = ? AND shard = ?',
+            (worker_id, now, run_id, shard),
+        )
+        logger.warning(f'Worker {worker_id} took over shard {shard} from {owner or "no worker"}')
+        return True
+
+    def takeover_time(self, run_id: str) -> Optional[float]:
+        """
+        Return when the first shard with batches left can be taken over with its
+        leased batches, i.e. once its heartbeat and their leases have expired.
+
+        Returns:
+            float: A time.time() value, or None when no batch is left.
+        """
+        with self._lock:
+            row = self.connection.execute(
+                'SELECT MIN(ready) FROM (SELECT MAX(shards.heartbeat + ?, COALESCE(MAX(batches.lease_until), 0)) '
+                'AS ready FROM shards JOIN batches ON batches.run_id = shards.run_id AND batches.shard = shards.shard '
+                'WHERE shards.run_id = ? AND batches.state IN (?, ?) GROUP BY shards.shard)',
+                (self.lease_seconds, run_id, self.PENDING, self.LEASED),
+            ).fetchone()
+        return row[0]
+
+    def renew(self, run_id: str, worker_id: str) -> None:
+        """
+        Renew the shards and the leased batches of a worker.
+        """
+        now = time.time()
+        with self._transaction() as connection:
+            connection.execute(
+                'UPDATE shards SET heartbeat = ? WHERE run_id = ? AND owner = ?', (now, run_id, worker_id),
+            )
+            connection.execute(
+                'UPDATE batches SET lease_until = ? WHERE run_id = ? AND owner = ? AND state = ?',
+                (now + self.lease_seconds, run_id, worker_id, self.LEASED),
+            )
+
+    @contextmanager
+    def heartbeat(self, run_id: str, worker_id: str) -> Iterator[None]:
+        """
+        Renew the shards and leases of a worker in a background thread.
+        """
+        stop = threading.Event()
+
+        def beat():
+            while not stop.wait(self.lease_seconds / 3):
+                try:
+                    self.renew(run_id, worker_id)
+                except sqlite3.Error as e:
+                    logger.error(f'Could not renew the leases of {worker_id}: {e}')
+
+        thread = threading.Thread(target=beat, name=f'heartbeat-{worker_id}', daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
+    def complete(self, batch_id: int, worker_id: str, result: Any) -> bool:
+        """
+        Store the result of a batch.
+
+        Returns:
+            bool: False if the worker lost its lease, in which case the result is
+                discarded because another worker took the batch over.
+        """
+        with self._transaction() as connection:
+            cursor = connection.execute(
+                'UPDATE batches SET state = ?, result = ?, lease_until = NULL '
+                'WHERE id = ? AND owner = ? AND state = ?',
+                (self.DONE, json.dumps(result), batch_id, worker_id, self.LEASED),
+            )
+        return cursor.rowcount == 1
+
+    def take_results(self, run_id: str) -> List[Any]:
+        """
+        Return the results of the batches completed since the last call.
+        """
+        with self._transaction() as connection:
+            rows = connection.execute(
+                'SELECT id, result FROM batches WHERE run_id = ? AND state = ? ORDER BY id',
+                (run_id, self.DONE),
+            ).fetchall()
+            connection.executemany(
+                'UPDATE batches SET state = ? WHERE id = ?', [(self.APPLIED, batch_id) for batch_id, _ in rows],
+            )
+        return [json.loads(result) for _, result in rows]
+
+    def counts(self, run_id: str) -> Dict[str, int]:
+        """
+        Return the number of batches of a run in each state.
+        """
+        with self._lock:
+            rows = self.connection.execute(
+                'SELECT state, COUNT(*) FROM batches WHERE run_id = ? GROUP BY state', (run_id,),
+            ).fetchall()
+        return dict(rows)
+
+    def finish_run(self, run_id: str) -> None:
+        """
+        Mark a run as finished and delete its batches and shards.
+        """
+        with self._transaction() as connection:
+            connection.execute('UPDATE runs SET finished_at = ? WHERE id = ?', (time.time(), run_id))
+            connection.execute('DELETE FROM batches WHERE run_id = ?', (run_id,))
+            connection.execute('DELETE FROM shards WHERE run_id = ?', (run_id,))
+
+    def close(self) -> None:
+        """
+        Close the queue. Closing twice is a no-op.
+        """
+        with self._lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
@@ -0,0 +1,141 @@
+import codecs
+import hashlib
+import time
+from typing import List
+from typing import NamedTuple
+from typing import Optional
+
+from .analysis import PageTokenizer
+from .config import STREAM_CHUNK_SIZE
+from .fingerprint import PageFingerprinter
+from .metrics import METRICS
+
+
+STOP_TITLE = 'title'
+STOP_HEAD = 'head'
+
+
+class StreamResult(NamedTuple):
+    status_code: int
+    title: Optional[str]
+    title_complete: bool
+    scripts: List[str]
+    modulepreloads: List[str]
+    content_length: Optional[int]
+    content_hash: Optional[str]
+    complete: bool
+    fingerprint: Optional[str] = None
+
+
+def _incremental_decoder(encoding: Optional[str]) -> codecs.IncrementalDecoder:
+    # An unknown charset, e.g. a typo in the Content-Type header, falls back to
+    # UTF-8 as when decoding response.text.
+    try:
+        return codecs.getincrementaldecoder(encoding or 'utf-8')(errors='replace')
+    except LookupError:
+        return codecs.getincrementaldecoder('utf-8')(errors='replace')
+
+
+def header_content_length(response) -> Optional[int]:
+    """
+    Return the decoded body length announced by the headers, if it is reliable.
+
+    Content-Length is the size on the wire, so it only matches the decoded body
+    when the response is not compressed.
+    """
+    encoding = response.headers.get('Content-Encoding', 'identity').lower()
+    length = response.headers.get('Content-Length')
+    if encoding != 'identity' or length is None or not length.isdigit():
+        return None
+    return int(length)
+
+
+def stream_page(
+    response,
+    stop: Optional[str] = STOP_TITLE,
+    count_length: bool = False,
+    hash_body: bool = False,
+    fingerprint: bool = False,
+    chunk_size: int = STREAM_CHUNK_SIZE,
+) -> StreamResult:
+    """
+    Read a streamed response incrementally and stop as early as possible.
+
+    The body is fed chunk by chunk to an incremental tokenizer, and parsing
+    stops as soon as the ``stop`` condition is met: the first </title>, or the
+    end of a head without title, for STOP_TITLE, the end of the head for
+    STOP_HEAD, or right away for None. A title is looked for in the head only.
+    Reading goes on, without parsing nor buffering, only when the content
+    length must be counted or the body hashed. With ``fingerprint``, the
+    whole body is parsed to fingerprint the page. The response is closed.
+
+    Args:
+        response: A requests response fetched with ``stream=True``.
+        stop: When to stop parsing: STOP_TITLE, STOP_HEAD or None.
+        count_length (bool): Return the decoded body length.
+        hash_body (bool): Return the MD5 hash of the body, read to its end.
+        fingerprint (bool): Return the fingerprint of the page, parsed to its end.
+        chunk_size (int): Size of the chunks read from the socket.
+
+    Returns:
+        StreamResult: The status, title, JS references and length of the page.
+    """
+    content_length = header_content_length(response) if count_length else None
+    must_read = hash_body or fingerprint or (count_length and content_length is None)
+
+    if fingerprint:
+        tokenizer = PageFingerprinter()
+    else:
+        tokenizer = PageTokenizer() if stop else None
+    parsing = tokenizer is not None
+    decoder = _incremental_decoder(response.encoding)
+    digest = hashlib.md5() if hash_body else None
+    bytes_read = 0
+    parse_seconds = 0.0
+    complete = False
+
+    try:
+        if parsing or must_read:
+            for chunk in response.iter_content(chunk_size):
+                bytes_read += len(chunk)
+                if digest is not None:
+                    digest.update(chunk)
+
+                if parsing:
+                    start = time.perf_counter()
+                    tokenizer.feed(decoder.decode(chunk))
+                    parse_seconds += time.perf_counter() - start
+                    parsing = fingerprint or not _stop_reached(tokenizer, stop)
+                    if not parsing and not must_read:
+                        break
+            else:
+                complete = True
+    finally:
+        response.close()
+
+    if parsing and complete:
+        tokenizer.feed(decoder.decode(b'', final=True))
+        tokenizer.close()
+    if tokenizer is not None:
+        METRICS.observe('parse', parse_seconds)
+
+    if count_length and content_length is None and complete:
+        content_length = bytes_read
+
+    return StreamResult(
+        status_code=response.status_code,
+        title=tokenizer.title if tokenizer is not None else None,
+        title_complete=tokenizer is not None and (_stop_reached(tokenizer, STOP_TITLE) or complete),
+        scripts=tokenizer.scripts if tokenizer is not None else [],
+        modulepreloads=tokenizer.modulepreloads if tokenizer is not None else [],
+        content_length=content_length,
+        content_hash=digest.hexdigest() if digest is not None and complete else None,
+        complete=complete,
+        fingerprint=str(tokenizer.fingerprint()) if fingerprint and complete else None,
+    )
+
+
+def _stop_reached(tokenizer: PageTokenizer, stop: str) -> bool:
+    if stop == STOP_HEAD:
+        return tokenizer.head_done
+    return tokenizer.title_done or tokenizer.head_done
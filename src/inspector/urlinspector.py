@@ -1,21 +1,96 @@
 import hashlib
-import logging
 import os
-import re
+import threading
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Callable
+from typing import Dict
+from typing import NamedTuple
+from typing import Optional
+from typing import Tuple
 from urllib.parse import urljoin
-from urllib.parse import urlparse
 
 import requests
-import tldextract
-import validators
-from bs4 import BeautifulSoup
 
+from .blobstore import get_blob_store
 from .config import BASE_DIR
 from .config import get_logger
+from .config import JS_CONCURRENCY
+from .config import JS_MAX_SIZE
+from .config import STREAM_CHUNK_SIZE
+from .httpclient import get_client
+from .masking import get_masking_rules
+from .metrics import METRICS
+from .parsepool import get_parser_pool
+from .streaming import header_content_length
+from .streaming import STOP_HEAD
+from .streaming import STOP_TITLE
+from .streaming import stream_page
+from .urls import canonicalize
+from .urls import FIRST_PARTY
+from .urls import get_host
+from .urls import is_first_party
+from .urls import is_relative
+from .urls import JS_URL_FILTER
+from .urls import site_name
 
 logger = get_logger()
 
 
+class JsFile(NamedTuple):
+    hash: str
+    size: Optional[int]
+
+
+class JsFileTooLarge(ValueError):
+    """The JS file is larger than the maximum size of the JS files downloaded."""
+
+
+class JsDownloads:
+    """
+    JsDownloads remembers the JS files downloaded during a run, so a bundle
+    loaded by many pages is downloaded once.
+
+    A page asking for a JS file being downloaded for another page waits for
+    that download and gets its result, or its error.
+
+    Usage Example:
+        downloads = JsDownloads()
+        for url in urls:
+            URLInspector(url, downloads=downloads).check_js_files()
+    """
+
+    def __init__(self) -> None:
+
+        self._lock = threading.Lock()
+        self._downloads: Dict[str, Future] = {}
+
+    def get(self, js_url: str, download: Callable[[str], Tuple[JsFile, Optional[str]]]) -> Tuple[JsFile, Optional[str]]:
+        """
+        Return the JsFile of a JS URL and the key of its blob, calling
+        ``download`` only for the first request of the URL.
+        """
+        with self._lock:
+            future = self._downloads.get(js_url)
+            first = future is None
+            if first:
+                future = self._downloads[js_url] = Future()
+        if not first:
+            return future.result()
+
+        try:
+            result = download(js_url)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        future.set_result(result)
+        return result
+
+    def __len__(self) -> int:
+        return len(self._downloads)
+
+
 class URLInspector:
     """
     URLInspector is a class for inspecting and analyzing web URLs.
@@ -27,60 +102,147 @@ class URLInspector:
 
     Attributes:
         url (str): The URL to inspect and analyze.
-        save_directory (str): The directory where downloaded JS files are saved.
-            The directory is created based on the URL's hostname.
+        client (HTTPClient): The shared HTTP client used for all requests.
+        url_filter (UrlFilter): The blacklist and allowlist of the JS URLs to download.
+        first_party (frozenset): The registered domains whose JS files belong to the site.
+        blob_store (BlobStore): The content-addressed store where JS files are saved.
+        downloads (JsDownloads): The JS files already downloaded during the run, if shared.
+        parser_pool (ParserPool): The worker processes analyzing the pages.
+        masking (MaskingRules): The rules masking the JS files and their URLs.
+        versions (VersionStore): The history where new versions of the JS files are kept, if any.
+        pace (callable): Called with each JS URL before it is downloaded, e.g. Scanner.wait_turn
+            to space the requests to a host, if any.
+        js_failed (list): The JS URLs of the page that could not be fetched, or were too large.
+        js_concurrency (int): The number of JS files of the page downloaded at once.
+        max_js_size (int): The maximum size in bytes of a JS file, larger ones are skipped.
+        conditional (bool): Revalidate the page with the client's validator cache.
+        defer_validators (bool): Collect the validators of the page and JS files in
+            ``validators`` instead of storing them, for the caller to store once the
+            results are written. Otherwise a crash before then would leave them
+            stored, and the next run would get a 304 and miss the change.
+        not_modified (bool): True when a conditional fetch returned 304 Not Modified.
+            In that case the page has no body, and the caller is expected to reuse
+            its previous results and pass the known JS URLs to check_js_files().
+        response (requests.Response): The URL's response, fetched on first access.
+        analysis (PageAnalysis): The title and JS references of the page, parsed once,
+            with its fingerprint when check_fingerprint() came first.
+        save_directory (str): The per-host directory where JS files used to be saved.
+            The directory is created based on the URL's hostname, on first access.
 
     Methods:
+        inspect(checks): Run several checks with a single fetch and return their results.
+        stream(stop, count_length, fingerprint): Fetch the page reading its body only as far as needed.
         check_status_code(): Retrieve and return the HTTP status code of the URL's response.
         check_content_length(): Calculate and return the content length of the URL's response.
+        check_fingerprint(): Return the fingerprint of the text and tag structure of the page.
         check_title(): Extract and return the title from the HTML content of the URL's response.
         check_word_in_body(word): Check if a specified word is present in the body of the URL's response.
-        check_js_files(): Identify, download, and hash JS files referenced in the web page.
+        check_js_files(): Identify, download, and hash JS files referenced in the web page,
+            returning the JsFile (hash and size) of each JS URL.
 
     Usage Example:
         url_inspector = URLInspector("https://example.com")
+        results = url_inspector.inspect(["status_code", "title"])
         status_code = url_inspector.check_status_code()
         content_length = url_inspector.check_content_length()
         title = url_inspector.check_title()
         is_word_present = url_inspector.check_word_in_body("Python")
-        js_hashes = url_inspector.check_js_files()
+        js_files = url_inspector.check_js_files()
     """
     INSPECTOR_DIR = BASE_DIR
-    BLACKLIST = ['jquery']
     JS_FILES_DIR = 'js_files'
     SCHEME_HTTPS = 'https://'
+    CHECKS = ('status_code', 'title', 'js_files', 'content_length', 'fingerprint')
 
-    def __init__(self, url):
+    def __init__(
+        self, url, client=None, conditional=False, blob_store=None, url_filter=None, first_party=None,
+        downloads=None, js_concurrency=JS_CONCURRENCY, max_js_size=JS_MAX_SIZE, parser_pool=None,
+        masking=None, versions=None, defer_validators=False, pace=None,
+    ):
 
-        if not validators.url(url):
+        if canonicalize(url) is None:
             raise ValueError('Invalid URL provided')
 
+        self.client = client or get_client()
+        self.blob_store = blob_store or get_blob_store()
+        self.url_filter = url_filter or JS_URL_FILTER
+        self.first_party = FIRST_PARTY if first_party is None else frozenset(first_party)
+        self.conditional = conditional
+        self.downloads = downloads
+        self.parser_pool = parser_pool or get_parser_pool()
+        self.masking = masking or get_masking_rules()
+        self.versions = versions
+        self.defer_validators = defer_validators
+        self.validators = []
+        self.pace = pace
+        self.js_concurrency = max(1, js_concurrency)
+        self.max_js_size = max_js_size
         self.url = self.add_scheme(url)
-        self.save_directory = self.create_save_directory()
-        self.response = self.fetch_response()
+        self.js_files = None
+        self.js_failed = []
+        self._response = None
+        self._save_directory = None
+        self._analysis = None
+        self._lowered_body = None
+        self._stream = None
+
+    @property
+    def response(self):
+        """
+        Return the URL's response, fetching it on first access.
+        """
+        if self._response is None:
+            self._response = self.fetch_response()
+        return self._response
 
-    def add_scheme(self, url):
+    @property
+    def save_directory(self):
         """
-        Add a scheme (https://) to the URL if it doesn't have one.
+        Return the JS files directory, creating it on first access.
         """
-        parsed_url = urlparse(url)
-        scheme = parsed_url.scheme
+        if self._save_directory is None:
+            self._save_directory = self.create_save_directory()
+        return self._save_directory
 
-        if not scheme:
-            return self.SCHEME_HTTPS + parsed_url.netloc + parsed_url.path.rstrip('/')
+    @property
+    def analysis(self):
+        """
+        Return the analysis of the page, parsing it on first access.
+        """
+        return self._analyze()
+
+    def _analyze(self, fingerprint=False):
+        # A page analyzed without its fingerprint is only parsed again if it is then asked for.
+        if self._analysis is None or (fingerprint and self._analysis.fingerprint is None):
+            response = self.response
+            with METRICS.time('parse'):
+                self._analysis = self.parser_pool.analyze(response, fingerprint=fingerprint)
+        return self._analysis
+
+    @property
+    def not_modified(self):
+        """
+        Return True if a conditional fetch of the page returned 304 Not Modified.
+        """
+        if self._response is None and self._stream is not None:
+            return self.conditional and self._stream.status_code == 304
+        return self.conditional and self.response.status_code == 304
 
-        return url.rstrip('/')
+    def add_scheme(self, url):
+        """
+        Return the canonical form of the URL without trailing slash, with a
+        scheme (https://) if it doesn't have one.
+        """
+        return canonicalize(url).url.rstrip('/')
 
     def is_relative_url(self, url):
         """
         Check if a given URL is relative (doesn't have a domain).
         """
-        parsed_url = urlparse(url)
-        return not bool(parsed_url.netloc)
+        return is_relative(url)
 
     def extract_site_name(self, url):
-        extracted = tldextract.extract(url)
-        return extracted.domain
+        return site_name(url)
 
     def create_save_directory(self, custom_save_directory=None) -> str:
         """
@@ -90,107 +252,313 @@ class URLInspector:
 
             return custom_save_directory
         else:
-            base_url = urlparse(self.url).hostname
+            base_url = get_host(self.url)
             save_directory = os.path.join(
                 self.INSPECTOR_DIR, self.JS_FILES_DIR, base_url,
             )
             os.makedirs(save_directory, exist_ok=True)
             return save_directory
 
+    def get(self, **kwargs):
+        """
+        Send a GET request for the URL, retrying with certificate verification
+        disabled on SSL errors.
+        """
+        try:
+            return self.client.get(self.url, conditional=self.conditional, **kwargs)
+        except requests.exceptions.SSLError:
+            return self.client.get(self.url, conditional=self.conditional, verify=False, **kwargs)
+
     def fetch_response(self):
         """
         Fetch the URL's response, handling SSL errors by
         retrying with certificate verification disabled.
         """
-        try:
-            response = requests.get(self.url)
-        except requests.exceptions.SSLError:
-            response = requests.get(self.url, verify=False)
+        response = self.get()
+
+        if self.conditional and response.status_code == 200:
+            with METRICS.time('hash'):
+                content_hash = hashlib.md5(response.content).hexdigest()
+            self._remember(self.url, response, content_hash)
 
         return response
 
+    def stream(self, stop=STOP_TITLE, count_length=False, fingerprint=False):
+        """
+        Fetch the URL with a streamed GET and read the body only as far as needed.
+
+        The body is never buffered: parsing stops after the title (STOP_TITLE) or
+        the head (STOP_HEAD), and with ``stop=None`` only the headers are read.
+        The content length comes from the headers, or is counted while streaming,
+        and with ``fingerprint`` the whole page is parsed to fingerprint it.
+        Later checks reuse the streamed results when they cover them.
+
+        Returns:
+            StreamResult: The streamed results, memoized per instance.
+        """
+        if self._stream is None:
+            response = self.get(stream=True)
+            self._stream = stream_page(
+                response, stop=stop, count_length=count_length, hash_body=self.conditional and count_length,
+                fingerprint=fingerprint,
+            )
+            if self._stream.content_hash:
+                self._remember(self.url, response, self._stream.content_hash)
+        return self._stream
+
+    def inspect(self, checks=CHECKS, head_only=False):
+        """
+        Run the given checks with a single fetch of the URL.
+
+        Unless JS files are checked, the page is streamed and its body is only read
+        as far as needed: up to the title, or to its end to count its length or
+        fingerprint it.
+
+        Args:
+            checks: The names of the checks to run, from URLInspector.CHECKS.
+            head_only (bool): Only look for JS files in the head of the page, which
+                also lets the JS check stream the page.
+
+        Returns:
+            dict: The result of each check, keyed by check name.
+        """
+        checks = set(checks)
+        unknown = checks.difference(self.CHECKS)
+        if unknown:
+            raise ValueError(f"Unknown checks: {', '.join(sorted(unknown))}")
+
+        if self._response is None and ('js_files' not in checks or head_only):
+            if 'js_files' in checks:
+                stop = STOP_HEAD
+            elif 'title' in checks:
+                stop = STOP_TITLE
+            else:
+                stop = None
+            self.stream(stop=stop, count_length='content_length' in checks, fingerprint='fingerprint' in checks)
+        elif 'fingerprint' in checks:
+            # The page is parsed once, for its fingerprint and its JS references.
+            self._analyze(fingerprint=True)
+
+        results = {}
+        if 'status_code' in checks:
+            results['status_code'] = self.check_status_code()
+        if 'title' in checks:
+            results['title'] = self.check_title()
+        if 'js_files' in checks:
+            js_urls = self._streamed_js_urls() if head_only and self._response is None else None
+            results['js_files'] = self.check_js_files(js_urls)
+        if 'content_length' in checks:
+            results['content_length'] = self.check_content_length()
+        if 'fingerprint' in checks:
+            results['fingerprint'] = self.check_fingerprint()
+        return results
+
     def check_status_code(self):
         """
         Return the status code of the URL's response.
         """
+        if self._response is None and self._stream is not None:
+            return self._stream.status_code
         return self.response.status_code
 
     def check_content_length(self):
         """
         Return the content length of the URL's response.
         """
+        if self._response is None and self._stream is not None and self._stream.content_length is not None:
+            return self._stream.content_length
         return len(self.response.content)
 
+    def check_fingerprint(self):
+        """
+        Return the fingerprint of the text and tag structure of the page, as
+        stored in UrlData, see Fingerprint.
+        """
+        if self._response is None and self._stream is not None and self._stream.fingerprint is not None:
+            return self._stream.fingerprint
+        return self._analyze(fingerprint=True).fingerprint
+
     def check_title(self):
         """
         Extract the title from the HTML content of the URL's response.
+        Returns '' if the page has no title, as a title of None means the
+        title of a record is not monitored.
         """
-        soup = BeautifulSoup(self.response.text, 'html.parser')
-        return soup.title.text.strip()
+        if self._response is None and self._stream is not None and self._stream.title_complete:
+            title = self._stream.title
+        else:
+            title = self.analysis.title
+        return '' if title is None else title
 
     def check_word_in_body(self, word):
         """
         Check if the given word is present in the body of the URL's response.
         """
-        return word.lower() in self.response.text.lower()
+        if self._lowered_body is None:
+            self._lowered_body = self.response.text.lower()
+        return word.lower() in self._lowered_body
 
-    def check_js_files(self):
+    def _streamed_js_urls(self):
+        stream = self.stream(stop=STOP_HEAD)
+        return self.find_js_urls(stream.modulepreloads + stream.scripts)
+
+    def find_js_urls(self, all_js=None):
         """
-        Check for blacklisted JS files in the URL's response, download and hash them, and save to a directory.
+        Return the first-party JS URLs referenced in the URL's response, or among
+        the given script and modulepreload URLs.
         """
-        base_url = urlparse(self.url).hostname
+        if all_js is None:
+            all_js = self.analysis.modulepreloads + self.analysis.scripts
 
-        soup = BeautifulSoup(self.response.text, 'html.parser')
-        js_tags = [
-            script['src']
-            for script in soup.find_all('script', src=True)
-        ]
+        base_url_path = f'{self.url}/'
+        base_domain_js_urls = []
+        for js_url in all_js:
+            if is_relative(js_url):
+                base_domain_js_urls.append(urljoin(base_url_path, js_url))
+            elif is_first_party(self.url, js_url, self.first_party):
+                base_domain_js_urls.append(self.SCHEME_HTTPS + js_url[2:] if js_url.startswith('//') else js_url)
 
-        js_modulepreload_links = soup.find_all(
-            'link', rel='modulepreload', href=re.compile(r'\.js$'),
-        )
-        js_links = [link['href'] for link in js_modulepreload_links]
+        return base_domain_js_urls
 
-        all_js = js_links + js_tags
+    def check_js_files(self, js_urls=None):
+        """
+        Check for blacklisted JS files in the URL's response, download and hash them, and save them
+        to the blob store, referenced by this URL. JS files no longer loaded by the page lose their
+        reference. The result is memoized, so the JS files are only downloaded once per instance.
+
+        Up to ``js_concurrency`` JS files are downloaded at once. Each one is streamed to the blob
+        store, hashed chunk by chunk and never held in memory, and skipped when it is larger than
+        ``max_js_size``. With shared ``downloads``, a JS file already downloaded for another page
+        of the run is not downloaded again.
+
+        JS files are revalidated with the client's validator cache: a 304 reuses the
+        stored hash without downloading, hashing or writing the file again, and its
+        size is unknown. When the page itself was not modified, the known JS URLs
+        must be given as ``js_urls``.
+
+        JS files are downloaded from the URLs the page loads them from, but known by
+        these URLs without the query parameters to strip, e.g. cache busters, which
+        are the keys of the result. When the page was not modified, the known JS files
+        are downloaded from the URLs they were last downloaded from, remembered by the
+        client's validator cache. The masks of their site are applied to the JS files
+        before they are hashed and stored, see MaskingRules.
+
+        JS files that could not be fetched are left out of the result and listed in
+        ``js_failed``, so the caller can keep what it knew of them.
+
+        Returns:
+            dict: The JsFile of each JS file fetched, keyed by URL, in page order.
+        """
+        if self.js_files is not None:
+            return self.js_files
+
+        if js_urls is None:
+            if self.not_modified:
+                raise ValueError('JS URLs are required when the page was not modified')
+            js_urls = self.find_js_urls()
+
+        # The URL each JS file is downloaded from, keyed by the URL it is known by.
+        sources = {}
+        for js_url in js_urls:
+            if self.url_filter.allows(js_url):
+                sources.setdefault(self.masking.strip_url(js_url), js_url)
+        if self.not_modified:
+            sources = {js_url: self.client.source(js_url) or source for js_url, source in sources.items()}
+
+        js_urls = list(sources)
+        workers = min(self.js_concurrency, len(js_urls))
+        if workers > 1:
+            with ThreadPoolExecutor(workers) as executor:
+                results = list(executor.map(self._check_js_file, js_urls, sources.values()))
+        else:
+            results = [self._check_js_file(js_url, sources[js_url]) for js_url in js_urls]
 
-        base_url_path = f'{self.url}/'
-        site_name = self.extract_site_name(self.url)
-        base_domain_js_urls = [
-            urljoin(base_url_path, js_url) if self.is_relative_url(
-                js_url,
-            ) else js_url
-            for js_url in all_js
-            if self.is_relative_url(js_url) or site_name in js_url
-        ]
-
-        base_domain_js_urls = [
-            url.replace(
-                '//', self.SCHEME_HTTPS,
-            ) if url.startswith('//') else url for url in base_domain_js_urls
-        ]
-
-        js_hashes = []
-        with requests.Session() as session:
-            for js_url in base_domain_js_urls:
-                if not any(blacklisted in js_url for blacklisted in self.BLACKLIST):
-                    try:
-                        js_response = session.get(js_url)
-                        js_response.raise_for_status()  # Check for HTTP status code other than 200
-                        js_hash = hashlib.md5(js_response.content).hexdigest()
-                        js_file_path = os.path.join(
-                            self.save_directory, f'{base_url}-{js_hash}.js',
-                        )
-
-                        with open(js_file_path, 'wb') as file:
-                            file.write(js_response.content)
-
-                        js_hashes.append(f'{js_url}|{js_hash}')
-                    except requests.exceptions.RequestException as e:
-                        logging.error(f"Error fetching JS URL '{js_url}': {e}")
-
-                    except Exception as e:
-                        logging.error(
-                            f"Unexpected error for JS URL '{js_url}': {e}",
-                        )
-
-        return ','.join(js_hashes)
+        js_files = {js_url: js_file for js_url, js_file in zip(js_urls, results) if js_file is not None}
+        self.js_failed = [js_url for js_url, js_file in zip(js_urls, results) if js_file is None]
+        # A JS file that failed is still loaded by the page: it keeps its blob.
+        self.blob_store.retain(self.url, list(js_files) + self.js_failed)
+        self.js_files = js_files
+        return self.js_files
+
+    def download_js_file(self, js_url, source=None):
+        """
+        Download a JS file into the blob store, or revalidate it, from ``source``
+        when it is known by a URL without its cache busters.
+
+        Returns:
+            tuple: The JsFile and the key of its blob, None when it was not modified.
+
+        Raises:
+            JsFileTooLarge: The JS file is larger than ``max_js_size``.
+            requests.exceptions.RequestException: The download failed.
+        """
+        source = source or js_url
+        if self.pace is not None:
+            self.pace(source)
+        js_response = self.client.get(source, conditional=True, stream=True)
+        try:
+            js_response.raise_for_status()  # Check for HTTP status code other than 200
+            cached = self.client.cached(source, js_response)
+            if cached:
+                # Reading the empty body gives the connection back to the pool.
+                js_response.content
+                return JsFile(cached.content_hash, None), None
+
+            length = header_content_length(js_response)
+            if self.max_js_size and length is not None and length > self.max_js_size:
+                raise JsFileTooLarge(f'{length} bytes')
+            masks = self.masking.for_url(js_url)
+            blob = self.blob_store.put_stream(masks.mask_chunks(self._limited(js_response.iter_content(STREAM_CHUNK_SIZE))))
+            self._remember(source, js_response, blob.md5)
+            if source != js_url:
+                self.client.remember_source(js_url, source)
+            self._add_version(js_url, blob)
+            return JsFile(blob.md5, blob.size), blob.key
+        finally:
+            js_response.close()
+
+    def _remember(self, url, response, content_hash):
+        if not self.defer_validators:
+            self.client.remember(url, response, content_hash)
+            return
+        entry = self.client.validators(url, response, content_hash)
+        if entry is not None:
+            self.validators.append(entry)
+
+    def _add_version(self, js_url, blob):
+        # The history is best effort: failing to keep a version does not fail the check.
+        if self.versions is None:
+            return
+        try:
+            if not self.versions.has(js_url, blob.md5):
+                self.versions.add(js_url, blob.md5, self.blob_store.get(blob.key))
+        except Exception as e:
+            logger.error(f"Error adding a version of JS URL '{js_url}' to the history: {e}", extra={'url': js_url})
+
+    def _limited(self, chunks):
+        size = 0
+        for chunk in chunks:
+            size += len(chunk)
+            if self.max_js_size and size > self.max_js_size:
+                raise JsFileTooLarge(f'more than {self.max_js_size} bytes')
+            yield chunk
+
+    def _check_js_file(self, js_url, source=None):
+        try:
+            if self.downloads is None:
+                js_file, key = self.download_js_file(js_url, source)
+            else:
+                js_file, key = self.downloads.get(js_url, partial(self.download_js_file, source=source))
+        except JsFileTooLarge as e:
+            logger.warning(f"Skipped JS URL '{js_url}', too large: {e}", extra={'url': js_url})
+            return None
+        except requests.exceptions.RequestException as e:
+            logger.error(f"Error fetching JS URL '{js_url}': {e}", extra={'url': js_url})
+            return None
+        except Exception as e:
+            logger.error(f"Unexpected error for JS URL '{js_url}': {e}", extra={'url': js_url})
+            return None
+
+        if key is not None:
+            self.blob_store.link(self.url, js_url, key)
+        return js_file
@@ -0,0 +1,218 @@
+import ipaddress
+import re
+from functools import lru_cache
+from typing import FrozenSet
+from typing import Iterable
+from typing import NamedTuple
+from typing import Optional
+from typing import Pattern
+from urllib.parse import urlsplit
+from urllib.parse import urlunsplit
+
+from .config import FIRST_PARTY_DOMAINS
+from .config import JS_ALLOWLIST
+from .config import JS_BLACKLIST
+from .config import URL_CACHE_SIZE
+
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+_HOST_LABEL = re.compile(r'(?!-)[a-z0-9_-]{1,63}(?<!-)')
+_ABSOLUTE = re.compile(r'(?:[a-zA-Z][a-zA-Z0-9+.-]*:)?//')
+
+
+class Host(NamedTuple):
+    subdomain: str
+    domain: str
+    suffix: str
+
+    @property
+    def registered_domain(self) -> str:
+        """The domain and its public suffix, e.g. 'example.co.uk', or the IP address."""
+        return f'{self.domain}.{self.suffix}' if self.suffix else self.domain
+
+
+class CanonicalUrl(NamedTuple):
+    url: str
+    scheme: str
+    host: str
+    port: Optional[int]
+
+
+@lru_cache(maxsize=None)
+def _extractor():
+    """
+    Return the public suffix list snapshot bundled with tldextract: it is
+    never refreshed from the network nor cached on disk.
+    """
+    # tldextract takes a while to import, the CLI commands that do not split
+    # hostnames go without it.
+    import tldextract
+
+    return tldextract.TLDExtract(suffix_list_urls=(), cache_dir=None)
+
+
+@lru_cache(maxsize=URL_CACHE_SIZE)
+def split_host(host: str) -> Host:
+    """
+    Split a hostname into its subdomain, domain and public suffix.
+    """
+    extracted = _extractor()(host)
+    return Host(extracted.subdomain, extracted.domain, extracted.suffix)
+
+
+def _canonical_host(host: str) -> Optional[str]:
+    try:
+        host = host.encode('idna').decode('ascii') if not host.isascii() else host
+    except UnicodeError:
+        return None
+    host = host.rstrip('.')
+    if host == 'localhost':
+        return host
+    try:
+        return str(ipaddress.ip_address(host))
+    except ValueError:
+        pass
+    labels = host.split('.')
+    if len(host) > 253 or len(labels) < 2 or not all(_HOST_LABEL.fullmatch(label) for label in labels):
+        return None
+    return host
+
+
+@lru_cache(maxsize=URL_CACHE_SIZE)
+def canonicalize(url: str) -> Optional[CanonicalUrl]:
+    """
+    Parse a URL into its canonical form, or return None if it is not a valid
+    HTTP(S) URL.
+
+    A bare hostname gets the https scheme, the scheme and the hostname are
+    lowercased (and IDNA encoded), the default port, the credentials, the
+    fragment and the slash of an empty path are dropped. The path and the
+    query are kept as they are.
+    """
+    url = url.strip()
+    if not url or url.startswith('#'):
+        return None
+    if '//' not in url:
+        url = f'https://{url}'
+
+    try:
+        parsed = urlsplit(url)
+        port = parsed.port
+    except ValueError:
+        return None
+    scheme = parsed.scheme.lower()
+    host = _canonical_host(parsed.hostname or '')
+    if scheme not in DEFAULT_PORTS or host is None:
+        return None
+
+    if port == DEFAULT_PORTS[scheme]:
+        port = None
+    netloc = f'[{host}]' if ':' in host else host
+    if port is not None:
+        netloc = f'{netloc}:{port}'
+    path = '' if parsed.path == '/' else parsed.path
+    return CanonicalUrl(urlunsplit((scheme, netloc, path, parsed.query, '')), scheme, host, port)
+
+
+def normalize_url(url: str) -> Optional[str]:
+    """
+    Return the canonical form of a URL, or None if it is not a valid HTTP(S) URL.
+    """
+    canonical = canonicalize(url)
+    return canonical.url if canonical else None
+
+
+@lru_cache(maxsize=URL_CACHE_SIZE)
+def get_host(url: str) -> str:
+    """
+    Return the lowercased hostname of a URL, with or without a scheme.
+    """
+    parsed = urlsplit(url if '//' in url else f'//{url}')
+    return (parsed.hostname or url).lower()
+
+
+def is_relative(url: str) -> bool:
+    """
+    Return True if a URL has no host, e.g. '/static/app.js'.
+    """
+    return not _ABSOLUTE.match(url)
+
+
+def site_name(url: str) -> str:
+    """
+    Return the name of the site of a URL, its domain without public suffix,
+    e.g. 'example' for 'https://www.example.co.uk'.
+    """
+    return split_host(get_host(url)).domain
+
+
+def is_first_party(page_url: str, url: str, domains: FrozenSet[str] = frozenset()) -> bool:
+    """
+    Return True if a URL loaded by a page belongs to the same site.
+
+    Relative URLs do, and so do the absolute URLs whose site name is the one
+    of the page, e.g. 'cdn.example.net' for 'www.example.com', or whose
+    registered domain is among ``domains``.
+    """
+    if is_relative(url):
+        return True
+    host = split_host(get_host(url))
+    return host.domain == site_name(page_url) or host.registered_domain in domains
+
+
+def _trie_pattern(words: Iterable[str]) -> str:
+    """
+    Return a regex matching any of the words, with their common prefixes
+    factored so a match is tried once per position, whatever the number of words.
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = {}
+
+    def build(node) -> str:
+        # A word ending here matches: the longer words starting with it add nothing.
+        if '' in node:
+            return ''
+        alternatives = [re.escape(char) + build(child) for char, child in sorted(node.items())]
+        return alternatives[0] if len(alternatives) == 1 else f"(?:{'|'.join(alternatives)})"
+
+    return build(trie)
+
+
+def compile_patterns(words: Iterable[str]) -> Optional[Pattern]:
+    """
+    Compile substrings into a single case insensitive regex, or None when there are none.
+    """
+    words = [word.lower() for word in words if word]
+    return re.compile(_trie_pattern(words), re.IGNORECASE) if words else None
+
+
+class UrlFilter:
+    """
+    UrlFilter selects the URLs to fetch with a blacklist and an allowlist of substrings.
+
+    Each list is compiled into a single regex, so filtering a URL takes one
+    scan of the URL whatever the number of patterns.
+
+    Usage Example:
+        url_filter = UrlFilter(blacklist=['jquery', 'analytics'])
+        url_filter.allows('https://example.com/jquery.min.js')  # False
+    """
+
+    def __init__(self, blacklist: Iterable[str] = (), allowlist: Iterable[str] = ()) -> None:
+
+        self._blacklist = compile_patterns(blacklist)
+        self._allowlist = compile_patterns(allowlist)
+
+    def allows(self, url: str) -> bool:
+        if self._blacklist is not None and self._blacklist.search(url):
+            return False
+        return self._allowlist is None or self._allowlist.search(url) is not None
+
+
+JS_URL_FILTER = UrlFilter(JS_BLACKLIST, JS_ALLOWLIST)
+FIRST_PARTY = frozenset(domain.lower() for domain in FIRST_PARTY_DOMAINS)
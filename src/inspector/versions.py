@@ -0,0 +1,191 @@
+import difflib
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Iterator
+from typing import List
+from typing import NamedTuple
+from typing import Optional
+
+from .config import get_logger
+from .config import HISTORY_KEYFRAME_INTERVAL
+from .config import VERSIONS_PATH
+from .delta import apply_delta
+from .delta import make_delta
+from .masking import asset_name
+from .metrics import METRICS
+
+
+logger = get_logger()
+
+# Lines longer than this, e.g. of minified bundles, are split after each
+# semicolon and brace to be diffed.
+MAX_LINE_LENGTH = 200
+JS_LINE_END = re.compile(r'(?<=[;{}])')
+
+
+class VersionInfo(NamedTuple):
+    id: int
+    url: str
+    md5: str
+    size: int
+    stored_size: int
+    keyframe: bool
+    created_at: float
+
+
+class VersionStore:
+    """
+    VersionStore keeps every version of the JS files, delta compressed.
+
+    The versions of a JS file, i.e. of the JS URLs with the same asset_name(),
+    form chains: each version is stored as a delta against the previous one,
+    or as a full copy, a keyframe, every ``keyframe_interval`` versions and
+    whenever the delta is not smaller. A version is read back by applying at
+    most ``keyframe_interval`` deltas to a keyframe, so the store grows with
+    the size of the changes, not with the number of versions. Versions are
+    never deleted, unlike the blobs of the BlobStore.
+
+    Usage Example:
+        versions = VersionStore()
+        if not versions.has(js_url, md5):
+            versions.add(js_url, md5, content)
+        content = versions.get(js_url, md5)
+    """
+
+    COMMIT_EVERY = 20
+
+    def __init__(
+        self,
+        path=VERSIONS_PATH,
+        keyframe_interval: int = HISTORY_KEYFRAME_INTERVAL,
+        commit_every: int = COMMIT_EVERY,
+    ) -> None:
+
+        self.keyframe_interval = max(1, keyframe_interval)
+        self.commit_every = commit_every
+        self._lock = threading.Lock()
+        self._pending = 0
+
+        self.connection = sqlite3.connect(str(path), check_same_thread=False, timeout=30)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(
+            'CREATE TABLE IF NOT EXISTS versions ('
+            'id INTEGER PRIMARY KEY, name TEXT NOT NULL, url TEXT NOT NULL, md5 TEXT NOT NULL, '
+            'size INTEGER NOT NULL, base_id INTEGER, depth INTEGER NOT NULL, data BLOB NOT NULL, '
+            'created_at REAL NOT NULL, UNIQUE (name, md5));',
+        )
+        self.connection.commit()
+
+    def has(self, url: str, md5: str) -> bool:
+        """Return True if the version of a JS file with this MD5 is stored."""
+        with self._lock:
+            return self._find(asset_name(url), md5) is not None
+
+    def add(self, url: str, md5: str, content: bytes) -> bool:
+        """
+        Store a version of a JS file, unless it is stored already.
+
+        Returns:
+            bool: True if the version was added.
+        """
+        name = asset_name(url)
+        with self._lock, METRICS.time('history'):
+            if self._find(name, md5) is not None:
+                return False
+            latest = self.connection.execute(
+                'SELECT id, depth FROM versions WHERE name = ? ORDER BY id DESC LIMIT 1', (name,),
+            ).fetchone()
+
+            data, base_id, depth = zlib.compress(content, 6), None, 0
+            if latest is not None and latest[1] + 1 < self.keyframe_interval:
+                delta = zlib.compress(make_delta(self._content(latest[0]), content), 6)
+                if len(delta) < len(data):
+                    data, base_id, depth = delta, latest[0], latest[1] + 1
+
+            self.connection.execute(
+                'INSERT OR IGNORE INTO versions (name, url, md5, size, base_id, depth, data, created_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (name, url, md5, len(content), base_id, depth, data, time.time()),
+            )
+            self._committed()
+        METRICS.inc('history_bytes_written', len(data))
+        return True
+
+    def get(self, url: str, md5: str) -> bytes:
+        """
+        Return the content of a version of a JS file.
+
+        Raises:
+            KeyError: If the version is not stored.
+        """
+        with self._lock:
+            version_id = self._find(asset_name(url), md5)
+            if version_id is None:
+                raise KeyError(f'{url} {md5}')
+            return self._content(version_id)
+
+    def versions(self, url: str) -> List[VersionInfo]:
+        """Return the versions of a JS file, oldest first."""
+        with self._lock:
+            rows = self.connection.execute(
+                'SELECT id, url, md5, size, length(data), base_id IS NULL, created_at '
+                'FROM versions WHERE name = ? ORDER BY id', (asset_name(url),),
+            ).fetchall()
+        return [VersionInfo(id_, url_, md5, size, stored, bool(keyframe), created) for id_, url_, md5, size, stored, keyframe, created in rows]
+
+    def close(self) -> None:
+        """
+        Commit pending changes and close the store. Closing twice is a no-op.
+        """
+        with self._lock:
+            if self.connection is None:
+                return
+            self.connection.commit()
+            self.connection.close()
+            self.connection = None
+
+    def _find(self, name: str, md5: str) -> Optional[int]:
+        row = self.connection.execute(
+            'SELECT id FROM versions WHERE name = ? AND md5 = ?', (name, md5),
+        ).fetchone()
+        return row[0] if row else None
+
+    def _content(self, version_id: int) -> bytes:
+        # Walk back to the keyframe, then apply the deltas from it.
+        chain = []
+        while version_id is not None:
+            base_id, data = self.connection.execute(
+                'SELECT base_id, data FROM versions WHERE id = ?', (version_id,),
+            ).fetchone()
+            chain.append(zlib.decompress(data))
+            version_id = base_id
+        content = chain.pop()
+        for delta in reversed(chain):
+            content = apply_delta(content, delta)
+        return content
+
+    def _committed(self) -> None:
+        self._pending += 1
+        if self._pending >= self.commit_every:
+            self.connection.commit()
+            self._pending = 0
+
+
+def split_lines(content: bytes) -> List[str]:
+    """Split a JS file into lines, splitting its long lines into statements."""
+    lines = []
+    for line in content.decode(errors='replace').splitlines():
+        if len(line) > MAX_LINE_LENGTH:
+            lines.extend(part for part in JS_LINE_END.split(line) if part)
+        else:
+            lines.append(line)
+    return lines
+
+
+def diff_versions(old: bytes, new: bytes, old_name: str = 'a', new_name: str = 'b', context: int = 3) -> Iterator[str]:
+    """Yield the lines of the unified diff of two versions of a JS file."""
+    return difflib.unified_diff(split_lines(old), split_lines(new), old_name, new_name, n=context, lineterm='')
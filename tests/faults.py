@@ -0,0 +1,89 @@
+"""
+Fault injection: a local HTTP server simulating misbehaving hosts.
+
+The path of a request selects its fault:
+
+    /ok            answers at once.
+    /slow/<s>      waits <s> seconds before answering.
+    /hang          never answers, until the server stops.
+    /drip          sends its headers, then one byte of the body every 50ms.
+    /flap/<n>      answers 503 to the first <n> requests, then 200.
+    /reset         closes the connection without answering.
+
+Every server listens on 127.0.0.1 and counts the requests received per path.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+
+BODY = b'<html><head><title>ok</title></head><body></body></html>'
+
+
+class FaultHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.hits[self.path] += 1
+        fault, _, argument = self.path.split('?')[0].strip('/').partition('/')
+
+        if fault == 'slow':
+            time.sleep(float(argument))
+        elif fault == 'hang':
+            self.server.stopping.wait()
+            return
+        elif fault == 'drip':
+            return self.drip()
+        elif fault == 'flap' and self.server.hits[self.path] <= int(argument):
+            return self.answer(503, b'unavailable')
+        elif fault == 'reset':
+            self.close_connection = True
+            return
+
+        self.answer(200, BODY)
+
+    def answer(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def drip(self):
+        self.send_response(200)
+        self.send_header('Content-Length', '100000')
+        self.end_headers()
+        try:
+            while not self.server.stopping.wait(0.05):
+                self.wfile.write(b' ')
+                self.wfile.flush()
+        except OSError:
+            pass
+        self.close_connection = True
+
+    def log_message(self, *args):
+        pass
+
+
+class FaultServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), FaultHandler)
+        self.hits = Counter()
+        self.stopping = threading.Event()
+        self.base_url = f'http://127.0.0.1:{self.server_port}'
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopping.set()
+        self.shutdown()
+        self.server_close()
+
+    def url(self, path):
+        return f'{self.base_url}{path}'
@@ -0,0 +1,74 @@
+from __future__ import annotations
+
+import unittest
+
+from inspector.analysis import analyze
+from inspector.analysis import available_parsers
+from inspector.analysis import get_parser
+from inspector.analysis import PageTokenizer
+from inspector.fingerprint import fingerprint_html
+
+PAGES = [
+    '<html><head><title> Hello  </title></head><body></body></html>',
+    '<html><head><title>A <b>b</b> c &amp; d</title><script src>x</script><script src="">y</script>'
+    '<script src="/a.js"></script><link rel="modulepreload foo" href="/m.js">'
+    '<link rel="MODULEPRELOAD" href="/n.js"><link rel=modulepreload href="/o.js?x">'
+    '<link rel="stylesheet" href="/s.js"></head><body><script>inline()</script>'
+    '<script type="module" src="https://cdn.site.com/b.js"></script></body></html>',
+    '<html><body><svg><title>icon</title></svg><p>no head title</p></body></html>',
+    '<p>no title at all</p>',
+]
+
+
+# What the former code extracted from PAGES with BeautifulSoup.
+EXPECTED = [
+    ('Hello', [], []),
+    ('A b c & d', ['', '', '/a.js', 'https://cdn.site.com/b.js'], ['/m.js']),
+    ('icon', [], []),
+    (None, [], []),
+]
+
+
+class TestAnalysis(unittest.TestCase):
+
+    def test_matches_former_analysis(self):
+        for parser in available_parsers():
+            for html, expected in zip(PAGES, EXPECTED):
+                with self.subTest(parser=parser, html=html):
+                    analysis = analyze(html, parser=parser)
+                    self.assertEqual((analysis.title, analysis.scripts, analysis.modulepreloads), expected)
+
+    def test_fingerprint_in_the_same_parse(self):
+        for html in PAGES:
+            with self.subTest(html=html):
+                analysis = analyze(html, fingerprint=True)
+                self.assertEqual(analysis[:3], analyze(html)[:3])
+                self.assertEqual(analysis.fingerprint, str(fingerprint_html(html)))
+        self.assertIsNone(analyze(PAGES[0]).fingerprint)
+
+    def test_keyword_hits(self):
+        analysis = analyze(PAGES[0], keywords=['hello', 'BODY', 'missing'])
+        self.assertEqual(analysis.keyword_hits, {'hello': True, 'BODY': True, 'missing': False})
+
+    def test_unknown_parser(self):
+        with self.assertRaises(ValueError):
+            get_parser('no-such-parser')
+
+    def test_auto_parser(self):
+        self.assertIn('html.parser', available_parsers())
+        self.assertTrue(callable(get_parser('auto')))
+
+    def test_tokenizer_is_incremental(self):
+        tokenizer = PageTokenizer()
+        tokenizer.feed('<html><head><tit')
+        self.assertFalse(tokenizer.title_done)
+        tokenizer.feed('le>Split</title>')
+        self.assertTrue(tokenizer.title_done)
+        self.assertFalse(tokenizer.head_done)
+        tokenizer.feed('</head>')
+        self.assertTrue(tokenizer.head_done)
+        self.assertEqual(tokenizer.title, 'Split')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+
+from inspector.blobstore import BlobStore
+
+
+class TestBlobStore(unittest.TestCase):
+    def setUp(self):
+
+        self.temp_dir = tempfile.mkdtemp()
+        self.store = self.open_store()
+
+    def tearDown(self):
+
+        self.store.close()
+        shutil.rmtree(self.temp_dir)
+
+    def open_store(self, retention_days=30):
+        return BlobStore(
+            root=os.path.join(self.temp_dir, 'blobs'),
+            index_path=os.path.join(self.temp_dir, 'blobs.db'),
+            retention_days=retention_days,
+        )
+
+    def blob_files(self):
+        root = os.path.join(self.temp_dir, 'blobs')
+        return [
+            os.path.join(directory, name)
+            for directory, _, names in os.walk(root) for name in names
+        ]
+
+    def test_put_and_get(self):
+        data = b'console.log("hello");' * 100
+        info = self.store.put(data)
+
+        self.assertEqual(info.md5, hashlib.md5(data).hexdigest())
+        self.assertEqual(info.size, len(data))
+        self.assertEqual(self.store.get(info.key), data)
+        path = self.store.path(info.key)
+        self.assertEqual(path.parent.name, info.key[2:4])
+        self.assertEqual(path.parent.parent.name, info.key[:2])
+        self.assertLess(path.stat().st_size, len(data))
+
+    def test_put_stream(self):
+        info = self.store.put_stream([b'part one ', b'part two'])
+        self.assertEqual(self.store.get(info.key), b'part one part two')
+
+    def test_blobs_are_written_once(self):
+        shared = b'var shared = 1;'
+        first = self.store.put(shared)
+        second = self.store.put(shared)
+        self.store.link('https://a.com', 'https://cdn.com/shared.js', first.key)
+        self.store.link('https://b.com', 'https://cdn.com/shared.js', second.key)
+
+        self.assertEqual(first.key, second.key)
+        self.assertEqual(len(self.blob_files()), 1)
+
+    def test_no_temp_files_left(self):
+        self.store.put(b'a')
+        self.assertFalse(any(os.path.basename(path).startswith('.tmp-') for path in self.blob_files()))
+
+    def test_gc_deletes_unreferenced_blobs_after_retention(self):
+        old = self.store.put(b'old version')
+        new = self.store.put(b'new version')
+        shared = self.store.put(b'shared')
+        self.store.link('https://a.com', 'https://a.com/app.js', old.key)
+        self.store.link('https://a.com', 'https://a.com/lib.js', shared.key)
+        self.store.link('https://b.com', 'https://b.com/lib.js', shared.key)
+
+        # The page now loads a new version of app.js and no longer loads lib.js.
+        self.store.link('https://a.com', 'https://a.com/app.js', new.key)
+        self.store.retain('https://a.com', ['https://a.com/app.js'])
+
+        self.assertEqual(self.store.gc(), (0, 0))
+        deleted, freed = self.store.gc(retention_days=0)
+
+        self.assertEqual(deleted, 1)
+        self.assertGreater(freed, 0)
+        with self.assertRaises(KeyError):
+            self.store.get(old.key)
+        self.assertEqual(self.store.get(new.key), b'new version')
+        self.assertEqual(self.store.get(shared.key), b'shared')
+
+    def test_index_survives_reopen(self):
+        info = self.store.put(b'persisted')
+        self.store.link('https://a.com', 'https://a.com/app.js', info.key)
+        self.store.close()
+
+        self.store = self.open_store()
+        self.assertEqual(self.store.get(info.key), b'persisted')
+        self.assertEqual(self.store.gc(retention_days=0), (0, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
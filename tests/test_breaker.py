@@ -0,0 +1,83 @@
+from __future__ import annotations
+
+import os
+import tempfile
+import unittest
+
+from inspector.breaker import CircuitBreaker
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    def setUp(self):
+
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp_dir.name, 'breaker.db')
+        self.clock = FakeClock()
+        self.breaker = self.make_breaker()
+
+    def tearDown(self):
+
+        self.breaker.close()
+        self.temp_dir.cleanup()
+
+    def make_breaker(self):
+        return CircuitBreaker(self.path, threshold=3, cooldown=10, max_cooldown=25, clock=self.clock)
+
+    def fail(self, host, times):
+        for _ in range(times):
+            self.breaker.record(host, False)
+
+    def test_opens_after_consecutive_failures(self):
+        self.fail('a.com', 2)
+        self.breaker.record('a.com', True)
+        self.fail('a.com', 2)
+        self.assertTrue(self.breaker.allow('a.com'))
+
+        self.fail('a.com', 1)
+        self.assertFalse(self.breaker.allow('a.com'))
+        self.assertTrue(self.breaker.allow('b.com'))
+        self.assertEqual(self.breaker.open_hosts(), ['a.com'])
+
+    def test_half_open_lets_one_trial_through(self):
+        self.fail('a.com', 3)
+        self.clock.now += 10
+
+        self.assertTrue(self.breaker.allow('a.com'))
+        self.assertFalse(self.breaker.allow('a.com'))
+
+        self.breaker.record('a.com', True)
+        self.assertTrue(self.breaker.allow('a.com'))
+        self.assertTrue(self.breaker.allow('a.com'))
+
+    def test_cooldown_doubles_up_to_the_maximum(self):
+        self.fail('a.com', 3)
+        self.clock.now += 10
+        for cooldown in (20, 25, 25):
+            # The trial fails and the circuit opens again for longer.
+            self.assertTrue(self.breaker.allow('a.com'))
+            self.breaker.record('a.com', False)
+            self.clock.now += cooldown - 1
+            self.assertFalse(self.breaker.allow('a.com'))
+            self.clock.now += 1
+
+    def test_state_is_persisted(self):
+        self.fail('a.com', 3)
+        self.fail('b.com', 1)
+        self.breaker.close()
+
+        self.breaker = self.make_breaker()
+        self.assertFalse(self.breaker.allow('a.com'))
+        self.fail('b.com', 2)
+        self.assertFalse(self.breaker.allow('b.com'))
+
+
+if __name__ == '__main__':
+    unittest.main()
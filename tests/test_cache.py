@@ -0,0 +1,146 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from unittest import mock
+
+from inspector.blobstore import BlobStore
+from inspector.cache import ValidatorCache
+from inspector.httpclient import HTTPClient
+from inspector.masking import MaskingRules
+from inspector.urlinspector import URLInspector
+
+PAGE = b'<html><head><title>Site</title><script src="/app.js"></script></head></html>'
+SCRIPT = b'console.log("app");' * 1000
+
+
+class ValidatingHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    page = PAGE
+    paths_seen = []
+    bodies_sent = []
+
+    def do_GET(self):
+        self.paths_seen.append(self.path)
+        body = self.page if self.path == '/' else SCRIPT
+        etag = '"%s"' % hashlib.md5(body).hexdigest()
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+
+        self.bodies_sent.append(self.path)
+        self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestValidatorCache(unittest.TestCase):
+    def setUp(self):
+
+        self.temp_dir = tempfile.mkdtemp()
+        ValidatingHandler.paths_seen = []
+        ValidatingHandler.bodies_sent = []
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), ValidatingHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+        self.blob_store = BlobStore(
+            root=os.path.join(self.temp_dir, 'blobs'),
+            index_path=os.path.join(self.temp_dir, 'blobs.db'),
+        )
+
+    def tearDown(self):
+
+        self.blob_store.close()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.temp_dir)
+
+    def new_client(self):
+        return HTTPClient(cache=ValidatorCache(os.path.join(self.temp_dir, 'cache.db')))
+
+    def inspector(self, client, conditional=True):
+        return URLInspector(self.url, client=client, conditional=conditional, blob_store=self.blob_store)
+
+    def stored_blobs(self):
+        return self.blob_store.connection.execute('SELECT COUNT(*) FROM blobs').fetchone()[0]
+
+    def test_not_modified_short_circuits(self):
+        with self.new_client() as client:
+            first = self.inspector(client)
+            first_files = first.check_js_files()
+            self.assertFalse(first.not_modified)
+
+        self.assertEqual(ValidatingHandler.bodies_sent, ['/', '/app.js'])
+        self.assertEqual(self.stored_blobs(), 1)
+        self.blob_store.connection.execute('DELETE FROM blobs')
+
+        with self.new_client() as client:
+            second = self.inspector(client)
+            self.assertTrue(second.not_modified)
+            second_files = second.check_js_files([f'{self.url}/app.js'])
+
+        self.assertEqual(
+            {url: js_file.hash for url, js_file in second_files.items()},
+            {url: js_file.hash for url, js_file in first_files.items()},
+        )
+        self.assertEqual(ValidatingHandler.bodies_sent, ['/', '/app.js'])
+        self.assertEqual(self.stored_blobs(), 0)
+
+    def test_not_modified_js_files_are_fetched_from_their_source(self):
+        masking = MaskingRules({'strip_params': ['v']}, {})
+        with mock.patch.object(ValidatingHandler, 'page', b'<html><head><script src="/app.js?v=7"></script></head></html>'):
+            with self.new_client() as client:
+                first_files = URLInspector(
+                    self.url, client=client, conditional=True, blob_store=self.blob_store, masking=masking,
+                ).check_js_files()
+            with self.new_client() as client:
+                second = URLInspector(self.url, client=client, conditional=True, blob_store=self.blob_store, masking=masking)
+                self.assertTrue(second.not_modified)
+                second_files = second.check_js_files(list(first_files))
+
+        self.assertEqual(list(first_files), [f'{self.url}/app.js'])
+        self.assertEqual(second_files, {f'{self.url}/app.js': (first_files[f'{self.url}/app.js'].hash, None)})
+        self.assertEqual(ValidatingHandler.paths_seen, ['/', '/app.js?v=7', '/', '/app.js?v=7'])
+        self.assertEqual(ValidatingHandler.bodies_sent, ['/', '/app.js?v=7'])
+
+    def test_unconditional_fetch_downloads_page(self):
+        with self.new_client() as client:
+            self.inspector(client).check_title()
+            inspector = self.inspector(client, conditional=False)
+
+        self.assertFalse(inspector.not_modified)
+        self.assertEqual(inspector.check_title(), 'Site')
+
+    def test_not_modified_requires_js_urls(self):
+        with self.new_client() as client:
+            self.inspector(client).check_title()
+            inspector = self.inspector(client)
+
+            with self.assertRaises(ValueError):
+                inspector.check_js_files()
+
+    def test_responses_without_validators_are_not_stored(self):
+        cache = ValidatorCache(os.path.join(self.temp_dir, 'cache.db'))
+        response = mock.Mock(status_code=200, headers={})
+        cache.store('https://example.com/a.js', response, 'abc')
+
+        self.assertIsNone(cache.get('https://example.com/a.js'))
+        self.assertEqual(cache.conditional_headers('https://example.com/a.js'), {})
+        cache.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
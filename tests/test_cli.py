@@ -0,0 +1,90 @@
+from __future__ import annotations
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import inspector
+
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(inspector.__file__)))
+
+# Dependencies of the commands which scan or migrate, never loaded by the ones
+# which only read the database or the log.
+HEAVY_MODULES = {
+    'alembic', 'discord_webhook', 'lxml', 'requests', 'selectolax', 'tldextract', 'tqdm', 'urllib3',
+}
+
+# Cold start budgets in seconds, the total import time reported by -X importtime,
+# about twice the time measured when they were set.
+DB_COMMAND_BUDGET = 1.0
+LOGS_BUDGET = 0.2
+
+
+def parse_importtime(stderr: str):
+    """Return the top-level packages imported and the total import time in seconds."""
+    modules = set()
+    total = 0
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        modules.add(name.strip().split('.')[0])
+        # Nested imports are included in the cumulative time of their importer.
+        if not name.startswith('  '):
+            total += int(cumulative)
+    return modules, total / 1e6
+
+
+class TestStartup(unittest.TestCase):
+    def setUp(self):
+
+        self.home = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.home, '.inspector'))
+        with open(os.path.join(self.home, '.inspector', 'app.log'), 'w') as file:
+            file.write('2026-10-18 00:00:00,000 - inspector - INFO - Scanned 1 due URLs\n')
+        # Create the database first: a migration loads Alembic.
+        self.run_cli('-subs')
+
+    def tearDown(self):
+
+        shutil.rmtree(self.home)
+
+    def run_cli(self, *args, importtime=False):
+        env = dict(os.environ, HOME=self.home, PYTHONPATH=SRC_DIR)
+        options = ['-X', 'importtime'] if importtime else []
+        process = subprocess.run(
+            [sys.executable, *options, '-m', 'inspector.cli', *args],
+            env=env, capture_output=True, text=True, timeout=60,
+        )
+        self.assertEqual(process.returncode, 0, process.stderr)
+        return process
+
+    def measure(self, *args):
+        """Return the modules imported by a command, and its best import time of three runs."""
+        runs = [parse_importtime(self.run_cli(*args, importtime=True).stderr) for _ in range(3)]
+        return runs[0][0], min(total for _, total in runs)
+
+    def test_read_only_commands_skip_heavy_dependencies(self):
+        for args in (
+            ['-subs'], ['-asset', 'app.js'], ['remove', '-u', 'example.com'],
+            ['history', '-u', 'example.com'], ['diff', '-u', 'example.com', '-from', '2d'],
+        ):
+            with self.subTest(args=args):
+                modules, total = self.measure(*args)
+                self.assertFalse(modules & HEAVY_MODULES)
+                self.assertLess(total, DB_COMMAND_BUDGET)
+
+    def test_logs_skips_the_database(self):
+        modules, total = self.measure('-logs')
+
+        self.assertFalse(modules & (HEAVY_MODULES | {'rich', 'sqlalchemy'}))
+        self.assertLess(total, LOGS_BUDGET)
+        self.assertIn('Scanned 1 due URLs', self.run_cli('-logs').stdout)
+
+
+if __name__ == '__main__':
+    unittest.main()
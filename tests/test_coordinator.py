@@ -0,0 +1,133 @@
+from __future__ import annotations
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from unittest import mock
+
+from inspector.cache import CacheEntry
+from inspector.coordinator import plan_batches
+from inspector.coordinator import ResultCollector
+from inspector.coordinator import run_coordinator
+from inspector.queries import MonitoredUrl
+from inspector.scanner import get_host
+from inspector.sharding import HashRing
+from inspector.sharding import LeaseQueue
+
+
+class SiteHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        body = f'<html><head><title>{self.headers["Host"].split(":")[0]}</title></head></html>'.encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def record(id, url, title='Old'):
+    return MonitoredUrl(id, url, title, 200, None, False, {})
+
+
+class TestPlanBatches(unittest.TestCase):
+    def test_hosts_stay_in_one_shard(self):
+        records = [record(i, f'https://host-{i % 7}.com/page/{i}') for i in range(100)]
+        shards = ['shard-0', 'shard-1', 'shard-2']
+        plan = plan_batches(records, shards, batch_size=4)
+        ring = HashRing(shards)
+
+        self.assertEqual(sorted(plan), shards)
+        seen = []
+        for shard, batches in plan.items():
+            for batch in batches:
+                self.assertLessEqual(len(batch), 4)
+                for item in batch:
+                    self.assertEqual(ring.node_for(get_host(item[1])), shard)
+                    seen.append(item[0])
+        self.assertEqual(sorted(seen), list(range(100)))
+
+    def test_result_collector(self):
+        collector = ResultCollector()
+        old = MonitoredUrl(1, 'https://a.com', None, None, None, True, {'https://a.com/a.js': 'x'})
+        collector.update(1, {})
+        changes = collector.sync_js_assets(old, {'https://a.com/b.js': ('y', 3)})
+
+        self.assertEqual(changes.added, ['https://a.com/b.js'])
+        self.assertEqual(changes.removed, ['https://a.com/a.js'])
+        collector.remember(1, None, [CacheEntry('https://a.com', '"e1"', None, 'z')])
+        self.assertEqual(collector.as_list(), [{
+            'id': 1, 'js_files': {'https://a.com/b.js': ['y', 3]}, 'validators': [['https://a.com', '"e1"', None, 'z']],
+        }])
+
+
+class TestRunCoordinator(unittest.TestCase):
+    def setUp(self):
+
+        self.temp_dir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.temp_dir, '.inspector'))
+        self.server = ThreadingHTTPServer(('0.0.0.0', 0), SiteHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        # Worker processes import the configuration with this home directory.
+        self.patcher = mock.patch.dict(os.environ, {'HOME': self.temp_dir, 'INSPECTOR_SCAN_DELAY': '0'})
+        self.patcher.start()
+
+    def tearDown(self):
+
+        self.patcher.stop()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.temp_dir)
+
+    def test_workers_scan_every_record(self):
+        port = self.server.server_port
+        records = [record(i, f'http://127.0.0.{i % 4 + 1}:{port}/{i}') for i in range(12)]
+        results = []
+
+        failed = run_coordinator(
+            records, results.append, workers=2, batch_size=3,
+            queue_path=os.path.join(self.temp_dir, 'queue.db'), poll_interval=0.1,
+        )
+
+        self.assertEqual(failed, 0)
+        changes = {item['id']: item['changes'] for result in results for item in result['records']}
+        self.assertEqual(changes, {i: {'title': f'127.0.0.{i % 4 + 1}'} for i in range(12)})
+        messages = [message for result in results for message in result['messages']]
+        self.assertEqual(len(messages), 12)
+
+    def test_coordinator_takes_over_once_when_every_worker_died(self):
+        queue_path = os.path.join(self.temp_dir, 'queue.db')
+        records = [record(i, f'http://127.0.0.{i % 4 + 1}/{i}') for i in range(12)]
+        results = []
+
+        def worker(run_id, queue_path, lease_seconds, deadline):
+            queue = LeaseQueue(queue_path, lease_seconds)
+            batch = queue.lease(run_id, 'coordinator')
+            while batch is not None:
+                queue.complete(batch.id, 'coordinator', batch.items)
+                batch = queue.lease(run_id, 'coordinator')
+            queue.close()
+
+        dead = mock.Mock(**{'is_alive.return_value': False})
+        context = mock.Mock(**{'Process.return_value': dead})
+        with mock.patch('inspector.coordinator.multiprocessing.get_context', return_value=context), \
+                mock.patch('inspector.coordinator.run_worker', side_effect=worker) as run_worker:
+            failed = run_coordinator(
+                records, results.append, workers=2, batch_size=3,
+                queue_path=queue_path, lease_seconds=0.5, poll_interval=0.05,
+            )
+
+        self.assertEqual(failed, 0)
+        self.assertEqual(run_worker.call_count, 1)
+        self.assertEqual(sorted(item[0] for result in results for item in result), list(range(12)))
+
+
+if __name__ == '__main__':
+    unittest.main()
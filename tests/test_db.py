@@ -0,0 +1,102 @@
+from __future__ import annotations
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from inspector.db import get_session
+from inspector.db import upgrade_db
+from inspector.models import UrlData
+from inspector.queries import UrlDataQueries
+
+
+LEGACY_SCHEMA = (
+    'CREATE TABLE url_data ('
+    'id INTEGER NOT NULL PRIMARY KEY, url VARCHAR NOT NULL, title VARCHAR, '
+    'status_code INTEGER, js_hash VARCHAR, content_length INTEGER, '
+    'added_time DATETIME DEFAULT (CURRENT_TIMESTAMP))'
+)
+
+
+class TestUpgradeDB(unittest.TestCase):
+    def setUp(self):
+
+        self.temp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.temp_dir, 'data.db')
+        self.db_url = f'sqlite:///{self.db_path}'
+
+    def tearDown(self):
+
+        shutil.rmtree(self.temp_dir)
+
+    def test_creates_schema(self):
+        upgrade_db(self.db_url)
+
+        session = get_session(self.db_url)
+        UrlDataQueries(session).add(UrlData(url='https://example.com'))
+        self.assertEqual(UrlDataQueries(session).get('https://example.com').track_js, False)
+        session.close()
+
+    def test_migrates_legacy_js_hash(self):
+        a, b = '0' * 32, 'f' * 32
+        connection = sqlite3.connect(self.db_path)
+        connection.execute(LEGACY_SCHEMA)
+        connection.executemany(
+            'INSERT INTO url_data (url, js_hash) VALUES (?, ?)',
+            [
+                ('https://a.com', f'https://a.com/app.js|{a},https://a.com/x.js?v=1,2|{b}'),
+                ('https://b.com', None),
+                ('https://c.com', ''),
+            ],
+        )
+        connection.commit()
+        connection.close()
+
+        upgrade_db(self.db_url)
+        upgrade_db(self.db_url)
+
+        session = get_session(self.db_url)
+        queries = UrlDataQueries(session)
+        migrated = queries.get('https://a.com')
+        self.assertTrue(migrated.track_js)
+        self.assertEqual(
+            [(asset.url, asset.hash) for asset in migrated.js_assets],
+            [('https://a.com/app.js', a), ('https://a.com/x.js?v=1,2', b)],
+        )
+        self.assertFalse(queries.get('https://b.com').track_js)
+        self.assertTrue(queries.get('https://c.com').track_js)
+        self.assertEqual(queries.get('https://c.com').js_assets, [])
+        self.assertEqual([u.url for u in queries.get_by_js_asset(b)], ['https://a.com'])
+        # The history starts with the values known before the upgrade.
+        self.assertEqual(
+            [(o.field, o.asset_url, o.value) for o in queries.history(migrated.id)],
+            [('js', 'https://a.com/app.js', a), ('js', 'https://a.com/x.js?v=1,2', b)],
+        )
+        session.close()
+
+
+    def test_removes_duplicate_urls(self):
+        connection = sqlite3.connect(self.db_path)
+        connection.execute(LEGACY_SCHEMA)
+        connection.executemany(
+            'INSERT INTO url_data (url, title) VALUES (?, ?)',
+            [('https://a.com', 'first'), ('https://b.com', 'b'), ('https://a.com', 'second')],
+        )
+        connection.commit()
+        connection.close()
+
+        upgrade_db(self.db_url)
+
+        connection = sqlite3.connect(self.db_path)
+        rows = connection.execute('SELECT url, title FROM url_data ORDER BY id').fetchall()
+        self.assertEqual(rows, [('https://a.com', 'first'), ('https://b.com', 'b')])
+        with self.assertRaises(sqlite3.IntegrityError):
+            connection.execute("INSERT INTO url_data (url) VALUES ('https://b.com')")
+        self.assertEqual(connection.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+        connection.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
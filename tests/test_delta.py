@@ -0,0 +1,56 @@
+from __future__ import annotations
+
+import random
+import unittest
+
+from inspector.delta import apply_delta
+from inspector.delta import make_delta
+
+
+class TestDelta(unittest.TestCase):
+    def setUp(self):
+
+        rng = random.Random(7)
+        self.base = b''.join(
+            b'function f%d(a){return a*%d+%d;}\n' % (i, rng.randrange(1000), rng.randrange(1000)) for i in range(2000)
+        )
+
+    def test_round_trip(self):
+        for target in (
+            self.base,
+            b'',
+            b'/* banner */\n' + self.base,
+            self.base.replace(b'function f1000(', b'function g1000('),
+            self.base[:len(self.base) // 2] + b'console.log("new");\n' + self.base[len(self.base) // 2:],
+            self.base[1000:],
+        ):
+            with self.subTest(size=len(target)):
+                self.assertEqual(apply_delta(self.base, make_delta(self.base, target)), target)
+        self.assertEqual(apply_delta(b'', make_delta(b'', b'new file')), b'new file')
+
+    def test_delta_grows_with_the_changes(self):
+        target = self.base.replace(b'function f1000(', b'function g1000(').replace(b'function f50(', b'const f50=(')
+        delta = make_delta(self.base, target)
+
+        self.assertLess(len(delta), 200)
+        self.assertEqual(apply_delta(self.base, delta), target)
+
+    def test_minified_lines_are_split_into_statements(self):
+        base = self.base.replace(b'\n', b'')
+        target = base.replace(b'return a*', b'return a/', 1)
+
+        self.assertLess(len(make_delta(base, target)), 200)
+
+    def test_corrupt_delta(self):
+        delta = make_delta(self.base, self.base + b'tail;')
+
+        with self.assertRaises(ValueError):
+            apply_delta(self.base, delta[:-2])
+        with self.assertRaises(ValueError):
+            apply_delta(self.base[:100], delta)
+        with self.assertRaises(ValueError):
+            apply_delta(self.base, delta[:1] + b'\x07')
+
+
+if __name__ == '__main__':
+    unittest.main()
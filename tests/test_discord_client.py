@@ -0,0 +1,183 @@
+from __future__ import annotations
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+
+from inspector.discord_client import DiscordDispatcher
+from inspector.discord_client import NotificationOutbox
+from inspector.discord_client import parse_message
+from inspector.discord_client import TokenBucket
+
+
+class StubWebhook(BaseHTTPRequestHandler):
+    """A Discord webhook answering with the queued status codes, then 200."""
+
+    statuses = []
+    payloads = []
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        status = self.statuses.pop(0) if self.statuses else 200
+        body = json.dumps({'id': '1'} if status == 200 else {'retry_after': 0.2}).encode()
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if status == 429:
+            self.send_header('Retry-After', '0.2')
+        else:
+            self.send_header('X-RateLimit-Remaining', '4')
+            self.send_header('X-RateLimit-Reset-After', '1')
+        self.end_headers()
+        self.wfile.write(body)
+        if status == 200:
+            self.payloads.append((time.monotonic(), payload))
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestTokenBucket(unittest.TestCase):
+    def test_rate_and_burst(self):
+        clock = FakeClock()
+        bucket = TokenBucket(rate=2, capacity=2, clock=clock)
+
+        self.assertEqual([bucket.reserve(), bucket.reserve()], [0, 0])
+        self.assertAlmostEqual(bucket.reserve(), 0.5)
+        clock.now += 0.5
+        self.assertAlmostEqual(bucket.reserve(), 0.5)
+
+    def test_pause(self):
+        clock = FakeClock()
+        bucket = TokenBucket(rate=10, capacity=5, clock=clock)
+        bucket.pause(3)
+
+        self.assertAlmostEqual(bucket.reserve(), 3.1)
+        clock.now += 3.1
+        self.assertAlmostEqual(bucket.reserve(), 0.1)
+
+    def test_parse_message(self):
+        notification = parse_message('Title changed from `a|b` to `c`|https://a.com/x|blue')
+        self.assertEqual(notification.title, 'Title changed from `a|b` to `c`')
+        self.assertEqual((notification.site, notification.url, notification.status), ('a.com', 'https://a.com/x', 'blue'))
+
+
+class TestDiscordDispatcher(unittest.TestCase):
+    def setUp(self):
+
+        self.temp_dir = tempfile.mkdtemp()
+        self.outbox_path = os.path.join(self.temp_dir, 'outbox.db')
+        StubWebhook.statuses = []
+        StubWebhook.payloads = []
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StubWebhook)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f'http://127.0.0.1:{self.server.server_port}/api/webhooks/1/token'
+
+    def tearDown(self):
+
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.temp_dir)
+
+    def dispatcher(self, url=None, flush_timeout=10, max_age=3600):
+        return DiscordDispatcher(
+            url or self.url,
+            outbox=NotificationOutbox(self.outbox_path),
+            bucket=TokenBucket(rate=100, capacity=100),
+            flush_timeout=flush_timeout,
+            max_age=max_age,
+        )
+
+    def pending(self):
+        outbox = NotificationOutbox(self.outbox_path)
+        try:
+            return outbox.count()
+        finally:
+            outbox.close()
+
+    def test_groups_per_site(self):
+        with self.dispatcher() as dispatcher:
+            for i in range(23):
+                dispatcher.send(f'JS file added|https://a.com/{i}.js|green')
+            dispatcher.send('Title changed|https://b.com|blue')
+
+        embeds = [[embed['description'] for embed in payload['embeds']] for _, payload in StubWebhook.payloads]
+        self.assertTrue(all(len(message) <= 10 for message in embeds))
+        for message in embeds:
+            self.assertEqual(len({url.split('/')[2] for url in message}), 1)
+        sent = sorted(url for message in embeds for url in message)
+        self.assertEqual(sent, sorted([f'https://a.com/{i}.js' for i in range(23)] + ['https://b.com']))
+        self.assertEqual(dispatcher.sent, 24)
+
+    def test_follows_retry_after(self):
+        StubWebhook.statuses = [429]
+        start = time.monotonic()
+        with self.dispatcher() as dispatcher:
+            dispatcher.send('Title changed|https://a.com|blue')
+
+        self.assertEqual(len(StubWebhook.payloads), 1)
+        self.assertGreaterEqual(StubWebhook.payloads[0][0] - start, 0.2)
+
+    def test_unsent_notifications_survive(self):
+        dispatcher = self.dispatcher(url='http://127.0.0.1:9/unreachable', flush_timeout=0.2)
+        dispatcher.start()
+        dispatcher.send('Title changed|https://a.com|blue')
+        dispatcher.close()
+        self.assertEqual(StubWebhook.payloads, [])
+
+        with self.dispatcher() as dispatcher:
+            pass
+        self.assertEqual(len(StubWebhook.payloads), 1)
+        outbox = NotificationOutbox(self.outbox_path)
+        self.assertEqual(outbox.count(), 0)
+        outbox.close()
+
+    def test_nothing_is_sent_without_webhook_url(self):
+        start = time.monotonic()
+        with self.dispatcher(url='put your webhook url here') as dispatcher:
+            dispatcher.send('Title changed|https://a.com|blue')
+
+        self.assertFalse(dispatcher.enabled)
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(self.pending(), 0)
+
+    def test_rejected_notifications_are_dropped(self):
+        StubWebhook.statuses = [404]
+        with self.dispatcher() as dispatcher:
+            dispatcher.send('Title changed|https://a.com|blue')
+
+        self.assertEqual(StubWebhook.payloads, [])
+        self.assertEqual(dispatcher.sent, 0)
+        self.assertEqual(self.pending(), 0)
+
+    def test_old_notifications_are_dropped(self):
+        outbox = NotificationOutbox(self.outbox_path)
+        outbox.add(parse_message('Title changed|https://a.com|blue'))
+        outbox.connection.execute('UPDATE outbox SET created_at = created_at - 7200')
+        outbox.connection.commit()
+        outbox.close()
+
+        dispatcher = self.dispatcher(url='http://127.0.0.1:9/unreachable', flush_timeout=0.2)
+        dispatcher.start()
+        dispatcher.send('Title changed|https://b.com|blue')
+        dispatcher.close()
+        self.assertEqual(self.pending(), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,182 @@
+from __future__ import annotations
+
+import os
+import socket
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import requests
+
+from .faults import FaultServer
+from inspector.breaker import CircuitBreaker
+from inspector.httpclient import CircuitOpenError
+from inspector.httpclient import HTTPClient
+from inspector.httpclient import TotalTimeout
+from inspector.scanner import Scanner
+from inspector.streaming import stream_page
+
+
+def closed_port_url():
+    # Another loopback address than the fault server, as circuits are per host.
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.2', 0))
+        return f'http://127.0.0.2:{sock.getsockname()[1]}/'
+
+
+class TestFaults(unittest.TestCase):
+    def setUp(self):
+
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.server = FaultServer().__enter__()
+
+    def tearDown(self):
+
+        self.server.__exit__(None, None, None)
+        self.temp_dir.cleanup()
+
+    def client(self, **kwargs):
+        options = {'connect_timeout': 1, 'read_timeout': 0.3, 'total_timeout': 2, 'retries': 2, 'backoff': 0.01}
+        options.update(kwargs)
+        return HTTPClient(**options)
+
+    def breaker(self, **kwargs):
+        return CircuitBreaker(os.path.join(self.temp_dir.name, 'breaker.db'), **kwargs)
+
+    def test_slow_host_within_read_timeout(self):
+        with self.client() as client:
+            response = client.get(self.server.url('/slow/0.1'))
+
+        self.assertEqual(response.status_code, 200)
+
+    def test_hanging_host_is_bounded(self):
+        start = time.monotonic()
+        with self.client(retries=1) as client:
+            with self.assertRaises(requests.exceptions.Timeout):
+                client.get(self.server.url('/hang'))
+            stats = client.stats()
+
+        # Two attempts of one read timeout each, and a short backoff.
+        self.assertLess(time.monotonic() - start, 1.5)
+        self.assertEqual(self.server.hits['/hang'], 2)
+        self.assertEqual(stats['retries'], 1)
+
+    def test_dripping_body_hits_the_total_timeout(self):
+        start = time.monotonic()
+        with self.client(total_timeout=0.5) as client:
+            with self.assertRaises(TotalTimeout):
+                client.get(self.server.url('/drip'))
+
+        self.assertLess(time.monotonic() - start, 1.5)
+        self.assertEqual(self.server.hits['/drip'], 1)
+
+    def test_streamed_body_hits_the_total_timeout(self):
+        with self.client(total_timeout=0.5) as client:
+            response = client.get(self.server.url('/drip'), stream=True)
+            with self.assertRaises(TotalTimeout):
+                stream_page(response, count_length=True)
+
+    def test_flapping_host_is_retried(self):
+        with self.client() as client:
+            response = client.get(self.server.url('/flap/2'))
+            stats = client.stats()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.server.hits['/flap/2'], 3)
+        self.assertEqual(stats['retries'], 2)
+
+    def test_retries_are_bounded(self):
+        with self.client(retries=1) as client:
+            response = client.get(self.server.url('/flap/5'))
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(self.server.hits['/flap/5'], 2)
+
+    def test_reset_connection_is_retried(self):
+        with self.client(retries=1) as client:
+            with self.assertRaises(requests.exceptions.ConnectionError):
+                client.get(self.server.url('/reset'))
+
+        self.assertEqual(self.server.hits['/reset'], 2)
+
+    def test_circuit_opens_for_failing_host(self):
+        url = closed_port_url()
+        with self.client(retries=0, breaker=self.breaker(threshold=2, cooldown=60)) as client:
+            for _ in range(2):
+                with self.assertRaises(requests.exceptions.ConnectionError) as raised:
+                    client.get(url)
+                self.assertNotIsInstance(raised.exception, CircuitOpenError)
+
+            with self.assertRaises(CircuitOpenError):
+                client.get(url)
+            # Other hosts are not affected.
+            self.assertEqual(client.get(self.server.url('/ok')).status_code, 200)
+            self.assertEqual(client.stats()['short_circuited'], 1)
+
+        # The next run still skips the host.
+        with self.client(retries=0, breaker=self.breaker(threshold=2, cooldown=60)) as client:
+            with self.assertRaises(CircuitOpenError):
+                client.get(url)
+
+    def test_circuit_closes_after_cooldown(self):
+        url = self.server.url('/flap/3')
+        with self.client(retries=0, breaker=self.breaker(threshold=1, cooldown=0.2)) as client:
+            self.assertEqual(client.get(url).status_code, 503)
+            with self.assertRaises(CircuitOpenError):
+                client.get(url)
+
+            time.sleep(0.25)
+            # The trial request fails: the circuit opens again for twice the cooldown.
+            self.assertEqual(client.get(url).status_code, 503)
+            time.sleep(0.25)
+            with self.assertRaises(CircuitOpenError):
+                client.get(url)
+
+            time.sleep(0.3)
+            self.assertEqual(client.get(url).status_code, 503)
+            time.sleep(1.0)
+            self.assertEqual(client.get(url).status_code, 200)
+            self.assertEqual(client.get(url).status_code, 200)
+
+        self.assertEqual(self.breaker().open_hosts(), [])
+
+    def test_half_open_trial_ends_with_any_error(self):
+        url = self.server.url('/ok')
+        with self.client(retries=0, breaker=self.breaker(threshold=1, cooldown=0.1)) as client:
+            with mock.patch.object(client.session, 'request', side_effect=requests.exceptions.ConnectionError):
+                with self.assertRaises(requests.exceptions.ConnectionError):
+                    client.get(url)
+            time.sleep(0.15)
+
+            # A failed trial, even with an error which is not retried, opens the circuit again.
+            with mock.patch.object(client.session, 'request', side_effect=requests.exceptions.TooManyRedirects):
+                with self.assertRaises(requests.exceptions.TooManyRedirects):
+                    client.get(url)
+            with self.assertRaises(CircuitOpenError):
+                client.get(url)
+            time.sleep(0.25)
+
+            # An SSL error is not counted, but the next request is a trial again.
+            with mock.patch.object(client.session, 'request', side_effect=requests.exceptions.SSLError):
+                with self.assertRaises(requests.exceptions.SSLError):
+                    client.get(url)
+            self.assertEqual(client.get(url).status_code, 200)
+
+        self.assertEqual(self.breaker().open_hosts(), [])
+
+    def test_run_wall_time_is_bounded(self):
+        urls = [self.server.url(f'/slow/0.2?page={i}') for i in range(20)]
+        scanner = Scanner(concurrency=2, per_host=2, delay=0, deadline=time.time() + 0.5)
+        done = []
+        start = time.monotonic()
+        with self.client() as client:
+            scanner.run(urls, lambda url: client.get(url).status_code, lambda *result: done.append(result), url_of=str)
+
+        self.assertLess(time.monotonic() - start, 1.5)
+        self.assertGreater(scanner.skipped, 0)
+        self.assertEqual(len(done) + scanner.skipped, len(urls))
+
+
+if __name__ == '__main__':
+    unittest.main()
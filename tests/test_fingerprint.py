@@ -0,0 +1,84 @@
+from __future__ import annotations
+
+import unittest
+from collections import Counter
+
+from inspector.fingerprint import Fingerprint
+from inspector.fingerprint import fingerprint_html
+from inspector.fingerprint import PageFingerprinter
+from inspector.fingerprint import simhash
+
+ARTICLE = ' '.join(
+    f'paragraph {word} of the article about monitoring websites and their scripts'
+    for word in ('one', 'two', 'three', 'four', 'five', 'six', 'seven', 'eight', 'nine', 'ten')
+)
+
+
+def page(token='a1b2c3', updated='2026-10-18 08:00', text=ARTICLE, extra=''):
+    return (
+        '<html><head><title>News</title>'
+        f'<meta name="csrf-token" content="{token}"><script>var t = "{token}";</script></head>'
+        f'<body><div id="ad-{token}" class="slot"></div><p>{text}</p>'
+        f'<footer>Updated {updated}, {token} visitors</footer>{extra}</body></html>'
+    )
+
+
+class TestFingerprint(unittest.TestCase):
+
+    def test_tokens_and_timestamps_are_ignored(self):
+        first = fingerprint_html(page())
+        second = fingerprint_html(page(token='ffe9910d', updated='2026-10-19 17:45'))
+
+        self.assertEqual(first, second)
+
+    def test_text_change(self):
+        first = fingerprint_html(page())
+        second = fingerprint_html(page(text='This article was removed by its author'))
+
+        text_bits, structure_bits = first.distance(second)
+        self.assertGreater(text_bits, 3)
+        self.assertEqual(structure_bits, 0)
+
+    def test_structure_change(self):
+        extra = '<form><label>Login</label><input name="user"><input name="password"></form>' * 3
+        first = fingerprint_html(page())
+        second = fingerprint_html(page(extra=extra))
+
+        self.assertGreater(first.distance(second)[1], 3)
+
+    def test_small_text_change_is_close(self):
+        first = fingerprint_html(page())
+        second = fingerprint_html(page(text=ARTICLE.replace('seven', 'eleven')))
+
+        self.assertLessEqual(first.distance(second)[0], 3)
+
+    def test_chunks_and_hidden_text(self):
+        html = page()
+        fingerprinter = PageFingerprinter()
+        for start in range(0, len(html), 5):
+            fingerprinter.feed(html[start:start + 5])
+        fingerprinter.close()
+
+        self.assertEqual(fingerprinter.fingerprint(), fingerprint_html(html))
+        self.assertEqual(fingerprinter.title, 'News')
+        self.assertNotIn('var', fingerprinter.words)
+        # 2026, 10, 18, 08, 00 and the token.
+        self.assertEqual(fingerprinter.words['#'], 6)
+        self.assertEqual(fingerprinter.paths['html>body>div'], 1)
+        self.assertEqual(fingerprinter.paths['html>head>meta'], 1)
+
+    def test_str_and_parse(self):
+        fingerprint = Fingerprint(0x0123456789abcdef, 1)
+
+        self.assertEqual(str(fingerprint), '0123456789abcdef0000000000000001')
+        self.assertEqual(Fingerprint.parse(str(fingerprint)), fingerprint)
+        self.assertEqual(fingerprint.distance(Fingerprint(0x0123456789abcdee, 2)), (1, 2))
+
+    def test_simhash(self):
+        self.assertEqual(simhash(Counter()), 0)
+        self.assertEqual(simhash(Counter({'word': 1})), simhash(Counter({'word': 5})))
+        self.assertNotEqual(simhash(Counter({'word': 1})), simhash(Counter({'other': 1})))
+
+
+if __name__ == '__main__':
+    unittest.main()
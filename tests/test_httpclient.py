@@ -0,0 +1,65 @@
+from __future__ import annotations
+
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+
+from inspector.httpclient import HTTPClient
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        body = b'<html><head><title>ok</title></head></html>'
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestHTTPClient(unittest.TestCase):
+    def setUp(self):
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), KeepAliveHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.base_url = f'http://127.0.0.1:{self.server.server_port}'
+
+    def tearDown(self):
+
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_connections_are_reused(self):
+        with HTTPClient() as client:
+            for i in range(5):
+                response = client.get(f'{self.base_url}/page{i}')
+                self.assertEqual(response.status_code, 200)
+
+            stats = client.stats()
+
+        self.assertEqual(stats['requests'], 5)
+        self.assertEqual(stats['connections'], 1)
+        self.assertEqual(stats['reused'], 4)
+
+    def test_stats_survive_pool_eviction(self):
+        client = HTTPClient(pool_connections=1)
+        client.get(f'{self.base_url}/a')
+        client.get(f'http://localhost:{self.server.server_port}/b')
+        client.close()
+
+        self.assertEqual(client.stats()['requests'], 2)
+        self.assertEqual(client.stats()['connections'], 2)
+
+    def test_default_timeout(self):
+        client = HTTPClient(connect_timeout=1, read_timeout=2)
+        self.assertEqual(client.timeout, (1, 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+from __future__ import annotations
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from inspector.db import get_session
+from inspector.db import upgrade_db
+from inspector.importer import BulkImporter
+from inspector.importer import read_urls
+from inspector.models import UrlData
+from inspector.queries import UrlDataQueries
+from inspector.scanner import Scanner
+from inspector.urlinspector import JsFile
+
+
+class TestReadUrls(unittest.TestCase):
+    def test_read_urls(self):
+        lines = ['a.com\n', 'https://A.com\n', '\n', 'ftp://b.com\n', 'https://b.com/x\n', 'a.com#x\n']
+        self.assertEqual(read_urls(lines), (['https://a.com', 'https://b.com/x'], 1, 2))
+
+
+class TestBulkImporter(unittest.TestCase):
+    def setUp(self):
+
+        self.temp_dir = tempfile.mkdtemp()
+        db_url = f"sqlite:///{os.path.join(self.temp_dir, 'data.db')}"
+        upgrade_db(db_url)
+        self.session = get_session(db_url)
+        self.queries = UrlDataQueries(self.session)
+        self.fetched = []
+        self.lock = threading.Lock()
+
+    def tearDown(self):
+
+        self.session.close()
+        shutil.rmtree(self.temp_dir)
+
+    def inspect(self, url):
+        with self.lock:
+            self.fetched.append(url)
+        if 'down' in url:
+            raise ConnectionError('unreachable')
+        return {
+            'title': url.split('//')[1],
+            'status_code': 200,
+            'js_files': {f'{url}/app.js': JsFile('h-' + url, 10)},
+        }
+
+    def importer(self, **kwargs):
+        scanner = Scanner(concurrency=8, per_host=1, delay=0)
+        return BulkImporter(self.queries, self.inspect, batch_size=3, scanner=scanner, **kwargs)
+
+    def test_import(self):
+        existing = UrlData(url='https://old.com', title='Old', status_code=404)
+        self.queries.add(existing)
+        urls = ['https://old.com', 'https://down.com'] + [f'https://site{i}.com' for i in range(7)]
+        progress = []
+
+        added, updated, failed = self.importer(min_interval=60).run(urls, progress=lambda: progress.append(1))
+
+        self.assertEqual((added, updated, failed), (7, 1, ['https://down.com']))
+        self.assertEqual(sorted(self.fetched), sorted(urls))
+        self.assertEqual(len(progress), len(urls))
+
+        self.session.expire_all()
+        records = {record.url: record for record in self.session.query(UrlData)}
+        self.assertEqual(len(records), 8)
+        self.assertEqual(records['https://old.com'].id, existing.id)
+        self.assertEqual((records['https://old.com'].title, records['https://old.com'].status_code), ('old.com', 200))
+        for url in urls:
+            if url != 'https://down.com':
+                self.assertTrue(records[url].track_js)
+                self.assertEqual(records[url].min_interval, 60)
+                self.assertEqual([asset.hash for asset in records[url].js_assets], ['h-' + url])
+
+    def test_reimport_updates_js_assets(self):
+        urls = ['https://a.com', 'https://b.com']
+        self.importer().run(urls)
+        added, updated, failed = self.importer().run(urls)
+
+        self.assertEqual((added, updated, failed), (0, 2, []))
+        self.session.expire_all()
+        self.assertEqual([len(self.queries.get(url).js_assets) for url in urls], [1, 1])
+
+
+if __name__ == '__main__':
+    unittest.main()
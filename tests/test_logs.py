@@ -0,0 +1,173 @@
+from __future__ import annotations
+
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+from datetime import timedelta
+
+from inspector.config import get_logger
+from inspector.logs import configure_logging
+from inspector.logs import parse_line
+from inspector.logs import parse_since
+from inspector.logs import read_logs
+from inspector.logs import reverse_lines
+from inspector.logs import stop_logging
+
+
+def entry(time, level, message, url=None):
+    line = {'time': time.isoformat(timespec='milliseconds'), 'level': level, 'logger': 'inspector', 'message': message}
+    if url:
+        line['url'] = url
+    return json.dumps(line)
+
+
+def write_logs(path, name, count):
+    logger = logging.getLogger(name)
+    logger.propagate = False
+    listener = configure_logging(logger, path, max_bytes=2000, backups=1000)
+    for index in range(count):
+        logger.info(f'{name} {index}')
+    stop_logging(listener)
+
+
+class TestLogging(unittest.TestCase):
+    def setUp(self):
+
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'app.log')
+        self.logger = logging.getLogger(f'inspector-test-{self.id()}')
+        self.logger.propagate = False
+
+    def tearDown(self):
+
+        for handler in self.logger.handlers[:]:
+            self.logger.removeHandler(handler)
+        shutil.rmtree(self.directory)
+
+    def test_get_logger_configures_once(self):
+        logger = get_logger()
+        handlers = list(logger.handlers)
+
+        self.assertIs(get_logger(), logger)
+        self.assertEqual(logger.handlers, handlers)
+        self.assertEqual(len(handlers), 1)
+
+    def test_records_are_written_as_json_lines(self):
+        listener = configure_logging(self.logger, self.path)
+        self.logger.info('Title changed for %s', 'https://a.com', extra={'url': 'https://a.com'})
+        try:
+            raise ValueError('boom')
+        except ValueError:
+            self.logger.exception('Failed')
+        self.logger.debug('not written')
+        stop_logging(listener)
+
+        with open(self.path) as file:
+            lines = [json.loads(line) for line in file]
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(lines[0]['message'], 'Title changed for https://a.com')
+        self.assertEqual((lines[0]['level'], lines[0]['url']), ('INFO', 'https://a.com'))
+        self.assertIn('ValueError: boom', lines[1]['exc'])
+        self.assertIsNotNone(datetime.fromisoformat(lines[1]['time']).tzinfo)
+
+    def test_rotation(self):
+        listener = configure_logging(self.logger, self.path, max_bytes=1000, backups=2)
+        for index in range(100):
+            self.logger.info(f'Message {index}')
+        stop_logging(listener)
+
+        self.assertEqual(sorted(os.listdir(self.directory)), ['app.log', 'app.log.1', 'app.log.2', 'app.log.lock'])
+        entries = read_logs(self.path, limit=0)
+        self.assertEqual(entries[-1].message, 'Message 99')
+        self.assertEqual(
+            [int(entry.message.split()[1]) for entry in entries],
+            list(range(100 - len(entries), 100)),
+        )
+
+    def test_rotation_shared_by_processes(self):
+        context = multiprocessing.get_context('fork')
+        processes = [
+            context.Process(target=write_logs, args=(self.path, f'writer-{index}', 300)) for index in range(4)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+
+        entries = read_logs(self.path, limit=0)
+        self.assertEqual(
+            sorted(entry.message for entry in entries),
+            sorted(f'writer-{index} {line}' for index in range(4) for line in range(300)),
+        )
+        for file in os.listdir(self.directory):
+            self.assertLessEqual(os.path.getsize(os.path.join(self.directory, file)), 2000)
+
+
+class TestReadLogs(unittest.TestCase):
+    def setUp(self):
+
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'app.log')
+        self.start = datetime(2026, 10, 18, 8).astimezone()
+        with open(f'{self.path}.1', 'w') as file:
+            file.write('2026-10-17 23:00:00,000 - inspector - INFO - Scanned 3 due URLs\n')
+            for minute in range(30):
+                file.write(entry(self.start + timedelta(minutes=minute), 'INFO', f'Entry {minute}') + '\n')
+        with open(self.path, 'w') as file:
+            for minute in range(30, 60):
+                level = 'WARNING' if minute % 10 == 0 else 'INFO'
+                url = 'https://b.com/' if minute == 45 else None
+                file.write(entry(self.start + timedelta(minutes=minute), level, f'Entry {minute}', url) + '\n')
+
+    def tearDown(self):
+
+        shutil.rmtree(self.directory)
+
+    def messages(self, **kwargs):
+        return [entry.message for entry in read_logs(self.path, **kwargs)]
+
+    def test_last_entries(self):
+        self.assertEqual(self.messages(limit=3), ['Entry 57', 'Entry 58', 'Entry 59'])
+        self.assertEqual(len(self.messages(limit=0)), 61)
+        self.assertEqual(self.messages(limit=0)[0], 'Scanned 3 due URLs')
+
+    def test_filters(self):
+        self.assertEqual(self.messages(level='warning'), ['Entry 30', 'Entry 40', 'Entry 50'])
+        self.assertEqual(self.messages(url='b.com'), ['Entry 45'])
+        self.assertEqual(self.messages(url='Entry 5', limit=2), ['Entry 58', 'Entry 59'])
+
+    def test_since_stops_reading(self):
+        since = self.start + timedelta(minutes=25)
+        self.assertEqual(self.messages(since=since, limit=0), [f'Entry {minute}' for minute in range(25, 60)])
+        self.assertEqual(self.messages(since=since, level='WARNING'), ['Entry 30', 'Entry 40', 'Entry 50'])
+
+    def test_reverse_lines_across_blocks(self):
+        with open(self.path) as file:
+            lines = file.read().splitlines()
+        for block_size in (1, 7, 100, 1 << 16):
+            with self.subTest(block_size=block_size):
+                self.assertEqual(list(reverse_lines(self.path, block_size)), lines[::-1])
+
+    def test_parse_line(self):
+        legacy = parse_line('2026-10-17 23:00:00,000 - inspector - ERROR - Failed - twice')
+        self.assertEqual((legacy.level, legacy.message), ('ERROR', 'Failed - twice'))
+        self.assertEqual(legacy.time, datetime(2026, 10, 17, 23).astimezone())
+        self.assertEqual(parse_line('Traceback (most recent call last):').message, 'Traceback (most recent call last):')
+        self.assertEqual(str(parse_line(entry(self.start, 'INFO', 'Done'))), '2026-10-18 08:00:00 INFO     Done')
+
+    def test_parse_since(self):
+        self.assertAlmostEqual(
+            (datetime.now().astimezone() - parse_since('2h')).total_seconds(), 7200, delta=5,
+        )
+        self.assertEqual(parse_since('2026-10-18T08:00'), self.start)
+        with self.assertRaises(ValueError):
+            parse_since('yesterday')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,339 @@
+from __future__ import annotations
+
+import contextlib
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from unittest import mock
+
+from inspector import main
+from inspector.blobstore import BlobStore
+from inspector.cache import ValidatorCache
+from inspector.db import get_session
+from inspector.db import upgrade_db
+from inspector.fingerprint import fingerprint_html
+from inspector.httpclient import HTTPClient
+from inspector.models import UrlData
+from inspector.queries import UrlDataQueries
+from inspector.versions import VersionStore
+
+
+class PageHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    title = 'New'
+
+    def do_GET(self):
+        title = '' if self.title is None else f'<title>{self.title}</title>'
+        body = f'<html><head>{title}</head></html>'.encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class ContentHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    text = 'Prices of the week for every product of the shop'
+    token = 'a1b2'
+
+    def do_GET(self):
+        body = self.page(self.text, self.token).encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    @staticmethod
+    def page(text, token):
+        return f'<html><body><input name="csrf" value="{token}"><p>{text}</p><p>Session {token}</p></body></html>'
+
+    def log_message(self, *args):
+        pass
+
+
+class ScriptPageHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    script = b'console.log("v1");'
+    fail_script = False
+
+    def do_GET(self):
+        if self.path == '/app.js':
+            status, body, headers = (500, b'', {}) if self.fail_script else (200, self.script, {})
+        elif self.headers.get('If-None-Match') == '"page-1"':
+            status, body, headers = 304, b'', {'ETag': '"page-1"'}
+        else:
+            status, body, headers = 200, b'<html><head><script src="/app.js"></script></head></html>', {'ETag': '"page-1"'}
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestDaemon(unittest.TestCase):
+    def setUp(self):
+
+        self.temp_dir = tempfile.mkdtemp()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), PageHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+
+        db_url = f"sqlite:///{os.path.join(self.temp_dir, 'data.db')}"
+        upgrade_db(db_url)
+        self.session = get_session(db_url)
+        self.queries = UrlDataQueries(self.session)
+        self.queries.add(UrlData(url=self.url, title='Old', next_due=datetime(2000, 1, 1)))
+        self.queries.add(UrlData(url='http://127.0.0.1:9', title='Later', next_due=datetime(2999, 1, 1)))
+
+        blob_store = BlobStore(
+            root=os.path.join(self.temp_dir, 'blobs'), index_path=os.path.join(self.temp_dir, 'blobs.db'),
+        )
+        versions = VersionStore(os.path.join(self.temp_dir, 'versions.db'))
+        self.patchers = [
+            mock.patch.object(main, 'DB_URL', db_url),
+            mock.patch.object(main, 'session', self.session),
+            mock.patch.object(main, 'queries', self.queries),
+            mock.patch.object(main, 'notifications', contextlib.nullcontext),
+            mock.patch.object(main, 'BlobStore', lambda: blob_store),
+            mock.patch.object(main, 'VersionStore', lambda: versions),
+            mock.patch.object(main, 'SCAN_WORKERS', 1),
+            mock.patch.object(main, 'messages', []),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+
+    def tearDown(self):
+
+        for patcher in reversed(self.patchers):
+            patcher.stop()
+        self.session.close()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.temp_dir)
+
+    def test_scans_due_urls_once(self):
+        main.run_daemon(once=True)
+
+        self.assertEqual(main.messages, [f'Title changed from `Old` to `New`|{self.url}|blue'])
+        self.session.expire_all()
+        scanned = self.queries.get(self.url)
+        self.assertEqual(scanned.title, 'New')
+        self.assertIsNotNone(scanned.last_checked)
+        self.assertGreater(scanned.next_due, scanned.last_checked)
+        self.assertIsNone(self.queries.get('http://127.0.0.1:9').last_checked)
+
+
+class TestTitleChanges(unittest.TestCase):
+    def setUp(self):
+
+        self.temp_dir = tempfile.mkdtemp()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), PageHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+
+        db_url = f"sqlite:///{os.path.join(self.temp_dir, 'data.db')}"
+        upgrade_db(db_url)
+        self.session = get_session(db_url)
+        self.queries = UrlDataQueries(self.session)
+        self.queries.add(UrlData(url=self.url, title='New'))
+
+        self.patchers = [
+            mock.patch.object(main, 'queries', self.queries),
+            mock.patch.object(main, 'messages', []),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+
+    def tearDown(self):
+
+        for patcher in reversed(self.patchers):
+            patcher.stop()
+        self.session.close()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.temp_dir)
+
+    def scan(self):
+        record = next(self.queries.iter_monitored())
+        main.process_record(record)
+        self.session.expire_all()
+        return self.queries.get(self.url)
+
+    def test_lost_title_stays_monitored(self):
+        with mock.patch.object(PageHandler, 'title', None):
+            stored = self.scan()
+            self.assertEqual(stored.title, '')
+            self.scan()
+        self.assertEqual(main.messages, [f'Title changed from `New` to ``|{self.url}|blue'])
+
+        stored = self.scan()
+        self.assertEqual(stored.title, 'New')
+        self.assertEqual(main.messages[1:], [f'Title changed from `` to `New`|{self.url}|blue'])
+
+
+class TestContentChanges(unittest.TestCase):
+    def setUp(self):
+
+        self.temp_dir = tempfile.mkdtemp()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), ContentHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+
+        db_url = f"sqlite:///{os.path.join(self.temp_dir, 'data.db')}"
+        upgrade_db(db_url)
+        self.session = get_session(db_url)
+        self.queries = UrlDataQueries(self.session)
+        old_page = ContentHandler.page(ContentHandler.text, '9f8e7d6c')
+        self.queries.add(UrlData(url=self.url, content_length=len(old_page), fingerprint=str(fingerprint_html(old_page))))
+
+        self.patchers = [
+            mock.patch.object(main, 'queries', self.queries),
+            mock.patch.object(main, 'messages', []),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+
+    def tearDown(self):
+
+        for patcher in reversed(self.patchers):
+            patcher.stop()
+        self.session.close()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.temp_dir)
+
+    def scan(self):
+        record = next(self.queries.iter_monitored())
+        main.process_record(record)
+        self.session.expire_all()
+        return self.queries.get(self.url)
+
+    def test_token_changes_are_not_notified(self):
+        stored = self.scan()
+
+        self.assertEqual(main.messages, [])
+        self.assertEqual(stored.content_length, len(ContentHandler.page(ContentHandler.text, '9f8e7d6c')))
+
+    def test_text_change_is_notified(self):
+        with mock.patch.object(ContentHandler, 'text', 'The shop is closed'):
+            stored = self.scan()
+
+        self.assertEqual(len(main.messages), 1)
+        self.assertRegex(main.messages[0], r'^Content changed \(\d+ text and 0 structure bits of 64\), length')
+        self.assertEqual(stored.fingerprint, str(fingerprint_html(ContentHandler.page('The shop is closed', 'a1b2'))))
+        self.assertEqual(
+            [(o.field, o.value) for o in self.queries.history(stored.id)][2:],
+            [('content_length', str(stored.content_length)), ('fingerprint', stored.fingerprint)],
+        )
+
+    def test_records_without_fingerprint_are_compared_by_length(self):
+        self.queries.get(self.url).fingerprint = None
+        self.session.commit()
+        stored = self.scan()
+
+        old_length = len(ContentHandler.page(ContentHandler.text, '9f8e7d6c'))
+        new_length = len(ContentHandler.page(ContentHandler.text, 'a1b2'))
+        self.assertEqual(
+            main.messages, [f'Content length changed from `{old_length}` to `{new_length}`|{self.url}|blue'],
+        )
+        self.assertIsNotNone(stored.fingerprint)
+
+
+class TestConditionalScans(unittest.TestCase):
+    def setUp(self):
+
+        self.temp_dir = tempfile.mkdtemp()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), ScriptPageHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+
+        db_url = f"sqlite:///{os.path.join(self.temp_dir, 'data.db')}"
+        upgrade_db(db_url)
+        self.session = get_session(db_url)
+        self.queries = UrlDataQueries(self.session)
+        self.queries.add(UrlData(url=self.url, track_js=True))
+        self.client = HTTPClient(cache=ValidatorCache(os.path.join(self.temp_dir, 'cache.db')), retries=0)
+        self.blob_store = BlobStore(
+            root=os.path.join(self.temp_dir, 'blobs'), index_path=os.path.join(self.temp_dir, 'blobs.db'),
+        )
+
+        self.patchers = [
+            mock.patch.object(main, 'queries', self.queries),
+            mock.patch.object(main, 'messages', []),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+
+    def tearDown(self):
+
+        for patcher in reversed(self.patchers):
+            patcher.stop()
+        self.client.close()
+        self.blob_store.close()
+        self.session.close()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.temp_dir)
+
+    def scan(self):
+        record = next(self.queries.iter_monitored())
+        domain = main.fetch_record(record, client=self.client, blob_store=self.blob_store)
+        main.process_record(record, domain)
+        self.session.expire_all()
+        return domain, self.queries.get(self.url)
+
+    def test_failed_js_file_is_kept_while_the_page_is_not_modified(self):
+        js_url = f'{self.url}/app.js'
+        _, stored = self.scan()
+        self.assertEqual([asset.url for asset in stored.js_assets], [js_url])
+        known_hash = stored.js_assets[0].hash
+        main.messages.clear()
+
+        with mock.patch.object(ScriptPageHandler, 'fail_script', True):
+            domain, stored = self.scan()
+        self.assertTrue(domain.not_modified)
+        self.assertEqual(domain.js_failed, [js_url])
+        self.assertEqual(main.messages, [])
+        self.assertEqual([(asset.url, asset.hash) for asset in stored.js_assets], [(js_url, known_hash)])
+
+        with mock.patch.object(ScriptPageHandler, 'script', b'console.log("v2");'):
+            domain, stored = self.scan()
+        self.assertTrue(domain.not_modified)
+        self.assertEqual(main.messages, [f'JS file changed|{js_url}|blue'])
+        self.assertNotEqual(stored.js_assets[0].hash, known_hash)
+
+    def test_validators_are_stored_once_the_changes_are_written(self):
+        record = next(self.queries.iter_monitored())
+        domain = main.fetch_record(record, client=self.client, blob_store=self.blob_store)
+        self.assertEqual([entry.url for entry in domain.validators], [self.url])
+        self.assertIsNone(self.client.cache.get(self.url))
+
+        # The changes are lost, and so are the validators: the next scan fetches the page again.
+        with mock.patch.object(self.session, 'commit', side_effect=RuntimeError('disk full')):
+            with self.assertRaises(RuntimeError):
+                with self.queries.bulk_updater() as updater:
+                    main.process_record(record, domain, updater)
+        self.assertIsNone(self.client.cache.get(self.url))
+
+        domain, stored = self.scan()
+        self.assertFalse(domain.not_modified)
+        self.assertEqual(len(stored.js_assets), 1)
+        self.assertEqual(self.client.cache.get(self.url).etag, '"page-1"')
+        domain, _ = self.scan()
+        self.assertTrue(domain.not_modified)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+from __future__ import annotations
+
+import json
+import os
+import tempfile
+import unittest
+
+from inspector.masking import asset_name
+from inspector.masking import MaskingRules
+from inspector.masking import Masks
+
+BUNDLE = b''.join(
+    b'var build%d={buildTime:"2026-10-18T08:%02d:00Z",nonce:"n0nce%d"};' % (index, index, index * 7919)
+    for index in range(200)
+)
+
+
+def chunked(data, size):
+    return [data[start:start + size] for start in range(0, len(data), size)]
+
+
+class TestMasks(unittest.TestCase):
+
+    def test_mask_chunks_across_chunk_boundaries(self):
+        masks = Masks([r'(?<=buildTime:")[^"]+', r'n0nce\d+'], max_length=64)
+        expected = masks.pattern.sub(b'MASKED', BUNDLE)
+
+        self.assertIn(b'{buildTime:"MASKED",nonce:"MASKED"}', expected)
+        for size in (1, 5, 63, 64, 65, 4096, len(BUNDLE)):
+            with self.subTest(size=size):
+                self.assertEqual(b''.join(masks.mask_chunks(chunked(BUNDLE, size))), expected)
+
+    def test_no_masks(self):
+        chunks = chunked(BUNDLE, 100)
+        self.assertEqual(list(Masks().mask_chunks(chunks)), chunks)
+        self.assertEqual(list(Masks(['x']).mask_chunks([])), [])
+
+    def test_invalid_mask(self):
+        with self.assertRaises(ValueError):
+            Masks(['(unclosed'])
+
+    def test_strip_url(self):
+        masks = Masks(strip_params=['v', '_'])
+
+        self.assertEqual(masks.strip_url('https://a.com/app.js?v=123'), 'https://a.com/app.js')
+        self.assertEqual(masks.strip_url('https://a.com/app.js?lang=en&_=1&v=2#x'), 'https://a.com/app.js?lang=en#x')
+        self.assertEqual(masks.strip_url('https://a.com/app.js?version=2'), 'https://a.com/app.js?version=2')
+
+    def test_asset_name(self):
+        self.assertEqual(asset_name('https://a.com/static/js/main.3f9a8c1b.js'), 'https://a.com/static/js/main.[hash].js')
+        self.assertEqual(asset_name('https://a.com/js/123.3f9a8c1b.chunk.js?v=2'), 'https://a.com/js/123.[hash].chunk.js')
+        self.assertEqual(asset_name('https://a.com/assets/index-BJk3x9aF.js'), 'https://a.com/assets/index-[hash].js')
+        self.assertEqual(asset_name('https://a.com/runtime~main.a1b2c3d4.js'), 'https://a.com/runtime~main.[hash].js')
+        for url in ('https://a.com/jquery-3.6.0.min.js', 'https://a.com/feedback.js', 'https://a.com/a1b2c3d4/app.js'):
+            self.assertEqual(asset_name(url), url)
+
+
+class TestMaskingRules(unittest.TestCase):
+
+    def test_site_rules_add_to_global_rules(self):
+        rules = MaskingRules(
+            {'masks': ['global'], 'strip_params': ['v']},
+            {'example.com': {'masks': ['site'], 'strip_params': ['rev']}},
+        )
+
+        masks = rules.for_url('https://cdn.example.com/app.js')
+        self.assertEqual(b''.join(masks.mask_chunks([b'global site other'])), b'MASKED MASKED other')
+        self.assertEqual(rules.strip_url('https://cdn.example.com/a.js?v=1&rev=2'), 'https://cdn.example.com/a.js')
+        self.assertEqual(rules.strip_url('https://other.com/a.js?v=1&rev=2'), 'https://other.com/a.js?rev=2')
+        self.assertIs(rules.for_url('https://notexample.com/a.js'), rules.global_masks)
+
+    def test_load(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'masks.json')
+            self.assertEqual(MaskingRules.load(path, strip_params=['v']).strip_url('https://a.com/a.js?v=1'), 'https://a.com/a.js')
+
+            with open(path, 'w') as file:
+                json.dump({'strip_params': ['t'], 'sites': {'a.com': {'masks': ['secret']}}}, file)
+            rules = MaskingRules.load(path, strip_params=['v'])
+            self.assertEqual(rules.strip_url('https://b.com/a.js?v=1&t=2&x=3'), 'https://b.com/a.js?x=3')
+            self.assertEqual(b''.join(rules.for_url('https://a.com/').mask_chunks([b'a secret'])), b'a MASKED')
+
+            with open(path, 'w') as file:
+                file.write('{not json')
+            with self.assertRaises(ValueError):
+                MaskingRules.load(path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,150 @@
+from __future__ import annotations
+
+import contextlib
+import io
+import os
+import tempfile
+import threading
+import unittest
+import urllib.request
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+
+from inspector.httpclient import HTTPClient
+from inspector.metrics import METRICS
+from inspector.metrics import Metrics
+from inspector.metrics import profiled
+from inspector.metrics import serve_metrics
+
+
+class PageHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        body = b'<html><head><title>ok</title></head></html>'
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+
+        self.metrics = Metrics(slow_request=1.0, top_hosts=2)
+
+    def test_histogram(self):
+        for seconds in (0.0005, 0.002, 0.002, 0.3, 12.0):
+            self.metrics.observe('parse', seconds)
+
+        histogram = self.metrics.stage('parse')
+        self.assertEqual(histogram.count, 5)
+        self.assertAlmostEqual(histogram.sum, 12.3045)
+        self.assertEqual(histogram.quantile(0.5), 0.0025)
+        self.assertEqual(histogram.quantile(0.99), 12.0)
+
+    def test_render(self):
+        self.metrics.inc('http_requests', 3)
+        self.metrics.observe('download', 0.02)
+        self.metrics.observe('download', 90)
+
+        text = self.metrics.render()
+        self.assertIn('inspector_http_requests_total 3\n', text)
+        self.assertIn('inspector_cache_hits_total 0\n', text)
+        self.assertIn('inspector_stage_seconds_bucket{stage="download",le="0.025"} 1\n', text)
+        self.assertIn('inspector_stage_seconds_bucket{stage="download",le="60"} 1\n', text)
+        self.assertIn('inspector_stage_seconds_bucket{stage="download",le="inf"} 2\n', text)
+        self.assertIn('inspector_stage_seconds_count{stage="download"} 2\n', text)
+
+    def test_slow_hosts(self):
+        for host, seconds in (('a.com', 0.1), ('b.com', 2.0), ('b.com', 0.2), ('c.com', 0.5), ('d"x', 1.5)):
+            self.metrics.observe_request(host, seconds)
+
+        hosts = self.metrics.slowest_hosts()
+        self.assertEqual([host for host, _ in hosts], ['b.com', 'd"x'])
+        self.assertEqual((hosts[0][1].requests, hosts[0][1].slow, hosts[0][1].max), (2, 1, 2.0))
+        text = self.metrics.render()
+        self.assertIn('inspector_host_slow_requests_total{host="b.com"} 1\n', text)
+        self.assertIn('inspector_host_request_seconds_max{host="d\\"x"} 1.500000\n', text)
+        self.assertNotIn('a.com', text)
+
+    def test_drain_and_merge(self):
+        self.metrics.inc('urls_scanned', 2)
+        self.metrics.observe('fetch', 0.3)
+        self.metrics.observe_request('a.com', 2.0)
+
+        snapshot = self.metrics.drain()
+        self.assertEqual(self.metrics.counter('urls_scanned'), 0)
+        self.metrics.merge(snapshot)
+        self.metrics.merge(snapshot)
+
+        self.assertEqual(self.metrics.counter('urls_scanned'), 4)
+        self.assertEqual(self.metrics.stage('fetch').count, 2)
+        self.assertEqual(self.metrics.slowest_hosts()[0][1].slow, 2)
+
+    def test_write_textfile(self):
+        self.metrics.inc('urls_failed')
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'inspector.prom')
+            self.metrics.write_textfile(path)
+
+            with open(path) as file:
+                self.assertIn('inspector_urls_failed_total 1\n', file.read())
+            self.assertEqual(os.listdir(directory), ['inspector.prom'])
+
+    def test_serve_metrics(self):
+        self.metrics.inc('discord_messages', 2)
+        server = serve_metrics(0, self.metrics)
+        try:
+            with urllib.request.urlopen(f'http://127.0.0.1:{server.server_port}/metrics') as response:
+                self.assertIn(b'inspector_discord_messages_total 2\n', response.read())
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_profiled_reports_the_block_only(self):
+        self.metrics.inc('http_requests', 10)
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output), profiled(metrics=self.metrics):
+            self.metrics.inc('http_requests', 2)
+            self.metrics.observe('parse', 0.004)
+
+        report = output.getvalue()
+        self.assertRegex(report, r'http_requests +2\n')
+        self.assertRegex(report, r'parse +1 ')
+        self.assertNotIn('fetch', report)
+
+
+class TestClientMetrics(unittest.TestCase):
+    def setUp(self):
+
+        METRICS.reset()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), PageHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f'http://127.0.0.1:{self.server.server_port}/'
+
+    def tearDown(self):
+
+        self.server.shutdown()
+        self.server.server_close()
+        METRICS.reset()
+
+    def test_requests_are_timed_per_stage_and_host(self):
+        with HTTPClient() as client:
+            for _ in range(3):
+                client.get(self.url)
+
+        self.assertEqual(METRICS.counter('http_requests'), 3)
+        self.assertEqual(METRICS.counter('http_response_bytes'), 3 * 43)
+        self.assertEqual(METRICS.stage('connect').count, 1)
+        self.assertEqual(METRICS.stage('request').count, 3)
+        self.assertEqual(METRICS.stage('download').count, 3)
+        self.assertEqual(METRICS.slowest_hosts()[0][0], '127.0.0.1')
+        self.assertEqual(METRICS.slowest_hosts()[0][1].requests, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+from __future__ import annotations
+
+import multiprocessing
+import os
+import signal
+import tempfile
+import unittest
+from unittest import mock
+
+import requests
+
+from inspector.analysis import analyze
+from inspector.fingerprint import fingerprint_html
+from inspector.parsepool import get_parser_pool
+from inspector.parsepool import ParserPool
+
+PAGE = (
+    '<html><head><title>Café</title><script src="/app.js"></script>'
+    '<link rel="modulepreload" href="/chunk.js"></head><body>'
+    + '<p>filler</p>' * 1000
+    + '</body></html>'
+)
+
+
+def make_response(body: str, encoding='utf-8'):
+    response = requests.Response()
+    response._content = body.encode(encoding)
+    response.encoding = encoding
+    return response
+
+
+def analyze_with_default_pool():
+    assert get_parser_pool().analyze(make_response(PAGE)).title == 'Café'
+
+
+class TestParserPool(unittest.TestCase):
+    def setUp(self):
+
+        self.spool_dir = tempfile.mkdtemp()
+        self.pool = ParserPool(workers=1, min_size=1024, parser='html.parser', spool_dir=self.spool_dir)
+
+    def tearDown(self):
+
+        self.pool.close()
+        os.rmdir(self.spool_dir)
+
+    def test_large_pages_are_parsed_by_workers(self):
+        analysis = self.pool.analyze(make_response(PAGE))
+
+        self.assertEqual(analysis, analyze(PAGE, parser='html.parser'))
+        self.assertEqual(analysis.title, 'Café')
+        self.assertIsNotNone(self.pool._executor)
+        self.assertEqual(os.listdir(self.spool_dir), [])
+
+    def test_workers_fingerprint_the_pages(self):
+        analysis = self.pool.analyze(make_response(PAGE), fingerprint=True)
+
+        self.assertEqual(analysis.fingerprint, str(fingerprint_html(PAGE)))
+        self.assertEqual(analysis.scripts, ['/app.js'])
+        self.assertIsNotNone(self.pool._executor)
+
+    def test_pages_are_decoded_with_their_encoding(self):
+        analysis = self.pool.analyze(make_response(PAGE, 'latin-1'))
+
+        self.assertEqual(analysis.title, 'Café')
+
+    def test_small_pages_are_parsed_in_the_calling_thread(self):
+        analysis = self.pool.analyze(make_response('<title>Small</title>'))
+
+        self.assertEqual(analysis.title, 'Small')
+        self.assertIsNone(self.pool._executor)
+
+    def test_without_workers(self):
+        with ParserPool(workers=0, min_size=0) as pool:
+            self.assertEqual(pool.analyze(make_response(PAGE)).scripts, ['/app.js'])
+            self.assertIsNone(pool._executor)
+
+    def test_dead_worker_restarts_the_pool(self):
+        self.pool.analyze(make_response(PAGE))
+        executor = self.pool._executor
+        for process in list(executor._processes.values()):
+            os.kill(process.pid, signal.SIGKILL)
+            process.join()
+
+        self.assertEqual(self.pool.analyze(make_response(PAGE)).title, 'Café')
+        self.assertEqual(self.pool.analyze(make_response(PAGE)).title, 'Café')
+        self.assertIsNot(self.pool._executor, executor)
+        self.assertEqual(os.listdir(self.spool_dir), [])
+
+    def test_default_pool_lets_a_worker_process_exit(self):
+        context = multiprocessing.get_context('spawn')
+        with mock.patch.dict(os.environ, {'INSPECTOR_PARSE_WORKERS': '1', 'INSPECTOR_PARSE_MIN_SIZE': '0'}):
+            process = context.Process(target=analyze_with_default_pool)
+            process.start()
+        process.join(60)
+
+        self.assertFalse(process.is_alive())
+        self.assertEqual(process.exitcode, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,280 @@
+from __future__ import annotations
+
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+from datetime import timedelta
+
+from inspector.db import get_session
+from inspector.db import upgrade_db
+from inspector.models import UrlData
+from inspector.queries import UrlDataQueries
+from inspector.urlinspector import JsFile
+
+
+class TestJsAssets(unittest.TestCase):
+    def setUp(self):
+
+        self.temp_dir = tempfile.mkdtemp()
+        db_url = f"sqlite:///{os.path.join(self.temp_dir, 'data.db')}"
+        upgrade_db(db_url)
+        self.session = get_session(db_url)
+        self.queries = UrlDataQueries(self.session)
+
+    def tearDown(self):
+
+        self.session.close()
+        shutil.rmtree(self.temp_dir)
+
+    def add(self, url, js_files, now):
+        url_data = UrlData(url=url, track_js=True)
+        self.queries.sync_js_assets(url_data, js_files, now)
+        return self.queries.add(url_data)
+
+    def test_sync_js_assets(self):
+        first, second = datetime(2024, 1, 1), datetime(2024, 1, 2)
+        url_data = self.add(
+            'https://a.com',
+            {'https://a.com/a.js': JsFile('1', 10), 'https://a.com/b.js': JsFile('2', 20)},
+            first,
+        )
+
+        changes = self.queries.sync_js_assets(
+            url_data,
+            {'https://a.com/a.js': JsFile('1', None), 'https://a.com/b.js': JsFile('3', 30), 'https://a.com/c.js': JsFile('4', 40)},
+            second,
+        )
+        self.queries.update(url_data)
+
+        self.assertEqual(changes.changed, ['https://a.com/b.js'])
+        self.assertEqual(changes.added, ['https://a.com/c.js'])
+        self.assertEqual(changes.removed, [])
+
+        assets = {asset.url: asset for asset in self.queries.get('https://a.com').js_assets}
+        self.assertEqual((assets['https://a.com/a.js'].size, assets['https://a.com/a.js'].last_changed), (10, first))
+        self.assertEqual(assets['https://a.com/a.js'].last_seen, second)
+        self.assertEqual((assets['https://a.com/b.js'].hash, assets['https://a.com/b.js'].last_changed), ('3', second))
+        self.assertEqual(assets['https://a.com/b.js'].first_seen, first)
+
+        changes = self.queries.sync_js_assets(url_data, {'https://a.com/c.js': JsFile('4', 40)}, second)
+        self.queries.update(url_data)
+
+        self.assertEqual(changes.removed, ['https://a.com/a.js', 'https://a.com/b.js'])
+        self.assertEqual([asset.url for asset in self.queries.get('https://a.com').js_assets], ['https://a.com/c.js'])
+
+    def test_renamed_js_assets(self):
+        first, second = datetime(2024, 1, 1), datetime(2024, 1, 2)
+        url_data = self.add(
+            'https://a.com',
+            {'https://a.com/main.3f9a8c1b.js': JsFile('1', 10), 'https://a.com/app.js?v=1': JsFile('2', 20)},
+            first,
+        )
+
+        changes = self.queries.sync_js_assets(
+            url_data,
+            {'https://a.com/main.77aa0c2e.js': JsFile('1', 10), 'https://a.com/app.js': JsFile('3', 30)},
+            second,
+        )
+        self.queries.update(url_data)
+
+        self.assertEqual(changes.changed, ['https://a.com/app.js'])
+        self.assertEqual((changes.added, changes.removed), ([], []))
+        self.assertEqual(changes.renamed, {
+            'https://a.com/main.77aa0c2e.js': 'https://a.com/main.3f9a8c1b.js',
+            'https://a.com/app.js': 'https://a.com/app.js?v=1',
+        })
+        assets = {asset.url: asset for asset in self.queries.get('https://a.com').js_assets}
+        self.assertEqual(assets['https://a.com/main.77aa0c2e.js'].last_changed, first)
+        self.assertEqual(assets['https://a.com/main.77aa0c2e.js'].first_seen, first)
+        self.assertEqual((assets['https://a.com/app.js'].hash, assets['https://a.com/app.js'].last_changed), ('3', second))
+
+    def test_get_by_js_asset(self):
+        now = datetime(2024, 1, 1)
+        self.add('https://a.com', {'https://cdn.com/shared.js': JsFile('1', 10)}, now)
+        self.add('https://b.com', {'https://cdn.com/shared.js': JsFile('1', 10)}, now)
+        self.add('https://c.com', {'https://c.com/own.js': JsFile('2', 10)}, now)
+
+        by_url = self.queries.get_by_js_asset('https://cdn.com/shared.js')
+        self.assertEqual([url_data.url for url_data in by_url], ['https://a.com', 'https://b.com'])
+        self.assertEqual([url_data.url for url_data in self.queries.get_by_js_asset('2')], ['https://c.com'])
+
+    def test_history(self):
+        first, second = datetime(2024, 1, 1), datetime(2024, 1, 2)
+        url_data = self.add('https://a.com', {'https://a.com/main.3f9a8c1b.js': JsFile('1', 10)}, first)
+        url_data.title = 'Old'
+        self.queries.update(url_data)
+        self.queries.sync_js_assets(
+            url_data, {'https://a.com/main.77aa0c2e.js': JsFile('2', 10), 'https://a.com/b.js': JsFile('3', 10)}, second,
+        )
+        url_data.title = 'New'
+        url_data.status_code = 200
+        self.queries.update(url_data)
+        url_data.title = 'New'
+        self.queries.update(url_data)
+
+        history = self.queries.history(url_data.id)
+        self.assertEqual(
+            [(o.field, o.asset_url, o.value) for o in history if o.field == 'js'],
+            [
+                ('js', 'https://a.com/main.3f9a8c1b.js', '1'),
+                ('js', 'https://a.com/b.js', '3'),
+                ('js', 'https://a.com/main.77aa0c2e.js', '2'),
+                ('js', 'https://a.com/main.3f9a8c1b.js', None),
+            ],
+        )
+        self.assertEqual([o.value for o in history if o.field == 'title'], ['Old', 'New'])
+
+        before = self.queries.state_at(url_data.id, first)
+        self.assertEqual(before.js_assets, {'https://a.com/main.3f9a8c1b.js': '1'})
+        self.assertEqual(before.fields, {})
+        after = self.queries.state_at(url_data.id, datetime.now() + timedelta(days=1))
+        self.assertEqual(after.js_assets, {'https://a.com/main.77aa0c2e.js': '2', 'https://a.com/b.js': '3'})
+        self.assertEqual(after.fields, {'title': 'New', 'status_code': '200'})
+
+        self.queries.delete('https://a.com')
+        self.assertEqual(self.queries.history(url_data.id), [])
+
+    def test_get_all_lists_js_assets(self):
+        self.add('https://a.com', {'https://a.com/a.js': JsFile('1', 10)}, datetime(2024, 1, 1))
+
+        record, = self.queries.get_all()
+        self.assertIs(record['track_js'], True)
+        self.assertEqual(record['js_assets'], ['https://a.com/a.js'])
+
+
+class TestBulkQueries(unittest.TestCase):
+    def setUp(self):
+
+        self.temp_dir = tempfile.mkdtemp()
+        db_url = f"sqlite:///{os.path.join(self.temp_dir, 'data.db')}"
+        upgrade_db(db_url)
+        self.session = get_session(db_url)
+        self.queries = UrlDataQueries(self.session)
+
+        now = datetime(2024, 1, 1)
+        for i in range(5):
+            url_data = UrlData(url=f'https://{i}.com', title=f'Site {i}', track_js=i % 2 == 0)
+            if url_data.track_js:
+                self.queries.sync_js_assets(url_data, {f'https://{i}.com/app.js': JsFile(str(i), 10)}, now)
+            self.session.add(url_data)
+        self.session.add(UrlData(url='https://untracked.com'))
+        self.session.commit()
+
+    def tearDown(self):
+
+        self.session.close()
+        shutil.rmtree(self.temp_dir)
+
+    def test_iter_monitored(self):
+        records = list(self.queries.iter_monitored(chunk_size=2))
+
+        self.assertEqual([record.url for record in records][:2], ['https://0.com', 'https://1.com'])
+        self.assertEqual(len(records), 6)
+        self.assertEqual(records[0].js_assets, {'https://0.com/app.js': '0'})
+        self.assertEqual(records[1].js_assets, {})
+        self.assertIs(records[2].track_js, True)
+        self.assertIsNone(records[5].title)
+        self.assertIsNone(records[5].status_code)
+
+    def test_bulk_updater_batches(self):
+        records = list(self.queries.iter_monitored())
+        later = datetime(2024, 1, 2)
+        with self.queries.bulk_updater(batch_size=2) as updater:
+            for record in records:
+                updater.update(record.id, {'title': record.url})
+                if record.track_js:
+                    changes = updater.sync_js_assets(
+                        record, {f'{record.url}/app.js': JsFile('new', None), f'{record.url}/new.js': JsFile('n', 1)}, later,
+                    )
+                    self.assertEqual(changes.changed, [f'{record.url}/app.js'])
+                    self.assertEqual(changes.added, [f'{record.url}/new.js'])
+            updater.update(records[-1].id, {})
+        self.assertEqual(updater.written, 6)
+
+        self.session.expire_all()
+        self.assertEqual(self.queries.get('https://1.com').title, 'https://1.com')
+        assets = {asset.url: asset for asset in self.queries.get('https://2.com').js_assets}
+        self.assertEqual(set(assets), {'https://2.com/app.js', 'https://2.com/new.js'})
+        self.assertEqual((assets['https://2.com/app.js'].hash, assets['https://2.com/app.js'].size), ('new', 10))
+        self.assertEqual(assets['https://2.com/app.js'].last_changed, later)
+
+        record = next(r for r in self.queries.iter_monitored() if r.url == 'https://2.com')
+        with self.queries.bulk_updater() as updater:
+            changes = updater.sync_js_assets(
+                record, {'https://2.com/app.js': JsFile('new', None), 'https://2.com/new.js?build=7': JsFile('n', 1)},
+            )
+        self.assertEqual(changes.renamed, {'https://2.com/new.js?build=7': 'https://2.com/new.js'})
+        self.assertEqual((changes.changed, changes.added, changes.removed), ([], [], []))
+        self.session.expire_all()
+        self.assertEqual(
+            [asset.url for asset in self.queries.get('https://2.com').js_assets],
+            ['https://2.com/app.js', 'https://2.com/new.js?build=7'],
+        )
+
+        record = next(r for r in self.queries.iter_monitored() if r.url == 'https://2.com')
+        with self.queries.bulk_updater() as updater:
+            changes = updater.sync_js_assets(record, {})
+        self.assertEqual(changes.removed, ['https://2.com/app.js', 'https://2.com/new.js?build=7'])
+        self.session.expire_all()
+        self.assertEqual(self.queries.get('https://2.com').js_assets, [])
+
+
+    def test_bulk_updater_history(self):
+        record = next(r for r in self.queries.iter_monitored() if r.url == 'https://2.com')
+        later = datetime(2024, 1, 2)
+        with self.queries.bulk_updater() as updater:
+            updater.update(record.id, {'title': 'New', 'check_interval': 60})
+            updater.sync_js_assets(record, {'https://2.com/app.js': JsFile('new', None)}, later)
+            updater.sync_js_assets(record._replace(js_assets={'https://2.com/app.js': 'new'}), {}, later)
+
+        history = [(o.field, o.asset_url, o.value) for o in self.queries.history(record.id)]
+        self.assertEqual(history[0], ('js', 'https://2.com/app.js', '2'))
+        self.assertEqual(history[1:], [
+            ('js', 'https://2.com/app.js', 'new'),
+            ('js', 'https://2.com/app.js', None),
+            ('title', None, 'New'),
+        ])
+
+        ids = self.queries.insert_many([{'url': 'https://new.com', 'title': 'Fresh', 'status_code': None}])
+        self.assertEqual(
+            [(o.field, o.value) for o in self.queries.history(ids['https://new.com'])], [('title', 'Fresh')],
+        )
+
+    def test_due_records(self):
+        now = datetime(2024, 1, 1)
+        self.queries.spread_unscheduled(interval=3600, now=now)
+        self.assertEqual(list(self.queries.iter_monitored(due_before=now - timedelta(seconds=1))), [])
+
+        due = list(self.queries.iter_monitored(due_before=now + timedelta(seconds=3600)))
+        self.assertEqual(len(due), 6)
+        self.assertEqual(self.queries.spread_unscheduled(now=now), 0)
+
+        self.queries.postpone([due[0].id], 7200, now=now)
+        later = list(self.queries.iter_monitored(due_before=now + timedelta(seconds=3600), limit=10))
+        self.assertNotIn(due[0].id, [record.id for record in later])
+        self.assertEqual(self.queries.next_due(), min(
+            url_data.next_due for url_data in self.session.query(UrlData).all()
+        ))
+
+        first = list(self.queries.iter_monitored(due_before=now + timedelta(seconds=3600), limit=2))
+        self.assertEqual([record.id for record in first], [record.id for record in later[:2]])
+
+    def test_reschedule(self):
+        record = next(iter(self.queries.iter_monitored()))
+        now = datetime(2024, 1, 1)
+        with self.queries.bulk_updater() as updater:
+            updater.update(record.id, {'title': 'New'})
+            updater.reschedule(record, changed=True, now=now)
+
+        self.session.expire_all()
+        url_data = self.queries.get(record.url)
+        self.assertEqual(url_data.title, 'New')
+        self.assertEqual(url_data.last_checked, now)
+        self.assertLess(url_data.check_interval, 3600)
+        self.assertGreater(url_data.next_due, now)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,226 @@
+from __future__ import annotations
+
+import socket
+import socketserver
+import struct
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+
+import requests
+
+from inspector.httpclient import HostNotFound
+from inspector.httpclient import HTTPClient
+from inspector.resolver import parse_reply
+from inspector.resolver import parse_server
+from inspector.resolver import Resolver
+
+SOA = b'\x02ns\x00\x05admin\x00' + struct.pack('!IIIII', 1, 3600, 600, 86400, 120)
+
+
+def record(rtype, ttl, rdata, name=b'\xc0\x0c'):
+    return name + struct.pack('!HHIH', rtype, 1, ttl, len(rdata)) + rdata
+
+
+class StubDNSHandler(socketserver.BaseRequestHandler):
+    """
+    Answers from ZONE: A and AAAA records, a CNAME to an A record, NXDOMAIN
+    with an SOA record, or no reply at all.
+    """
+
+    ZONE = {
+        'www.example.test': {1: [record(1, 30, socket.inet_aton('127.0.0.1'))], 28: []},
+        'v6.example.test': {1: [], 28: [record(28, 7200, socket.inet_pton(socket.AF_INET6, '::1'))]},
+        'cdn.example.test': {1: [record(5, 300, b'\x04edge\xc0\x10'), record(1, 100, socket.inet_aton('127.0.0.2'), b'\x04edge\xc0\x10')]},
+        'multi.example.test': {1: [record(1, 300, socket.inet_aton('127.0.0.2')), record(1, 300, socket.inet_aton('127.0.0.1'))]},
+        'dead.example.test': 'nxdomain',
+        'slow.example.test': 'drop',
+    }
+    queries = []
+
+    def handle(self):
+        data, sock = self.request
+        query_id, = struct.unpack('!H', data[:2])
+        position, labels = 12, []
+        while data[position]:
+            labels.append(data[position + 1:position + 1 + data[position]].decode())
+            position += data[position] + 1
+        name, (qtype,) = '.'.join(labels), struct.unpack('!H', data[position + 1:position + 3])
+        question = data[12:position + 5]
+        type(self).queries.append((name, qtype))
+
+        zone = self.ZONE.get(name, 'nxdomain')
+        if zone == 'drop':
+            return
+        if zone == 'nxdomain':
+            answers, authority, rcode = [], [record(6, 900, SOA, b'\xc0\x0c')], 3
+        else:
+            answers, authority, rcode = zone.get(qtype, []), [], 0
+            if not answers:
+                authority = [record(6, 900, SOA)]
+        header = struct.pack('!HHHHHH', query_id, 0x8180 | rcode, 1, len(answers), len(authority), 0)
+        sock.sendto(header + question + b''.join(answers) + b''.join(authority), self.client_address)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestResolver(unittest.TestCase):
+    def setUp(self):
+
+        StubDNSHandler.queries = []
+        self.server = socketserver.ThreadingUDPServer(('127.0.0.1', 0), StubDNSHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.clock = Clock()
+        self.resolver = self.open_resolver()
+
+    def tearDown(self):
+
+        self.resolver.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def open_resolver(self, **kwargs):
+        options = dict(
+            servers=[f'127.0.0.1:{self.server.server_address[1]}'], min_ttl=60, max_ttl=3600,
+            negative_ttl=600, timeout=0.2, attempts=1, hosts_path='/nonexistent', clock=self.clock,
+        )
+        options.update(kwargs)
+        return Resolver(**options)
+
+    def test_addresses_are_cached_within_the_ttl_bounds(self):
+        self.assertEqual(self.resolver.resolve('www.example.test'), ('127.0.0.1',))
+        self.assertEqual(self.resolver.resolve('www.example.test'), ('127.0.0.1',))
+        self.assertEqual(len(StubDNSHandler.queries), 2)
+
+        # A TTL of 30s is raised to the minimum TTL.
+        self.clock.now += 59
+        self.resolver.resolve('www.example.test')
+        self.assertEqual(len(StubDNSHandler.queries), 2)
+        self.clock.now += 2
+        self.resolver.resolve('www.example.test')
+        self.assertEqual(len(StubDNSHandler.queries), 4)
+
+        # A TTL of 7200s is lowered to the maximum TTL.
+        self.assertEqual(self.resolver.resolve('v6.example.test'), ('::1',))
+        self.clock.now += 3601
+        self.assertIsNone(self.resolver.cached('v6.example.test'))
+
+    def test_cname_chain(self):
+        self.assertEqual(self.resolver.resolve('cdn.example.test'), ('127.0.0.2',))
+        self.clock.now += 101
+        self.assertIsNone(self.resolver.cached('cdn.example.test'))
+
+    def test_nxdomain_is_cached(self):
+        self.assertEqual(self.resolver.resolve('dead.example.test'), ())
+        self.assertTrue(self.resolver.is_dead('dead.example.test'))
+        self.assertEqual(self.resolver.resolve('dead.example.test'), ())
+        self.assertEqual(len(StubDNSHandler.queries), 2)
+
+        # The negative TTL is the SOA minimum, 120s.
+        self.clock.now += 121
+        self.assertFalse(self.resolver.is_dead('dead.example.test'))
+
+    def test_unanswered_hosts_are_left_to_the_system_resolver(self):
+        self.assertIsNone(self.resolver.resolve('slow.example.test'))
+        self.assertIsNone(self.resolver.cached('slow.example.test'))
+        self.assertIsNone(self.resolver.resolve('127.0.0.1'))
+        self.assertIsNone(self.resolver.resolve('localhost'))
+        self.assertEqual([name for name, _ in StubDNSHandler.queries], ['slow.example.test'] * 2)
+
+        resolver = self.open_resolver(servers=['system'])
+        self.assertIsNone(resolver.resolve('www.example.test'))
+        resolver.close()
+
+    def test_prefetch_finds_dead_hosts(self):
+        hosts = [f'gone{i}.example.test' for i in range(50)] + ['www.example.test', 'dead.example.test']
+        resolver = self.open_resolver(concurrency=10)
+        try:
+            self.assertEqual(resolver.prefetch(hosts + hosts), sorted(set(hosts) - {'www.example.test'}))
+            self.assertEqual(len(StubDNSHandler.queries), 2 * 52)
+            self.assertEqual(resolver.resolve('www.example.test'), ('127.0.0.1',))
+            self.assertEqual(resolver.prefetch(hosts), [])
+            self.assertEqual(len(StubDNSHandler.queries), 2 * 52)
+        finally:
+            resolver.close()
+
+    def test_parse(self):
+        self.assertEqual(parse_server('10.0.0.1'), ('10.0.0.1', 53))
+        self.assertEqual(parse_server('127.0.0.1:5353'), ('127.0.0.1', 5353))
+        self.assertEqual(parse_server('[::1]:5353'), ('::1', 5353))
+        self.assertEqual(parse_server('::1'), ('::1', 53))
+        with self.assertRaises(Exception):
+            parse_reply(b'\x00\x01\x81\x80\x00\x01\x00\x01')
+
+
+class PageHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        body = self.headers['Host'].encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestResolvingClient(unittest.TestCase):
+    def setUp(self):
+
+        StubDNSHandler.queries = []
+        self.dns = socketserver.ThreadingUDPServer(('127.0.0.1', 0), StubDNSHandler)
+        threading.Thread(target=self.dns.serve_forever, daemon=True).start()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), PageHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.port = self.server.server_port
+        self.client = HTTPClient(resolver=Resolver(
+            servers=[f'127.0.0.1:{self.dns.server_address[1]}'], timeout=0.2, attempts=1, hosts_path='/nonexistent',
+        ))
+
+    def tearDown(self):
+
+        self.client.close()
+        for server in (self.server, self.dns):
+            server.shutdown()
+            server.server_close()
+
+    def test_connections_use_the_resolver(self):
+        response = self.client.get(f'http://www.example.test:{self.port}/')
+
+        self.assertEqual(response.text, f'www.example.test:{self.port}')
+        self.assertEqual(len(StubDNSHandler.queries), 2)
+        self.client.get(f'http://www.example.test:{self.port}/again')
+        self.assertEqual(len(StubDNSHandler.queries), 2)
+
+    def test_next_address_is_tried_when_one_refuses(self):
+        # The server only listens on 127.0.0.1, so 127.0.0.2 refuses the connection.
+        self.assertEqual(self.client.resolver.resolve('multi.example.test'), ('127.0.0.2', '127.0.0.1'))
+        response = self.client.get(f'http://multi.example.test:{self.port}/')
+
+        self.assertEqual(response.text, f'multi.example.test:{self.port}')
+        self.assertEqual(self.client.stats()['retries'], 0)
+
+    def test_dead_hosts_are_not_requested(self):
+        self.assertEqual(self.client.resolver.prefetch(['dead.example.test']), ['dead.example.test'])
+        with self.assertRaises(HostNotFound):
+            self.client.get(f'http://dead.example.test:{self.port}/')
+        self.assertEqual(self.client.stats()['requests'], 0)
+
+        # Found dead by the connection itself: not retried.
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            self.client.get(f'http://gone.example.test:{self.port}/')
+        self.assertEqual(len(StubDNSHandler.queries), 4)
+        self.assertTrue(self.client.resolver.is_dead('gone.example.test'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+from __future__ import annotations
+
+import threading
+import time
+import unittest
+
+from inspector.scanner import get_host
+from inspector.scanner import Scanner
+
+
+class TestScanner(unittest.TestCase):
+    def setUp(self):
+
+        self.lock = threading.Lock()
+        self.running = {}
+        self.peak = {}
+        self.started = []
+
+    def fetch(self, item):
+        host = get_host(item['url'])
+        with self.lock:
+            self.started.append((host, time.monotonic()))
+            self.running[host] = self.running.get(host, 0) + 1
+            self.running['*'] = self.running.get('*', 0) + 1
+            for key in (host, '*'):
+                self.peak[key] = max(self.peak.get(key, 0), self.running[key])
+        time.sleep(0.05)
+        with self.lock:
+            self.running[host] -= 1
+            self.running['*'] -= 1
+        if 'fail' in item['url']:
+            raise ValueError('boom')
+        return item['url'].upper()
+
+    def test_get_host(self):
+        self.assertEqual(get_host('https://Example.com:8443/a'), 'example.com')
+        self.assertEqual(get_host('example.com/path'), 'example.com')
+
+    def test_results_and_failures(self):
+        items = [{'url': f'https://site{i}.com'} for i in range(10)]
+        items.append({'url': 'https://fail.com'})
+        results = {}
+
+        scanner = Scanner(concurrency=5, per_host=1, delay=0)
+        scanner.run(items, self.fetch, lambda item, result: results.update({item['url']: result}))
+
+        self.assertEqual(len(results), 10)
+        self.assertEqual(results['https://site3.com'], 'HTTPS://SITE3.COM')
+        self.assertEqual(scanner.failed, 1)
+
+    def test_global_concurrency_cap(self):
+        items = [{'url': f'https://site{i}.com'} for i in range(20)]
+
+        Scanner(concurrency=4, per_host=1, delay=0).run(items, self.fetch, lambda item, result: None)
+
+        self.assertEqual(self.peak['*'], 4)
+
+    def test_per_host_cap_and_delay(self):
+        items = [{'url': f'https://example.com/{i}'} for i in range(4)]
+
+        Scanner(concurrency=10, per_host=2, delay=0.03).run(items, self.fetch, lambda item, result: None)
+
+        self.assertLessEqual(self.peak['example.com'], 2)
+        starts = sorted(start for _, start in self.started)
+        gaps = [b - a for a, b in zip(starts, starts[1:])]
+        self.assertTrue(all(gap >= 0.025 for gap in gaps))
+
+    def test_requests_of_a_fetch_wait_their_turn(self):
+        items = [{'url': f'https://example.com/{i}'} for i in range(2)]
+        scanner = Scanner(concurrency=10, per_host=2, delay=0.03)
+
+        def fetch(item):
+            self.fetch(item)
+            # E.g. a JS file of the page, on the same host.
+            scanner.wait_turn('https://example.com/app.js')
+            self.fetch({'url': 'https://example.com/app.js'})
+
+        scanner.run(items, fetch, lambda item, result: None)
+
+        starts = sorted(start for _, start in self.started)
+        self.assertEqual(len(starts), 4)
+        gaps = [b - a for a, b in zip(starts, starts[1:])]
+        self.assertTrue(all(gap >= 0.025 for gap in gaps))
+        # Outside of a run, nothing waits.
+        scanner.wait_turn('https://example.com/app.js')
+
+    def test_concurrency_scales_throughput(self):
+        items = [{'url': f'https://site{i}.com'} for i in range(20)]
+
+        start = time.monotonic()
+        Scanner(concurrency=20, per_host=1, delay=0).run(items, self.fetch, lambda item, result: None)
+        elapsed = time.monotonic() - start
+
+        # 20 fetches of 50ms each would take a second if run serially.
+        self.assertLess(elapsed, 0.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+from __future__ import annotations
+
+import random
+import unittest
+from datetime import datetime
+from datetime import timedelta
+
+from inspector.config import SCHEDULE_DEFAULT_INTERVAL
+from inspector.config import SCHEDULE_MAX_INTERVAL
+from inspector.config import SCHEDULE_MIN_INTERVAL
+from inspector.queries import MonitoredUrl
+from inspector.schedule import interval_bounds
+from inspector.schedule import jittered
+from inspector.schedule import next_check
+from inspector.schedule import next_interval
+
+
+class TestSchedule(unittest.TestCase):
+    def test_backs_off_stable_urls(self):
+        interval = None
+        for _ in range(50):
+            interval = next_interval(interval, changed=False)
+        self.assertEqual(interval, SCHEDULE_MAX_INTERVAL)
+
+    def test_speeds_up_changing_urls(self):
+        interval = next_interval(None, changed=True)
+        self.assertLess(interval, SCHEDULE_DEFAULT_INTERVAL)
+        for _ in range(50):
+            interval = next_interval(interval, changed=True)
+        self.assertEqual(interval, SCHEDULE_MIN_INTERVAL)
+
+    def test_per_url_bounds(self):
+        self.assertEqual(next_interval(100, changed=True, min_interval=300), 300)
+        self.assertEqual(next_interval(7200, changed=False, max_interval=7200), 7200)
+        self.assertEqual(interval_bounds(500, 100), (500, 500))
+
+    def test_jitter(self):
+        rng = random.Random(1)
+        values = [jittered(1000, jitter=0.1, rng=rng) for _ in range(200)]
+        self.assertTrue(all(900 <= value <= 1100 for value in values))
+        self.assertGreater(len(set(values)), 100)
+
+    def test_next_check(self):
+        record = MonitoredUrl(1, 'https://a.com', None, None, None, False, {}, check_interval=1000)
+        now = datetime(2024, 1, 1)
+        interval, next_due = next_check(record, changed=False, now=now, rng=random.Random(1))
+
+        self.assertEqual(interval, 1500)
+        self.assertTrue(now + timedelta(seconds=1350) <= next_due <= now + timedelta(seconds=1650))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+from __future__ import annotations
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from inspector.sharding import HashRing
+from inspector.sharding import LeaseQueue
+
+
+class TestHashRing(unittest.TestCase):
+    def test_node_for_is_stable(self):
+        ring = HashRing(['shard-0', 'shard-1', 'shard-2'])
+        self.assertEqual(ring.node_for('example.com'), ring.node_for('example.com'))
+        self.assertIn(ring.node_for('example.com'), ring.nodes)
+
+    def test_removing_a_node_only_moves_its_keys(self):
+        keys = [f'host-{i}.com' for i in range(2000)]
+        before = HashRing(['shard-0', 'shard-1', 'shard-2'])
+        after = HashRing(['shard-0', 'shard-1'])
+
+        for key in keys:
+            if before.node_for(key) != 'shard-2':
+                self.assertEqual(after.node_for(key), before.node_for(key))
+
+    def test_keys_are_spread(self):
+        ring = HashRing(['shard-0', 'shard-1', 'shard-2', 'shard-3'])
+        counts = {}
+        for i in range(4000):
+            node = ring.node_for(f'host-{i}.com')
+            counts[node] = counts.get(node, 0) + 1
+        self.assertEqual(len(counts), 4)
+        self.assertGreater(min(counts.values()), 600)
+
+    def test_requires_a_node(self):
+        with self.assertRaises(ValueError):
+            HashRing([])
+
+
+class TestLeaseQueue(unittest.TestCase):
+    def setUp(self):
+
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, 'queue.db')
+        self.queue = LeaseQueue(self.path, lease_seconds=0.2)
+        self.run_id = self.queue.create_run({'shard-0': [[1, 2], [3]], 'shard-1': [[4]]})
+
+    def tearDown(self):
+
+        self.queue.close()
+        shutil.rmtree(self.temp_dir)
+
+    def test_workers_lease_their_own_shard(self):
+        self.queue.join(self.run_id, 'a', 'shard-0')
+        self.queue.join(self.run_id, 'b', 'shard-1')
+
+        first = self.queue.lease(self.run_id, 'a')
+        self.assertEqual((first.shard, first.items), ('shard-0', [1, 2]))
+        self.assertEqual(self.queue.lease(self.run_id, 'b').items, [4])
+        self.assertIsNone(self.queue.lease(self.run_id, 'b'))
+
+        self.assertTrue(self.queue.complete(first.id, 'a', {'ok': 1}))
+        self.assertEqual(self.queue.take_results(self.run_id), [{'ok': 1}])
+        self.assertEqual(self.queue.take_results(self.run_id), [])
+        self.assertEqual(self.queue.latest_run(), self.run_id)
+
+    def test_dead_worker_shard_is_taken_over(self):
+        self.queue.join(self.run_id, 'a', 'shard-0')
+        self.queue.join(self.run_id, 'b', 'shard-1')
+        lost = self.queue.lease(self.run_id, 'a')
+        self.queue.complete(self.queue.lease(self.run_id, 'b').id, 'b', {})
+
+        # 'a' keeps shard-0 while it renews its leases.
+        time.sleep(0.15)
+        self.queue.renew(self.run_id, 'a')
+        time.sleep(0.1)
+        self.assertIsNone(self.queue.lease(self.run_id, 'b'))
+
+        time.sleep(0.25)
+        retried = self.queue.lease(self.run_id, 'b')
+        self.assertEqual(retried.id, lost.id)
+        self.assertEqual(self.queue.lease(self.run_id, 'b').items, [3])
+
+        self.assertFalse(self.queue.complete(lost.id, 'a', {'stale': True}))
+        self.assertTrue(self.queue.complete(retried.id, 'b', {'fresh': True}))
+        self.assertEqual(self.queue.take_results(self.run_id), [{'fresh': True}, {}])
+
+    def test_takeover_time(self):
+        created = self.queue.takeover_time(self.run_id)
+        self.queue.join(self.run_id, 'a', 'shard-0')
+        self.queue.join(self.run_id, 'b', 'shard-1')
+        self.queue.complete(self.queue.lease(self.run_id, 'b').id, 'b', {})
+        time.sleep(0.05)
+        leased = self.queue.lease(self.run_id, 'a')
+
+        # Only shard-0 is left, with a batch leased after its heartbeat.
+        takeover_time = self.queue.takeover_time(self.run_id)
+        self.assertGreater(takeover_time, created + 0.05)
+        time.sleep(max(0, takeover_time - time.time()))
+        self.assertEqual(self.queue.lease(self.run_id, 'b').id, leased.id)
+
+        self.queue.complete(leased.id, 'b', {})
+        self.queue.complete(self.queue.lease(self.run_id, 'b').id, 'b', {})
+        self.assertIsNone(self.queue.takeover_time(self.run_id))
+
+    def test_batch_fails_after_max_attempts(self):
+        self.queue.join(self.run_id, 'b', 'shard-1')
+        for _ in range(LeaseQueue.MAX_ATTEMPTS):
+            self.assertIsNotNone(self.queue.lease(self.run_id, 'b'))
+            time.sleep(0.25)
+
+        # The failed batch is skipped, and 'b' moves on to the unowned shard-0.
+        self.assertEqual(self.queue.lease(self.run_id, 'b').shard, 'shard-0')
+        self.assertEqual(self.queue.counts(self.run_id)[LeaseQueue.FAILED], 1)
+
+    def test_finish_run(self):
+        self.queue.finish_run(self.run_id)
+        self.assertIsNone(self.queue.latest_run())
+        self.assertEqual(self.queue.counts(self.run_id), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
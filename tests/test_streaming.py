@@ -0,0 +1,129 @@
+from __future__ import annotations
+
+import unittest
+
+from inspector.fingerprint import fingerprint_html
+from inspector.streaming import header_content_length
+from inspector.streaming import STOP_HEAD
+from inspector.streaming import STOP_TITLE
+from inspector.streaming import stream_page
+
+PAGE = (
+    b'<html><head><title>Streamed</title><script src="/head.js"></script></head>'
+    b'<body>' + b'<p>filler</p>' * 10000 + b'<script src="/body.js"></script></body></html>'
+)
+
+
+class FakeResponse:
+    def __init__(self, body, headers=None, status_code=200, encoding='utf-8'):
+        self.body = body
+        self.headers = headers or {}
+        self.status_code = status_code
+        self.encoding = encoding
+        self.chunks_read = 0
+        self.closed = False
+
+    def iter_content(self, chunk_size):
+        for start in range(0, len(self.body), chunk_size):
+            self.chunks_read += 1
+            yield self.body[start:start + chunk_size]
+
+    def close(self):
+        self.closed = True
+
+
+class TestStreaming(unittest.TestCase):
+
+    def test_stops_after_title(self):
+        response = FakeResponse(PAGE)
+        result = stream_page(response, stop=STOP_TITLE, chunk_size=16)
+
+        self.assertEqual(result.title, 'Streamed')
+        self.assertTrue(result.title_complete)
+        self.assertFalse(result.complete)
+        self.assertLessEqual(response.chunks_read, 3)
+        self.assertTrue(response.closed)
+
+    def test_stops_after_head(self):
+        response = FakeResponse(PAGE)
+        result = stream_page(response, stop=STOP_HEAD, chunk_size=64)
+
+        self.assertEqual(result.scripts, ['/head.js'])
+        self.assertLess(response.chunks_read * 64, 200)
+
+    def test_headers_only(self):
+        response = FakeResponse(PAGE)
+        result = stream_page(response, stop=None)
+
+        self.assertEqual(result.status_code, 200)
+        self.assertIsNone(result.title)
+        self.assertFalse(result.title_complete)
+        self.assertEqual(response.chunks_read, 0)
+
+    def test_content_length_from_headers(self):
+        response = FakeResponse(PAGE, headers={'Content-Length': str(len(PAGE))})
+        result = stream_page(response, stop=STOP_TITLE, count_length=True, chunk_size=16)
+
+        self.assertEqual(result.content_length, len(PAGE))
+        self.assertLessEqual(response.chunks_read, 3)
+
+    def test_content_length_counted_when_compressed(self):
+        response = FakeResponse(PAGE, headers={'Content-Length': '10', 'Content-Encoding': 'gzip'})
+        result = stream_page(response, stop=STOP_TITLE, count_length=True, chunk_size=1024)
+
+        self.assertEqual(result.content_length, len(PAGE))
+        self.assertEqual(result.title, 'Streamed')
+        self.assertTrue(result.complete)
+
+    def test_hash_reads_whole_body(self):
+        response = FakeResponse(PAGE, headers={'Content-Length': str(len(PAGE))})
+        result = stream_page(response, stop=STOP_TITLE, hash_body=True, chunk_size=1024)
+
+        self.assertTrue(result.complete)
+        self.assertEqual(len(result.content_hash), 32)
+
+    def test_page_without_title(self):
+        response = FakeResponse(b'<html><body>no title</body></html>')
+        result = stream_page(response, stop=STOP_TITLE, chunk_size=8)
+
+        self.assertIsNone(result.title)
+        self.assertTrue(result.title_complete)
+
+    def test_large_page_without_title_stops_after_head(self):
+        response = FakeResponse(PAGE.replace(b'<title>Streamed</title>', b''))
+        result = stream_page(response, stop=STOP_TITLE, chunk_size=64)
+
+        self.assertIsNone(result.title)
+        self.assertTrue(result.title_complete)
+        self.assertFalse(result.complete)
+        self.assertLess(response.chunks_read * 64, 200)
+
+    def test_multibyte_characters_split_across_chunks(self):
+        response = FakeResponse('<title>héllo wörld</title>'.encode())
+        result = stream_page(response, stop=STOP_TITLE, chunk_size=1)
+
+        self.assertEqual(result.title, 'héllo wörld')
+
+    def test_unknown_charset_falls_back_to_utf8(self):
+        # requests takes the encoding of a 'text/html; charset=bogus' response from the header.
+        response = FakeResponse('<title>héllo</title>'.encode(), encoding='bogus')
+        result = stream_page(response, stop=STOP_TITLE, chunk_size=3)
+
+        self.assertEqual(result.title, 'héllo')
+
+    def test_fingerprint_parses_whole_body(self):
+        response = FakeResponse(PAGE, headers={'Content-Length': str(len(PAGE))})
+        result = stream_page(response, stop=None, count_length=True, fingerprint=True, chunk_size=7)
+
+        self.assertTrue(result.complete)
+        self.assertEqual(result.title, 'Streamed')
+        self.assertEqual(result.scripts, ['/head.js', '/body.js'])
+        self.assertEqual(result.fingerprint, str(fingerprint_html(PAGE.decode())))
+
+    def test_header_content_length(self):
+        self.assertIsNone(header_content_length(FakeResponse(b'', headers={})))
+        self.assertEqual(header_content_length(FakeResponse(b'', headers={'Content-Length': '42'})), 42)
+
+
+if __name__ == '__main__':
+    unittest.main()
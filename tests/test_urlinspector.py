@@ -3,9 +3,101 @@ from __future__ import annotations
 import os
 import shutil
 import tempfile
+import threading
+import time
+import tracemalloc
 import unittest
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from unittest import mock
 
+from inspector.analysis import PageTokenizer
+from inspector.blobstore import BlobStore
+from inspector.fingerprint import fingerprint_html
+from inspector.httpclient import HTTPClient
+from inspector.masking import MaskingRules
+from inspector.parsepool import ParserPool
+from inspector.urlinspector import JsDownloads
 from inspector.urlinspector import URLInspector
+from inspector.versions import VersionStore
+
+# 8 MB served in chunks of 64 KB, never held in memory by the server either.
+BIG_CHUNK = b'/* padding */' * 5041
+BIG_CHUNKS = 128
+
+
+class CountingHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    requests_seen = []
+
+    def do_GET(self):
+        self.requests_seen.append(self.path)
+        if self.path == '/main.js':
+            body = b'console.log(1);'
+        else:
+            body = b'<html><head><title> Local </title><script src="/main.js"></script></head></html>'
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class ScriptsHandler(BaseHTTPRequestHandler):
+    """Pages loading /0.js to /7.js, /shared.js, /big.js or /chunked.js, which answer slowly."""
+
+    protocol_version = 'HTTP/1.1'
+    lock = threading.Lock()
+    in_flight = 0
+    max_in_flight = 0
+    requests_seen = []
+
+    def do_GET(self):
+        cls = type(self)
+        with cls.lock:
+            cls.requests_seen.append(self.path)
+            cls.in_flight += 1
+            cls.max_in_flight = max(cls.max_in_flight, cls.in_flight)
+        try:
+            if self.path in ('/big.js', '/chunked.js'):
+                return self.send_big(chunked=self.path == '/chunked.js')
+            if self.path.split('?')[0].endswith('.js'):
+                time.sleep(0.05)
+                body = f'console.log("{self.path}");'.encode()
+            elif self.path == '/large':
+                body = b'<html><head><script src="/big.js"></script><script src="/chunked.js"></script></head></html>'
+            elif self.path == '/busted':
+                scripts = ('/0.js?v=1', '/0.js?v=2', '/1.js?lang=en&_=1697615999')
+                body = ''.join(f'<script src="{src}"></script>' for src in scripts).encode()
+            elif self.path.startswith('/shared'):
+                body = b'<html><head><script src="/shared.js"></script></head></html>'
+            else:
+                scripts = ''.join(f'<script src="/{index}.js"></script>' for index in range(8))
+                body = f'<html><head>{scripts}</head></html>'.encode()
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        finally:
+            with cls.lock:
+                cls.in_flight -= 1
+
+    def send_big(self, chunked):
+        self.send_response(200)
+        if chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+        else:
+            self.send_header('Content-Length', str(len(BIG_CHUNK) * BIG_CHUNKS))
+        self.end_headers()
+        for _ in range(BIG_CHUNKS):
+            self.wfile.write(b'%x\r\n%s\r\n' % (len(BIG_CHUNK), BIG_CHUNK) if chunked else BIG_CHUNK)
+        if chunked:
+            self.wfile.write(b'0\r\n\r\n')
+
+    def log_message(self, *args):
+        pass
 
 
 class TestURLInspector(unittest.TestCase):
@@ -72,5 +164,195 @@ class TestURLInspector(unittest.TestCase):
         self.assertTrue(os.path.exists(expected_dir))
 
 
+class TestURLInspectorLocal(unittest.TestCase):
+    def setUp(self):
+
+        self.temp_dir = tempfile.mkdtemp()
+        CountingHandler.requests_seen = []
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), CountingHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+        self.client = HTTPClient()
+        self.blob_store = BlobStore(
+            root=os.path.join(self.temp_dir, 'blobs'),
+            index_path=os.path.join(self.temp_dir, 'blobs.db'),
+        )
+        self.patcher = mock.patch.object(URLInspector, 'INSPECTOR_DIR', self.temp_dir)
+        self.patcher.start()
+
+    def tearDown(self):
+
+        self.patcher.stop()
+        self.blob_store.close()
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.temp_dir)
+
+    def test_constructor_is_lazy(self):
+        URLInspector(self.url, client=self.client, blob_store=self.blob_store)
+        self.assertEqual(CountingHandler.requests_seen, [])
+        self.assertFalse(os.path.exists(os.path.join(self.temp_dir, URLInspector.JS_FILES_DIR)))
+
+    def test_inspect_fetches_page_once(self):
+        inspector = URLInspector(self.url, client=self.client, blob_store=self.blob_store)
+        results = inspector.inspect(URLInspector.CHECKS)
+
+        self.assertEqual(results['status_code'], 200)
+        self.assertEqual(results['title'], 'Local')
+        self.assertEqual(results['content_length'], len(inspector.response.content))
+        self.assertEqual(list(results['js_files']), [f'{self.url}/main.js'])
+        self.assertEqual(CountingHandler.requests_seen, ['/', '/main.js'])
+
+    def test_inspect_parses_page_once_for_fingerprint_and_js(self):
+        pool = ParserPool(workers=0, parser='html.parser')
+        inspector = URLInspector(self.url, client=self.client, blob_store=self.blob_store, parser_pool=pool)
+        with mock.patch.object(PageTokenizer, 'feed', autospec=True, side_effect=PageTokenizer.feed) as feed:
+            results = inspector.inspect(['title', 'js_files', 'fingerprint'])
+
+        self.assertEqual(feed.call_count, 1)
+        self.assertEqual(results['fingerprint'], str(fingerprint_html(inspector.response.text)))
+        self.assertEqual(list(results['js_files']), [f'{self.url}/main.js'])
+
+    def test_inspect_status_code_only(self):
+        inspector = URLInspector(self.url, client=self.client, blob_store=self.blob_store)
+        self.assertEqual(inspector.inspect(['status_code']), {'status_code': 200})
+        self.assertIsNone(inspector._response)
+
+    def test_inspect_streams_without_js(self):
+        inspector = URLInspector(self.url, client=self.client, blob_store=self.blob_store)
+        results = inspector.inspect(['status_code', 'title', 'content_length'])
+
+        self.assertEqual(results, {'status_code': 200, 'title': 'Local', 'content_length': 80})
+        self.assertIsNone(inspector._response)
+        self.assertEqual(CountingHandler.requests_seen, ['/'])
+
+    def test_inspect_head_only_js(self):
+        inspector = URLInspector(self.url, client=self.client, blob_store=self.blob_store)
+        results = inspector.inspect(['js_files'], head_only=True)
+
+        self.assertEqual(list(results['js_files']), [f'{self.url}/main.js'])
+        self.assertIsNone(inspector._response)
+
+    def test_inspect_unknown_check(self):
+        with self.assertRaises(ValueError):
+            URLInspector(self.url, client=self.client, blob_store=self.blob_store).inspect(['colour'])
+
+
+class TestJsFiles(unittest.TestCase):
+    def setUp(self):
+
+        self.temp_dir = tempfile.mkdtemp()
+        ScriptsHandler.requests_seen = []
+        ScriptsHandler.max_in_flight = 0
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), ScriptsHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+        self.client = HTTPClient()
+        self.blobs = os.path.join(self.temp_dir, 'blobs')
+        self.blob_store = BlobStore(root=self.blobs, index_path=os.path.join(self.temp_dir, 'blobs.db'))
+
+    def tearDown(self):
+
+        self.blob_store.close()
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.temp_dir)
+
+    def inspector(self, path='/', **kwargs):
+        return URLInspector(f'{self.url}{path}', client=self.client, blob_store=self.blob_store, **kwargs)
+
+    def stored_files(self):
+        return [name for _, _, names in os.walk(self.blobs) for name in names]
+
+    def test_js_files_are_downloaded_concurrently_in_page_order(self):
+        js_files = self.inspector(js_concurrency=4).check_js_files()
+
+        self.assertEqual(list(js_files), [f'{self.url}/{index}.js' for index in range(8)])
+        self.assertEqual(ScriptsHandler.max_in_flight, 4)
+        self.assertEqual(len(set(js_file.hash for js_file in js_files.values())), 8)
+        self.assertEqual(len(self.stored_files()), 8)
+
+    def test_js_files_are_masked(self):
+        masking = MaskingRules({'strip_params': ['v', '_']}, {'127.0.0.1': {'masks': [r'(?<=log\(")[^"]+']}})
+        js_files = self.inspector('/busted', masking=masking).check_js_files()
+
+        self.assertEqual(list(js_files), [f'{self.url}/0.js', f'{self.url}/1.js?lang=en'])
+        # The JS files are downloaded from the URLs of the page, cache busters included.
+        self.assertEqual(ScriptsHandler.requests_seen[0], '/busted')
+        self.assertEqual(sorted(ScriptsHandler.requests_seen[1:]), ['/0.js?v=1', '/1.js?lang=en&_=1697615999'])
+        self.assertEqual(len(set(js_file.hash for js_file in js_files.values())), 1)
+        self.assertEqual(len(self.stored_files()), 1)
+        _, key = self.inspector(masking=masking).download_js_file(f'{self.url}/1.js?lang=en')
+        self.assertEqual(self.blob_store.get(key), b'console.log("MASKED");')
+
+    def test_js_downloads_wait_for_their_pace(self):
+        paced = []
+        self.inspector('/busted', pace=paced.append).check_js_files()
+
+        self.assertEqual(sorted(paced), [f'{self.url}/0.js?v=1', f'{self.url}/1.js?lang=en&_=1697615999'])
+
+    def test_new_js_file_versions_are_kept(self):
+        versions = VersionStore(os.path.join(self.temp_dir, 'versions.db'))
+        try:
+            js_files = self.inspector(versions=versions).check_js_files()
+            self.inspector(versions=versions).check_js_files()
+
+            for js_url, js_file in js_files.items():
+                self.assertEqual([version.md5 for version in versions.versions(js_url)], [js_file.hash])
+            js_file = js_files[f'{self.url}/0.js']
+            self.assertEqual(versions.get(f'{self.url}/0.js', js_file.hash), b'console.log("/0.js");')
+        finally:
+            versions.close()
+
+    def test_js_files_larger_than_the_maximum_are_skipped(self):
+        js_files = self.inspector('/large', max_js_size=1024 * 1024).check_js_files()
+
+        self.assertEqual(js_files, {})
+        self.assertEqual(self.stored_files(), [])
+
+    def test_js_files_are_streamed_to_the_blob_store(self):
+        tracemalloc.start()
+        try:
+            js_files = self.inspector('/large').check_js_files()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        size = len(BIG_CHUNK) * BIG_CHUNKS
+        self.assertEqual([js_file.size for js_file in js_files.values()], [size, size])
+        self.assertLess(peak, size / 4)
+        self.assertEqual(len(self.stored_files()), 1)
+
+    def test_shared_js_files_are_downloaded_once_per_run(self):
+        downloads = JsDownloads()
+        inspectors = [self.inspector(f'/shared-{index}', downloads=downloads) for index in range(4)]
+        threads = [threading.Thread(target=inspector.check_js_files) for inspector in inspectors]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(ScriptsHandler.requests_seen.count('/shared.js'), 1)
+        hashes = {inspector.js_files[f'{self.url}/shared.js'].hash for inspector in inspectors}
+        self.assertEqual(len(hashes), 1)
+        refcount = self.blob_store.connection.execute('SELECT refcount FROM blobs').fetchone()[0]
+        self.assertEqual(refcount, 4)
+
+    def test_failed_downloads_are_shared(self):
+        downloads = JsDownloads()
+        calls = []
+
+        def download(js_url):
+            calls.append(js_url)
+            raise ConnectionError('refused')
+
+        for _ in range(2):
+            with self.assertRaises(ConnectionError):
+                downloads.get('https://a.com/app.js', download)
+        self.assertEqual(calls, ['https://a.com/app.js'])
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,83 @@
+from __future__ import annotations
+
+import socket
+import unittest
+from unittest import mock
+
+from inspector.urls import canonicalize
+from inspector.urls import compile_patterns
+from inspector.urls import is_first_party
+from inspector.urls import is_relative
+from inspector.urls import normalize_url
+from inspector.urls import site_name
+from inspector.urls import split_host
+from inspector.urls import UrlFilter
+
+
+class TestNormalizeUrl(unittest.TestCase):
+    def test_normalize_url(self):
+        self.assertEqual(normalize_url('  HTTPS://Sub.Example.COM:443/Path?q=1#top\n'), 'https://sub.example.com/Path?q=1')
+        self.assertEqual(normalize_url('sub.example.com/'), 'https://sub.example.com')
+        self.assertEqual(normalize_url('http://user:pw@example.com:8080/a/'), 'http://example.com:8080/a/')
+        self.assertEqual(normalize_url('http://[::1]:80/a'), 'http://[::1]/a')
+        self.assertEqual(normalize_url('http://127.0.0.1:8000'), 'http://127.0.0.1:8000')
+        self.assertEqual(normalize_url('https://bücher.example'), 'https://xn--bcher-kva.example')
+
+    def test_invalid_urls(self):
+        for url in (
+            '', '# comment', 'invalid-url', 'ftp://example.com', 'https://example.com:99999',
+            'https://', 'https://-bad-.com', 'https://exa mple.com',
+        ):
+            self.assertIsNone(normalize_url(url), url)
+
+    def test_canonical_parts(self):
+        canonical = canonicalize('HTTP://WWW.Example.com:8080/x')
+        self.assertEqual((canonical.scheme, canonical.host, canonical.port), ('http', 'www.example.com', 8080))
+
+
+class TestPublicSuffix(unittest.TestCase):
+    def test_offline_lookup(self):
+        # The bundled snapshot is used: no connection is ever made.
+        with mock.patch.object(socket, 'create_connection', side_effect=AssertionError('network')):
+            host = split_host('static.cdn.example.co.uk')
+
+        self.assertEqual(host, ('static.cdn', 'example', 'co.uk'))
+        self.assertEqual(host.registered_domain, 'example.co.uk')
+        self.assertEqual(split_host('127.0.0.1').registered_domain, '127.0.0.1')
+        self.assertEqual(site_name('https://www.example.co.uk/page'), 'example')
+
+    def test_first_party(self):
+        page = 'https://www.example.com'
+        self.assertTrue(is_first_party(page, '/static/app.js'))
+        self.assertTrue(is_first_party(page, 'https://cdn.example.net/app.js'))
+        self.assertTrue(is_first_party(page, '//static.example.com/app.js'))
+        self.assertFalse(is_first_party(page, 'https://cdn.other.com/example.js'))
+        self.assertTrue(is_first_party(page, 'https://d1.cloudfront.net/app.js', frozenset({'cloudfront.net'})))
+
+    def test_is_relative(self):
+        self.assertTrue(is_relative('app.js'))
+        self.assertTrue(is_relative('/static/app.js'))
+        self.assertFalse(is_relative('//cdn.example.com/app.js'))
+        self.assertFalse(is_relative('https://cdn.example.com/app.js'))
+
+
+class TestUrlFilter(unittest.TestCase):
+    def test_patterns_share_prefixes(self):
+        pattern = compile_patterns(['jquery', 'jq', 'analytics', 'ads.', 'a+b'])
+        self.assertEqual(pattern.pattern, r'(?:a(?:\+b|ds\.|nalytics)|jq)')
+
+        for url in ('https://x.com/jquery.min.js', 'https://ads.x.com/a.js', 'https://x.com/Analytics.js', '/a+b.js'):
+            self.assertIsNotNone(pattern.search(url), url)
+        self.assertIsNone(pattern.search('https://x.com/ab.js'))
+
+    def test_blacklist_and_allowlist(self):
+        url_filter = UrlFilter(blacklist=['jquery', 'tracking'], allowlist=['/static/', '/assets/'])
+
+        self.assertTrue(url_filter.allows('https://x.com/static/app.js'))
+        self.assertFalse(url_filter.allows('https://x.com/static/jQuery.js'))
+        self.assertFalse(url_filter.allows('https://x.com/other/app.js'))
+        self.assertTrue(UrlFilter().allows('https://x.com/jquery.js'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+
+from inspector.versions import diff_versions
+from inspector.versions import VersionStore
+
+
+def md5(data):
+    return hashlib.md5(data).hexdigest()
+
+
+class TestVersionStore(unittest.TestCase):
+    def setUp(self):
+
+        self.temp_dir = tempfile.mkdtemp()
+        self.store = self.open_store()
+        self.bundle = b''.join(b'function f%d(a){return a+%d;}\n' % (i, i) for i in range(3000))
+
+    def tearDown(self):
+
+        self.store.close()
+        shutil.rmtree(self.temp_dir)
+
+    def open_store(self, keyframe_interval=4):
+        return VersionStore(os.path.join(self.temp_dir, 'versions.db'), keyframe_interval=keyframe_interval)
+
+    def build(self, number):
+        return self.bundle.replace(b'return a+7;', b'return a+7+%d;' % number)
+
+    def test_versions_are_stored_as_deltas(self):
+        builds = [self.build(number) for number in range(10)]
+        for number, build in enumerate(builds):
+            # Each build has a new chunk hash, the versions still form one chain.
+            self.assertIs(self.store.add(f'https://a.com/main.{number:08d}.js', md5(build), build), True)
+        self.assertIs(self.store.add('https://a.com/main.00000009.js', md5(builds[-1]), builds[-1]), False)
+
+        versions = self.store.versions('https://a.com/main.12345678.js')
+        self.assertEqual([version.md5 for version in versions], [md5(build) for build in builds])
+        self.assertEqual([version.keyframe for version in versions], [True, False, False, False] * 2 + [True, False])
+        self.assertLess(sum(version.stored_size for version in versions if not version.keyframe), 2000)
+
+        for number, build in enumerate(builds):
+            self.assertTrue(self.store.has(f'https://a.com/main.{number:08d}.js', md5(build)))
+            self.assertEqual(self.store.get(f'https://a.com/main.{number:08d}.js', md5(build)), build)
+        with self.assertRaises(KeyError):
+            self.store.get('https://a.com/other.js', md5(builds[0]))
+
+    def test_unrelated_versions_are_keyframes(self):
+        self.store.add('https://a.com/app.js', md5(self.bundle), self.bundle)
+        other = os.urandom(4096)
+        self.store.add('https://a.com/app.js?v=2', md5(other), other)
+
+        self.assertEqual([version.keyframe for version in self.store.versions('https://a.com/app.js')], [True, True])
+        self.assertEqual(self.store.get('https://a.com/app.js', md5(other)), other)
+
+    def test_versions_survive_reopen(self):
+        build = self.build(1)
+        self.store.add('https://a.com/app.js', md5(self.bundle), self.bundle)
+        self.store.add('https://a.com/app.js', md5(build), build)
+        self.store.close()
+        self.store = self.open_store()
+
+        self.assertEqual(self.store.get('https://a.com/app.js', md5(build)), build)
+
+    def test_diff_versions(self):
+        minified = self.bundle.replace(b'\n', b'')
+        lines = list(diff_versions(minified, minified.replace(b'return a+7;', b'return a-7;'), 'old.js', 'new.js'))
+
+        self.assertEqual(lines[:2], ['--- old.js', '+++ new.js'])
+        self.assertIn('-return a+7;', lines)
+        self.assertIn('+return a-7;', lines)
+        self.assertLess(len(lines), 12)
+
+
+if __name__ == '__main__':
+    unittest.main()